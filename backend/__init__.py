@@ -1,17 +1,26 @@
 print("--- backend/__init__.py 로드됨 ---")
-from flask import Flask, render_template, request, jsonify, session, url_for
+from flask import Flask, render_template, request, jsonify, session, url_for, Response
 from flask_cors import CORS
 from supabase import create_client, Client
 import os
+import threading
 
 # 내부 모듈 임포트. 이 임포트들은 create_app 함수 내부 또는 외부에서 앱 컨텍셔스트를 고려하여 위치할 수 있습니다.
 # 예를 들어, config는 앱 생성 전에 로드될 수 있고, 블루프린트는 앱 객체가 생성된 후 등록됩니다.
-from .config import SUPABASE_URL, SUPABASE_KEY, FLASK_SECRET_KEY, GEMINI_API_KEY
+from .config import SUPABASE_URL, SUPABASE_KEY, FLASK_SECRET_KEY, GEMINI_WARMUP_ON_START, GEMINI_WARMUP_NETWORK, METRICS_ENABLED, METRICS_TOKEN, INTERNAL_STATS_TOKEN
 # supabase_client 대신 default_supabase_client를 사용하거나, get_db_client를 통해 접근하므로 직접적인 클라이언트 임포트는 불필요할 수 있음
 # init_supabase_client는 database.py 모듈 로드 시 자동으로 호출되도록 변경했으므로, 여기서 명시적 호출도 불필요.
 # 만약 init_supabase_client()를 create_app에서 명시적으로 호출하고 싶다면 임포트 유지.
 # 현재 database.py에서 init_supabase_client()가 모듈 레벨에서 호출되므로, 여기서는 호출 불필요.
-from .gemini_utils import DEFAULT_PROMPT_TEMPLATE # Gemini API 초기화는 gemini_utils에서 수행
+from .gemini_utils import DEFAULT_PROMPT_TEMPLATE, render_gemini_call_stats_prometheus # Gemini API 초기화는 gemini_utils에서 수행
+from .model_registry import gemini_models
+from .tracing import stage_metrics
+from .token_accounting import token_ledger
+from .llm_scheduler import llm_scheduler
+from .world_cache import world_cache
+from .speculation import speculative_generator
+from .story_summarizer import story_summarizer
+from .logging_setup import configure_logging
 from .auth_utils import get_user_and_token_from_request, get_current_user_id_from_request # auth_utils 함수 임포트
 
 # Blueprint 임포트
@@ -23,6 +32,7 @@ from .adventure_routes import adventure_bp # 새 블루프린트 임포트
 
 def create_app():
     print("--- create_app 함수 호출됨 (backend/__init__.py) ---")
+    configure_logging() # 로그 레벨/비동기 핸들러/payload 자르기를 한 번만 설정
     print(f"[DEBUG __init__.py] FLASK_SECRET_KEY from config before app creation: {FLASK_SECRET_KEY}") # config에서 가져온 값 확인
     app = Flask(__name__, template_folder='../../templates', static_folder='../../static')
     # template_folder와 static_folder 경로가 __init__.py 위치 기준으로 변경됨
@@ -60,6 +70,10 @@ def create_app():
     # init_supabase_client() # 여기서 호출 제거 또는 database.py에서 모듈 레벨 호출 제거 중 택1. 현재는 database.py에서 호출.
     
     # Gemini API 키 설정 (gemini_utils에서 이미 수행됨, 여기서 별도 호출 필요 없음)
+    # 워커마다 Gemini 전송 채널을 미리 열어 첫 요청의 연결 비용을 줄임 (시작을 막지 않도록 백그라운드에서)
+    if GEMINI_WARMUP_ON_START and gemini_models.provider.available:
+        threading.Thread(target=gemini_models.warm_up, kwargs={"network": GEMINI_WARMUP_NETWORK},
+                         name="gemini-warmup", daemon=True).start()
 
     app.secret_key = FLASK_SECRET_KEY # config.py에서 가져온 값을 사용 (여기서는 None일 수 있음)
     if not app.secret_key: # FLASK_SECRET_KEY가 None이거나 빈 문자열이었다면
@@ -145,6 +159,35 @@ def create_app():
         print("Flask session cleared.")
         return jsonify({"message": "Flask session cleared successfully"}), 200
 
+    if METRICS_ENABLED:
+        @app.route('/metrics')
+        def metrics():
+            """
+            Prometheus 텍스트 형식 지표: 요청/단계별 지연 시간 히스토그램, 호출 종류별 Gemini 토큰 수,
+            Gemini 대기열, call_gemini_api 재시도, 세계관 캐시, 예측 생성, 히스토리 요약(하드 한도 도달 포함).
+            """
+            if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+                return jsonify({"error": "Unauthorized"}), 401
+            return Response(stage_metrics.render_prometheus() + token_ledger.render_prometheus()
+                            + llm_scheduler.render_prometheus() + render_gemini_call_stats_prometheus()
+                            + world_cache.render_prometheus() + speculative_generator.render_prometheus()
+                            + story_summarizer.render_prometheus(),
+                            mimetype="text/plain; version=0.0.4")
+
+    if INTERNAL_STATS_TOKEN:
+        @app.route('/internal/token-usage')
+        def internal_token_usage():
+            """Gemini 토큰 사용량/비용: 전체, 호출 종류별, 상위 세션/세계관/사용자 (?top=N, ?session_id=...)."""
+            if request.headers.get('Authorization') != f"Bearer {INTERNAL_STATS_TOKEN}":
+                return jsonify({"error": "Unauthorized"}), 401
+            session_id = request.args.get('session_id')
+            if session_id:
+                totals = token_ledger.session_totals(session_id)
+                if totals is None:
+                    return jsonify({"error": "이 프로세스에 기록된 사용량이 없는 세션입니다."}), 404
+                return jsonify({"session_id": session_id, **totals})
+            return jsonify(token_ledger.stats(top=request.args.get('top', 20, type=int)))
+
     @app.route('/privacy-policy')
     def privacy_policy():
         """개인정보처리방침 페이지를 렌더링합니다."""
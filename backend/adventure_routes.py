@@ -2,43 +2,46 @@
 Routes for managing user's ongoing adventures.
 """
 from flask import Blueprint, request, jsonify
-import traceback
+import logging
 import uuid
+from datetime import datetime, timezone
 
 # Absolute imports from the 'backend' package perspective
 from backend.auth_utils import get_user_and_token_from_request
 from backend.database import get_db_client, save_ongoing_adventure, get_ongoing_adventure, get_all_ongoing_adventures, delete_ongoing_adventure
+from backend.autosave_queue import autosave_queue
+from backend.config import AUTOSAVE_WRITE_BEHIND_ENABLED
+from backend.session_store import story_session_store
+from backend.token_accounting import token_ledger
 
 adventure_bp = Blueprint('adventure_bp', __name__, url_prefix='/api/adventures')
+logger = logging.getLogger(__name__)
 
 @adventure_bp.route('', methods=['GET'])
 def get_ongoing_adventures():
-    print("[DEBUG adventure_routes] Attempting to get ongoing adventures...")
     current_user, user_jwt = get_user_and_token_from_request(request)
     if not current_user or not user_jwt:
-        print("[DEBUG adventure_routes] User not authenticated or token missing.")
+        logger.debug("User not authenticated or token missing.")
         return jsonify({"error": "인증되지 않은 사용자이거나 토큰이 없습니다."}), 401
 
     user_id = str(current_user.id)
-    print(f"[DEBUG adventure_routes] Authenticated user: {user_id}")
-    print(f"[DEBUG adventure_routes] Fetching adventures for user_id: {user_id} using get_all_ongoing_adventures.")
+    logger.debug("Fetching ongoing adventures for user_id: %s", user_id)
 
     try:
+        if AUTOSAVE_WRITE_BEHIND_ENABLED:
+            autosave_queue.flush_user(user_id, user_jwt) # 아직 큐에 있는 저장(다른 워커 포함)이 목록에 반영되도록 먼저 기록
         # user_jwt를 get_all_ongoing_adventures 함수에 전달합니다.
         adventures_data = get_all_ongoing_adventures(user_id=user_id, user_jwt=user_jwt)
-        
-        print(f"[DEBUG adventure_routes] Raw adventures_data from DB function: {adventures_data}")
 
         if adventures_data is not None: # 함수가 None을 반환하는 경우도 처리
-            print(f"[DEBUG adventure_routes] Successfully fetched adventures data. Count: {len(adventures_data) if isinstance(adventures_data, list) else 'N/A'}")
+            logger.debug("Successfully fetched adventures data. Count: %s", len(adventures_data) if isinstance(adventures_data, list) else 'N/A')
             return jsonify(adventures_data), 200
         else:
-            print(f"[DEBUG adventure_routes] get_all_ongoing_adventures returned None for user_id: {user_id}")
+            logger.warning("get_all_ongoing_adventures returned None for user_id: %s", user_id)
             return jsonify({"error": "진행 중인 모험 목록을 가져오는데 실패했습니다 (데이터 없음)."}), 500 # 또는 404
 
     except Exception as e:
-        print(f"[DEBUG adventure_routes] Exception in get_ongoing_adventures: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Exception in get_ongoing_adventures: %s", e)
         return jsonify({"error": f"서버 내부 오류: {str(e)}"}), 500
 
 @adventure_bp.route('', methods=['POST'])
@@ -63,12 +66,27 @@ def save_adventure_endpoint():
         "last_choices": data.get('last_choices'),
         "active_systems": data.get('active_systems', {}),
         "system_configs": data.get('system_configs', {}),
-        "summary": data.get("summary")
+        "summary": data.get("summary"),
+        # 저장 요청을 받은 시각. 늦게 기록된 이전 저장이 더 새 저장을 덮어쓰지 않도록 DB 트리거가 비교함
+        "saved_at": datetime.now(timezone.utc).isoformat()
     }
 
     if not data_to_save['world_id']:
         return jsonify({"error": "world_id is required"}), 400
 
+    # 토큰 사용량과 턴 번호는 클라이언트 값이 아니라 서버 세션의 값을 저장 (세션이 메모리에 없으면 DB의 기존 값 유지)
+    session_state = story_session_store.get(session_id)
+    if session_state and session_state.get('user_id') == str(current_user.id):
+        if 'token_usage' in session_state:
+            data_to_save['token_usage'] = token_ledger.snapshot(session_state['token_usage'])
+        # 복원 후에도 턴 번호가 이어지도록 (엔딩 판정 결과가 턴 번호로 조회됨)
+        data_to_save['turn'] = session_state.get('turn', 0)
+
+    if AUTOSAVE_WRITE_BEHIND_ENABLED:
+        # write-behind: 상태를 큐에 넣고 바로 응답합니다. 실제 upsert는 autosave 워커가 배치로 수행합니다.
+        autosave_queue.enqueue(data_to_save, user_jwt)
+        return jsonify({"message": "Adventure queued for saving", "session_id": session_id, "user_id": str(current_user.id), "queued": True}), 202
+
     success = save_ongoing_adventure(adventure_data=data_to_save, user_jwt=user_jwt)
     if success:
         return jsonify({"message": "Adventure saved successfully", "session_id": session_id, "user_id": str(current_user.id)}), 200
@@ -82,6 +100,8 @@ def get_adventure_endpoint(session_id):
         return jsonify({"error": "Not authenticated"}), 401
     
     user_id = str(current_user.id)
+    if AUTOSAVE_WRITE_BEHIND_ENABLED:
+        autosave_queue.flush_session(session_id, user_id, user_jwt)
     adventure = get_ongoing_adventure(session_id=session_id, user_id=user_id, user_jwt=user_jwt)
     if adventure:
         return jsonify(adventure), 200
@@ -90,20 +110,20 @@ def get_adventure_endpoint(session_id):
 
 @adventure_bp.route('/<session_id>', methods=['DELETE'])
 def delete_adventure_endpoint(session_id):
-    print(f"[DEBUG delete_adventure_endpoint] Received DELETE request for session_id: {session_id}")
     current_user, user_jwt = get_user_and_token_from_request(request)
     if not current_user or not user_jwt:
-        print("[DEBUG delete_adventure_endpoint] User not authenticated.")
+        logger.debug("[delete_adventure_endpoint] User not authenticated.")
         return jsonify({"error": "Not authenticated"}), 401
 
     user_id = str(current_user.id)
-    print(f"[DEBUG delete_adventure_endpoint] Attempting to delete adventure for user_id: {user_id}, session_id: {session_id}")
+    logger.debug("[delete_adventure_endpoint] Attempting to delete adventure for user_id: %s, session_id: %s", user_id, session_id)
+    autosave_queue.discard(user_id, session_id) # 삭제 후 대기 중이던 저장이 모험을 되살리지 않도록
     success = delete_ongoing_adventure(session_id=session_id, user_id=user_id, user_jwt=user_jwt)
     
     if success:
-        print(f"[DEBUG delete_adventure_endpoint] Successfully deleted adventure for session_id: {session_id}")
+        logger.debug("[delete_adventure_endpoint] Successfully deleted adventure for session_id: %s", session_id)
         return jsonify({"message": "Adventure deleted successfully", "session_id": session_id, "user_id": user_id}), 200
     else:
         # delete_ongoing_adventure 함수 내부에서 이미 실패 원인이 로깅될 것으로 예상
-        print(f"[DEBUG delete_adventure_endpoint] Failed to delete adventure for session_id: {session_id}")
+        logger.warning("[delete_adventure_endpoint] Failed to delete adventure for session_id: %s", session_id)
         return jsonify({"error": "Failed to delete adventure or adventure not found"}), 500
\ No newline at end of file
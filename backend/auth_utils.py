@@ -1,44 +1,151 @@
 '''
 Authentication utilities, including JWT validation.
 '''
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
 from flask import request as current_request # Flask의 request 객체를 사용하기 위해 import
 # from supabase import Client as SupabaseClient # 타입 힌팅용이었으나 직접 사용 안 함
 from backend.database import get_db_client # get_db_client 함수를 직접 임포트
 # from fastapi import Request # FastAPI 의존성 제거
 from jose import jwt, JWTError, ExpiredSignatureError
 from .config import SUPABASE_JWT_SECRET # SUPABASE_JWT_SECRET를 config.py에서 가져옵니다.
+from .config import AUTH_TOKEN_CACHE_MAX_ENTRIES, AUTH_TOKEN_CACHE_MAX_TTL_SECONDS, AUTH_REMOTE_FALLBACK
 
-# --- JWT 토큰 검증 헬퍼 함수 ---
-def get_user_and_token_from_request(request_obj) -> tuple[dict | None, str | None]: # supabase_client_instance 인자 제거, 반환 타입 변경
+# Supabase JWT Audience - 일반적으로 "authenticated"
+# Supabase 프로젝트 설정 > API > Settings > JWT Settings 에서 확인 가능
+# 혹은 Supabase 클라이언트 초기화 시 자동으로 설정될 수도 있음. 명시적으로 지정하는 것이 안전.
+JWT_AUDIENCE = "authenticated" 
+
+# 검증된 JWT 클레임 캐시: sha256(token) -> (만료 시각, claims)
+# 토큰 원문은 키로 보관하지 않으며, 항목은 토큰의 exp(또는 최대 TTL) 시점에 만료됩니다.
+_verified_claims_cache = OrderedDict()
+_verified_claims_lock = threading.Lock()
+_verified_claims_stats = {"hits": 0, "misses": 0, "evictions": 0, "remote_fallbacks": 0}
+
+class LocalJWTUser:
+    """검증된 JWT 클레임으로 만든 사용자 객체. supabase-py User처럼 .id 등을 제공합니다."""
+    def __init__(self, claims: dict):
+        self.id = claims.get("sub")
+        self.email = claims.get("email")
+        self.role = claims.get("role")
+        self.aud = claims.get("aud")
+        self.app_metadata = claims.get("app_metadata") or {}
+        self.user_metadata = claims.get("user_metadata") or {}
+
+def _decode_supabase_jwt(token: str) -> dict:
+    """SUPABASE_JWT_SECRET으로 HS256 토큰을 검증하고 payload를 반환합니다. 실패 시 jose 예외를 그대로 올립니다."""
+    return jwt.decode(
+        token, 
+        SUPABASE_JWT_SECRET, 
+        algorithms=["HS256"], 
+        audience=JWT_AUDIENCE # audience 검증 추가
+    )
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _get_verified_claims(token: str) -> dict:
+    """
+    캐시에서 검증된 클레임을 찾고, 없으면 로컬에서 검증한 뒤 캐시에 저장합니다.
+    검증 실패 시 _decode_supabase_jwt와 동일하게 jose 예외를 올립니다.
+    """
+    cache_key = _token_cache_key(token)
+    now = time.time()
+    with _verified_claims_lock:
+        cached = _verified_claims_cache.get(cache_key)
+        if cached is not None:
+            expires_at, claims = cached
+            if expires_at > now:
+                _verified_claims_cache.move_to_end(cache_key)
+                _verified_claims_stats["hits"] += 1
+                return claims
+            del _verified_claims_cache[cache_key] # 만료된 항목 제거
+        _verified_claims_stats["misses"] += 1
+
+    claims = _decode_supabase_jwt(token) # 락 밖에서 서명 검증
+
+    expires_at = claims.get("exp") or (now + AUTH_TOKEN_CACHE_MAX_TTL_SECONDS)
+    if AUTH_TOKEN_CACHE_MAX_TTL_SECONDS > 0:
+        expires_at = min(expires_at, now + AUTH_TOKEN_CACHE_MAX_TTL_SECONDS)
+    if AUTH_TOKEN_CACHE_MAX_ENTRIES > 0 and expires_at > now:
+        with _verified_claims_lock:
+            _verified_claims_cache[cache_key] = (expires_at, claims)
+            _verified_claims_cache.move_to_end(cache_key)
+            while len(_verified_claims_cache) > AUTH_TOKEN_CACHE_MAX_ENTRIES:
+                _verified_claims_cache.popitem(last=False)
+                _verified_claims_stats["evictions"] += 1
+    return claims
+
+def get_auth_cache_stats() -> dict:
+    """JWT 검증 캐시의 크기와 hit/miss/eviction 카운터를 반환합니다."""
+    with _verified_claims_lock:
+        return {"size": len(_verified_claims_cache), **_verified_claims_stats}
+
+def _get_user_from_supabase(jwt_token: str):
+    """supabase.auth.get_user 원격 호출로 사용자를 확인합니다 (AUTH_REMOTE_FALLBACK 전용)."""
     supabase_client_instance = get_db_client() # 내부에서 get_db_client 호출
+    if not supabase_client_instance:
+        print("auth_utils: Supabase client is None when trying to get user.")
+        return None
+    with _verified_claims_lock:
+        _verified_claims_stats["remote_fallbacks"] += 1
+    try:
+        user_response = supabase_client_instance.auth.get_user(jwt_token)
+        if user_response and hasattr(user_response, 'user') and user_response.user:
+            return user_response.user
+        return None
+    except Exception as e:
+        print(f"토큰 검증 중 오류 (auth_utils): {e}")
+        return None
+
+# --- JWT 토큰 검증 헬퍼 함수 ---
+def get_user_and_token_from_request(request_obj) -> tuple[object | None, str | None]:
+    """
+    Authorization 헤더의 Bearer 토큰을 검증하고 (사용자 객체, 토큰)을 반환합니다.
+    SUPABASE_JWT_SECRET으로 로컬 검증하며, 검증된 클레임은 TTL 캐시에 보관합니다.
+    AUTH_REMOTE_FALLBACK이 켜져 있을 때만 supabase.auth.get_user 원격 호출로 재확인합니다.
+    """
     auth_header = request_obj.headers.get("Authorization")
-    if not auth_header or not supabase_client_instance:
-        if not supabase_client_instance:
-            print("auth_utils: Supabase client is None when trying to get user.")
+    if not auth_header:
         return None, None # 토큰도 None 반환
     parts = auth_header.split()
     if parts[0].lower() != "bearer" or len(parts) == 1 or len(parts) > 2:
         return None, None # 토큰도 None 반환
     jwt_token = parts[1]
-    try:
-        user_response = supabase_client_instance.auth.get_user(jwt_token)
-        if user_response and hasattr(user_response, 'user') and user_response.user:
-            return user_response.user, jwt_token # 사용자 객체와 토큰 반환
-        return None, None # 토큰도 None 반환
-    except Exception as e:
-        print(f"토큰 검증 중 오류 (auth_utils): {e}")
-        return None, None # 토큰도 None 반환 
 
-# Supabase JWT Audience - 일반적으로 "authenticated"
-# Supabase 프로젝트 설정 > API > Settings > JWT Settings 에서 확인 가능
-# 혹은 Supabase 클라이언트 초기화 시 자동으로 설정될 수도 있음. 명시적으로 지정하는 것이 안전.
-JWT_AUDIENCE = "authenticated" 
+    if SUPABASE_JWT_SECRET:
+        try:
+            claims = _get_verified_claims(jwt_token)
+            if claims.get("sub"):
+                return LocalJWTUser(claims), jwt_token
+            print("AuthUtils: 'sub' (user ID) not found in JWT payload.")
+            return None, None
+        except ExpiredSignatureError:
+            return None, None # 만료된 토큰은 원격 확인도 실패하므로 바로 거부
+        except JWTError as e:
+            if not AUTH_REMOTE_FALLBACK:
+                print(f"AuthUtils: JWT Error - {e}")
+                return None, None
+        except Exception as e:
+            print(f"AuthUtils: An unexpected error occurred during JWT decoding: {e}")
+            if not AUTH_REMOTE_FALLBACK:
+                return None, None
+    elif not AUTH_REMOTE_FALLBACK:
+        print("AuthUtils: SUPABASE_JWT_SECRET is not configured and AUTH_REMOTE_FALLBACK is off.")
+        return None, None
+
+    remote_user = _get_user_from_supabase(jwt_token)
+    if remote_user:
+        return remote_user, jwt_token # 사용자 객체와 토큰 반환
+    return None, None
 
 def get_current_user_id_from_request(request: current_request) -> str | None: # 타입 힌트를 Flask의 request로 변경
     """
     Extracts user ID from the Authorization header's JWT token.
-    Placeholder for actual JWT validation and user ID extraction.
-    This should be replaced with a robust JWT validation mechanism.
+    Uses the same local HS256 verification and claims cache as get_user_and_token_from_request.
     """
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
@@ -54,22 +161,11 @@ def get_current_user_id_from_request(request: current_request) -> str | None: #
         return None # 혹은 raise Exception("JWT Secret not configured")
 
     try:
-        # print(f"AuthUtils: Attempting to decode token: {token[:20]}...") # 토큰 일부 로깅 (디버깅용)
-        # print(f"AuthUtils: Using JWT_SECRET: {SUPABASE_JWT_SECRET[:10]}...") # 시크릿 일부 로깅 (디버깅용, 실제 운영에서는 민감)
-        # print(f"AuthUtils: Using JWT_AUDIENCE: {JWT_AUDIENCE}")
-
-        payload = jwt.decode(
-            token, 
-            SUPABASE_JWT_SECRET, 
-            algorithms=["HS256"], 
-            audience=JWT_AUDIENCE # audience 검증 추가
-        )
-        # print(f"AuthUtils: Token decoded successfully. Payload: {payload}")
+        payload = _get_verified_claims(token)
         user_id = payload.get("sub")
         if not user_id:
             print("AuthUtils: 'sub' (user ID) not found in JWT payload.")
             return None
-        # print(f"AuthUtils: User ID extracted: {user_id}")
         return user_id
     except ExpiredSignatureError:
         print("AuthUtils: JWT token has expired.")
@@ -0,0 +1,318 @@
+"""
+Write-behind queue for ongoing_adventures autosaves.
+
+저장 요청은 메모리 버퍼에 쌓이고, 같은 session_id의 반복 저장은 하나로 합쳐집니다(coalescing).
+백그라운드 워커가 coalesce 창이 지난 항목을 사용자(JWT)별 배치 upsert로 DB에 기록합니다.
+버퍼가 AUTOSAVE_MAX_BUFFERED에 도달하면 즉시 플러시하고, 프로세스 종료 시 남은 항목을 모두 플러시합니다.
+플러시가 실패하면 AUTOSAVE_RETRY_BACKOFF_*만큼 (연속 실패마다 두 배로) 기다린 뒤 다시 시도합니다.
+
+여러 워커 프로세스에서의 일관성:
+- 각 저장에는 요청을 받은 시각(saved_at)이 붙고, DB 트리거(ongoing_adventures_keep_newer)가 이미 기록된 것보다
+  오래된 saved_at의 upsert를 무시하므로, 늦게 플러시된 이전 상태가 더 새 진행 상황을 덮어쓰지 않습니다.
+- SESSION_SHARED_SQLITE_PATH가 설정되면 대기 중인 저장을 같은 호스트의 워커들이 공유하는 SQLite 파일에도 기록하고,
+  다른 워커가 그 세션/사용자를 DB에서 읽기 전(flush_session/flush_user)에 그 워커가 자기 JWT로 대신 기록합니다.
+  설정하지 않으면 다른 워커의 읽기는 최대 coalesce 창만큼 이전 상태일 수 있습니다 (단일 워커나 sticky 라우팅 필요).
+"""
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from backend.config import (AUTOSAVE_COALESCE_WINDOW_SECONDS, AUTOSAVE_MAX_BUFFERED, AUTOSAVE_MAX_BATCH_SIZE, AUTOSAVE_MAX_RETRIES,
+                            AUTOSAVE_RETRY_BACKOFF_BASE_SECONDS, AUTOSAVE_RETRY_BACKOFF_MAX_SECONDS, SESSION_SHARED_SQLITE_PATH)
+from backend.database import save_ongoing_adventures_batch
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePendingAutosaves:
+    """
+    대기 중인 저장을 워커 프로세스 간에 공유하는 SQLite 테이블 (session_store의 공유 파일과 같은 파일 사용 가능).
+    JWT는 디스크에 남기지 않으며, 다른 워커는 같은 사용자의 요청을 처리할 때 그 요청의 JWT로 기록합니다.
+    행은 (user_id, session_id)로 구분하므로 다른 사용자가 같은 session_id를 보내도 서로의 저장을 덮어쓰거나 지우지 않습니다.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        primary_key = [row[1] for row in sorted(conn.execute("PRAGMA table_info(pending_autosaves)").fetchall(), key=lambda row: row[5]) if row[5]]
+        if primary_key == ["session_id"]:
+            # session_id만 키로 쓰던 이전 테이블: 대기 중인 저장을 유지한 채 (user_id, session_id) 키로 다시 만듦
+            conn.execute("ALTER TABLE pending_autosaves RENAME TO pending_autosaves_old")
+        conn.execute("CREATE TABLE IF NOT EXISTS pending_autosaves ("
+                     "user_id TEXT NOT NULL, session_id TEXT NOT NULL, saved_at TEXT NOT NULL, data TEXT NOT NULL, "
+                     "PRIMARY KEY (user_id, session_id))")
+        if primary_key == ["session_id"]:
+            conn.execute("INSERT OR IGNORE INTO pending_autosaves (user_id, session_id, saved_at, data) "
+                         "SELECT user_id, session_id, saved_at, data FROM pending_autosaves_old")
+            conn.execute("DROP TABLE pending_autosaves_old")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 연결은 스레드 간 공유하지 않고 스레드마다 하나씩 사용
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def put(self, adventure_data):
+        conn = self._conn()
+        conn.execute("INSERT INTO pending_autosaves (user_id, session_id, saved_at, data) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT(user_id, session_id) DO UPDATE SET saved_at = excluded.saved_at, data = excluded.data "
+                     "WHERE excluded.saved_at >= pending_autosaves.saved_at",
+                     (str(adventure_data.get('user_id')), str(adventure_data['session_id']), _saved_at(adventure_data),
+                      json.dumps(adventure_data, ensure_ascii=False, default=str)))
+        conn.commit()
+
+    def pending(self, user_id, session_id=None) -> list[dict]:
+        if session_id is None:
+            rows = self._conn().execute("SELECT data FROM pending_autosaves WHERE user_id = ?", (str(user_id),)).fetchall()
+        else:
+            rows = self._conn().execute("SELECT data FROM pending_autosaves WHERE user_id = ? AND session_id = ?",
+                                        (str(user_id), str(session_id))).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def remove(self, user_id, session_id, saved_at):
+        """기록이 끝난 항목을 지웁니다. 그 사이 더 새 저장이 들어왔으면 남겨 둡니다."""
+        conn = self._conn()
+        conn.execute("DELETE FROM pending_autosaves WHERE session_id = ? AND user_id = ? AND saved_at = ?",
+                     (str(session_id), str(user_id), saved_at))
+        conn.commit()
+
+    def delete(self, user_id, session_id):
+        conn = self._conn()
+        conn.execute("DELETE FROM pending_autosaves WHERE session_id = ? AND user_id = ?", (str(session_id), str(user_id)))
+        conn.commit()
+
+
+def _saved_at(adventure_data) -> str:
+    return str(adventure_data.get('saved_at') or '')
+
+
+def _pending_key(adventure_data) -> tuple:
+    return str(adventure_data.get('user_id')), str(adventure_data['session_id'])
+
+
+class AdventureWriteBehindQueue:
+    def __init__(self, flush_batch_fn, coalesce_window_seconds, max_buffered, max_batch_size, max_retries,
+                 retry_backoff_base_seconds, retry_backoff_max_seconds, shared_pending=None):
+        self._flush_batch_fn = flush_batch_fn # (adventure_list, user_jwt) -> bool
+        self.coalesce_window_seconds = coalesce_window_seconds
+        self.max_buffered = max_buffered
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.retry_backoff_base_seconds = retry_backoff_base_seconds
+        self.retry_backoff_max_seconds = retry_backoff_max_seconds
+        self.shared_pending = shared_pending
+
+        # (user_id, session_id) -> {'data', 'user_jwt', 'first_dirty_at', 'attempts'}
+        # 사용자까지 키에 넣어 다른 사용자가 같은 session_id로 보낸 저장이 이 사용자의 상태/JWT를 덮어쓰지 않도록 함
+        self._pending = {}
+        self._cond = threading.Condition()
+        # 배치 쓰기를 직렬화하여, 같은 세션의 오래된 상태가 새 상태보다 늦게 기록되는 일을 막습니다.
+        self._write_lock = threading.Lock()
+        self._worker = None
+        self._stopping = False
+        self._consecutive_failures = 0
+        self._retry_after = 0.0 # 플러시 실패 후 워커가 다음 플러시를 시작할 수 있는 시각 (monotonic)
+        self._stats = {"enqueued": 0, "coalesced": 0, "flushed_rows": 0, "flush_batches": 0,
+                       "failed_batches": 0, "dropped_rows": 0, "size_triggered_flushes": 0,
+                       "backoffs": 0, "shared_flushed_rows": 0, "shared_errors": 0}
+
+    def enqueue(self, adventure_data: dict, user_jwt: str | None):
+        """저장할 모험 상태를 버퍼에 넣습니다. 같은 사용자의 같은 session_id가 이미 대기 중이면 최신 상태로 교체합니다."""
+        key = _pending_key(adventure_data)
+        self._shared_call("put", adventure_data)
+        with self._cond:
+            self._ensure_worker()
+            self._stats["enqueued"] += 1
+            existing = self._pending.get(key)
+            if existing:
+                self._stats["coalesced"] += 1
+                existing['data'] = adventure_data
+                existing['user_jwt'] = user_jwt
+                existing['attempts'] = 0
+            else:
+                self._pending[key] = {'data': adventure_data, 'user_jwt': user_jwt,
+                                      'first_dirty_at': time.monotonic(), 'attempts': 0}
+                if len(self._pending) == 1:
+                    self._cond.notify() # 비어 있던 버퍼에 첫 항목이 들어오면 워커의 대기 시간을 다시 계산
+            if len(self._pending) >= self.max_buffered:
+                self._stats["size_triggered_flushes"] += 1
+                self._cond.notify()
+
+    def discard(self, user_id: str, session_id: str):
+        """사용자의 대기 중인 저장을 버립니다 (모험 삭제 시). 진행 중인 배치 쓰기가 끝날 때까지 기다립니다."""
+        with self._write_lock:
+            with self._cond:
+                self._pending.pop((str(user_id), str(session_id)), None)
+            self._shared_call("delete", user_id, session_id)
+
+    def flush_session(self, session_id: str, user_id: str | None = None, user_jwt: str | None = None) -> bool:
+        """
+        해당 세션의 대기 중인 저장을 즉시 기록합니다 (DB에서 읽기 전에 호출).
+        user_id/user_jwt를 넘기면 다른 워커가 공유 파일에 남긴 그 사용자의 저장도 이 JWT로 기록합니다.
+        """
+        ok = self._flush(lambda key, entry: key[1] == str(session_id) and (user_id is None or key[0] == str(user_id)))
+        return self._flush_shared(user_id, user_jwt, session_id) and ok
+
+    def flush_user(self, user_id: str, user_jwt: str | None = None) -> bool:
+        """해당 사용자의 대기 중인 저장을 모두 즉시 기록합니다 (다른 워커의 대기 중인 저장 포함, user_jwt 필요)."""
+        ok = self._flush(lambda key, entry: key[0] == str(user_id))
+        return self._flush_shared(user_id, user_jwt) and ok
+
+    def flush_all(self) -> bool:
+        return self._flush(lambda key, entry: True)
+
+    def shutdown(self):
+        """워커를 멈추고 남은 항목을 모두 플러시합니다 (atexit에서 호출)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        worker = self._worker
+        if worker and worker.is_alive():
+            worker.join(timeout=max(self.coalesce_window_seconds, 1) + 10)
+        self.flush_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"pending": len(self._pending), "shared": self.shared_pending is not None,
+                    "consecutive_failures": self._consecutive_failures, **self._stats}
+
+    def _ensure_worker(self):
+        # gunicorn preload/fork 이후 워커 프로세스 안에서 스레드를 만들도록 첫 enqueue 시점에 시작합니다.
+        if self._worker is None or not self._worker.is_alive():
+            self._stopping = False
+            self._worker = threading.Thread(target=self._run, name="adventure-autosave", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # 플러시가 실패했으면 버퍼가 가득 차 있어도 백오프가 끝날 때까지 기다림 (실패한 DB를 계속 두드리지 않도록)
+                while not self._stopping and time.monotonic() < self._retry_after:
+                    self._cond.wait(timeout=self._retry_after - time.monotonic())
+                if self._stopping:
+                    return
+                if len(self._pending) < self.max_buffered:
+                    self._cond.wait(timeout=self._next_due_in())
+                if self._stopping:
+                    return
+                force = len(self._pending) >= self.max_buffered
+            now = time.monotonic()
+            ok = self._flush(lambda key, entry: force or now - entry['first_dirty_at'] >= self.coalesce_window_seconds)
+            with self._cond:
+                if ok:
+                    self._consecutive_failures = 0
+                    continue
+                self._consecutive_failures += 1
+                backoff = min(self.retry_backoff_max_seconds,
+                              self.retry_backoff_base_seconds * (2 ** (self._consecutive_failures - 1)))
+                self._retry_after = time.monotonic() + backoff
+                self._stats["backoffs"] += 1
+            logger.warning("플러시 실패: %.1f초 후 다시 시도합니다.", backoff)
+
+    def _next_due_in(self) -> float:
+        if not self._pending:
+            return self.coalesce_window_seconds
+        oldest = min(entry['first_dirty_at'] for entry in self._pending.values())
+        return max(0.05, oldest + self.coalesce_window_seconds - time.monotonic())
+
+    def _flush(self, should_flush) -> bool:
+        with self._write_lock:
+            with self._cond:
+                due = {key: entry for key, entry in self._pending.items() if should_flush(key, entry)}
+                for key in due:
+                    del self._pending[key]
+            if not due:
+                return True
+
+            # RLS 때문에 사용자 JWT별로 묶어서 배치 upsert
+            groups = {}
+            for key, entry in due.items():
+                groups.setdefault(entry['user_jwt'], []).append((key, entry))
+
+            all_ok = True
+            for user_jwt, entries in groups.items():
+                for start in range(0, len(entries), self.max_batch_size):
+                    chunk = entries[start:start + self.max_batch_size]
+                    ok = self._flush_batch_fn([entry['data'] for _, entry in chunk], user_jwt)
+                    with self._cond:
+                        if ok:
+                            self._stats["flush_batches"] += 1
+                            self._stats["flushed_rows"] += len(chunk)
+                            finished = chunk
+                        else:
+                            all_ok = False
+                            self._stats["failed_batches"] += 1
+                            finished = self._requeue_failed(chunk) # 재시도 한도를 넘어 버린 항목
+                    for key, entry in finished:
+                        self._shared_call("remove", key[0], key[1], _saved_at(entry['data']))
+            return all_ok
+
+    def _flush_shared(self, user_id, user_jwt, session_id=None) -> bool:
+        """다른 워커가 공유 파일에 남긴 이 사용자(세션)의 대기 중인 저장을 user_jwt로 기록합니다."""
+        if self.shared_pending is None or not user_id or not user_jwt:
+            return True
+        with self._write_lock:
+            rows = self._shared_call("pending", user_id, session_id) or []
+            if not rows:
+                return True
+            # 같은 저장을 여러 워커가 기록해도 saved_at 트리거 덕분에 결과는 같음
+            ok = self._flush_batch_fn(rows, user_jwt)
+            if ok:
+                for data in rows:
+                    self._shared_call("remove", data.get('user_id'), data['session_id'], _saved_at(data))
+            with self._cond:
+                if ok:
+                    self._stats["shared_flushed_rows"] += len(rows)
+                else:
+                    self._stats["failed_batches"] += 1
+            return ok
+
+    def _shared_call(self, method, *args):
+        if self.shared_pending is None:
+            return None
+        try:
+            return getattr(self.shared_pending, method)(*args)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.exception("공유 대기열 %s 실패: %s", method, e)
+            with self._cond:
+                self._stats["shared_errors"] += 1
+            return None
+
+    def _requeue_failed(self, chunk):
+        """
+        실패한 항목은 더 새로운 상태가 들어오지 않았다면 다시 대기열에 넣고, 재시도 한도를 넘으면 버립니다.
+        버린 (key, entry) 목록을 반환합니다.
+        """
+        dropped = []
+        for key, entry in chunk:
+            if key in self._pending:
+                continue
+            entry['attempts'] += 1
+            if entry['attempts'] > self.max_retries:
+                self._stats["dropped_rows"] += 1
+                logger.error("session_id=%s 저장을 %d회 재시도 후 포기합니다.", key[1], self.max_retries)
+                dropped.append((key, entry))
+                continue
+            entry['first_dirty_at'] = time.monotonic()
+            self._pending[key] = entry
+        return dropped
+
+
+autosave_queue = AdventureWriteBehindQueue(
+    flush_batch_fn=save_ongoing_adventures_batch,
+    coalesce_window_seconds=AUTOSAVE_COALESCE_WINDOW_SECONDS,
+    max_buffered=AUTOSAVE_MAX_BUFFERED,
+    max_batch_size=AUTOSAVE_MAX_BATCH_SIZE,
+    max_retries=AUTOSAVE_MAX_RETRIES,
+    retry_backoff_base_seconds=AUTOSAVE_RETRY_BACKOFF_BASE_SECONDS,
+    retry_backoff_max_seconds=AUTOSAVE_RETRY_BACKOFF_MAX_SECONDS,
+    shared_pending=SQLitePendingAutosaves(SESSION_SHARED_SQLITE_PATH) if SESSION_SHARED_SQLITE_PATH else None,
+)
+atexit.register(autosave_queue.shutdown)
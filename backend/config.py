@@ -6,11 +6,186 @@ from dotenv import load_dotenv
 
 load_dotenv() # .env 파일에서 환경 변수 로드
 
+def _env_bool(name, default=False):
+    """환경 변수를 불리언으로 해석합니다 ('1', 'true', 'yes', 'on' 이면 True)."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 # Supabase 설정
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
 
+# Supabase HTTP 커넥션 풀 설정 (database.py)
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get("DB_POOL_MAX_CONNECTIONS", "50"))
+DB_POOL_MAX_KEEPALIVE = int(os.environ.get("DB_POOL_MAX_KEEPALIVE", "20"))
+DB_POOL_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("DB_POOL_KEEPALIVE_EXPIRY_SECONDS", "30"))
+DB_HTTP_TIMEOUT_SECONDS = float(os.environ.get("DB_HTTP_TIMEOUT_SECONDS", "30"))
+DB_USER_CLIENT_CACHE_SIZE = int(os.environ.get("DB_USER_CLIENT_CACHE_SIZE", "512"))
+
+# ongoing_adventures 저장 write-behind 큐 설정 (autosave_queue.py)
+# 서버리스(Vercel)에서는 응답 후 백그라운드 스레드가 멈추므로 기본적으로 꺼집니다.
+AUTOSAVE_WRITE_BEHIND_ENABLED = _env_bool("AUTOSAVE_WRITE_BEHIND_ENABLED", not os.environ.get("VERCEL"))
+AUTOSAVE_COALESCE_WINDOW_SECONDS = float(os.environ.get("AUTOSAVE_COALESCE_WINDOW_SECONDS", "5"))
+AUTOSAVE_MAX_BUFFERED = int(os.environ.get("AUTOSAVE_MAX_BUFFERED", "200")) # 이 개수에 도달하면 즉시 플러시
+AUTOSAVE_MAX_BATCH_SIZE = int(os.environ.get("AUTOSAVE_MAX_BATCH_SIZE", "100"))
+AUTOSAVE_MAX_RETRIES = int(os.environ.get("AUTOSAVE_MAX_RETRIES", "3"))
+# 플러시 실패 후 다음 플러시까지 기다리는 시간 (연속 실패마다 두 배, 최대값까지)
+AUTOSAVE_RETRY_BACKOFF_BASE_SECONDS = float(os.environ.get("AUTOSAVE_RETRY_BACKOFF_BASE_SECONDS", "1"))
+AUTOSAVE_RETRY_BACKOFF_MAX_SECONDS = float(os.environ.get("AUTOSAVE_RETRY_BACKOFF_MAX_SECONDS", "60"))
+
+# 스토리 세션 저장소 설정 (session_store.py)
+SESSION_STORE_MAX_SESSIONS = int(os.environ.get("SESSION_STORE_MAX_SESSIONS", "2000"))
+SESSION_STORE_IDLE_TTL_SECONDS = int(os.environ.get("SESSION_STORE_IDLE_TTL_SECONDS", "3600"))
+SESSION_STORE_MAX_BYTES = int(os.environ.get("SESSION_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_LOCK_STRIPES = int(os.environ.get("SESSION_LOCK_STRIPES", "256"))
+# 설정 시 같은 호스트의 모든 gunicorn 워커가 이 SQLite 파일로 세션 상태를 공유 (예: /tmp/storydive_sessions.db)
+SESSION_SHARED_SQLITE_PATH = os.environ.get("SESSION_SHARED_SQLITE_PATH")
+
+# 세계관 메타데이터 캐시 설정 (world_cache.py)
+WORLD_CACHE_TTL_SECONDS = float(os.environ.get("WORLD_CACHE_TTL_SECONDS", "300"))
+WORLD_CACHE_MAX_ENTRIES = int(os.environ.get("WORLD_CACHE_MAX_ENTRIES", "1000"))
+
+# 백그라운드 엔딩 판정 설정 (ending_checks.py)
+ENDING_CHECK_MAX_WORKERS = int(os.environ.get("ENDING_CHECK_MAX_WORKERS", "4"))
+ENDING_CHECK_RESULT_TTL_SECONDS = float(os.environ.get("ENDING_CHECK_RESULT_TTL_SECONDS", "600"))
+ENDING_CHECK_MAX_WAIT_SECONDS = float(os.environ.get("ENDING_CHECK_MAX_WAIT_SECONDS", "15")) # 폴링 요청 한 번이 기다리는 최대 시간
+
+# 백그라운드 히스토리 요약 설정 (story_summarizer.py). 하드 한도는 프롬프트 토큰 예산 (PROMPT_TOKEN_BUDGET, prompt_builder.py)
+SUMMARY_SOFT_WATERMARK_CHARS = int(os.environ.get("SUMMARY_SOFT_WATERMARK_CHARS", "2000"))
+SUMMARY_MAX_WORKERS = int(os.environ.get("SUMMARY_MAX_WORKERS", "2"))
+SUMMARY_HARD_WAIT_SECONDS = float(os.environ.get("SUMMARY_HARD_WAIT_SECONDS", "10"))
+# 계층형 이야기 기억 (story_memory.py): 최근 턴 원문 → 챕터 요약 → 전체 개요
+SUMMARY_TURNS_PER_CHAPTER = int(os.environ.get("SUMMARY_TURNS_PER_CHAPTER", "3"))
+SUMMARY_KEEP_RECENT_TURNS = int(os.environ.get("SUMMARY_KEEP_RECENT_TURNS", "2"))
+SUMMARY_MAX_CHAPTERS = int(os.environ.get("SUMMARY_MAX_CHAPTERS", "3"))
+SUMMARY_CHAPTER_TARGET_CHARS = int(os.environ.get("SUMMARY_CHAPTER_TARGET_CHARS", "300"))
+SUMMARY_ARC_TARGET_CHARS = int(os.environ.get("SUMMARY_ARC_TARGET_CHARS", "500"))
+
+# 선택지별 다음 이야기 예측 생성 설정 (speculation.py). API 호출이 늘어나므로 기본값은 꺼짐
+SPECULATION_ENABLED = _env_bool("SPECULATION_ENABLED", False)
+# 예측 생성을 적용할 세계관 ID 목록 (쉼표 구분, 비어 있으면 모든 세계관)
+SPECULATION_WORLD_IDS = frozenset(w.strip() for w in os.environ.get("SPECULATION_WORLD_IDS", "").split(",") if w.strip())
+SPECULATION_TOP_K = int(os.environ.get("SPECULATION_TOP_K", "2")) # 턴마다 미리 생성할 선택지 수
+SPECULATION_MAX_WORKERS = int(os.environ.get("SPECULATION_MAX_WORKERS", "4"))
+SPECULATION_MAX_PER_USER = int(os.environ.get("SPECULATION_MAX_PER_USER", "4")) # 사용자별 동시 예측 생성 수
+SPECULATION_MAX_GLOBAL = int(os.environ.get("SPECULATION_MAX_GLOBAL", "32")) # 프로세스 전체 동시 예측 생성 수
+SPECULATION_USER_CALLS_PER_HOUR = int(os.environ.get("SPECULATION_USER_CALLS_PER_HOUR", "120"))
+SPECULATION_TTL_SECONDS = int(os.environ.get("SPECULATION_TTL_SECONDS", "900")) # 선택되지 않은 예측 결과 보관 시간
+SPECULATION_MAX_WAIT_SECONDS = float(os.environ.get("SPECULATION_MAX_WAIT_SECONDS", "5")) # 생성 중인 예측 결과를 기다리는 최대 시간 (요청 데드라인으로도 제한)
+
+# 세계관별 첫 장면 미리 생성 풀 설정 (opening_pool.py). 서버리스(Vercel)에서는 백그라운드 스레드를 쓰지 않음
+OPENING_POOL_ENABLED = _env_bool("OPENING_POOL_ENABLED", not os.environ.get("VERCEL"))
+OPENING_POOL_SIZE = int(os.environ.get("OPENING_POOL_SIZE", "3")) # 세계관당 미리 만들어 둘 첫 장면 수
+OPENING_POOL_MAX_WORKERS = int(os.environ.get("OPENING_POOL_MAX_WORKERS", "2"))
+OPENING_POOL_MAX_WORLDS = int(os.environ.get("OPENING_POOL_MAX_WORLDS", "200")) # 오래 시작되지 않은 세계관부터 풀을 버림
+OPENING_POOL_PUBLIC_ONLY = _env_bool("OPENING_POOL_PUBLIC_ONLY", True) # 비공개 세계관은 풀을 만들지 않음
+
+# Gemini 구조화(JSON 스키마) 출력 설정 (gemini_utils.call_gemini_api). 끄면 텍스트 파싱 + 재시도 방식만 사용
+GEMINI_STRUCTURED_OUTPUT = _env_bool("GEMINI_STRUCTURED_OUTPUT", True)
+
+# Gemini 모델 핸들 레지스트리 설정 (model_registry.py)
+GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-1.5-flash-latest")
+# create_app 시점에 전송 채널을 미리 만들지 여부. 서버리스(Vercel)에서는 요청마다 콜드 스타트이므로 끔
+GEMINI_WARMUP_ON_START = _env_bool("GEMINI_WARMUP_ON_START", not os.environ.get("VERCEL"))
+GEMINI_WARMUP_NETWORK = _env_bool("GEMINI_WARMUP_NETWORK", True) # count_tokens 호출로 연결(TLS)까지 미리 염
+
+# Gemini 호출 동시성/사용자 한도/우선순위 설정 (llm_scheduler.py)
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8")) # 프로세스 전체 동시 Gemini 호출 수
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", "60"))
+LLM_USER_CALLS_PER_MINUTE = float(os.environ.get("LLM_USER_CALLS_PER_MINUTE", "20")) # 0이면 사용자 한도 없음
+LLM_USER_BURST = int(os.environ.get("LLM_USER_BURST", "8"))
+LLM_USER_QUOTA_MAX_WAIT_SECONDS = float(os.environ.get("LLM_USER_QUOTA_MAX_WAIT_SECONDS", "5")) # 넘으면 429로 거절
+# 429 응답 시 새 호출 시작을 늦추는 시간 (연속 429마다 두 배, 최대값까지)
+LLM_RATE_LIMIT_BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_RATE_LIMIT_BACKOFF_BASE_SECONDS", "1"))
+LLM_RATE_LIMIT_BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_RATE_LIMIT_BACKOFF_MAX_SECONDS", "30"))
+LLM_RATE_LIMIT_MAX_RETRIES = int(os.environ.get("LLM_RATE_LIMIT_MAX_RETRIES", "2"))
+
+# Gemini 호출 데드라인/헤지/서킷 브레이커 설정 (llm_resilience.py)
+LLM_REQUEST_DEADLINE_SECONDS = float(os.environ.get("LLM_REQUEST_DEADLINE_SECONDS", "45")) # handle_action 요청 하나의 전체 예산
+LLM_GENERATION_TIMEOUT_SECONDS = float(os.environ.get("LLM_GENERATION_TIMEOUT_SECONDS", "25"))
+LLM_SUMMARY_TIMEOUT_SECONDS = float(os.environ.get("LLM_SUMMARY_TIMEOUT_SECONDS", "20"))
+LLM_ENDING_CHECK_TIMEOUT_SECONDS = float(os.environ.get("LLM_ENDING_CHECK_TIMEOUT_SECONDS", "15"))
+LLM_ENDING_ENHANCEMENT_TIMEOUT_SECONDS = float(os.environ.get("LLM_ENDING_ENHANCEMENT_TIMEOUT_SECONDS", "25"))
+# 헤지 요청: 응답이 호출 종류별 지연 시간의 p95보다 늦으면 같은 요청을 한 번 더 보냄 (API 비용이 늘어나므로 기본값은 꺼짐)
+LLM_HEDGE_ENABLED = _env_bool("LLM_HEDGE_ENABLED", False)
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("LLM_HEDGE_MIN_DELAY_SECONDS", "2"))
+LLM_HEDGE_INITIAL_DELAY_SECONDS = float(os.environ.get("LLM_HEDGE_INITIAL_DELAY_SECONDS", "8")) # 지연 표본이 모이기 전
+LLM_HEDGE_MAX_WORKERS = int(os.environ.get("LLM_HEDGE_MAX_WORKERS", "16"))
+# 서킷 브레이커: 최근 LLM_BREAKER_WINDOW_SECONDS 동안 오류율이 기준을 넘으면 잠시 대체 응답만 사용
+LLM_BREAKER_WINDOW_SECONDS = float(os.environ.get("LLM_BREAKER_WINDOW_SECONDS", "60"))
+LLM_BREAKER_MIN_CALLS = int(os.environ.get("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_RATE = float(os.environ.get("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_OPEN_SECONDS = float(os.environ.get("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+# LLM 백엔드 선택 (llm_providers.py)
+# gemini: 실제 Gemini API, fake: 네트워크 없는 결정적 가짜 응답,
+# record: Gemini 응답을 LLM_RECORDING_PATH에 기록, replay: 기록된 응답을 재생
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "gemini").strip().lower()
+LLM_RECORDING_PATH = os.environ.get("LLM_RECORDING_PATH", "llm_recordings.jsonl")
+LLM_REPLAY_FALLBACK = os.environ.get("LLM_REPLAY_FALLBACK", "fake").strip().lower() # 기록에 없는 요청: fake | error
+LLM_REPLAY_LATENCY_SCALE = float(os.environ.get("LLM_REPLAY_LATENCY_SCALE", "1.0")) # 0이면 지연 없이 재생
+# 가짜 provider의 지연/오류 분포
+LLM_FAKE_SEED = int(os.environ.get("LLM_FAKE_SEED", "0"))
+LLM_FAKE_FIRST_TOKEN_SECONDS = float(os.environ.get("LLM_FAKE_FIRST_TOKEN_SECONDS", "0.8")) # 첫 토큰까지의 지연 중앙값
+LLM_FAKE_LATENCY_JITTER = float(os.environ.get("LLM_FAKE_LATENCY_JITTER", "0.3")) # 첫 토큰 지연의 로그정규 sigma
+LLM_FAKE_TOKENS_PER_SECOND = float(os.environ.get("LLM_FAKE_TOKENS_PER_SECOND", "80"))
+LLM_FAKE_SLOW_RATE = float(os.environ.get("LLM_FAKE_SLOW_RATE", "0.0")) # 이 비율의 호출은 LLM_FAKE_SLOW_SECONDS만큼 더 느림
+LLM_FAKE_SLOW_SECONDS = float(os.environ.get("LLM_FAKE_SLOW_SECONDS", "10"))
+LLM_FAKE_FAILURE_RATE = float(os.environ.get("LLM_FAKE_FAILURE_RATE", "0.0")) # 503 비율
+LLM_FAKE_RATE_LIMIT_RATE = float(os.environ.get("LLM_FAKE_RATE_LIMIT_RATE", "0.0")) # 429 비율
+
+# 요청 단계별 시간 측정 (tracing.py)
+TRACING_ENABLED = _env_bool("TRACING_ENABLED", True)
+SERVER_TIMING_ENABLED = _env_bool("SERVER_TIMING_ENABLED", True) # /api/action 응답에 Server-Timing 헤더를 붙임
+# 단계별 히스토그램 버킷 경계(초)
+TRACING_HISTOGRAM_BUCKETS = [float(b) for b in os.environ.get(
+    "TRACING_HISTOGRAM_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,20,40").split(",") if b.strip()]
+# Prometheus 텍스트 형식 /metrics 엔드포인트 (Authorization: Bearer <METRICS_TOKEN> 필요).
+# METRICS_TOKEN이 없으면 기본적으로 열지 않음. 내부망 전용으로 토큰 없이 열려면 METRICS_ENABLED=true를 명시
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", bool(METRICS_TOKEN))
+if METRICS_ENABLED and not METRICS_TOKEN:
+    print("경고 (config.py): METRICS_TOKEN 없이 /metrics가 열려 있습니다. 외부에 노출되지 않는 곳에서만 사용하세요.")
+
+# 로깅 설정 (logging_setup.py, create_app에서 적용)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# 로거별 레벨 (이름=레벨, 쉼표로 구분). httpx는 요청마다 INFO 로그를 남기므로 기본으로 낮춤
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "httpx=WARNING,httpcore=WARNING,hpack=WARNING")
+LOG_JSON = _env_bool("LOG_JSON", False) # 한 줄에 JSON 하나 (ts, level, logger, thread, msg)
+LOG_ASYNC = _env_bool("LOG_ASYNC", True) # 요청 스레드는 큐에 넣기만 하고 출력은 별도 스레드에서
+LOG_QUEUE_MAX = int(os.environ.get("LOG_QUEUE_MAX", "10000")) # 가득 차면 새 레코드를 버림
+LOG_MAX_MESSAGE_CHARS = int(os.environ.get("LOG_MAX_MESSAGE_CHARS", "2000"))
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "200")) # truncated()로 넘긴 payload의 문자열 필드 길이
+LOG_DEBUG_MAX_PER_SECOND = int(os.environ.get("LOG_DEBUG_MAX_PER_SECOND", "5")) # 호출 위치별 DEBUG 로그 한도 (0이면 제한 없음)
+
+# Gemini 토큰 사용량 집계 (token_accounting.py)
+TOKEN_ACCOUNTING_MAX_KEYS = int(os.environ.get("TOKEN_ACCOUNTING_MAX_KEYS", "5000")) # 세션/세계관/사용자별로 유지할 최근 항목 수
+# 100만 토큰당 가격(USD). 0이면 비용은 0으로 기록하고 토큰 수만 집계
+LLM_PRICE_INPUT_PER_MTOK = float(os.environ.get("LLM_PRICE_INPUT_PER_MTOK", "0"))
+LLM_PRICE_OUTPUT_PER_MTOK = float(os.environ.get("LLM_PRICE_OUTPUT_PER_MTOK", "0"))
+# /internal/token-usage 조회용 토큰 (Authorization: Bearer <token>). 비어 있으면 엔드포인트를 열지 않음
+INTERNAL_STATS_TOKEN = os.environ.get("INTERNAL_STATS_TOKEN")
+
+# 토큰 예산 기반 프롬프트 조립 (prompt_builder.py). 토큰 수는 로컬 추정치이며, Gemini 응답의 실제 입력 토큰 수로 보정됨
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "3000")) # 이어가기 프롬프트 전체 목표 토큰 수
+PROMPT_SETTING_MAX_TOKENS = int(os.environ.get("PROMPT_SETTING_MAX_TOKENS", "600")) # 세계관 설정에 배정하는 최대 토큰 (넘으면 뒷부분 생략)
+PROMPT_SETTING_MIN_TOKENS = int(os.environ.get("PROMPT_SETTING_MIN_TOKENS", "200")) # 예산이 모자랄 때 세계관 설정을 줄이는 하한
+PROMPT_MIN_RECENT_TURNS = int(os.environ.get("PROMPT_MIN_RECENT_TURNS", "2")) # 예산이 모자라도 원문으로 남기는 최근 턴 수
+PROMPT_TOKEN_CALIBRATION = float(os.environ.get("PROMPT_TOKEN_CALIBRATION", "1.0")) # 로컬 추정치 보정 계수의 초기값
+
+# 호출 종류별로 바뀌지 않는 규칙(스토리텔러 지시, 엔딩 판정 기준)을 프롬프트 대신 모델 핸들의 system_instruction으로 보냄 (gemini_utils.py)
+GEMINI_SYSTEM_INSTRUCTIONS_ENABLED = _env_bool("GEMINI_SYSTEM_INSTRUCTIONS_ENABLED", True) # 끄면 이전처럼 매 프롬프트 앞에 붙임
+
+# JWT 로컬 검증 캐시 설정 (auth_utils.py)
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_TOKEN_CACHE_MAX_ENTRIES", "2048"))
+AUTH_TOKEN_CACHE_MAX_TTL_SECONDS = int(os.environ.get("AUTH_TOKEN_CACHE_MAX_TTL_SECONDS", "300")) # 0이면 토큰 exp까지 캐시
+# 로컬 검증이 불가능하거나 실패했을 때 supabase.auth.get_user 원격 호출로 재확인할지 여부
+AUTH_REMOTE_FALLBACK = _env_bool("AUTH_REMOTE_FALLBACK", False)
+
 # Gemini API 설정
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
@@ -31,5 +206,8 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 if not GEMINI_API_KEY:
     print("경고: GEMINI_API_KEY 환경 변수가 설정되지 않았습니다.")
 
+if not SUPABASE_JWT_SECRET and not AUTH_REMOTE_FALLBACK:
+    print("경고: SUPABASE_JWT_SECRET이 없고 AUTH_REMOTE_FALLBACK도 꺼져 있어 API 인증이 모두 실패합니다.")
+
 if not SUPABASE_SERVICE_KEY:
     print("경고: SUPABASE_SERVICE_KEY 환경 변수가 설정되지 않았습니다. 파일 업로드 등 일부 백엔드 기능이 제한될 수 있습니다.") 
\ No newline at end of file
@@ -2,20 +2,82 @@
 Database-related utilities, including Supabase client initialization and helper functions.
 """
 import os
-from supabase import create_client, Client
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import httpx
+from postgrest import SyncPostgrestClient, ReturnMethod
+from postgrest.exceptions import APIError
+from supabase import create_client, Client, ClientOptions
 from .config import SUPABASE_URL, SUPABASE_KEY # config에서 가져오기
+from .logging_setup import truncated
+from .config import DB_POOL_MAX_CONNECTIONS, DB_POOL_MAX_KEEPALIVE, DB_POOL_KEEPALIVE_EXPIRY_SECONDS, DB_HTTP_TIMEOUT_SECONDS, DB_USER_CLIENT_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
 
 # 기본 클라이언트 (anon key 사용)
 default_supabase_client: Client | None = None
 
+# 모든 Supabase 요청이 공유하는 httpx 클라이언트 (keep-alive 커넥션 풀)
+# httpx.Client는 스레드 안전하므로 gunicorn 스레드 간에 하나의 풀을 공유합니다.
+_shared_http_client: httpx.Client | None = None
+_shared_http_client_lock = threading.Lock()
+
+# 사용자 JWT별 경량 클라이언트 캐시: sha256(jwt) -> PooledUserClient
+_user_clients = OrderedDict()
+_user_clients_lock = threading.Lock()
+_db_pool_stats = {"user_clients_created": 0, "user_clients_reused": 0, "user_clients_evicted": 0}
+
+def get_shared_http_client() -> httpx.Client:
+    """프로세스 전체에서 공유하는 httpx 클라이언트를 반환합니다 (최초 호출 시 생성)."""
+    global _shared_http_client
+    if _shared_http_client is None:
+        with _shared_http_client_lock:
+            if _shared_http_client is None:
+                _shared_http_client = httpx.Client(
+                    http2=True,
+                    follow_redirects=True,
+                    timeout=DB_HTTP_TIMEOUT_SECONDS,
+                    limits=httpx.Limits(
+                        max_connections=DB_POOL_MAX_CONNECTIONS,
+                        max_keepalive_connections=DB_POOL_MAX_KEEPALIVE,
+                        keepalive_expiry=DB_POOL_KEEPALIVE_EXPIRY_SECONDS,
+                    ),
+                )
+    return _shared_http_client
+
+class PooledUserClient:
+    """
+    사용자 JWT가 적용된 경량 Supabase(PostgREST) 클라이언트.
+    공유 httpx 커넥션 풀을 사용하고, Authorization 헤더는 요청마다 적용됩니다.
+    사용자 클라이언트로는 table()/from_()/rpc()만 사용하므로 auth/storage/realtime 서브 클라이언트는 만들지 않습니다.
+    """
+    def __init__(self, user_jwt: str):
+        self.postgrest = SyncPostgrestClient(
+            f"{SUPABASE_URL.rstrip('/')}/rest/v1",
+            headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {user_jwt}"},
+            http_client=get_shared_http_client(),
+        )
+
+    def table(self, table_name: str):
+        return self.postgrest.from_(table_name)
+
+    def from_(self, table_name: str):
+        return self.postgrest.from_(table_name)
+
+    def rpc(self, fn: str, params: dict | None = None, count=None):
+        return self.postgrest.rpc(fn, params or {}, count)
+
 def init_supabase_client():
     """Initializes the default Supabase client using anon key."""
     global default_supabase_client
     print(f"[DB_DEBUG] init_supabase_client called. Current default_supabase_client: {'Not None' if default_supabase_client else 'None'}")
     if SUPABASE_URL and SUPABASE_KEY:
         try:
-            # 기본 클라이언트는 항상 anon key로 초기화
-            default_supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            # 기본 클라이언트는 항상 anon key로 초기화 (공유 커넥션 풀 사용)
+            default_supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=get_shared_http_client()))
             print("Default Supabase client initialized successfully with anon key (database.py)")
         except Exception as e:
             print(f"Error initializing default Supabase client (database.py): {e}")
@@ -28,89 +90,56 @@ def init_supabase_client():
 # 앱 시작 시 기본 클라이언트 자동 초기화 (선택 사항, 필요에 따라 주석 처리/해제)
 init_supabase_client()
 
-def get_db_client(user_jwt: str | None = None) -> Client | None:
+def get_db_client(user_jwt: str | None = None) -> Client | PooledUserClient | None:
     """
     Returns a Supabase client.
-    If user_jwt is provided, returns a new client instance authenticated with the user's JWT.
+    If user_jwt is provided, returns a pooled client authenticated with the user's JWT
+    (reused across calls for the same token, sharing one keep-alive connection pool).
     Otherwise, returns the default client (using anon key).
     """
     global default_supabase_client
-    print(f"[DB_DEBUG] get_db_client called. User JWT provided: {'Yes' if user_jwt else 'No'}")
 
     if user_jwt:
-        if SUPABASE_URL and SUPABASE_KEY: # SUPABASE_KEY는 URL과 함께 항상 필요
-            try:
-                # 사용자 JWT로 새 클라이언트 인스턴스 생성
-                # 헤더를 올바르게 설정하는 방법은 supabase-python 버전에 따라 다를 수 있습니다.
-                # 일반적인 접근 방식은 클라이언트 생성 시 headers 옵션을 사용하는 것입니다.
-                headers = {
-                    "Authorization": f"Bearer {user_jwt}",
-                    "apikey": SUPABASE_KEY # anon key도 여전히 필요할 수 있음 (RLS 정책 등에 따라)
-                }
-                # create_client의 options 파라미터로 headers 전달 시도 (v2 방식)
-                # 또는 postgrest_client_kwargs={'headers': headers} 등 버전에 맞는 방식 사용
-                # 가장 기본적인 create_client는 URL과 anon/service key만 받음. 
-                # PostgREST 클라이언트에 직접 헤더를 설정해야 할 수도 있음.
-                # 여기서는 create_client가 options를 통해 headers를 받을 수 있다고 가정하고 진행
-                # (실제 라이브러리 API 확인 필요)
-                # Supabase-py v0.x/1.x 에서는 options 파라미터가 없을 수 있음. 
-                # 이 경우 client.auth.set_session(access_token=user_jwt) 등을 고려해야 함.
-                # 하지만 set_session은 refresh token도 필요로 할 수 있어 복잡.
-                # 가장 호환성 높은 방식은 Client 생성 후 PostgREST client의 헤더를 직접 설정하는 것.
-                # user_specific_client = create_client(SUPABASE_URL, SUPABASE_KEY) # 일단 anon으로 만들고
-                # user_specific_client.postgrest.auth(user_jwt) # postgrest client에 인증 토큰 설정
-                # 위 방식이 더 안정적일 수 있음. 여기서는 create_client options를 먼저 시도.
-                
-                # supabase-py v2+ 에서의 권장 방식:
-                # from supabase.lib.client_options import ClientOptions
-                # opts = ClientOptions(headers=headers)
-                # user_client = create_client(SUPABASE_URL, SUPABASE_KEY, options=opts)
-                # 위 ClientOptions를 사용하려면 해당 클래스가 라이브러리에 있어야 함.
-                # 현재 코드에서는 직접 headers를 넘기는 방식이 없으므로, 생성 후 Postgrest client에 설정.
-
-                # 안정적인 접근: anon키로 클라이언트 생성 후, Postgrest 부분에만 JWT 설정
-                if not SUPABASE_URL or not SUPABASE_KEY:
-                    print("Error: SUPABASE_URL or SUPABASE_KEY is missing for user-specific client.")
-                    return None
-                
-                # print(f"[DB_DEBUG] Creating user-specific client with JWT.")
-                # # user_client = create_client(SUPABASE_URL, SUPABASE_KEY) # 기본 클라이언트 생성
-                # # user_client.postgrest.headers["Authorization"] = f"Bearer {user_jwt}" # 헤더 직접 설정 (v1 방식)
-                # # 위 방식은 postgrest v0.x 에서 가능. v1.x 에서는 postgrest.auth() 사용.
-                # user_client.auth.set_session(access_token=user_jwt, refresh_token="dummy_refresh_token_if_not_available_but_needed")
-                # set_session은 실제 refresh token이 없으면 문제가 될 수 있음.
-                # JWT만으로 인증하는 가장 간단한 방법은 클라이언트 생성시 headers를 넘기는 것인데, supabase-py create_client는 이를 직접 지원하지 않음.
-                # 대신, postgrest 클라이언트에 직접 접근하여 설정.
-                
-                # supabase-py (postgrest-py 기반)의 일반적인 JWT 사용법:
-                # supabase-py 2.x.x 버전에서는 다음과 같이 시도 가능
-                from supabase.lib.client_options import ClientOptions
-                options = ClientOptions()
-                options.headers["Authorization"] = f"Bearer {user_jwt}"
-                # options.headers["apikey"] = SUPABASE_KEY # 이미 create_client에서 처리됨
-
-                user_specific_client = create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
-                print("[DB_DEBUG] Created new user-specific Supabase client with JWT.")
-                return user_specific_client
-            except Exception as e:
-                print(f"Error creating user-specific Supabase client (database.py): {e}")
-                return None
-        else:
+        if not SUPABASE_URL or not SUPABASE_KEY: # SUPABASE_KEY는 URL과 함께 항상 필요
             print("Warning: SUPABASE_URL or SUPABASE_KEY not set. Cannot create user-specific client (database.py).")
             return None
+
+        cache_key = hashlib.sha256(user_jwt.encode("utf-8")).hexdigest()
+        with _user_clients_lock:
+            user_client = _user_clients.get(cache_key)
+            if user_client is not None:
+                _user_clients.move_to_end(cache_key)
+                _db_pool_stats["user_clients_reused"] += 1
+                return user_client
+        try:
+            user_client = PooledUserClient(user_jwt)
+        except Exception as e:
+            print(f"Error creating user-specific Supabase client (database.py): {e}")
+            return None
+        with _user_clients_lock:
+            _user_clients[cache_key] = user_client
+            _db_pool_stats["user_clients_created"] += 1
+            while len(_user_clients) > DB_USER_CLIENT_CACHE_SIZE:
+                _user_clients.popitem(last=False)
+                _db_pool_stats["user_clients_evicted"] += 1
+        return user_client
     else:
         # JWT가 제공되지 않으면 기본 클라이언트 반환
         if default_supabase_client is None:
             print("Default Supabase client is None, attempting to re-initialize (get_db_client).")
             init_supabase_client()
-        print("[DB_DEBUG] Returning default Supabase client.")
         return default_supabase_client
 
+def get_db_pool_stats() -> dict:
+    """사용자 클라이언트 캐시 크기와 생성/재사용/퇴출 카운터를 반환합니다."""
+    with _user_clients_lock:
+        return {"user_clients_cached": len(_user_clients), **_db_pool_stats}
+
 def load_story_from_db(session_id: str, user_id: str, user_jwt: str | None = None) -> dict | None:
     # 이제 get_db_client가 JWT를 처리하므로, 여기서 headers 인자 제거
     client = get_db_client(user_jwt=user_jwt) 
     if not client or not user_id:
-        print(f"DB 로드 실패: 클라이언트({client is not None}) 또는 user_id({user_id is not None}) 없음")
+        logger.warning("DB 로드 실패: 클라이언트(%s) 또는 user_id(%s) 없음", client is not None, user_id is not None)
         return None
     # JWT 유무 검사는 get_db_client 내부 또는 호출부에서 처리되므로 여기서는 client 객체 유효성만 확인
     # if not user_jwt: # 더 이상 여기서 직접 JWT 검사 불필요
@@ -129,7 +158,7 @@ def load_story_from_db(session_id: str, user_id: str, user_jwt: str | None = Non
         response = query.maybe_single().execute() # headers 인자 제거
         
         if response and hasattr(response, 'data') and response.data:
-            print(f"DB 로드 성공: {response.data}")
+            logger.debug("DB 로드 성공: %s", truncated(response.data))
             return {
                 "history": response.data.get('story_history'),
                 "last_response": response.data.get('last_ai_response'),
@@ -138,10 +167,10 @@ def load_story_from_db(session_id: str, user_id: str, user_jwt: str | None = Non
                 "user_id": response.data.get('user_id'),
                 "world_id": str(response.data.get('world_id')) if response.data.get('world_id') else None # world_id 반환 (문자열로 변환)
             }
-        print(f"DB에 해당 조건의 데이터 없음 (user_id: {user_id}, session_id: {session_id})")
+        logger.info("DB에 해당 조건의 데이터 없음 (user_id: %s, session_id: %s)", user_id, session_id)
         return None
     except Exception as e:
-        print(f"DB에서 스토리 로드 중 오류 (user_id: {user_id}, session_id: {session_id}): {e}")
+        logger.error("DB에서 스토리 로드 중 오류 (user_id: %s, session_id: %s): %s", user_id, session_id, e)
         return None
 
 def save_story_to_db(session_id: str, story_content: str, 
@@ -150,129 +179,214 @@ def save_story_to_db(session_id: str, story_content: str,
                      user_id: str = None, 
                      world_id: str | None = None,
                      user_jwt: str | None = None) -> bool:
-    # 이제 get_db_client가 JWT를 처리하므로, 여기서 headers 인자 제거
+    """단일 스토리 스냅샷을 저장합니다. save_story_snapshots_to_db의 1건짜리 래퍼입니다."""
+    if not session_id or not user_id:
+        logger.warning("DB 저장 실패: session_id(%s), user_id(%s) 누락", session_id is not None, user_id is not None)
+        return False
+    return save_story_snapshots_to_db([{
+        'session_id': session_id,
+        'story_content': story_content,
+        'last_ai_response': last_ai_response,
+        'last_choices': last_choices,
+        'user_id': user_id,
+        'world_id': world_id,
+    }], user_jwt=user_jwt)
+
+# upsert_story_snapshots가 없다는 PostgREST 응답 코드 (스키마 캐시에 함수 없음 / 함수 없음)
+_MISSING_FUNCTION_CODES = {"PGRST202", "42883"}
+# 마이그레이션(20261018000100)이 적용되지 않은 DB로 확인되면 이 프로세스에서는 RPC를 다시 시도하지 않음
+_story_snapshot_rpc_available = True
+
+def save_story_snapshots_to_db(snapshots: list[dict], user_jwt: str | None = None) -> bool:
+    """
+    여러 스토리 스냅샷을 upsert_story_snapshots RPC 한 번으로 저장합니다.
+    (user_id, session_id) 충돌 시 world_id/created_at은 유지하고 나머지 필드만 갱신하며,
+    확인(select) 후 쓰기 방식과 달리 한 번의 왕복으로 원자적으로 처리됩니다.
+    각 스냅샷은 save_story_to_db와 같은 키(session_id, story_content, last_ai_response, last_choices, user_id, world_id)를 사용합니다.
+    RPC가 없는 DB(마이그레이션 미적용)에서는 스냅샷마다 확인 후 update/insert하는 이전 방식으로 저장합니다.
+    """
+    global _story_snapshot_rpc_available
     client = get_db_client(user_jwt=user_jwt)
-    if not client or not session_id or not user_id:
-        print(f"DB 저장 실패: 클라이언트({client is not None}), session_id({session_id is not None}), user_id({user_id is not None}) 누락")
+    if not client:
+        logger.warning("DB 저장 실패: 클라이언트 없음")
         return False
-    # if not user_jwt: # 더 이상 여기서 직접 JWT 검사 불필요
-    #     print(f"DB 저장 실패: user_jwt 없음 (user_id: {user_id}, session_id: {session_id})")
-    #     return False
-    
-    try:
-        # headers 인자 제거 (클라이언트에 이미 설정됨)
-        data_to_save = {
-            'story_history': story_content,
-            'last_ai_response': last_ai_response,
-            'last_choices': last_choices,
-            'last_updated_at': 'now()', 
-            'last_played_at': 'now()',
-            'session_id': session_id,
-            'user_id': user_id,
-            'world_id': world_id,
-            'status': 'ongoing' 
+
+    # 같은 (user_id, session_id)가 한 배치에 여러 번 있으면 ON CONFLICT가 실패하므로 마지막 스냅샷만 남깁니다.
+    rows_by_key = {}
+    for snapshot in snapshots:
+        session_id = snapshot.get('session_id')
+        user_id = snapshot.get('user_id')
+        if not session_id or not user_id:
+            logger.warning("DB 저장 건너뜀: session_id(%s), user_id(%s) 누락", session_id is not None, user_id is not None)
+            continue
+        rows_by_key[(str(user_id), str(session_id))] = {
+            'session_id': str(session_id),
+            'user_id': str(user_id),
+            'world_id': str(snapshot['world_id']) if snapshot.get('world_id') else None,
+            'story_history': snapshot.get('story_content'),
+            'last_ai_response': snapshot.get('last_ai_response'),
+            'last_choices': snapshot.get('last_choices'),
+            'status': 'ongoing'
         }
+    if not rows_by_key:
+        return False
 
-        query_check = client.table('stories').select('id', count='exact') \
-                          .eq('user_id', user_id) \
-                          .eq('session_id', session_id)
-        
-        response_check_existence = query_check.execute() # headers 인자 제거
+    if not _story_snapshot_rpc_available:
+        return _save_story_rows_legacy(client, rows_by_key.values())
 
-        record_exists = False
-        if hasattr(response_check_existence, 'count') and response_check_existence.count is not None and response_check_existence.count > 0:
-            record_exists = True
-        elif hasattr(response_check_existence, 'data') and response_check_existence.data:
-             record_exists = True
-        
-        if record_exists:
-            print(f"DB 업데이트 시도 (user_id: {user_id}, session_id: {session_id})")
-            update_payload = {k: v for k, v in data_to_save.items() if k not in ['user_id', 'session_id', 'world_id', 'created_at']}
-            response = client.table('stories').update(update_payload) \
-                               .eq('user_id', user_id) \
-                               .eq('session_id', session_id) \
-                               .execute() # headers 인자 제거
-        else:
-            print(f"DB 삽입 시도 (user_id: {user_id}, session_id: {session_id})")
-            response = client.table('stories').insert(data_to_save).execute() # headers 인자 제거
+    try:
+        try:
+            response = client.rpc('upsert_story_snapshots', {'snapshots': list(rows_by_key.values())}).execute()
+        except APIError as e:
+            if e.code not in _MISSING_FUNCTION_CODES:
+                raise
+            logger.warning("upsert_story_snapshots 함수가 없어 이전 저장 방식을 사용합니다 (마이그레이션 20261018000100 미적용): %s", e.message)
+            _story_snapshot_rpc_available = False
+            return _save_story_rows_legacy(client, rows_by_key.values())
 
         if hasattr(response, 'error') and response.error:
-            print(f"DB 작업 실패: {response.error.message if hasattr(response.error, 'message') else response.error}")
+            logger.error("DB 작업 실패: %s", getattr(response.error, 'message', response.error))
             return False
-        
-        if hasattr(response, 'data') and response.data:
-            print(f"DB 저장/업데이트 성공 (user_id: {user_id}, session_id: {session_id}), 데이터: {response.data}")
-            return True
-        elif not hasattr(response, 'error'): 
-            print(f"DB 작업은 오류 없이 완료되었으나, 반환된 데이터가 없습니다. (user_id: {user_id}, session_id: {session_id})")
-            return True 
-
-        print(f"DB 작업 실패 (예상치 못한 응답): {response}")
-        return False
+
+        logger.debug("DB 저장/업데이트 성공: %d개 스냅샷 (처리된 행: %s)", len(rows_by_key), truncated(getattr(response, 'data', None)))
+        return True
 
     except Exception as e:
-        print(f"DB에 스토리 저장/업데이트 중 심각한 오류: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("DB에 스토리 저장/업데이트 중 심각한 오류: %s", e)
         return False 
 
+def _save_story_rows_legacy(client, rows) -> bool:
+    """upsert_story_snapshots 없이 행마다 존재 여부를 확인한 뒤 update(world_id 유지) 또는 insert합니다."""
+    try:
+        for row in rows:
+            data_to_save = {**row, 'last_updated_at': 'now()', 'last_played_at': 'now()'}
+            response_check_existence = client.table('stories').select('id', count='exact') \
+                                             .eq('user_id', row['user_id']) \
+                                             .eq('session_id', row['session_id']) \
+                                             .execute()
+            record_exists = bool(response_check_existence.count or response_check_existence.data)
+            if record_exists:
+                update_payload = {k: v for k, v in data_to_save.items() if k not in ['user_id', 'session_id', 'world_id', 'created_at']}
+                response = client.table('stories').update(update_payload) \
+                                 .eq('user_id', row['user_id']) \
+                                 .eq('session_id', row['session_id']) \
+                                 .execute()
+            else:
+                response = client.table('stories').insert(data_to_save).execute()
+            if hasattr(response, 'error') and response.error:
+                logger.error("DB 작업 실패: %s", getattr(response.error, 'message', response.error))
+                return False
+        logger.debug("DB 저장/업데이트 성공 (이전 방식)")
+        return True
+    except Exception as e:
+        logger.exception("DB에 스토리 저장/업데이트 중 심각한 오류 (이전 방식): %s", e)
+        return False
+
 # ongoing_adventures 테이블 관련 함수들
 
+def _build_ongoing_adventure_row(adventure_data: dict) -> dict:
+    """ongoing_adventures 테이블에 upsert할 행을 만듭니다."""
+    row = {
+        'user_id': str(adventure_data['user_id']),
+        'world_id': str(adventure_data['world_id']),
+        'session_id': str(adventure_data['session_id']),
+        'world_title': adventure_data.get('world_title'),
+        'history': adventure_data.get('history'),
+        'last_ai_response': adventure_data.get('last_ai_response'),
+        'last_choices': adventure_data.get('last_choices'),
+        'active_systems': adventure_data.get('active_systems', {}),
+        'system_configs': adventure_data.get('system_configs', {}),
+        'summary': adventure_data.get('summary'), # summary 필드 추가 (main.js에서 보내는 것으로 보임)
+        'updated_at': 'now()' # updated_at은 자동 갱신되도록 설정하는 것이 좋으나, 명시적 설정도 가능
+    }
+    if 'token_usage' in adventure_data:
+        # 서버 세션의 누적 토큰 사용량을 알 때만 저장 (없을 때 덮어써서 0으로 되돌리지 않도록)
+        row['token_usage'] = adventure_data['token_usage'] or {}
+    if 'turn' in adventure_data:
+        # 서버 세션의 턴 번호를 알 때만 저장 (token_usage와 같은 이유)
+        row['turn'] = int(adventure_data['turn'] or 0)
+    if adventure_data.get('saved_at'):
+        # 저장 요청 시각. DB 트리거가 이보다 새 saved_at이 이미 기록된 행은 갱신하지 않음 (워커 간 늦은 플러시 보호)
+        row['saved_at'] = adventure_data['saved_at']
+    return row
+
 def save_ongoing_adventure(adventure_data: dict, user_jwt: str | None = None) -> bool:
-    print(f"[DEBUG save_ongoing_adventure] Called with adventure_data: {adventure_data}") # 함수 호출 및 데이터 확인 로그
+    logger.debug("[save_ongoing_adventure] Called with adventure_data: %s", truncated(adventure_data)) # history 등 긴 필드는 잘라서 로깅
     client = get_db_client(user_jwt=user_jwt)
     if not client:
-        print("[DEBUG save_ongoing_adventure] DB 저장 실패: 클라이언트 없음")
+        logger.warning("[save_ongoing_adventure] DB 저장 실패: 클라이언트 없음")
         return False
 
     required_fields = ['session_id', 'user_id', 'world_id']
     for field in required_fields:
         if field not in adventure_data or not adventure_data[field]:
-            print(f"[DEBUG save_ongoing_adventure] DB 저장 실패: 필수 필드 '{field}' 누락 또는 비어있음. Data: {adventure_data}")
+            logger.warning("[save_ongoing_adventure] DB 저장 실패: 필수 필드 '%s' 누락 또는 비어있음. Data: %s", field, truncated(adventure_data))
             return False
     
     try:
-        data_to_save = {
-            'user_id': str(adventure_data['user_id']),
-            'world_id': str(adventure_data['world_id']),
-            'session_id': str(adventure_data['session_id']),
-            'world_title': adventure_data.get('world_title'),
-            'history': adventure_data.get('history'),
-            'last_ai_response': adventure_data.get('last_ai_response'),
-            'last_choices': adventure_data.get('last_choices'),
-            'active_systems': adventure_data.get('active_systems', {}),
-            'system_configs': adventure_data.get('system_configs', {}),
-            'summary': adventure_data.get('summary'), # summary 필드 추가 (main.js에서 보내는 것으로 보임)
-            'updated_at': 'now()' # updated_at은 자동 갱신되도록 설정하는 것이 좋으나, 명시적 설정도 가능
-        }
-        print(f"[DEBUG save_ongoing_adventure] Data to upsert: {data_to_save}")
+        data_to_save = _build_ongoing_adventure_row(adventure_data)
         
         response = client.table('ongoing_adventures') \
                          .upsert(data_to_save, on_conflict='session_id') \
                          .execute()
 
-        print(f"[DEBUG save_ongoing_adventure] Supabase upsert response: {response}") # Supabase 응답 전체 로깅
-
         if hasattr(response, 'error') and response.error:
-            print(f"[DEBUG save_ongoing_adventure] DB 저장/업데이트 실패: {response.error.message if hasattr(response.error, 'message') else response.error}")
+            logger.error("[save_ongoing_adventure] DB 저장/업데이트 실패: %s", getattr(response.error, 'message', response.error))
             return False
         
         # Supabase upsert는 성공 시 보통 data 필드에 삽입/수정된 레코드를 반환합니다.
         # response.data가 비어있더라도 오류가 없으면 성공으로 간주할 수 있습니다 (특히 count가 없는 경우).
         if (hasattr(response, 'data') and response.data) or not (hasattr(response, 'error') and response.error):
-            print(f"[DEBUG save_ongoing_adventure] DB 저장/업데이트 성공: session_id={adventure_data['session_id']}")
+            logger.debug("[save_ongoing_adventure] DB 저장/업데이트 성공: session_id=%s", adventure_data['session_id'])
         return True
 
     except Exception as e:
-        print(f"[DEBUG save_ongoing_adventure] DB에 ongoing_adventure 저장/업데이트 중 심각한 오류: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("[save_ongoing_adventure] DB에 ongoing_adventure 저장/업데이트 중 심각한 오류: %s", e)
+        return False
+
+def save_ongoing_adventures_batch(adventure_list: list[dict], user_jwt: str | None = None) -> bool:
+    """
+    여러 ongoing_adventure를 한 번의 upsert 요청으로 저장합니다 (autosave_queue의 배치 플러시용).
+    응답 본문에 history 전체가 되돌아오지 않도록 returning=minimal을 사용합니다.
+    """
+    client = get_db_client(user_jwt=user_jwt)
+    if not client:
+        logger.warning("[save_ongoing_adventures_batch] DB 저장 실패: 클라이언트 없음")
+        return False
+
+    rows = []
+    for adventure_data in adventure_list:
+        if all(adventure_data.get(field) for field in ('session_id', 'user_id', 'world_id')):
+            rows.append(_build_ongoing_adventure_row(adventure_data))
+        else:
+            logger.warning("[save_ongoing_adventures_batch] 필수 필드 누락으로 건너뜀: session_id=%s", adventure_data.get('session_id'))
+    if not rows:
+        return False
+
+    # 목록 upsert는 모든 행의 키 합집합을 컬럼으로 쓰므로, token_usage가 없는 행이 기존 값을 지우지 않도록 키 구성별로 나눠 보냄
+    row_groups = {}
+    for row in rows:
+        row_groups.setdefault(frozenset(row), []).append(row)
+
+    try:
+        for group in row_groups.values():
+            response = client.table('ongoing_adventures') \
+                             .upsert(group, on_conflict='session_id', returning=ReturnMethod.minimal) \
+                             .execute()
+            if hasattr(response, 'error') and response.error:
+                logger.error("[save_ongoing_adventures_batch] DB 저장/업데이트 실패: %s", getattr(response.error, 'message', response.error))
+                return False
+        logger.debug("[save_ongoing_adventures_batch] DB 저장/업데이트 성공: %d개", len(rows))
+        return True
+    except Exception as e:
+        logger.exception("[save_ongoing_adventures_batch] ongoing_adventures 배치 저장 중 심각한 오류: %s", e)
         return False
 
 def get_ongoing_adventure(session_id: str, user_id: str, user_jwt: str | None = None) -> dict | None:
     client = get_db_client(user_jwt=user_jwt)
     if not client or not session_id or not user_id:
-        print(f"DB 로드 실패 (ongoing_adventure): 클라이언트({client is not None}), session_id({session_id is not None}), user_id({user_id is not None}) 누락")
+        logger.warning("DB 로드 실패 (ongoing_adventure): 클라이언트(%s), session_id(%s), user_id(%s) 누락",
+                       client is not None, session_id is not None, user_id is not None)
         return None
     try:
         response = client.table('ongoing_adventures') \
@@ -286,13 +400,13 @@ def get_ongoing_adventure(session_id: str, user_id: str, user_jwt: str | None =
             return response.data
         return None
     except Exception as e:
-        print(f"DB에서 ongoing_adventure 로드 중 오류: {e}")
+        logger.error("DB에서 ongoing_adventure 로드 중 오류: %s", e)
         return None
 
 def get_all_ongoing_adventures(user_id: str, user_jwt: str | None = None) -> list | None:
     client = get_db_client(user_jwt=user_jwt)
     if not client or not user_id:
-        print(f"DB 목록 로드 실패 (all_ongoing_adventures): 클라이언트({client is not None}) 또는 user_id({user_id is not None}) 누락")
+        logger.warning("DB 목록 로드 실패 (all_ongoing_adventures): 클라이언트(%s) 또는 user_id(%s) 누락", client is not None, user_id is not None)
         return None
     try:
         response = client.table('ongoing_adventures') \
@@ -305,14 +419,15 @@ def get_all_ongoing_adventures(user_id: str, user_jwt: str | None = None) -> lis
             return response.data
         return []
     except Exception as e:
-        print(f"DB에서 all_ongoing_adventures 로드 중 오류: {e}")
+        logger.error("DB에서 all_ongoing_adventures 로드 중 오류: %s", e)
         return None
 
 def delete_ongoing_adventure(session_id: str, user_id: str, user_jwt: str | None = None) -> bool:
-    print(f"[DEBUG delete_ongoing_adventure] Called with session_id: {session_id}, user_id: {user_id}") # 함수 호출 및 파라미터 확인 로그
+    logger.debug("[delete_ongoing_adventure] Called with session_id: %s, user_id: %s", session_id, user_id)
     client = get_db_client(user_jwt=user_jwt)
     if not client or not session_id or not user_id:
-        print(f"[DEBUG delete_ongoing_adventure] DB 삭제 실패: 클라이언트({client is not None}), session_id({session_id is not None}), user_id({user_id is not None}) 누락")
+        logger.warning("[delete_ongoing_adventure] DB 삭제 실패: 클라이언트(%s), session_id(%s), user_id(%s) 누락",
+                       client is not None, session_id is not None, user_id is not None)
         return False
     try:
         # count='exact'를 사용하여 삭제된 레코드 수를 확인합니다.
@@ -322,30 +437,26 @@ def delete_ongoing_adventure(session_id: str, user_id: str, user_jwt: str | None
                          .eq('user_id', user_id) \
                          .execute()
         
-        print(f"[DEBUG delete_ongoing_adventure] Supabase delete response: {response}") # Supabase 응답 전체 로깅
-        
         if hasattr(response, 'error') and response.error:
-            print(f"[DEBUG delete_ongoing_adventure] DB 삭제 실패 (API 오류): {response.error.message if hasattr(response.error, 'message') else response.error}")
+            logger.error("[delete_ongoing_adventure] DB 삭제 실패 (API 오류): %s", getattr(response.error, 'message', response.error))
             return False
         
         # 삭제 성공 여부 확인 (count가 있고 0보다 큰 경우)
         if hasattr(response, 'count') and response.count is not None:
             if response.count > 0:
-                print(f"[DEBUG delete_ongoing_adventure] DB 삭제 성공: {response.count}개 레코드 삭제 (session_id={session_id}, user_id={user_id})")
+                logger.debug("[delete_ongoing_adventure] DB 삭제 성공: %s개 레코드 삭제 (session_id=%s, user_id=%s)", response.count, session_id, user_id)
                 return True
             else:
-                print(f"[DEBUG delete_ongoing_adventure] DB 삭제 대상 없음 (0개 레코드 삭제됨): session_id={session_id}, user_id={user_id}")
+                logger.info("[delete_ongoing_adventure] DB 삭제 대상 없음 (0개 레코드 삭제됨): session_id=%s, user_id=%s", session_id, user_id)
                 return True # 대상이 없어도 실패는 아님
         elif hasattr(response, 'data') and not response.data and not (hasattr(response, 'error') and response.error): # count가 없고 data가 비어있으며 오류도 없는 경우
-             print(f"[DEBUG delete_ongoing_adventure] DB 삭제 성공 또는 대상 없음 (데이터 없음, 오류 없음): session_id={session_id}, user_id={user_id}")
+             logger.debug("[delete_ongoing_adventure] DB 삭제 성공 또는 대상 없음 (데이터 없음, 오류 없음): session_id=%s, user_id=%s", session_id, user_id)
              return True
         # else: # 이 else 블록은 불필요하며, 다음 라인들이 여기에 속하면 오류가 발생합니다.
         # 위의 if/elif 조건에 해당하지 않으면 실패로 간주하거나, 응답을 로깅합니다.
-        print(f"[DEBUG delete_ongoing_adventure] DB 삭제 실패 (예상치 못한 응답 또는 명시적 성공 아님). Response: {response}")
+        logger.error("[delete_ongoing_adventure] DB 삭제 실패 (예상치 못한 응답 또는 명시적 성공 아님). Response: %s", truncated(response))
         return False
 
     except Exception as e:
-        print(f"[DEBUG delete_ongoing_adventure] DB에서 ongoing_adventure 삭제 중 심각한 오류: {e}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("[delete_ongoing_adventure] DB에서 ongoing_adventure 삭제 중 심각한 오류: %s", e)
         return False 
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Background LLM ending checks for continue_adventure.
+
+스토리/선택지 응답을 먼저 돌려주고, check_ending_conditions_with_llm은 스레드 풀에서 실행합니다.
+결과는 (session_id, turn) 키로 보관되어 스트리밍 채널의 ending 이벤트나 폴링 엔드포인트로 전달됩니다.
+턴 번호로 키를 잡기 때문에 판정 결과는 항상 그 판정을 계산한 턴에만 대응합니다.
+SESSION_SHARED_SQLITE_PATH가 설정되면 판정 상태를 같은 호스트의 워커가 공유하는 SQLite 파일에도 기록해,
+폴링 요청이 다른 gunicorn 워커로 가도 결과를 받을 수 있습니다.
+설정하지 않으면 판정은 실행한 워커에만 있으므로 단일 워커나 세션 고정(sticky) 라우팅이 필요합니다.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from backend import tracing
+from backend.config import ENDING_CHECK_MAX_WORKERS, ENDING_CHECK_RESULT_TTL_SECONDS, SESSION_SHARED_SQLITE_PATH
+from backend.llm_resilience import detached_context
+
+logger = logging.getLogger(__name__)
+
+_SHARED_POLL_INTERVAL_SECONDS = 0.25 # 다른 워커의 판정을 기다릴 때 공유 파일을 다시 읽는 간격
+
+
+class SQLiteEndingVerdicts:
+    """
+    엔딩 판정 상태를 워커 프로세스 간에 공유하는 SQLite 테이블 (session_store의 공유 파일과 같은 파일 사용 가능).
+    판정을 시작한 워커가 'pending'을 기록하고, 완료되면 'done'/'error'와 결과로 덮어씁니다.
+    """
+    _CLEANUP_EVERY_WRITES = 200
+
+    def __init__(self, path, result_ttl_seconds):
+        self.path = path
+        self.result_ttl_seconds = result_ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS ending_checks ("
+                     "session_id TEXT NOT NULL, turn INTEGER NOT NULL, user_id TEXT NOT NULL, status TEXT NOT NULL, "
+                     "triggered_ending TEXT, updated_at REAL NOT NULL, PRIMARY KEY (session_id, turn))")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 연결은 스레드 간 공유하지 않고 스레드마다 하나씩 사용
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def put(self, session_id, turn, user_id, status, triggered_ending=None):
+        conn = self._conn()
+        conn.execute("INSERT INTO ending_checks (session_id, turn, user_id, status, triggered_ending, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                     "ON CONFLICT(session_id, turn) DO UPDATE SET user_id = excluded.user_id, status = excluded.status, "
+                     "triggered_ending = excluded.triggered_ending, updated_at = excluded.updated_at",
+                     (session_id, turn, user_id, status,
+                      json.dumps(triggered_ending, ensure_ascii=False, default=str) if triggered_ending is not None else None, time.time()))
+        self._writes += 1
+        if self._writes % self._CLEANUP_EVERY_WRITES == 0:
+            conn.execute("DELETE FROM ending_checks WHERE updated_at < ?", (time.time() - self.result_ttl_seconds,))
+        conn.commit()
+
+    def get(self, session_id, turn):
+        """(user_id, status, triggered_ending) 또는 None (없거나 만료)을 반환합니다."""
+        row = self._conn().execute("SELECT user_id, status, triggered_ending, updated_at FROM ending_checks WHERE session_id = ? AND turn = ?",
+                                   (session_id, turn)).fetchone()
+        if not row or time.time() - row[3] > self.result_ttl_seconds:
+            return None
+        return row[0], row[1], json.loads(row[2]) if row[2] is not None else None
+
+
+class EndingCheckRegistry:
+    def __init__(self, max_workers, result_ttl_seconds, shared_results=None):
+        self.max_workers = max_workers
+        self.result_ttl_seconds = result_ttl_seconds
+        self.shared_results = shared_results # SQLiteEndingVerdicts 또는 None (워커별 메모리만 사용)
+        self._executor = None
+        # (session_id, turn) -> {'future', 'user_id', 'submitted_at'}
+        self._checks = {}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "triggered": 0, "no_ending": 0, "errors": 0, "expired": 0,
+                       "shared_lookups": 0, "shared_errors": 0}
+
+    def submit(self, session_id, turn, user_id, check_fn, **check_kwargs):
+        """엔딩 판정을 백그라운드에서 시작합니다. 같은 (session_id, turn)의 이전 판정은 대체됩니다."""
+        key = (str(session_id), int(turn))
+        self._shared_call("put", key[0], key[1], str(user_id), "pending")
+        with self._lock:
+            if self._executor is None:
+                # gunicorn fork 이후 워커 프로세스 안에서 스레드 풀을 만들도록 첫 사용 시점에 생성
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ending-check")
+            self._expire_locked()
+            # 요청 문맥(llm_call_context의 사용자 등)을 백그라운드 판정에도 넘기고, 판정 시간은 요청의 액션 종류로 기록
+            future = self._executor.submit(detached_context().run, self._run_check, key, str(user_id), tracing.current_action(),
+                                           check_fn, check_kwargs)
+            self._checks[key] = {'future': future, 'user_id': str(user_id), 'submitted_at': time.monotonic()}
+            self._stats["submitted"] += 1
+        return future
+
+    def result(self, session_id, turn, user_id, wait_seconds=0.0):
+        """
+        판정 결과를 반환합니다. wait_seconds 동안 완료를 기다릴 수 있습니다.
+        {'status': 'pending' | 'done' | 'error' | 'unknown', 'turn': turn, 'triggered_ending': ...}
+        'unknown'은 해당 턴의 판정이 없거나 만료되었거나 다른 사용자의 세션인 경우입니다.
+        이 프로세스에 없는 판정은 공유 파일(설정된 경우)에서 찾습니다.
+        """
+        key = (str(session_id), int(turn))
+        with self._lock:
+            entry = self._checks.get(key)
+        if entry is None:
+            return self._shared_result(key, str(user_id), wait_seconds)
+        if entry['user_id'] != str(user_id):
+            return {"status": "unknown", "turn": int(turn), "triggered_ending": None}
+
+        future = entry['future']
+        if wait_seconds > 0:
+            try:
+                future.result(timeout=wait_seconds)
+            except FutureTimeoutError:
+                pass
+            except Exception:
+                pass # 오류 상태는 아래에서 보고
+        if not future.done():
+            return {"status": "pending", "turn": int(turn), "triggered_ending": None}
+        if future.exception() is not None:
+            return {"status": "error", "turn": int(turn), "triggered_ending": None}
+        return {"status": "done", "turn": int(turn), "triggered_ending": future.result()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(1 for entry in self._checks.values() if not entry['future'].done())
+            return {"tracked": len(self._checks), "pending": pending, "shared": self.shared_results is not None, **self._stats}
+
+    def _run_check(self, key, user_id, action, check_fn, check_kwargs):
+        try:
+            with tracing.background_span(action, "ending_check"):
+                triggered_ending = check_fn(**check_kwargs)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            self._shared_call("put", key[0], key[1], user_id, "error")
+            raise
+        with self._lock:
+            self._stats["triggered" if triggered_ending else "no_ending"] += 1
+        self._shared_call("put", key[0], key[1], user_id, "done", triggered_ending)
+        return triggered_ending
+
+    def _shared_result(self, key, user_id, wait_seconds):
+        """다른 워커가 시작한 판정을 공유 파일에서 찾습니다. 진행 중이면 wait_seconds 동안 다시 읽습니다."""
+        unknown = {"status": "unknown", "turn": key[1], "triggered_ending": None}
+        if self.shared_results is None:
+            return unknown
+        with self._lock:
+            self._stats["shared_lookups"] += 1
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            row = self._shared_call("get", key[0], key[1])
+            if row is None or row[0] != user_id:
+                return unknown
+            status, triggered_ending = row[1], row[2]
+            if status != "pending" or time.monotonic() >= deadline:
+                return {"status": status, "turn": key[1], "triggered_ending": triggered_ending}
+            time.sleep(min(_SHARED_POLL_INTERVAL_SECONDS, max(deadline - time.monotonic(), 0.0)))
+
+    def _shared_call(self, method, *args):
+        if self.shared_results is None:
+            return None
+        try:
+            return getattr(self.shared_results, method)(*args)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.exception("공유 판정 %s 실패: %s", method, e)
+            with self._lock:
+                self._stats["shared_errors"] += 1
+            return None
+
+    def _expire_locked(self):
+        deadline = time.monotonic() - self.result_ttl_seconds
+        expired = [key for key, entry in self._checks.items()
+                   if entry['submitted_at'] < deadline and entry['future'].done()]
+        for key in expired:
+            del self._checks[key]
+        self._stats["expired"] += len(expired)
+
+
+ending_checks = EndingCheckRegistry(
+    max_workers=ENDING_CHECK_MAX_WORKERS,
+    result_ttl_seconds=ENDING_CHECK_RESULT_TTL_SECONDS,
+    shared_results=SQLiteEndingVerdicts(SESSION_SHARED_SQLITE_PATH, ENDING_CHECK_RESULT_TTL_SECONDS) if SESSION_SHARED_SQLITE_PATH else None,
+)
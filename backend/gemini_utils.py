@@ -2,8 +2,22 @@
 Utilities for interacting with the Gemini API.
 """
 import google.generativeai as genai
+import logging
 import re
-from .config import GEMINI_API_KEY # config에서 API 키 가져오기
+import json
+import threading
+from .config import GEMINI_API_KEY, GEMINI_STRUCTURED_OUTPUT, GEMINI_SYSTEM_INSTRUCTIONS_ENABLED # config에서 API 키 가져오기
+from .model_registry import gemini_models # 설정별 모델 핸들을 프로세스당 한 번만 생성
+from .llm_providers import llm_provider # LLM_PROVIDER: gemini | fake | record | replay
+from .llm_scheduler import (llm_scheduler, LLMAdmissionError, PRIORITY_INTERACTIVE, PRIORITY_SUMMARY,
+                            PRIORITY_ENDING_CHECK, PRIORITY_ENDING_ENHANCEMENT) # 동시 호출 수/사용자 쿼터/우선순위 제어
+from .llm_resilience import (llm_resilience, current_deadline, LLMUnavailableError, CALL_GENERATION, CALL_SUMMARY,
+                             CALL_ENDING_CHECK, CALL_ENDING_ENHANCEMENT) # 데드라인/헤지/서킷 브레이커
+from . import tracing # 요청 단계별 시간 측정 (Gemini 시도/파싱 구간)
+from .token_accounting import token_ledger, USAGE_GENERATION_RETRY # 호출별 입력/출력 토큰 집계
+from .logging_setup import truncated # 긴 응답/프롬프트는 잘라서 로깅
+
+logger = logging.getLogger(__name__)
 
 # Gemini API 초기 설정
 if GEMINI_API_KEY:
@@ -15,20 +29,10 @@ if GEMINI_API_KEY:
 else:
     print("경고: GEMINI_API_KEY가 설정되지 않아 Gemini API가 초기화되지 않았습니다 (gemini_utils.py).")
 
-# 기본 프롬프트 템플릿 (app.py에서 이동)
-DEFAULT_PROMPT_TEMPLATE = """
-당신은 {world_setting_summary} 세계관을 배경으로 진행되는 대화형 스토리 게임의 AI 스토리텔러입니다.
+# 이어가기 턴의 스토리텔러 시스템 지시문 (모든 턴에서 같은 규칙이므로 모델 핸들에 한 번 묶음)
+STORYTELLER_SYSTEM_INSTRUCTION = """당신은 대화형 스토리 게임의 AI 스토리텔러입니다.
 사용자의 선택이나 행동에 따라 흥미진진하고 일관성 있는 이야기를 생성해야 합니다.
-주어진 이야기 맥락과 사용자의 최근 행동을 바탕으로 다음 이야기와 선택지를 만들어주세요.
-
-[현재까지의 이야기 요약]
-{story_summary}
-
-[가장 최근 이야기 내용]
-{last_story_segment}
-
-[사용자의 최근 행동/선택]
-{user_action}
+매 턴 주어지는 세계관 설정, 이야기 맥락, 사용자의 최근 행동, 현재 시스템 값을 바탕으로 다음 이야기와 선택지를 만들어주세요.
 
 [지시사항]
 1. 다음 이야기 세그먼트는 최소 150자 이상으로 작성해주세요. 독창적이고 몰입감 있는 이야기를 들려주세요.
@@ -39,12 +43,11 @@ DEFAULT_PROMPT_TEMPLATE = """
 6. 사용자가 이야기를 계속 이어가고 싶도록 흥미를 유발해야 합니다.
 7. 다음 응답은 이야기 전개와 선택지만 포함해야 하며, 그 외의 설명이나 인사말은 제외해주세요.
 
---- 존재하는 게임 시스템 ---
-다음은 이 세계관에서 현재 사용 중인 시스템 목록과 현재 값입니다:
-{current_systems_list_for_prompt}
+--- 게임 시스템 ---
+매 턴 [현재 시스템 값]에 이 세계관에서 현재 사용 중인 시스템 목록과 현재 값이 주어집니다.
 
 **매우 중요**:
-만약 이야기의 결과로 **위에 명시된 시스템들의 값 변경이 필요하다면, 해당 변경 사항은 반드시 생성되는 *스토리 본문 내용 중 가장 적절한 위치에 자연스럽게* 다음 형식으로 명시해야 합니다.**
+만약 이야기의 결과로 **[현재 시스템 값]에 주어진 시스템들의 값 변경이 필요하다면, 해당 변경 사항은 반드시 생성되는 *스토리 본문 내용 중 가장 적절한 위치에 자연스럽게* 다음 형식으로 명시해야 합니다.**
 형식: `[SYSTEM_UPDATE: 시스템명(+|-)변경값]` 또는 `[SYSTEM_UPDATE: 시스템명=새로운절대값]`
 하나의 스토리 본문에 여러 시스템 변경이 있다면 각각의 태그를 모두 포함할 수 있습니다.
 예시 스토리 본문: "...그는 용감하게 동굴로 들어갔다. [SYSTEM_UPDATE: 용기+10] 그의 심장이 거칠게 뛰었지만, 발걸음을 멈추지 않았다. [SYSTEM_UPDATE: 피로도+5] ..."
@@ -60,10 +63,23 @@ DEFAULT_PROMPT_TEMPLATE = """
    - 생명력이 0에 도달할 수 있는 현실적인 변화량 적용
    - 시스템 수치가 음수가 되어도 괜찮습니다 (0 이하 = 조건 충족)
 
-**위에 명시되지 않은 시스템 이름(예: 평판, 건강 등)을 임의로 만들거나 수정하려고 시도하지 마세요. 오직 제공된 시스템 이름만 사용해야 합니다.**
+**[현재 시스템 값]에 없는 시스템 이름(예: 평판, 건강 등)을 임의로 만들거나 수정하려고 시도하지 마세요. 오직 제공된 시스템 이름만 사용해야 합니다.**
 시스템 값 변경이 없다면 시스템 업데이트 태그를 포함하지 않아도 됩니다.
-**선택지 텍스트에는 절대로 시스템 업데이트 태그를 포함하지 마십시오.**
--------------------------
+시스템이 "없음"으로 주어지면 시스템 변경 지시를 내리지 마세요.
+**선택지 텍스트에는 절대로 시스템 업데이트 태그를 포함하지 마십시오.**"""
+
+# 이어가기 턴마다 바뀌는 부분만 담는 프롬프트 (규칙은 STORYTELLER_SYSTEM_INSTRUCTION)
+DEFAULT_PROMPT_TEMPLATE = """[세계관 설정]
+{world_setting_summary}
+
+[현재까지의 이야기 요약]
+{story_summary}
+
+[사용자의 최근 행동/선택]
+{user_action}
+
+[현재 시스템 값]
+{current_systems_list_for_prompt}
 
 이제 다음 이야기와 선택지를 생성해주세요:
 """
@@ -71,7 +87,7 @@ DEFAULT_PROMPT_TEMPLATE = """
 SUMMARIZE_PROMPT_TEMPLATE = """
 다음은 대화형 스토리 게임의 진행 내용입니다. 이 내용을 바탕으로 사용자가 앞으로의 이야기를 이해하는 데 필요한 핵심 정보만 남기고 간결하게 요약해주세요.
 등장인물, 주요 사건, 현재 상황, 해결해야 할 문제 등을 중심으로 요약하고, 너무 세부적인 대화나 묘사는 생략해주세요.
-요약은 500자 이내로 해주세요.
+요약은 {target_char_length}자 이내로 해주세요.
 
 [세계관 배경 설정 요약 (참고용)]
 {world_setting_summary}
@@ -141,14 +157,42 @@ ENDING_STORY_ENHANCEMENT_TEMPLATE = """당신은 스토리 게임의 엔딩을 
 확장된 엔딩 스토리:
 """
 
-def summarize_story_with_gemini(story_text_to_summarize, world_setting_for_summary="", target_char_length=800):
+def _instructed(prompt, system_instruction):
+    """
+    (프롬프트, 모델 핸들에 묶을 시스템 지시문). GEMINI_SYSTEM_INSTRUCTIONS_ENABLED가 꺼져 있으면
+    이전처럼 지시문을 매 호출 프롬프트 앞에 붙입니다.
+    """
+    if not system_instruction or GEMINI_SYSTEM_INSTRUCTIONS_ENABLED:
+        return prompt, system_instruction
+    return f"{system_instruction}\n\n{prompt}", None
+
+def _generate_content(model, prompt, call_type, priority, usage_label=None, system_instruction=None):
+    """
+    데드라인/헤지/서킷 브레이커(llm_resilience)와 동시성/쿼터/429 백오프(llm_scheduler)를 거쳐 generate_content를 호출합니다.
+    헤지 요청도 각각 스케줄러의 자리를 얻어 실행되고, 응답마다 토큰을 usage_label(기본: call_type)로 집계합니다.
+    system_instruction은 model에 묶인 지시문이며 토큰 추정/보정에만 씁니다.
+    스케줄러 대기는 요청 데드라인까지로 제한되고, Gemini 요청의 제한 시간은 자리를 얻은 뒤 남은 예산으로 다시 계산합니다.
+    """
+    def generate(timeout):
+        def request():
+            return model.generate_content(prompt, request_options={"timeout": llm_resilience.remaining_timeout(timeout)})
+        response = llm_scheduler.call(request, priority=priority, deadline=current_deadline())
+        token_ledger.record(usage_label or call_type, prompt, response, system_instruction=system_instruction)
+        return response
+    return llm_resilience.call(call_type, generate)
+
+def summarize_story_with_gemini(story_text_to_summarize, world_setting_for_summary="", target_char_length=500, strict=False):
     """
     Gemini API를 사용하여 긴 이야기를 요약하는 함수.
     world_setting_for_summary: 요약 시 참고할 세계관 설정.
     target_char_length는 목표 요약문의 글자 수.
+    strict=True이면 API 키 없음/오류/빈 응답일 때 안내 문구 대신 예외를 발생시킵니다
+    (요약을 챕터/개요로 저장하고 원문 턴을 버리는 story_summarizer용).
     """
-    if not GEMINI_API_KEY:
-        print("경고: GEMINI_API_KEY가 없어 요약을 건너뜁니다. 원본의 일부를 반환합니다.")
+    if not llm_provider.available:
+        if strict:
+            raise RuntimeError("GEMINI_API_KEY가 없어 요약할 수 없습니다.")
+        logger.warning("GEMINI_API_KEY가 없어 요약을 건너뜁니다. 원본의 일부를 반환합니다.")
         # 요약 건너뛸 때 너무 짧지 않게, 의미있는 부분을 반환하도록 시도
         truncated_text = story_text_to_summarize
         if len(truncated_text) > target_char_length + 200: # 원본이 목표보다 충분히 길다면
@@ -158,34 +202,297 @@ def summarize_story_with_gemini(story_text_to_summarize, world_setting_for_summa
 
         return truncated_text + "... (중요: 이야기의 앞부분이 생략되었거나 요약되지 않았습니다. Gemini API 키를 확인하세요.)"
 
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    prompt = SUMMARIZE_PROMPT_TEMPLATE.format(story_history=story_text_to_summarize, world_setting_summary=world_setting_for_summary)
+    prompt = SUMMARIZE_PROMPT_TEMPLATE.format(story_history=story_text_to_summarize, world_setting_summary=world_setting_for_summary, target_char_length=target_char_length)
     
-    estimated_tokens_for_summary = min(int(target_char_length * 1.5), 2048)
+    estimated_tokens_for_summary = min(int(target_char_length * 2), 2048)
 
     try:
-        print(f"요약 시도: 원본 길이 {len(story_text_to_summarize)}, 목표 요약 길이 {target_char_length}, 예상 토큰 {estimated_tokens_for_summary}")
-        generation_config = genai.types.GenerationConfig(
-            max_output_tokens=int(estimated_tokens_for_summary),
-            temperature=0.5 
-        )
-        response = model.generate_content(prompt, generation_config=generation_config)
+        logger.debug("요약 시도: 원본 길이 %d, 목표 요약 길이 %d, 예상 토큰 %d", len(story_text_to_summarize), target_char_length, estimated_tokens_for_summary)
+        model = gemini_models.get(max_output_tokens=int(estimated_tokens_for_summary), temperature=0.5)
+        response = _generate_content(model, prompt, CALL_SUMMARY, PRIORITY_SUMMARY)
         summary = response.text.strip()
         summary = re.sub(r"^요약\s*\(이야기의 흐름을 알 수 있도록,\s*약\s*\d+자\s*내외\):\s*", "", summary, flags=re.IGNORECASE).strip()
-        print(f"요약 결과 (길이: {len(summary)}): {summary[:100]}...")
+        logger.debug("요약 결과 (길이: %d): %s", len(summary), truncated(summary, 100))
+        if strict and not summary:
+            raise ValueError("Gemini가 빈 요약을 반환했습니다.")
         return summary
+    except (LLMAdmissionError, LLMUnavailableError):
+        raise # 오류 문구를 요약 대신 저장하지 않도록 호출자(story_summarizer)가 실패로 처리
     except Exception as e:
-        print(f"Gemini API 요약 중 오류: {e}")
+        logger.exception("Gemini API 요약 중 오류: %s", e)
+        if strict:
+            raise
         error_prefix = f"... (중요: 이야기 앞부분 요약 중 오류 발생: {e}). 이야기의 최근 부분은 다음과 같습니다: ..."
         return error_prefix + story_text_to_summarize[-(target_char_length // 2):]
 
-def call_gemini_api(prompt):
+# 응답에서 선택지 목록이 시작됨을 나타내는 표시 (스트리밍 필터와 파서가 함께 사용)
+CHOICES_MARKERS = [
+    "\n선택지:", "\nChoices:", "\n선택지 목록:", 
+    "\n**선택지:**", "\n**Choices:**", "\n**당신의 선택은?**",
+    "\n다음 선택지 중에서 골라주세요:", "\n다음 행동을 선택하세요:"
+]
+CHOICE_LINE_PREFIX_PATTERN = re.compile(r"^(?:[-*•✓✔※◦]|[가-힣]\.|[a-zA-Z]\.|\d+\.)\s+")
+SYSTEM_UPDATE_TAG_PREFIX = "[SYSTEM_UPDATE:"
+
+def parse_story_and_choices(generated_text):
+    """
+    Gemini 응답 텍스트를 (스토리 본문, 선택지 텍스트 리스트)로 나눕니다.
+    선택지는 앞뒤 공백을 제거하고 중복과 너무 짧은 항목을 걸러낸 상태로 반환합니다.
+    """
+    story_part = generated_text
+    choices_list_text = []
+
+    choices_marker_found = None
+    actual_marker_used = ""
+
+    for marker in CHOICES_MARKERS:
+        marker_lower = marker.lower()
+        generated_text_lower = generated_text.lower()
+        if marker_lower in generated_text_lower:
+            try:
+                actual_marker_pos = generated_text_lower.index(marker_lower)
+                actual_marker_used = generated_text[actual_marker_pos : actual_marker_pos + len(marker)]
+                choices_marker_found = True
+                break
+            except ValueError:
+                continue
+
+    if choices_marker_found and actual_marker_used:
+        parts = generated_text.split(actual_marker_used, 1)
+        story_part = parts[0].strip()
+        story_part = re.sub(r"^(이야기|Story):\s*", "", story_part, flags=re.IGNORECASE).strip()
+
+        if len(parts) > 1:
+            choices_section_text = parts[1].strip()
+            potential_lines = choices_section_text.split('\n')
+            current_choice_text = ""
+            for line in potential_lines:
+                stripped_line = line.strip()
+                if not stripped_line: continue
+
+                choice_prefix_match = CHOICE_LINE_PREFIX_PATTERN.match(stripped_line)
+                text_to_process = stripped_line
+                is_new_item = False
+
+                if choice_prefix_match:
+                    text_to_process = stripped_line[choice_prefix_match.end():].strip()
+                    is_new_item = True
+
+                if is_new_item:
+                    if current_choice_text:
+                        choices_list_text.append(current_choice_text)
+                    current_choice_text = text_to_process
+                elif current_choice_text:
+                    current_choice_text += " " + text_to_process
+                elif text_to_process:
+                    current_choice_text = text_to_process
+
+            if current_choice_text:
+                choices_list_text.append(current_choice_text)
+    else:
+        lines = generated_text.split('\n')
+        story_content_lines = []
+        temp_choices = []
+        choice_pattern = r"^(?:[-*•✓✔※◦]|[가-힣]\.|[a-zA-Z]\.|\d+\.)\s+(.+)"
+
+        collecting_story = True
+        for line in lines:
+            stripped_line = line.strip()
+            if not stripped_line: continue
+
+            match = re.match(choice_pattern, stripped_line)
+            if match and len(temp_choices) < 4 :
+                collecting_story = False
+                choice_text = match.group(1).replace("**", "").strip()
+                if choice_text and len(choice_text) > 2:
+                    temp_choices.append(choice_text)
+            elif collecting_story:
+                story_content_lines.append(line)
+            elif temp_choices and not match and len(stripped_line) < 60 :
+                temp_choices[-1] += " " + stripped_line
+            elif not match :
+                story_content_lines.append(line)
+
+        if temp_choices:
+            choices_list_text = temp_choices
+            story_part = "\n".join(story_content_lines).strip()
+        else:
+            story_part = generated_text
+            choices_list_text = []
+
+    if not story_part.strip() and generated_text.strip():
+        story_part = generated_text
+
+    final_choices = [choice.strip() for choice in choices_list_text if choice and len(choice.strip()) > 2]
+    seen_choices = set()
+    unique_final_choices = []
+    for choice_text in final_choices:
+        if choice_text not in seen_choices:
+            unique_final_choices.append(choice_text)
+            seen_choices.add(choice_text)
+    return story_part, unique_final_choices
+
+# 구조화 출력: 스토리/선택지/시스템 변경을 JSON 스키마로 받아 마커 파싱 실패에 따른 재시도를 없앱니다.
+STORY_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "story": {"type": "string"},
+        "choices": {"type": "array", "items": {"type": "string"}},
+        "system_updates": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "system": {"type": "string"},
+                    "operator": {"type": "string", "enum": ["+", "-", "="]},
+                    "value": {"type": "number"}
+                },
+                "required": ["system", "operator", "value"]
+            }
+        }
+    },
+    "required": ["story", "choices"]
+}
+
+STRUCTURED_OUTPUT_INSTRUCTION = """
+
+[응답 형식]
+위 지시의 출력 형식 대신 다음 필드를 가진 JSON 객체 하나로만 응답하세요.
+- story: 이야기 본문 (선택지만 요청받은 경우 빈 문자열). 시스템 변경 태그는 본문에 넣지 말고 system_updates에 적으세요.
+- choices: 선택지 텍스트 배열 (번호나 기호 없이 문장만)
+- system_updates: 시스템 값 변경 배열. 각 항목은 system(시스템명), operator("+", "-", "="), value(숫자). 변경이 없으면 빈 배열."""
+
+# 호출 방식별 재시도 집계 (구조화 출력 도입 전후의 재시도율 비교용)
+_call_stats_lock = threading.Lock()
+_call_stats = {"calls": 0, "structured_ok": 0, "structured_invalid": 0, "structured_errors": 0,
+               "heuristic_calls": 0, "heuristic_attempts": 0, "heuristic_retries": 0, "fallback_choices": 0,
+               "unavailable_fallbacks": 0}
+
+def _count_call_stat(name, amount=1):
+    with _call_stats_lock:
+        _call_stats[name] += amount
+
+def get_gemini_call_stats() -> dict:
+    """
+    call_gemini_api 집계. retry_rate는 첫 응답을 그대로 쓰지 못해 추가 호출이 필요했던 비율입니다
+    (구조화 출력이 검증에 실패해 텍스트 파싱으로 넘어간 경우 + 텍스트 파싱 재시도).
+    """
+    with _call_stats_lock:
+        stats = dict(_call_stats)
+    structured_failures = stats["structured_invalid"] + stats["structured_errors"]
+    stats["structured_enabled"] = GEMINI_STRUCTURED_OUTPUT
+    stats["retry_rate"] = round((structured_failures + stats["heuristic_retries"]) / stats["calls"], 4) if stats["calls"] else 0.0
+    stats["heuristic_retry_rate"] = round(stats["heuristic_retries"] / stats["heuristic_calls"], 4) if stats["heuristic_calls"] else 0.0
+    return stats
+
+def render_gemini_call_stats_prometheus() -> str:
+    """call_gemini_api 집계 (구조화 출력 검증 결과, 텍스트 파싱 재시도, 대체 응답)와 재시도율 (Prometheus 텍스트 형식)."""
+    stats = get_gemini_call_stats()
+    lines = ["# HELP storydive_gemini_story_calls_total call_gemini_api events by outcome.",
+             "# TYPE storydive_gemini_story_calls_total counter"]
+    for event in ("calls", "structured_ok", "structured_invalid", "structured_errors", "heuristic_calls",
+                  "heuristic_attempts", "heuristic_retries", "fallback_choices", "unavailable_fallbacks"):
+        lines.append(f'storydive_gemini_story_calls_total{{event="{event}"}} {stats[event]}')
+    lines += ["# HELP storydive_gemini_story_retry_ratio Share of call_gemini_api calls that needed an extra Gemini request.",
+              "# TYPE storydive_gemini_story_retry_ratio gauge",
+              f"storydive_gemini_story_retry_ratio {stats['retry_rate']:.4f}"]
+    return "\n".join(lines) + "\n"
+
+def _format_system_update_value(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+def validate_structured_story(generated_text):
+    """
+    구조화 출력 응답을 검증해 (story_part, choice_texts)를 반환합니다. 유효하지 않으면 None.
+    system_updates는 기존 처리 경로(parse_and_apply_system_updates)가 그대로 적용하도록
+    [SYSTEM_UPDATE: 시스템명(+|-|=)값] 태그로 바꿔 본문 끝에 붙입니다.
+    """
+    try:
+        data = json.loads(generated_text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("story", ""), str) or not isinstance(data.get("choices"), list):
+        return None
+
+    choice_texts = []
+    for choice_text in data["choices"]:
+        if isinstance(choice_text, str):
+            choice_text = CHOICE_LINE_PREFIX_PATTERN.sub("", choice_text.strip()).strip()
+            if len(choice_text) > 1 and choice_text not in choice_texts:
+                choice_texts.append(choice_text)
+    if len(choice_texts) < 2:
+        return None
+
+    update_tags = []
+    for update in data.get("system_updates") or []:
+        if not isinstance(update, dict) or update.get("operator") not in ("+", "-", "="):
+            continue
+        system_name = str(update.get("system", "")).strip()
+        value = update.get("value")
+        if not system_name or isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        update_tags.append(f"{SYSTEM_UPDATE_TAG_PREFIX} {system_name}{update['operator']}{_format_system_update_value(value)}]")
+
+    story_part = data.get("story", "").strip()
+    if update_tags:
+        story_part = (story_part + " " + " ".join(update_tags)).strip()
+    return story_part, choice_texts
+
+def _call_gemini_structured(prompt, system_instruction=None):
+    """구조화 출력으로 한 번 호출합니다. 검증을 통과하지 못하면 None (호출자가 텍스트 파싱 방식으로 대체)."""
+    if system_instruction:
+        # 응답 형식 지시도 바뀌지 않으므로 시스템 지시문 뒤에 붙여 핸들에 묶음
+        system_instruction += STRUCTURED_OUTPUT_INSTRUCTION
+    else:
+        prompt += STRUCTURED_OUTPUT_INSTRUCTION
+    try:
+        model = gemini_models.get(
+            system_instruction=system_instruction,
+            max_output_tokens=1024, # JSON 구문만큼 여유를 둠
+            temperature=0.7,
+            response_mime_type="application/json",
+            response_schema=STORY_RESPONSE_SCHEMA
+        )
+        with tracing.span("llm_structured"):
+            response = _generate_content(model, prompt, CALL_GENERATION, PRIORITY_INTERACTIVE,
+                                         system_instruction=system_instruction)
+        with tracing.span("parse"):
+            validated = validate_structured_story(response.text)
+    except (LLMAdmissionError, LLMUnavailableError):
+        raise
+    except Exception as e:
+        logger.warning("구조화 출력 호출 실패, 텍스트 파싱 방식으로 대체합니다: %s", e)
+        _count_call_stat("structured_errors")
+        return None
+    if validated is None:
+        logger.warning("구조화 출력이 스키마 검증에 실패해 텍스트 파싱 방식으로 대체합니다.")
+        _count_call_stat("structured_invalid")
+        return None
+    _count_call_stat("structured_ok")
+    story_part, choice_texts = validated
+    return story_part, [{"id": f"choice_{i+1}", "text": choice_text} for i, choice_text in enumerate(choice_texts)]
+
+# 데드라인 초과나 서킷 브레이커로 Gemini를 호출할 수 없을 때의 대체 응답
+UNAVAILABLE_STORY_TEXT = "이야기꾼의 응답이 늦어지고 있습니다. 잠시 숨을 고른 뒤 다음 행동을 선택해주세요."
+UNAVAILABLE_CHOICES = [
+    {"id": "fallback_0_1", "text": "계속한다..."},
+    {"id": "fallback_0_2", "text": "다른 행동을 시도한다."}
+]
+
+def call_gemini_api(prompt, strict=False, system_instruction=None):
     """
     Gemini API를 호출하여 응답을 생성하는 함수.
-    선택지가 2개 미만일 경우 최대 3번까지 재시도합니다.
+    system_instruction(예: STORYTELLER_SYSTEM_INSTRUCTION)은 매 호출 같은 규칙으로, 프롬프트 대신 모델 핸들에 묶어 보냅니다.
+    GEMINI_STRUCTURED_OUTPUT이면 JSON 스키마 응답을 먼저 요청하고, 검증에 실패했을 때만
+    텍스트 파싱 방식(선택지가 2개 미만이면 최대 3번까지 재시도)으로 대체합니다.
+    데드라인이 지났거나 서킷 브레이커가 열려 있으면 재시도 없이 대체 선택지로 바로 응답합니다.
+    strict=True이면 API 키 없음 예시 데이터, 선택지가 2개 미만일 때의 대체 선택지, 오류 응답 대신 예외를 발생시킵니다
+    (결과를 저장해 두고 다른 요청에 제공하는 첫 장면 풀, 예측 생성용).
     """
-    if not GEMINI_API_KEY:
-        print("경고: GEMINI_API_KEY가 설정되지 않아 API를 호출할 수 없습니다. 예시 데이터를 반환합니다.")
+    if not llm_provider.available:
+        if strict:
+            raise RuntimeError("GEMINI_API_KEY가 설정되지 않아 Gemini를 호출할 수 없습니다.")
+        logger.warning("GEMINI_API_KEY가 설정되지 않아 API를 호출할 수 없습니다. 예시 데이터를 반환합니다.")
         example_story = f"API 키 없음. 프롬프트 기반 예시 이야기: 사용자가 '{{prompt[:50]}}...'에 대해 액션을 취했습니다."
         example_choices = [
             {"id": "example_choice_no_key_1", "text": "API 키 없음 예시 선택지 1"},
@@ -193,7 +500,23 @@ def call_gemini_api(prompt):
         ]
         return example_story, example_choices
 
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    prompt, system_instruction = _instructed(prompt, system_instruction)
+    try:
+        return _call_gemini_attempts(prompt, strict, system_instruction)
+    except LLMUnavailableError as e:
+        if strict:
+            raise
+        logger.warning("Gemini를 호출할 수 없어 대체 선택지로 응답합니다: %s", e)
+        _count_call_stat("unavailable_fallbacks")
+        return UNAVAILABLE_STORY_TEXT, [dict(choice) for choice in UNAVAILABLE_CHOICES]
+
+def _call_gemini_attempts(prompt, strict, system_instruction):
+    _count_call_stat("calls")
+    if GEMINI_STRUCTURED_OUTPUT:
+        structured_result = _call_gemini_structured(prompt, system_instruction)
+        if structured_result:
+            return structured_result
+    _count_call_stat("heuristic_calls")
         
     max_retries = 3
     attempts = 0
@@ -206,127 +529,40 @@ def call_gemini_api(prompt):
         current_prompt = prompt
         if attempts > 1:
             current_prompt += "\n\n(중요: 반드시 선택지 앞에 - 를 붙여서 생성해주세요.)"
-            print(f"재시도 {attempts-1}/{max_retries-1}. 프롬프트에 선택지 개수 요청 추가.")
+            logger.debug("재시도 %d/%d. 프롬프트에 선택지 개수 요청 추가.", attempts - 1, max_retries - 1)
 
-        print(f"Gemini API 호출 시도: {attempts}/{max_retries}")
+        logger.debug("Gemini API 호출 시도: %d/%d", attempts, max_retries)
+        _count_call_stat("heuristic_attempts")
+        if attempts > 1:
+            _count_call_stat("heuristic_retries")
         generated_text = ""
         story_part_candidate = ""
         choices_section_text_candidate = ""
 
         try:
-            generation_config = genai.types.GenerationConfig(
-                max_output_tokens=800,
-                temperature=0.7 + (0.1 * (attempts - 1))
-            )
-            response = model.generate_content(current_prompt, generation_config=generation_config)
+            model = gemini_models.get(system_instruction=system_instruction, max_output_tokens=800,
+                                      temperature=round(0.7 + (0.1 * (attempts - 1)), 1))
+            with tracing.span(f"llm_attempt_{attempts}"):
+                response = _generate_content(model, current_prompt, CALL_GENERATION, PRIORITY_INTERACTIVE,
+                                             usage_label=CALL_GENERATION if attempts == 1 else USAGE_GENERATION_RETRY,
+                                             system_instruction=system_instruction)
             generated_text = response.text.strip()
             
-            story_part = generated_text
-            choices_list_text = []
-
-            possible_markers = [
-                "\n선택지:", "\nChoices:", "\n선택지 목록:", 
-                "\n**선택지:**", "\n**Choices:**", "\n**당신의 선택은?**",
-                "\n다음 선택지 중에서 골라주세요:", "\n다음 행동을 선택하세요:"
-            ]
-            choices_marker_found = None
-            actual_marker_used = ""
-
-            for marker in possible_markers:
-                marker_lower = marker.lower()
-                generated_text_lower = generated_text.lower()
-                if marker_lower in generated_text_lower:
-                    try:
-                        actual_marker_pos = generated_text_lower.index(marker_lower)
-                        actual_marker_used = generated_text[actual_marker_pos : actual_marker_pos + len(marker)]
-                        choices_marker_found = True
-                        break
-                    except ValueError:
-                        continue
-            
-            if choices_marker_found and actual_marker_used:
-                parts = generated_text.split(actual_marker_used, 1)
-                story_part = parts[0].strip()
-                story_part = re.sub(r"^(이야기|Story):\s*", "", story_part, flags=re.IGNORECASE).strip()
-
-                if len(parts) > 1:
-                    choices_section_text = parts[1].strip()
-                    potential_lines = choices_section_text.split('\n')
-                    current_choice_text = ""
-                    for line in potential_lines:
-                        stripped_line = line.strip()
-                        if not stripped_line: continue
-                        
-                        choice_prefix_match = re.match(r"^(?:[-*•✓✔※◦]|[가-힣]\.|[a-zA-Z]\.|\d+\.)\s+", stripped_line)
-                        text_to_process = stripped_line
-                        is_new_item = False
-
-                        if choice_prefix_match:
-                            text_to_process = stripped_line[choice_prefix_match.end():].strip()
-                            is_new_item = True
-
-                        if is_new_item:
-                            if current_choice_text:
-                                choices_list_text.append(current_choice_text)
-                            current_choice_text = text_to_process
-                        elif current_choice_text:
-                            current_choice_text += " " + text_to_process
-                        elif text_to_process:
-                            current_choice_text = text_to_process
-
-                    if current_choice_text:
-                        choices_list_text.append(current_choice_text)
-            else:
-                lines = generated_text.split('\n')
-                story_content_lines = []
-                temp_choices = []
-                choice_pattern = r"^(?:[-*•✓✔※◦]|[가-힣]\.|[a-zA-Z]\.|\d+\.)\s+(.+)"
-                
-                collecting_story = True
-                for line in lines:
-                    stripped_line = line.strip()
-                    if not stripped_line: continue
-                    
-                    match = re.match(choice_pattern, stripped_line)
-                    if match and len(temp_choices) < 4 :
-                        collecting_story = False
-                        choice_text = match.group(1).replace("**", "").strip()
-                        if choice_text and len(choice_text) > 2:
-                            temp_choices.append(choice_text)
-                    elif collecting_story:
-                        story_content_lines.append(line)
-                    elif temp_choices and not match and len(stripped_line) < 60 :
-                        temp_choices[-1] += " " + stripped_line
-                    elif not match :
-                        story_content_lines.append(line)
-
-                if temp_choices:
-                    choices_list_text = temp_choices
-                    story_part = "\n".join(story_content_lines).strip()
-                else:
-                    story_part = generated_text
-                    choices_list_text = []
-            
-            if not story_part.strip() and generated_text.strip():
-                story_part = generated_text
-
-            final_choices_for_this_attempt = [choice.strip() for choice in choices_list_text if choice and len(choice.strip()) > 2]
-            seen_choices = set()
-            unique_final_choices = []
-            for choice_text in final_choices_for_this_attempt:
-                if choice_text not in seen_choices:
-                    unique_final_choices.append(choice_text)
-                    seen_choices.add(choice_text)
-            final_choices_for_this_attempt = unique_final_choices
+            with tracing.span("parse"):
+                story_part, final_choices_for_this_attempt = parse_story_and_choices(generated_text)
+            choices_list_text = final_choices_for_this_attempt
 
             if len(final_choices_for_this_attempt) >= 2:
-                print(f"성공 (시도 {attempts}): {len(final_choices_for_this_attempt)}개의 선택지 생성됨.")
+                logger.debug("성공 (시도 %d): %d개의 선택지 생성됨.", attempts, len(final_choices_for_this_attempt))
                 parsed_choices = [{"id": f"choice_{i+1}", "text": choice_text} for i, choice_text in enumerate(final_choices_for_this_attempt)]
                 return story_part.strip(), parsed_choices
             else:
-                print(f"경고 (시도 {attempts}): {len(final_choices_for_this_attempt)}개의 선택지만 생성됨. (내용: '{final_choices_for_this_attempt}')")
+                logger.warning("시도 %d: %d개의 선택지만 생성됨. (내용: %s)", attempts, len(final_choices_for_this_attempt), truncated(final_choices_for_this_attempt))
                 if attempts == max_retries:
-                    print(f"최대 재시도 ({max_retries}) 후에도 선택지가 2개 미만입니다. 현재 확보된 내용으로 반환합니다.")
+                    if strict:
+                        raise ValueError(f"최대 재시도 ({max_retries}) 후에도 선택지가 2개 미만입니다.")
+                    logger.warning("최대 재시도 (%d) 후에도 선택지가 2개 미만입니다. 현재 확보된 내용으로 반환합니다.", max_retries)
+                    _count_call_stat("fallback_choices")
                     current_choices = [{"id": f"choice_{i+1}", "text": choice_text} for i, choice_text in enumerate(final_choices_for_this_attempt)]
                     if len(current_choices) == 0:
                         current_choices.extend([
@@ -336,11 +572,15 @@ def call_gemini_api(prompt):
                     elif len(current_choices) == 1:
                         current_choices.append({"id": "fallback_1_1", "text": "다른 가능성을 찾아본다."})
                     return story_part.strip(), current_choices
+        except (LLMAdmissionError, LLMUnavailableError):
+            raise # 대기열/쿼터 초과, 데드라인 초과, 브레이커 열림은 재시도해도 같은 결과이므로 호출자에게 그대로 전달
         except Exception as e:
-            print(f"Gemini API 호출 또는 파싱 중 오류 발생 (시도 {attempts}/{max_retries}): {e}")
+            logger.exception("Gemini API 호출 또는 파싱 중 오류 발생 (시도 %d/%d): %s", attempts, max_retries, e)
             import traceback
             traceback.print_exc()
             if attempts == max_retries:
+                if strict:
+                    raise
                 error_story_part = story_part if story_part.strip() else "이야기 생성 중 API 오류가 발생하여 내용을 가져올 수 없었습니다."
                 error_choices = [
                     {"id": "error_api_1", "text": "알겠습니다. (오류)"},
@@ -348,7 +588,9 @@ def call_gemini_api(prompt):
                 ]
                 return error_story_part, error_choices
     
-    print("경고: call_gemini_api의 예상치 못한 로직 흐름으로 루프 외부 도달.")
+    if strict:
+        raise RuntimeError("call_gemini_api가 응답을 만들지 못했습니다.")
+    logger.warning("call_gemini_api의 예상치 못한 로직 흐름으로 루프 외부 도달.")
     final_story_part_fallback = story_part if story_part.strip() else "이야기 생성에 최종적으로 실패했습니다."
     final_choices_fallback = choices_list_text if choices_list_text else []
     
@@ -360,66 +602,192 @@ def call_gemini_api(prompt):
 
     return final_story_part_fallback, parsed_fallback_choices 
 
-def check_ending_conditions_with_llm(story_content, story_history, world_endings, active_systems=None):
+_STORY_LABEL_PREFIXES = ("이야기:", "story:")
+_CHOICE_PREFIX_PARTIAL_PATTERN = re.compile(r"^(?:[-*•✓✔※◦]|[가-힣]\.?|[a-zA-Z]\.?|\d+\.?)$")
+
+class StoryStreamFilter:
     """
-    Gemini API를 사용하여 스토리 내용을 분석하고 엔딩 조건이 충족되었는지 판별하는 함수.
-    복잡한 스토리 상황 조건만 처리하고, 시스템 수치나 단순 키워드는 프론트엔드에서 처리.
-    
-    Args:
-        story_content (str): 현재 스토리 내용
-        story_history (str): 지금까지의 스토리 진행 내역
-        world_endings (list): 세계관의 엔딩 목록
-        active_systems (dict): 현재 활성 시스템 상태
-    
-    Returns:
-        dict: 엔딩 정보 또는 None (조건 미충족 시)
+    스트리밍으로 도착하는 Gemini 응답에서 브라우저에 보낼 스토리 본문만 골라냅니다.
+    - [SYSTEM_UPDATE: ...] 태그는 닫는 괄호가 올 때까지 보류했다가 제거합니다.
+    - 선택지 표시(CHOICES_MARKERS)나 목록 항목 줄이 시작되면 그 뒤로는 아무것도 내보내지 않습니다.
+    - 줄 머리가 선택지인지 아직 판단할 수 없으면 다음 조각이 올 때까지 보류합니다.
+    최종 본문/선택지는 전체 텍스트(raw_text)를 parse_story_and_choices로 다시 파싱해 결정합니다.
     """
-    if not GEMINI_API_KEY or not world_endings:
-        return None
-
-    # 복잡한 스토리 조건만 필터링
-    story_endings = []
-    for ending in world_endings:
-        condition_type = determine_ending_condition_type(ending.get('condition', ''))
-        if condition_type in ['story', 'hybrid']:
-            story_endings.append(ending)
-    
-    if not story_endings:
-        print("[DEBUG check_ending_conditions_with_llm] No story-type endings to check")
-        return None
-
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    
-    # 스토리 조건 엔딩들만 분석용 텍스트로 변환
-    endings_text = ""
-    for i, ending in enumerate(story_endings, 1):
-        endings_text += f"{i}. 엔딩명: '{ending.get('name', '')}'\n"
-        endings_text += f"   조건: {ending.get('condition', '')}\n"
-        endings_text += f"   내용: {ending.get('content', '')[:100]}...\n\n"
-    
-    # 시스템 상태 텍스트
-    systems_text = ""
-    if active_systems:
-        for system, value in active_systems.items():
-            systems_text += f"- {system}: {value}\n"
-    
-    # 더 보수적인 프롬프트 생성
-    prompt = f"""당신은 스토리 게임의 **복잡한 스토리 상황 조건**만을 신중하게 판별하는 AI입니다.
+    def __init__(self):
+        self.raw_text = ""
+        self._pending = ""      # 아직 내보내지 않은 현재 줄의 텍스트
+        self._line_is_story = False
+        self._in_choices = False
+        self._tag_buffer = ""   # 닫히지 않은 '[' 이후 텍스트
+        self._first_line = True
+        self._skip_leading_space = False
+
+    def feed(self, chunk: str) -> str:
+        self.raw_text += chunk
+        if self._in_choices:
+            return ""
+        self._pending += chunk
+        return self._drain(final=False)
+
+    def finish(self) -> str:
+        if self._in_choices:
+            return ""
+        out = self._drain(final=True)
+        if self._tag_buffer and not self._tag_buffer.startswith(SYSTEM_UPDATE_TAG_PREFIX):
+            out += self._tag_buffer
+        self._tag_buffer = ""
+        return out
+
+    def _drain(self, final: bool) -> str:
+        out = []
+        while self._pending and not self._in_choices:
+            newline_pos = self._pending.find("\n")
+            line_complete = newline_pos >= 0 or final
+            if not self._line_is_story:
+                head = self._pending if newline_pos < 0 else self._pending[:newline_pos]
+                verdict = self._classify_line(head, line_complete)
+                if verdict is None:
+                    break
+                if verdict == "choices":
+                    self._in_choices = True
+                    self._pending = ""
+                    break
+                self._line_is_story = True
+            if self._skip_leading_space:
+                self._pending = self._pending.lstrip(" ")
+                if not self._pending:
+                    break
+                self._skip_leading_space = False
+                newline_pos = self._pending.find("\n")
+            if newline_pos < 0:
+                out.append(self._strip_tags(self._pending))
+                self._pending = ""
+                break
+            out.append(self._strip_tags(self._pending[:newline_pos + 1]))
+            self._pending = self._pending[newline_pos + 1:]
+            self._line_is_story = False
+        return "".join(out)
+
+    def _classify_line(self, head: str, line_complete: bool):
+        """줄 머리를 보고 'story' / 'choices' / None(판단 보류)을 반환합니다. 이야기 라벨은 여기서 제거합니다."""
+        stripped = head.strip()
+        if not stripped:
+            return "story" if line_complete else None
+        lowered = stripped.lower()
+        if self._first_line:
+            for label in _STORY_LABEL_PREFIXES:
+                if lowered.startswith(label):
+                    self._pending = self._pending[self._pending.lower().index(label) + len(label):]
+                    self._skip_leading_space = True
+                    self._first_line = False
+                    return "story"
+                if label.startswith(lowered) and not line_complete:
+                    return None
+        for marker in CHOICES_MARKERS:
+            marker_text = marker.strip().lower()
+            if lowered.startswith(marker_text):
+                return "choices"
+            if marker_text.startswith(lowered) and not line_complete:
+                return None
+        if CHOICE_LINE_PREFIX_PATTERN.match(stripped):
+            return "choices"
+        if _CHOICE_PREFIX_PARTIAL_PATTERN.match(stripped) and not line_complete:
+            return None
+        self._first_line = False
+        return "story"
+
+    def _strip_tags(self, text: str) -> str:
+        text = self._tag_buffer + text
+        self._tag_buffer = ""
+        out = []
+        pos = 0
+        while True:
+            start = text.find("[", pos)
+            if start < 0:
+                out.append(text[pos:])
+                break
+            out.append(text[pos:start])
+            end = text.find("]", start)
+            if end >= 0:
+                candidate = text[start:end + 1]
+                if not candidate.startswith(SYSTEM_UPDATE_TAG_PREFIX):
+                    out.append(candidate)
+                pos = end + 1
+                continue
+            candidate = text[start:]
+            if candidate.startswith(SYSTEM_UPDATE_TAG_PREFIX) or SYSTEM_UPDATE_TAG_PREFIX.startswith(candidate):
+                self._tag_buffer = candidate # 태그일 수 있으니 닫는 괄호가 올 때까지 보류
+                break
+            out.append("[")
+            pos = start + 1
+        return "".join(out)
+
+def stream_gemini_api(prompt, system_instruction=None):
+    """
+    call_gemini_api의 스트리밍 버전입니다 (system_instruction도 같은 의미). 이벤트 튜플을 순서대로 yield합니다.
+    ("delta", 텍스트): 태그와 선택지를 뺀 스토리 본문 조각
+    ("final", 스토리 본문, 선택지 리스트): 전체 응답을 파싱한 최종 결과 (항상 마지막에 한 번)
+    스트리밍 중에는 재시도할 수 없으므로 선택지가 2개 미만이면 call_gemini_api와 같은 대체 선택지로 채웁니다.
+    """
+    if not llm_provider.available:
+        story_part, choices = call_gemini_api(prompt, system_instruction=system_instruction)
+        yield ("delta", story_part)
+        yield ("final", story_part, choices)
+        return
+
+    prompt, system_instruction = _instructed(prompt, system_instruction)
+    stream_filter = StoryStreamFilter()
+    emitted_any = False
+    try:
+        model = gemini_models.get(system_instruction=system_instruction, max_output_tokens=800, temperature=0.7)
+        # 스트림을 다 읽을 때까지 호출 자리를 유지 (429 재시도는 아래의 일반 호출 대체 경로가 담당)
+        with llm_resilience.guard(CALL_GENERATION) as timeout, llm_scheduler.slot(PRIORITY_INTERACTIVE, current_deadline()):
+            response = model.generate_content(prompt, stream=True,
+                                              request_options={"timeout": llm_resilience.remaining_timeout(timeout)})
+            for chunk in response:
+                delta = stream_filter.feed(chunk.text)
+                if delta:
+                    emitted_any = True
+                    yield ("delta", delta)
+        # 스트림을 다 읽은 뒤에야 응답의 usage_metadata가 채워짐
+        token_ledger.record(CALL_GENERATION, prompt, response, text=stream_filter.raw_text,
+                            system_instruction=system_instruction)
+        tail = stream_filter.finish()
+        if tail:
+            yield ("delta", tail)
+    except LLMAdmissionError:
+        raise
+    except Exception as e:
+        logger.exception("Gemini 스트리밍 호출 중 오류 발생: %s", e)
+        if not emitted_any:
+            # 아직 아무것도 보내지 않았다면 일반 호출(재시도 포함)로 대체
+            story_part, choices = call_gemini_api(prompt, system_instruction=system_instruction)
+            yield ("delta", story_part)
+            yield ("final", story_part, choices)
+            return
+        if not stream_filter.raw_text.strip():
+            yield ("final", "이야기 생성 중 API 오류가 발생하여 내용을 가져올 수 없었습니다.",
+                   [{"id": "error_api_1", "text": "알겠습니다. (오류)"}, {"id": "error_api_2", "text": "새 게임 시작하기"}])
+            return
+
+    story_part, choices_text = parse_story_and_choices(stream_filter.raw_text.strip())
+    choices = [{"id": f"choice_{i+1}", "text": choice_text} for i, choice_text in enumerate(choices_text)]
+    if len(choices) == 0:
+        choices.extend([
+            {"id": "fallback_0_1", "text": "계속한다..."},
+            {"id": "fallback_0_2", "text": "다른 행동을 시도한다."}
+        ])
+    elif len(choices) == 1:
+        choices.append({"id": "fallback_1_1", "text": "다른 가능성을 찾아본다."})
+    yield ("final", story_part.strip(), choices)
+
+# 엔딩 조건 판정의 시스템 지시문 (보수적인 판별 기준과 응답 형식)
+ENDING_CHECK_SYSTEM_INSTRUCTION = """당신은 스토리 게임의 **복잡한 스토리 상황 조건**만을 신중하게 판별하는 AI입니다.
 단순한 수치나 키워드 조건이 아닌, 복잡한 감정이나 상황적 맥락이 필요한 엔딩 조건만 판별해주세요.
 
 **중요**: 매우 보수적으로 판단하세요. 확실하지 않은 경우 NO_ENDING으로 응답하세요.
 
-[현재 스토리 내용]
-{story_content}
-
-[지금까지의 스토리 진행 (최근 부분)]
-{story_history[-800:] if story_history else "없음"}
-
-[현재 시스템 상태]
-{systems_text if systems_text else "시스템 없음"}
-
-[검토할 스토리 조건 엔딩들]
-{endings_text}
+매 요청에는 [현재 스토리 내용], [지금까지의 스토리 진행 (최근 부분)], [현재 시스템 상태], [검토할 스토리 조건 엔딩들]이 주어집니다.
 
 [판별 기준 - 매우 엄격하게 적용]
 1. **명확하고 확실한 스토리 상황**만 인정합니다
@@ -439,15 +807,90 @@ ENDING_TRIGGERED: [엔딩 번호]
 
 조건이 불확실하거나 미충족인 경우:
 NO_ENDING
-이유: [조건이 충족되지 않은 이유 또는 더 명확한 증거가 필요한 이유]
+이유: [조건이 충족되지 않은 이유 또는 더 명확한 증거가 필요한 이유]"""
 
+ENDING_CHECK_PROMPT_TEMPLATE = """[현재 스토리 내용]
+{story_content}
+
+[지금까지의 스토리 진행 (최근 부분)]
+{recent_history}
+
+[현재 시스템 상태]
+{systems_text}
+
+[검토할 스토리 조건 엔딩들]
+{endings_text}
 응답:"""
 
+def build_ending_check_prompt(story_content, story_history, story_endings, active_systems=None):
+    """엔딩 조건 판정의 호출별 프롬프트 (판별 규칙은 ENDING_CHECK_SYSTEM_INSTRUCTION)."""
+    # 스토리 조건 엔딩들만 분석용 텍스트로 변환
+    endings_text = ""
+    for i, ending in enumerate(story_endings, 1):
+        endings_text += f"{i}. 엔딩명: '{ending.get('name', '')}'\n"
+        endings_text += f"   조건: {ending.get('condition', '')}\n"
+        endings_text += f"   내용: {ending.get('content', '')[:100]}...\n\n"
+
+    # 시스템 상태 텍스트
+    systems_text = ""
+    if active_systems:
+        for system, value in active_systems.items():
+            systems_text += f"- {system}: {value}\n"
+
+    return ENDING_CHECK_PROMPT_TEMPLATE.format(
+        story_content=story_content,
+        recent_history=story_history[-800:] if story_history else "없음",
+        systems_text=systems_text if systems_text else "시스템 없음",
+        endings_text=endings_text
+    )
+
+def get_story_condition_endings(world_endings):
+    """LLM 판정이 필요한 스토리/복합 조건 엔딩만 골라냅니다 (시스템 수치, 키워드 조건은 프론트엔드에서 처리)."""
+    story_endings = []
+    for ending in world_endings or []:
+        condition_type = determine_ending_condition_type(ending.get('condition', ''))
+        if condition_type in ['story', 'hybrid']:
+            story_endings.append(ending)
+    return story_endings
+
+def needs_llm_ending_check(world_endings):
+    return bool(llm_provider.available and get_story_condition_endings(world_endings))
+
+def check_ending_conditions_with_llm(story_content, story_history, world_endings, active_systems=None):
+    """
+    Gemini API를 사용하여 스토리 내용을 분석하고 엔딩 조건이 충족되었는지 판별하는 함수.
+    복잡한 스토리 상황 조건만 처리하고, 시스템 수치나 단순 키워드는 프론트엔드에서 처리.
+    
+    Args:
+        story_content (str): 현재 스토리 내용
+        story_history (str): 지금까지의 스토리 진행 내역
+        world_endings (list): 세계관의 엔딩 목록
+        active_systems (dict): 현재 활성 시스템 상태
+    
+    Returns:
+        dict: 엔딩 정보 또는 None (조건 미충족 시)
+    """
+    if not llm_provider.available or not world_endings:
+        return None
+
+    # 복잡한 스토리 조건만 필터링
+    story_endings = get_story_condition_endings(world_endings)
+    
+    if not story_endings:
+        logger.debug("No story-type endings to check")
+        return None
+
+    
+    # 판별 규칙(ENDING_CHECK_SYSTEM_INSTRUCTION)은 모델 핸들에 묶고, 호출마다 바뀌는 내용만 보냄
+    prompt = build_ending_check_prompt(story_content, story_history, story_endings, active_systems)
+
     try:
-        response = model.generate_content(prompt)
+        prompt, system_instruction = _instructed(prompt, ENDING_CHECK_SYSTEM_INSTRUCTION)
+        response = _generate_content(gemini_models.get(system_instruction=system_instruction), prompt, CALL_ENDING_CHECK,
+                                     PRIORITY_ENDING_CHECK, system_instruction=system_instruction)
         response_text = response.text.strip()
         
-        print(f"[DEBUG check_ending_conditions_with_llm] LLM Response: {response_text}")
+        logger.debug("Ending check LLM response: %s", truncated(response_text))
         
         # 응답 파싱
         if "ENDING_TRIGGERED:" in response_text:
@@ -458,17 +901,19 @@ NO_ENDING
                 
                 if 1 <= ending_num <= len(story_endings):
                     triggered_ending = story_endings[ending_num - 1]
-                    print(f"[DEBUG check_ending_conditions_with_llm] Story ending triggered: {triggered_ending.get('name')}")
+                    logger.debug("Story ending triggered: %s", triggered_ending.get('name'))
                     return triggered_ending
                     
             except (ValueError, IndexError) as e:
-                print(f"[DEBUG check_ending_conditions_with_llm] Error parsing ending number: {e}")
+                logger.warning("Error parsing ending number: %s", e)
         
-        print("[DEBUG check_ending_conditions_with_llm] No story ending triggered")
+        logger.debug("No story ending triggered")
         return None
         
+    except (LLMAdmissionError, LLMUnavailableError):
+        raise # ending_checks에서 판정 오류(status: error)로 보고
     except Exception as e:
-        print(f"[DEBUG check_ending_conditions_with_llm] Error: {e}")
+        logger.exception("Ending check failed: %s", e)
         return None
 
 def determine_ending_condition_type(condition):
@@ -524,11 +969,10 @@ def generate_enhanced_ending_story(ending_name, ending_condition, basic_ending_c
     Returns:
         str: 확장된 엔딩 스토리 또는 None (실패 시)
     """
-    if not GEMINI_API_KEY:
-        print("경고: GEMINI_API_KEY가 없어 엔딩 스토리 확장을 건너뜁니다.")
+    if not llm_provider.available:
+        logger.warning("GEMINI_API_KEY가 없어 엔딩 스토리 확장을 건너뜁니다.")
         return basic_ending_content
 
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
     
     # 스토리 히스토리가 너무 길면 요약
     summarized_history = story_history
@@ -548,21 +992,18 @@ def generate_enhanced_ending_story(ending_name, ending_condition, basic_ending_c
     )
     
     try:
-        print(f"엔딩 스토리 확장 시도: {ending_name}")
-        generation_config = genai.types.GenerationConfig(
-            max_output_tokens=800,
-            temperature=0.8  # 창의적인 엔딩을 위해 약간 높은 온도
-        )
-        response = model.generate_content(prompt, generation_config=generation_config)
+        logger.debug("엔딩 스토리 확장 시도: %s", ending_name)
+        model = gemini_models.get(max_output_tokens=800, temperature=0.8) # 창의적인 엔딩을 위해 약간 높은 온도
+        response = _generate_content(model, prompt, CALL_ENDING_ENHANCEMENT, PRIORITY_ENDING_ENHANCEMENT)
         enhanced_story = response.text.strip()
         
         # 불필요한 접두사 제거
         enhanced_story = re.sub(r"^확장된\s*엔딩\s*스토리:\s*", "", enhanced_story, flags=re.IGNORECASE).strip()
         enhanced_story = re.sub(r"^엔딩\s*스토리:\s*", "", enhanced_story, flags=re.IGNORECASE).strip()
         
-        print(f"엔딩 스토리 확장 성공 (길이: {len(enhanced_story)})")
+        logger.debug("엔딩 스토리 확장 성공 (길이: %d)", len(enhanced_story))
         return enhanced_story
         
     except Exception as e:
-        print(f"엔딩 스토리 확장 중 오류: {e}")
+        logger.exception("엔딩 스토리 확장 중 오류: %s", e)
         return basic_ending_content  # 실패 시 기본 엔딩 내용 반환 
\ No newline at end of file
@@ -0,0 +1,378 @@
+"""
+LLM backends behind gemini_models (model_registry) and gemini_utils.
+
+gemini_utils는 모델 핸들의 generate_content(prompt, stream=..., request_options=...)와 응답의 .text(스트리밍이면
+조각별 .text)만 사용하므로, 그 모양을 지키는 모델 핸들을 만들어 주는 provider를 LLM_PROVIDER로 고릅니다.
+- gemini: 실제 Gemini API (google.generativeai)
+- fake: 네트워크 없이 결정적인 가짜 응답. 첫 토큰 지연, 초당 토큰 수, 느린 응답/오류/429 비율을 설정할 수 있어
+  /api/action 전체 흐름을 CI나 부하 테스트에서 실제와 비슷한 시간으로 실행할 수 있습니다.
+- record: gemini 응답과 지연 시간을 LLM_RECORDING_PATH(JSONL)에 (모델, 생성 설정, 시스템 지시문, 프롬프트) 해시별로 기록
+- replay: 기록된 응답을 기록된 지연 시간(LLM_REPLAY_LATENCY_SCALE 배)으로 재생. 기록에 없는 프롬프트는
+  LLM_REPLAY_FALLBACK(fake | error)에 따라 가짜 응답으로 대신하거나 오류를 냅니다.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from google.api_core import exceptions as google_exceptions
+
+from backend.config import (GEMINI_API_KEY, LLM_PROVIDER, LLM_RECORDING_PATH, LLM_REPLAY_FALLBACK, LLM_REPLAY_LATENCY_SCALE,
+                            LLM_FAKE_SEED, LLM_FAKE_FIRST_TOKEN_SECONDS, LLM_FAKE_LATENCY_JITTER, LLM_FAKE_TOKENS_PER_SECOND,
+                            LLM_FAKE_SLOW_RATE, LLM_FAKE_SLOW_SECONDS, LLM_FAKE_FAILURE_RATE, LLM_FAKE_RATE_LIMIT_RATE)
+
+_STREAM_CHUNK_CHARS = 24 # 가짜/재생 스트리밍 조각 크기
+
+
+def estimate_tokens(text) -> int:
+    """한국어 위주 텍스트의 대략적인 토큰 수 (글자 2개당 1토큰)."""
+    return max(1, math.ceil(len(text or "") / 2))
+
+
+def request_key(model_name, generation_config, prompt, system_instruction=None) -> str:
+    """기록/재생 키. 같은 모델, 같은 생성 설정, 같은 시스템 지시문, 같은 프롬프트면 같은 키입니다."""
+    # 시스템 지시문이 없는 요청은 이전에 기록한 파일과 같은 키가 되도록 목록에 넣지 않음
+    parts = [model_name, generation_config, prompt] if system_instruction is None else \
+        [model_name, generation_config, system_instruction, prompt]
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _usage(prompt, text, system_instruction=None):
+    # Gemini처럼 시스템 지시문도 입력 토큰에 포함
+    prompt_tokens = estimate_tokens(prompt) + (estimate_tokens(system_instruction) if system_instruction else 0)
+    output_tokens = estimate_tokens(text)
+    return SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                           total_token_count=prompt_tokens + output_tokens)
+
+
+def _request_timeout(request_options):
+    timeout = (request_options or {}).get("timeout")
+    return float(timeout) if timeout else None
+
+
+class StaticResponse:
+    """
+    미리 정해진 텍스트를 주어진 시간표대로 돌려주는 응답. stream=False면 만들기 전에 전체 지연을 기다리고,
+    stream=True면 반복할 때 조각마다 기다립니다. 제한 시간을 넘으면 google DeadlineExceeded를 발생시킵니다.
+    """
+
+    def __init__(self, prompt, chunks, chunk_delays, timeout=None, stream=False, system_instruction=None):
+        self.usage_metadata = _usage(prompt, "".join(chunks), system_instruction)
+        self._chunks = chunks
+        self._chunk_delays = chunk_delays # 조각별로 이전 조각 이후 기다릴 초
+        self._timeout = timeout
+        if not stream:
+            self._sleep_within_timeout(sum(chunk_delays), 0.0)
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def __iter__(self):
+        elapsed = 0.0
+        for chunk, delay in zip(self._chunks, self._chunk_delays):
+            elapsed = self._sleep_within_timeout(delay, elapsed)
+            yield SimpleNamespace(text=chunk)
+
+    def _sleep_within_timeout(self, delay, elapsed):
+        if self._timeout is not None and elapsed + delay > self._timeout:
+            time.sleep(max(0.0, self._timeout - elapsed))
+            raise google_exceptions.DeadlineExceeded("LLM 응답이 제한 시간 안에 오지 않았습니다.")
+        if delay > 0:
+            time.sleep(delay)
+        return elapsed + delay
+
+
+def _split_chunks(text):
+    return [text[i:i + _STREAM_CHUNK_CHARS] for i in range(0, len(text), _STREAM_CHUNK_CHARS)] or [""]
+
+
+class GeminiProvider:
+    name = "gemini"
+
+    @property
+    def available(self):
+        return bool(GEMINI_API_KEY)
+
+    def build_model(self, model_name, generation_config, system_instruction=None):
+        import google.generativeai as genai
+        config = genai.types.GenerationConfig(**generation_config) if generation_config else None
+        return genai.GenerativeModel(model_name, generation_config=config, system_instruction=system_instruction)
+
+    def warm_up(self, model, network):
+        from google.generativeai import client as genai_client
+        genai_client.get_default_generative_client()
+        if network:
+            model.count_tokens("warm-up")
+
+
+# 가짜 응답 문장 재료 (프롬프트 해시로 골라 같은 프롬프트에는 항상 같은 응답)
+_FAKE_STORY_SENTENCES = [
+    "낡은 등불이 흔들리며 벽에 긴 그림자를 드리웠다.",
+    "멀리서 종소리가 세 번 울리고, 골목은 다시 고요해졌다.",
+    "당신은 손끝에 닿는 차가운 금속의 감촉에 숨을 죽였다.",
+    "바람에 실려 온 냄새는 비 온 뒤의 흙내음과 어딘가 타는 냄새가 섞여 있었다.",
+    "문틈 사이로 누군가의 낮은 목소리가 새어 나왔다.",
+    "발밑의 돌바닥에는 오래전에 새겨진 문양이 희미하게 남아 있었다.",
+    "동행은 말없이 고개를 끄덕이고는 앞장서 걸음을 옮겼다.",
+    "하늘을 가르는 번개가 순간 주변을 대낮처럼 밝혔다.",
+    "지도에 표시되지 않은 갈림길이 눈앞에 나타났다.",
+    "주머니 속 낡은 편지가 유난히 무겁게 느껴졌다.",
+]
+_FAKE_CHOICES = [
+    "조심스럽게 문을 열고 안으로 들어간다.",
+    "동행에게 지금까지 알게 된 것을 털어놓는다.",
+    "왔던 길을 되돌아가 다른 단서를 찾는다.",
+    "소리가 난 쪽으로 몸을 숨긴 채 다가간다.",
+    "지도를 펼쳐 갈림길의 위치를 확인한다.",
+    "낡은 편지를 꺼내 다시 읽어본다.",
+]
+
+
+class FakeProvider:
+    """
+    네트워크 없이 결정적인 응답을 만드는 provider. 응답 내용은 (시드, 모델, 생성 설정, 프롬프트)로 정해지고,
+    지연 시간과 오류는 같은 프롬프트의 몇 번째 호출인지까지 포함한 시드로 뽑으므로 같은 순서로 호출하면
+    실행할 때마다 같은 결과가 나옵니다 (재시도는 다른 결과를 받을 수 있음).
+    """
+    name = "fake"
+    available = True
+
+    def __init__(self, seed, first_token_seconds, latency_jitter, tokens_per_second, slow_rate, slow_seconds,
+                 failure_rate, rate_limit_rate):
+        self.seed = seed
+        self.first_token_seconds = first_token_seconds
+        self.latency_jitter = latency_jitter # 첫 토큰 지연의 로그정규 분포 sigma
+        self.tokens_per_second = tokens_per_second
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._occurrences = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def build_model(self, model_name, generation_config, system_instruction=None):
+        return _FakeModel(self, model_name, dict(generation_config or {}), system_instruction)
+
+    def warm_up(self, model, network):
+        pass
+
+    def respond(self, model_name, generation_config, prompt, stream=False, request_options=None, system_instruction=None):
+        key = request_key(model_name, generation_config, prompt, system_instruction)
+        with self._lock:
+            occurrence = self._occurrences[key]
+            self._occurrences[key] += 1
+        timing_rng = random.Random(f"{self.seed}:{key}:{occurrence}")
+        roll = timing_rng.random()
+        if roll < self.rate_limit_rate:
+            raise google_exceptions.ResourceExhausted("fake provider: 429 Resource has been exhausted")
+        if roll < self.rate_limit_rate + self.failure_rate:
+            raise google_exceptions.ServiceUnavailable("fake provider: 503 The service is currently unavailable")
+
+        text = self.fake_text(model_name, generation_config, prompt, system_instruction)
+        first_token = self.first_token_seconds * timing_rng.lognormvariate(0, self.latency_jitter) if self.first_token_seconds > 0 else 0.0
+        if timing_rng.random() < self.slow_rate:
+            first_token += self.slow_seconds
+        chunks = _split_chunks(text)
+        per_chunk = (estimate_tokens(chunks[0]) / self.tokens_per_second) if self.tokens_per_second > 0 else 0.0
+        delays = [first_token] + [per_chunk] * (len(chunks) - 1)
+        return StaticResponse(prompt, chunks, delays, timeout=_request_timeout(request_options), stream=stream,
+                              system_instruction=system_instruction)
+
+    def fake_text(self, model_name, generation_config, prompt, system_instruction=None):
+        rng = random.Random(f"{self.seed}:{request_key(model_name, generation_config, prompt, system_instruction)}")
+        story = " ".join(rng.sample(_FAKE_STORY_SENTENCES, 4))
+        choices = rng.sample(_FAKE_CHOICES, 3)
+        if generation_config.get("response_mime_type") == "application/json":
+            return json.dumps({"story": story, "choices": choices, "system_updates": []}, ensure_ascii=False)
+        if "NO_ENDING" in prompt or "NO_ENDING" in (system_instruction or ""): # 엔딩 조건 판정
+            return "NO_ENDING\n이유: 가짜 LLM 응답입니다."
+        if "[요약 결과]" in prompt:
+            return " ".join(rng.sample(_FAKE_STORY_SENTENCES, 3))
+        if "확장된 엔딩 스토리" in prompt:
+            return " ".join(rng.sample(_FAKE_STORY_SENTENCES, 8))
+        if "선택지만 제공해주세요" in prompt:
+            return "\n".join(f"- {choice}" for choice in choices)
+        return story + "\n\n선택지:\n" + "\n".join(f"- {choice}" for choice in choices)
+
+
+class _FakeModel:
+    def __init__(self, provider, model_name, generation_config, system_instruction=None):
+        self.model_name = model_name
+        self._provider = provider
+        self._generation_config = generation_config
+        self._system_instruction = system_instruction
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        return self._provider.respond(self.model_name, self._generation_config, prompt, stream=stream,
+                                      request_options=request_options, system_instruction=self._system_instruction)
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=estimate_tokens(contents))
+
+
+class RecordingProvider:
+    """inner provider의 응답을 그대로 돌려주면서, 응답 텍스트와 조각별 도착 시간을 JSONL로 남깁니다."""
+    name = "record"
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.inner.available
+
+    def build_model(self, model_name, generation_config, system_instruction=None):
+        return _RecordingModel(self, self.inner.build_model(model_name, generation_config, system_instruction), model_name,
+                               dict(generation_config or {}), system_instruction)
+
+    def warm_up(self, model, network):
+        self.inner.warm_up(model._inner, network)
+
+    def write(self, model_name, generation_config, system_instruction, prompt, chunks, chunk_delays):
+        entry = {"key": request_key(model_name, generation_config, prompt, system_instruction), "model": model_name,
+                 "recorded_at": time.time(), "chunks": chunks, "chunk_delays": [round(d, 4) for d in chunk_delays]}
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class _RecordingModel:
+    def __init__(self, provider, inner, model_name, generation_config, system_instruction=None):
+        self.model_name = model_name
+        self._provider = provider
+        self._inner = inner
+        self._generation_config = generation_config
+        self._system_instruction = system_instruction
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        started_at = time.monotonic()
+        response = self._inner.generate_content(prompt, stream=stream, request_options=request_options)
+        if not stream:
+            self._provider.write(self.model_name, self._generation_config, self._system_instruction, prompt, [response.text],
+                                 [time.monotonic() - started_at])
+            return response
+        return self._record_stream(prompt, response, started_at)
+
+    def _record_stream(self, prompt, response, started_at):
+        chunks, delays, last = [], [], started_at
+        for chunk in response:
+            now = time.monotonic()
+            chunks.append(chunk.text)
+            delays.append(now - last)
+            last = now
+            yield chunk
+        self._provider.write(self.model_name, self._generation_config, self._system_instruction, prompt, chunks, delays)
+
+    def count_tokens(self, contents):
+        return self._inner.count_tokens(contents)
+
+
+class ReplayProvider:
+    """RecordingProvider가 남긴 응답을 재생합니다. 같은 키가 여러 번 기록되었으면 차례로 돌려가며 사용합니다."""
+    name = "replay"
+    available = True
+
+    def __init__(self, path, latency_scale, fallback=None):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.fallback = fallback # 기록에 없는 요청을 맡을 provider (None이면 오류)
+        self._entries = None # key -> [entry]
+        self._cursor = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def build_model(self, model_name, generation_config, system_instruction=None):
+        return _ReplayModel(self, model_name, dict(generation_config or {}), system_instruction)
+
+    def warm_up(self, model, network):
+        self._load()
+
+    def respond(self, model_name, generation_config, prompt, stream=False, request_options=None, system_instruction=None):
+        entries = self._load().get(request_key(model_name, generation_config, prompt, system_instruction))
+        if not entries:
+            with self._lock:
+                self._stats["misses"] += 1
+            if self.fallback is None:
+                raise google_exceptions.NotFound(f"replay: {self.path}에 기록되지 않은 요청입니다.")
+            return self.fallback.respond(model_name, generation_config, prompt, stream=stream,
+                                         request_options=request_options, system_instruction=system_instruction)
+        with self._lock:
+            self._stats["hits"] += 1
+            key = entries[0]["key"]
+            entry = entries[self._cursor[key] % len(entries)]
+            self._cursor[key] += 1
+        delays = [delay * self.latency_scale for delay in entry["chunk_delays"]]
+        return StaticResponse(prompt, entry["chunks"], delays, timeout=_request_timeout(request_options), stream=stream,
+                              system_instruction=system_instruction)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"recorded_keys": len(self._entries or {}), **self._stats}
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        entries = defaultdict(list)
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry["key"]].append(entry)
+        else:
+            print(f"[WARN llm_providers] 재생할 기록 파일이 없습니다: {self.path}")
+        with self._lock:
+            if self._entries is None:
+                self._entries = dict(entries)
+        return self._entries
+
+
+class _ReplayModel:
+    def __init__(self, provider, model_name, generation_config, system_instruction=None):
+        self.model_name = model_name
+        self._provider = provider
+        self._generation_config = generation_config
+        self._system_instruction = system_instruction
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        return self._provider.respond(self.model_name, self._generation_config, prompt, stream=stream,
+                                      request_options=request_options, system_instruction=self._system_instruction)
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=estimate_tokens(contents))
+
+
+def build_fake_provider(**overrides):
+    """환경 변수 설정(LLM_FAKE_*)으로 FakeProvider를 만듭니다. 벤치마크/부하 테스트는 overrides로 바꿔 씁니다."""
+    settings = dict(seed=LLM_FAKE_SEED, first_token_seconds=LLM_FAKE_FIRST_TOKEN_SECONDS,
+                    latency_jitter=LLM_FAKE_LATENCY_JITTER, tokens_per_second=LLM_FAKE_TOKENS_PER_SECOND,
+                    slow_rate=LLM_FAKE_SLOW_RATE, slow_seconds=LLM_FAKE_SLOW_SECONDS,
+                    failure_rate=LLM_FAKE_FAILURE_RATE, rate_limit_rate=LLM_FAKE_RATE_LIMIT_RATE)
+    settings.update(overrides)
+    return FakeProvider(**settings)
+
+
+def build_provider(name):
+    if name == "fake":
+        return build_fake_provider()
+    if name == "record":
+        return RecordingProvider(GeminiProvider(), LLM_RECORDING_PATH)
+    if name == "replay":
+        fallback = build_fake_provider() if LLM_REPLAY_FALLBACK == "fake" else None
+        return ReplayProvider(LLM_RECORDING_PATH, LLM_REPLAY_LATENCY_SCALE, fallback=fallback)
+    if name != "gemini":
+        print(f"[WARN llm_providers] 알 수 없는 LLM_PROVIDER '{name}', gemini를 사용합니다.")
+    return GeminiProvider()
+
+
+llm_provider = build_provider(LLM_PROVIDER)
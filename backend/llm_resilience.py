@@ -0,0 +1,302 @@
+"""
+Deadlines, hedged requests and circuit breaking for Gemini calls.
+
+- 요청 데드라인: handle_action 요청마다 request_deadline()으로 전체 시간 예산을 정하고(contextvars),
+  각 호출(생성, 요약, 엔딩 판정, 엔딩 확장)은 호출 종류별 제한 시간과 남은 예산 중 짧은 쪽을 씁니다.
+  제한 시간은 Gemini 요청 자체(request_options timeout)에도 전달됩니다. 스케줄러(llm_scheduler)의 대기열/쿼터 대기도
+  데드라인까지로 제한하고(current_deadline()), 자리를 얻은 뒤 remaining_timeout()으로 제한 시간을 다시 계산합니다.
+- 헤지 요청(옵트인): 호출 종류별 최근 지연 시간의 p95(LLM_HEDGE_PERCENTILE)가 지나도 응답이 없으면
+  같은 요청을 한 번 더 보내 먼저 성공한 응답을 씁니다.
+- 서킷 브레이커: 최근 오류율이 LLM_BREAKER_ERROR_RATE를 넘으면 LLM_BREAKER_OPEN_SECONDS 동안 호출하지 않고
+  LLMCircuitOpen을 발생시킵니다 (call_gemini_api는 기존 대체 선택지로 바로 응답). 이후 한 번 시험 호출해 복구를 확인합니다.
+
+백그라운드 작업(엔딩 판정, 요약, 예측 생성)은 detached_context()로 요청 문맥을 넘겨받되 요청 데드라인은 물려받지 않습니다.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+from contextlib import contextmanager
+
+from backend.config import (LLM_GENERATION_TIMEOUT_SECONDS, LLM_SUMMARY_TIMEOUT_SECONDS, LLM_ENDING_CHECK_TIMEOUT_SECONDS,
+                            LLM_ENDING_ENHANCEMENT_TIMEOUT_SECONDS, LLM_HEDGE_ENABLED, LLM_HEDGE_PERCENTILE,
+                            LLM_HEDGE_MIN_DELAY_SECONDS, LLM_HEDGE_INITIAL_DELAY_SECONDS, LLM_HEDGE_MAX_WORKERS,
+                            LLM_BREAKER_WINDOW_SECONDS, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_ERROR_RATE, LLM_BREAKER_OPEN_SECONDS)
+from backend.llm_scheduler import LLMAdmissionError, LLMQueueTimeout
+from backend import tracing
+
+logger = logging.getLogger(__name__)
+
+CALL_GENERATION = "generation"
+CALL_SUMMARY = "summary"
+CALL_ENDING_CHECK = "ending_check"
+CALL_ENDING_ENHANCEMENT = "ending_enhancement"
+
+_LATENCY_SAMPLES = 200 # 호출 종류별 헤지 지연 계산에 쓰는 최근 성공 표본 수
+_MIN_HEDGE_SAMPLES = 20 # 표본이 이보다 적으면 LLM_HEDGE_INITIAL_DELAY_SECONDS 사용
+
+_deadline = contextvars.ContextVar("llm_request_deadline", default=None) # time.monotonic() 기준 절대 시각
+
+
+class LLMUnavailableError(RuntimeError):
+    """데드라인 초과나 서킷 브레이커로 Gemini 응답을 받을 수 없음 (호출자는 대체 응답을 사용)."""
+
+
+class LLMDeadlineExceeded(LLMUnavailableError):
+    pass
+
+
+class LLMCircuitOpen(LLMUnavailableError):
+    pass
+
+
+@contextmanager
+def request_deadline(seconds):
+    """이 블록 안의 Gemini 호출 전체가 seconds 안에 끝나도록 합니다. 바깥 데드라인이 더 짧으면 그쪽을 유지합니다."""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(min(deadline, outer) if outer is not None else deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget():
+    """요청 데드라인까지 남은 초. 데드라인이 없으면 None."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def current_deadline():
+    """요청 데드라인의 time.monotonic() 기준 절대 시각. 데드라인이 없으면 None (llm_scheduler 대기 한도로 전달)."""
+    return _deadline.get()
+
+
+def detached_context():
+    """현재 문맥(사용자 등)을 복사하되 요청 데드라인과 요청 트레이스는 뺀 문맥. 백그라운드 작업을 submit할 때 사용합니다."""
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    context.run(tracing.detach)
+    return context
+
+
+class CircuitBreaker:
+    def __init__(self, window_seconds, min_calls, error_rate, open_seconds):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self._outcomes = deque() # (monotonic, ok)
+        self._state = "closed" # closed | open | half_open
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "short_circuited": 0}
+
+    def before_call(self) -> bool:
+        """호출해도 되는지 확인합니다. 열려 있으면 LLMCircuitOpen. 이 호출이 복구 확인(시험) 호출이면 True."""
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self._stats["short_circuited"] += 1
+                    raise LLMCircuitOpen("Gemini 오류율이 높아 잠시 호출을 중단했습니다.")
+                self._state = "half_open"
+            if self._state == "half_open":
+                if self._trial_in_flight:
+                    self._stats["short_circuited"] += 1
+                    raise LLMCircuitOpen("Gemini 복구 확인 호출이 진행 중입니다.")
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, ok, trial=False):
+        now = time.monotonic()
+        with self._lock:
+            if trial:
+                self._trial_in_flight = False
+                if ok:
+                    self._state = "closed"
+                    self._outcomes.clear()
+                else:
+                    self._open_locked(now)
+                return
+            if self._state != "closed":
+                return # 브레이커가 열리기 전에 시작된 호출의 결과는 상태를 바꾸지 않음
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+                self._outcomes.popleft()
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate:
+                self._open_locked(now)
+
+    def release_trial(self, trial):
+        """시험 호출이 결과 없이 끝났을 때(대기열 거절 등) 다음 호출이 다시 시험할 수 있게 합니다."""
+        if trial:
+            with self._lock:
+                self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            return {"state": self._state, "window_calls": len(self._outcomes), "window_failures": failures, **self._stats}
+
+    def _open_locked(self, now):
+        self._state = "open"
+        self._opened_at = now
+        self._stats["opened"] += 1
+        logger.warning("Gemini 서킷 브레이커 열림: %s초 동안 대체 응답을 사용합니다.", self.open_seconds)
+
+
+class LLMResilience:
+    def __init__(self, call_timeouts, hedge_enabled, hedge_percentile, hedge_min_delay_seconds, hedge_initial_delay_seconds,
+                 hedge_max_workers, breaker):
+        self.call_timeouts = call_timeouts # call_type -> 초
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_seconds = hedge_min_delay_seconds
+        self.hedge_initial_delay_seconds = hedge_initial_delay_seconds
+        self.hedge_max_workers = hedge_max_workers
+        self.breaker = breaker
+        self._executor = None
+        self._latencies = {call_type: deque(maxlen=_LATENCY_SAMPLES) for call_type in call_timeouts}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "succeeded": 0, "failed": 0, "deadline_exceeded": 0,
+                       "hedges_fired": 0, "hedges_won": 0}
+
+    @contextmanager
+    def guard(self, call_type):
+        """
+        호출 하나를 데드라인/브레이커로 감쌉니다. 이 호출에 쓸 제한 시간(초)을 돌려주고, 결과를 브레이커에 기록합니다.
+        스트리밍처럼 헤지할 수 없는 호출에 직접 사용합니다.
+        """
+        timeout = self._timeout_for(call_type)
+        trial = self.breaker.before_call()
+        started_at = time.monotonic()
+        with self._lock:
+            self._stats["calls"] += 1
+        ok = None
+        try:
+            yield timeout
+            ok = True
+        except LLMAdmissionError:
+            raise # 호출하지 못한 것은 Gemini 오류가 아님
+        except Exception:
+            ok = False
+            raise
+        finally:
+            if ok is None:
+                # 대기열 거절이나 스트리밍 중 연결 종료처럼 결과가 없으면 다음 호출이 다시 시험할 수 있게 함
+                self.breaker.release_trial(trial)
+            else:
+                self.breaker.record(ok, trial)
+                with self._lock:
+                    self._stats["succeeded" if ok else "failed"] += 1
+                    if ok:
+                        self._latencies.setdefault(call_type, deque(maxlen=_LATENCY_SAMPLES)).append(time.monotonic() - started_at)
+
+    def call(self, call_type, fn):
+        """
+        fn(timeout_seconds)를 실행해 결과를 반환합니다. 헤지가 켜져 있으면 p95 지연 후 같은 요청을 한 번 더 보냅니다.
+        데드라인 안에 결과가 없으면 LLMDeadlineExceeded, 브레이커가 열려 있으면 LLMCircuitOpen.
+        """
+        with self.guard(call_type) as timeout:
+            if not self.hedge_enabled:
+                return fn(timeout)
+            return self._call_hedged(call_type, fn, timeout)
+
+    def hedge_delay(self, call_type):
+        with self._lock:
+            samples = sorted(self._latencies.get(call_type, ()))
+        if len(samples) < _MIN_HEDGE_SAMPLES:
+            return self.hedge_initial_delay_seconds
+        percentile_value = samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile))]
+        return max(self.hedge_min_delay_seconds, percentile_value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hedge_enabled"] = self.hedge_enabled
+        stats["hedge_delay_seconds"] = {call_type: round(self.hedge_delay(call_type), 3) for call_type in self.call_timeouts}
+        stats["breaker"] = self.breaker.stats()
+        return stats
+
+    def remaining_timeout(self, timeout):
+        """
+        스케줄러에서 자리를 얻은 직후 Gemini 요청에 넘길 제한 시간. 대기하는 동안 줄어든 요청 예산을 반영합니다.
+        대기하다 예산을 다 썼으면 호출하지 못한 것이므로 (Gemini 오류가 아니므로) LLMQueueTimeout.
+        """
+        remaining = remaining_budget()
+        if remaining is None:
+            return timeout
+        if remaining <= 0.5:
+            raise LLMQueueTimeout("Gemini 호출 자리를 기다리는 동안 요청 데드라인이 지났습니다.")
+        return min(timeout, remaining)
+
+    def _timeout_for(self, call_type):
+        timeout = self.call_timeouts.get(call_type, LLM_GENERATION_TIMEOUT_SECONDS)
+        remaining = remaining_budget()
+        if remaining is not None:
+            if remaining <= 0.5: # 남은 예산으로는 응답을 받을 수 없음
+                with self._lock:
+                    self._stats["deadline_exceeded"] += 1
+                raise LLMDeadlineExceeded("요청 데드라인이 지나 Gemini를 호출하지 않습니다.")
+            timeout = min(timeout, remaining)
+        return timeout
+
+    def _call_hedged(self, call_type, fn, timeout):
+        with self._lock:
+            if self._executor is None:
+                # gunicorn fork 이후 워커 프로세스 안에서 스레드 풀을 만들도록 첫 사용 시점에 생성
+                self._executor = ThreadPoolExecutor(max_workers=self.hedge_max_workers, thread_name_prefix="llm-hedge")
+        deadline = time.monotonic() + timeout
+        primary = self._executor.submit(contextvars.copy_context().run, fn, timeout)
+        futures = {primary}
+        done, _ = wait_futures(futures, timeout=min(self.hedge_delay(call_type), timeout))
+        if not done:
+            with self._lock:
+                self._stats["hedges_fired"] += 1
+            remaining = max(0.1, deadline - time.monotonic())
+            futures.add(self._executor.submit(contextvars.copy_context().run, fn, remaining))
+
+        last_error = None
+        while futures:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, futures = wait_futures(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        with self._lock:
+                            self._stats["hedges_won"] += 1
+                    return future.result()
+                last_error = future.exception()
+        if last_error is not None and not futures:
+            raise last_error
+        with self._lock:
+            self._stats["deadline_exceeded"] += 1
+        raise LLMDeadlineExceeded(f"Gemini 응답이 {timeout:.1f}초 안에 오지 않았습니다.")
+
+
+llm_resilience = LLMResilience(
+    call_timeouts={
+        CALL_GENERATION: LLM_GENERATION_TIMEOUT_SECONDS,
+        CALL_SUMMARY: LLM_SUMMARY_TIMEOUT_SECONDS,
+        CALL_ENDING_CHECK: LLM_ENDING_CHECK_TIMEOUT_SECONDS,
+        CALL_ENDING_ENHANCEMENT: LLM_ENDING_ENHANCEMENT_TIMEOUT_SECONDS,
+    },
+    hedge_enabled=LLM_HEDGE_ENABLED,
+    hedge_percentile=LLM_HEDGE_PERCENTILE,
+    hedge_min_delay_seconds=LLM_HEDGE_MIN_DELAY_SECONDS,
+    hedge_initial_delay_seconds=LLM_HEDGE_INITIAL_DELAY_SECONDS,
+    hedge_max_workers=LLM_HEDGE_MAX_WORKERS,
+    breaker=CircuitBreaker(
+        window_seconds=LLM_BREAKER_WINDOW_SECONDS,
+        min_calls=LLM_BREAKER_MIN_CALLS,
+        error_rate=LLM_BREAKER_ERROR_RATE,
+        open_seconds=LLM_BREAKER_OPEN_SECONDS,
+    ),
+)
@@ -0,0 +1,293 @@
+"""
+Admission control for Gemini calls.
+
+프로세스 전체의 동시 Gemini 호출 수를 LLM_MAX_CONCURRENCY로 제한하고, 자리가 날 때까지 우선순위
+대기열에서 기다리게 합니다 (스토리 생성이 요약, 엔딩 판정, 엔딩 확장, 백그라운드 미리 생성보다 먼저).
+사용자별로는 토큰 버킷(분당 호출 수 + 버스트)으로 호출량을 제한하고,
+429(ResourceExhausted) 응답을 받으면 모든 호출의 시작을 지수적으로 늦추고 그 호출을 다시 시도합니다.
+
+사용자와 우선순위 하한은 llm_call_context()로 요청/작업 단위로 지정합니다 (contextvars).
+호출자가 deadline(요청 데드라인, llm_resilience.current_deadline())을 넘기면 대기열/쿼터 대기도 그 시각을 넘기지 않습니다.
+스레드 풀에서 실행되는 백그라운드 작업은 submit할 때 contextvars.copy_context()로 문맥을 넘겨받습니다.
+"""
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from google.api_core import exceptions as google_exceptions
+
+from backend.config import (LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT_SECONDS, LLM_USER_CALLS_PER_MINUTE, LLM_USER_BURST,
+                            LLM_USER_QUOTA_MAX_WAIT_SECONDS, LLM_RATE_LIMIT_BACKOFF_BASE_SECONDS,
+                            LLM_RATE_LIMIT_BACKOFF_MAX_SECONDS, LLM_RATE_LIMIT_MAX_RETRIES)
+
+logger = logging.getLogger(__name__)
+
+# 숫자가 작을수록 먼저 처리
+PRIORITY_INTERACTIVE = 0 # 플레이어가 기다리는 스토리/선택지 생성
+PRIORITY_SUMMARY = 1
+PRIORITY_ENDING_CHECK = 2
+PRIORITY_ENDING_ENHANCEMENT = 3
+PRIORITY_BACKGROUND = 4 # 예측 생성, 첫 장면 풀 등 서버가 먼저 시작한 호출 (사용자 쿼터에서 차감하지 않음)
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_SUMMARY: "summary", PRIORITY_ENDING_CHECK: "ending_check",
+                  PRIORITY_ENDING_ENHANCEMENT: "ending_enhancement", PRIORITY_BACKGROUND: "background"}
+
+_BUCKET_IDLE_SECONDS = 600 # 이 시간 동안 호출이 없던 사용자 버킷은 정리
+_WAIT_SAMPLES = 512 # 우선순위별 p95 대기 시간 계산에 쓰는 최근 표본 수
+
+_llm_user_id = contextvars.ContextVar("llm_user_id", default=None)
+_llm_priority_floor = contextvars.ContextVar("llm_priority_floor", default=PRIORITY_INTERACTIVE)
+
+
+class LLMAdmissionError(RuntimeError):
+    """대기열 시간 초과나 사용자 쿼터 초과로 Gemini 호출을 시작하지 못함 (클라이언트에는 429로 응답)."""
+
+
+class LLMQueueTimeout(LLMAdmissionError):
+    pass
+
+
+class LLMQuotaExceeded(LLMAdmissionError):
+    pass
+
+
+@contextmanager
+def llm_call_context(user_id=None, priority_floor=None):
+    """
+    이 블록 안의 Gemini 호출을 user_id의 쿼터로 계산하고, priority_floor보다 높은 우선순위로 처리하지 않습니다.
+    지정하지 않은 값은 바깥 문맥의 값을 그대로 사용합니다.
+    """
+    tokens = []
+    if user_id is not None:
+        tokens.append((_llm_user_id, _llm_user_id.set(str(user_id))))
+    if priority_floor is not None:
+        tokens.append((_llm_priority_floor, _llm_priority_floor.set(priority_floor)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def current_llm_user_id():
+    """llm_call_context()로 지정된 현재 사용자 ID (없으면 None)."""
+    return _llm_user_id.get()
+
+
+def is_rate_limited_error(e) -> bool:
+    return isinstance(e, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)) or getattr(e, "code", None) == 429
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency, queue_timeout_seconds, user_calls_per_minute, user_burst, quota_max_wait_seconds,
+                 backoff_base_seconds, backoff_max_seconds, max_rate_limit_retries):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.user_calls_per_minute = user_calls_per_minute
+        self.user_burst = user_burst
+        self.quota_max_wait_seconds = quota_max_wait_seconds
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self._cond = threading.Condition()
+        self._waiting = [] # (priority, seq) 힙
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._backoff_until = 0.0
+        self._consecutive_rate_limits = 0
+        self._buckets = {} # user_id -> [tokens, last_refill]
+        self._waits = {name: deque(maxlen=_WAIT_SAMPLES) for name in PRIORITY_NAMES.values()}
+        self._wait_totals = {name: [0, 0.0] for name in PRIORITY_NAMES.values()} # 우선순위별 [자리를 얻은 횟수, 대기 시간 합]
+        self._stats = {"admitted": 0, "queue_timeouts": 0, "quota_waits": 0, "quota_rejections": 0,
+                       "rate_limited": 0, "rate_limit_retries": 0, "backoff_seconds_total": 0.0, "max_queue_depth": 0}
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, deadline=None):
+        """
+        Gemini 호출 하나의 실행 자리를 얻습니다. 스트리밍 응답처럼 반복하는 동안 자리를 유지해야 할 때 사용합니다.
+        자리를 얻지 못하면 LLMAdmissionError를 발생시킵니다.
+        deadline(time.monotonic() 기준 절대 시각)이 있으면 쿼터/대기열 대기를 그 시각까지로 줄입니다.
+        """
+        priority = max(priority, _llm_priority_floor.get())
+        self._take_user_quota(_llm_user_id.get(), priority, deadline)
+        self._acquire(priority, deadline)
+        try:
+            yield
+        except Exception as e:
+            if is_rate_limited_error(e):
+                self._record_rate_limit()
+            raise
+        else:
+            self._record_success()
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def call(self, fn, priority=PRIORITY_INTERACTIVE, deadline=None):
+        """fn()을 자리를 얻은 뒤 실행합니다. 429를 받으면 전역 백오프 후 LLM_RATE_LIMIT_MAX_RETRIES번까지 다시 시도합니다."""
+        for attempt in range(self.max_rate_limit_retries + 1):
+            try:
+                with self.slot(priority, deadline):
+                    return fn()
+            except Exception as e:
+                if not is_rate_limited_error(e) or attempt == self.max_rate_limit_retries:
+                    raise
+                with self._cond:
+                    self._stats["rate_limit_retries"] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            depth_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiting:
+                depth_by_priority[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            waits = {}
+            for name, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[name] = {"samples": len(ordered),
+                               "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else 0.0,
+                               "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1) if ordered else 0.0,
+                               "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0}
+            return {"max_concurrency": self.max_concurrency, "in_flight": self._in_flight,
+                    "queue_depth": len(self._waiting), "queue_depth_by_priority": depth_by_priority,
+                    "backoff_remaining_seconds": round(max(0.0, self._backoff_until - time.monotonic()), 2),
+                    "tracked_users": len(self._buckets), "wait": waits,
+                    **{**self._stats, "backoff_seconds_total": round(self._stats["backoff_seconds_total"], 2)}}
+
+    def render_prometheus(self) -> str:
+        """대기열 깊이/대기 시간(우선순위별), 대기열 시간 초과, 사용자 쿼터, 429 백오프 (Prometheus 텍스트 형식)."""
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiting:
+                depth[PRIORITY_NAMES.get(priority, "background")] += 1
+            lines = ["# HELP storydive_llm_queue_depth Gemini calls waiting for a scheduler slot by priority.",
+                     "# TYPE storydive_llm_queue_depth gauge"]
+            lines += [f'storydive_llm_queue_depth{{priority="{name}"}} {count}' for name, count in depth.items()]
+            lines += ["# HELP storydive_llm_in_flight Gemini calls currently holding a scheduler slot.",
+                      "# TYPE storydive_llm_in_flight gauge",
+                      f"storydive_llm_in_flight {self._in_flight}",
+                      "# HELP storydive_llm_queue_wait_seconds Time spent waiting for a scheduler slot by priority (recent samples).",
+                      "# TYPE storydive_llm_queue_wait_seconds summary"]
+            for name, samples in self._waits.items():
+                ordered = sorted(samples)
+                for quantile in (0.5, 0.95):
+                    value = ordered[min(len(ordered) - 1, int(len(ordered) * quantile))] if ordered else 0.0
+                    lines.append(f'storydive_llm_queue_wait_seconds{{priority="{name}",quantile="{quantile}"}} {value:.6f}')
+                count, total = self._wait_totals[name]
+                lines.append(f'storydive_llm_queue_wait_seconds_sum{{priority="{name}"}} {total:.6f}')
+                lines.append(f'storydive_llm_queue_wait_seconds_count{{priority="{name}"}} {count}')
+            for metric, key, help_text in (
+                    ("storydive_llm_queue_timeouts_total", "queue_timeouts", "Gemini calls rejected after waiting too long for a slot."),
+                    ("storydive_llm_quota_waits_total", "quota_waits", "Gemini calls delayed by the per-user quota."),
+                    ("storydive_llm_quota_rejections_total", "quota_rejections", "Gemini calls rejected by the per-user quota."),
+                    ("storydive_llm_rate_limited_total", "rate_limited", "Gemini 429 responses that triggered a global backoff."),
+                    ("storydive_llm_rate_limit_retries_total", "rate_limit_retries", "Gemini calls retried after a 429 backoff.")):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter", f"{metric} {self._stats[key]}"]
+            lines += ["# HELP storydive_llm_backoff_seconds_total Total 429 backoff applied to new Gemini calls.",
+                      "# TYPE storydive_llm_backoff_seconds_total counter",
+                      f"storydive_llm_backoff_seconds_total {self._stats['backoff_seconds_total']:.3f}",
+                      "# HELP storydive_llm_backoff_remaining_seconds Remaining 429 backoff before new Gemini calls may start.",
+                      "# TYPE storydive_llm_backoff_remaining_seconds gauge",
+                      f"storydive_llm_backoff_remaining_seconds {max(0.0, self._backoff_until - time.monotonic()):.3f}"]
+        return "\n".join(lines) + "\n"
+
+    def _acquire(self, priority, request_deadline=None):
+        started_at = time.monotonic()
+        deadline = started_at + self.queue_timeout_seconds
+        if request_deadline is not None:
+            deadline = min(deadline, request_deadline)
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._waiting))
+            try:
+                while True:
+                    now = time.monotonic()
+                    backoff = self._backoff_until - now
+                    if self._waiting[0] == entry and self._in_flight < self.max_concurrency and backoff <= 0:
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["queue_timeouts"] += 1
+                        raise LLMQueueTimeout(f"Gemini 호출 대기열에서 {deadline - started_at:.1f}초 안에 자리를 얻지 못했습니다.")
+                    self._cond.wait(min(remaining, backoff) if backoff > 0 else remaining)
+                heapq.heappop(self._waiting)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            name = PRIORITY_NAMES.get(priority, "background")
+            waited = time.monotonic() - started_at
+            self._waits[name].append(waited)
+            self._wait_totals[name][0] += 1
+            self._wait_totals[name][1] += waited
+            self._cond.notify_all() # 자리가 남아 있으면 다음 대기자도 진행
+
+    def _take_user_quota(self, user_id, priority, request_deadline=None):
+        """
+        사용자 토큰 버킷에서 호출 1회를 예약합니다.
+        모자라면 채워질 때까지(최대 LLM_USER_QUOTA_MAX_WAIT_SECONDS, 요청 데드라인까지) 기다립니다.
+        """
+        if not user_id or priority >= PRIORITY_BACKGROUND or self.user_calls_per_minute <= 0:
+            return
+        refill_per_second = self.user_calls_per_minute / 60.0
+        with self._cond:
+            now = time.monotonic()
+            max_wait = self.quota_max_wait_seconds
+            if request_deadline is not None:
+                max_wait = min(max_wait, request_deadline - now)
+            if len(self._buckets) > 1000:
+                self._prune_buckets_locked(now, refill_per_second)
+            bucket = self._buckets.setdefault(user_id, [float(self.user_burst), now])
+            bucket[0] = min(float(self.user_burst), bucket[0] + (now - bucket[1]) * refill_per_second)
+            bucket[1] = now
+            bucket[0] -= 1
+            wait_seconds = -bucket[0] / refill_per_second if bucket[0] < 0 else 0.0
+            if wait_seconds > max_wait:
+                bucket[0] += 1 # 예약 취소
+                self._stats["quota_rejections"] += 1
+                raise LLMQuotaExceeded(f"사용자 {user_id}의 Gemini 호출 한도(분당 {self.user_calls_per_minute}회)를 초과했습니다.")
+            if wait_seconds > 0:
+                self._stats["quota_waits"] += 1
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    def _prune_buckets_locked(self, now, refill_per_second):
+        for user_id in [uid for uid, (tokens, last) in self._buckets.items()
+                        if now - last > _BUCKET_IDLE_SECONDS and tokens + (now - last) * refill_per_second >= self.user_burst]:
+            del self._buckets[user_id]
+
+    def _record_rate_limit(self):
+        with self._cond:
+            self._consecutive_rate_limits += 1
+            backoff = min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** (self._consecutive_rate_limits - 1)))
+            backoff *= random.uniform(0.8, 1.2) # 여러 워커가 동시에 재시도하지 않도록
+            self._backoff_until = max(self._backoff_until, time.monotonic() + backoff)
+            self._stats["rate_limited"] += 1
+            self._stats["backoff_seconds_total"] += backoff
+        logger.warning("Gemini 429 응답: %.1f초 동안 새 호출 시작을 늦춥니다.", backoff)
+
+    def _record_success(self):
+        if self._consecutive_rate_limits:
+            with self._cond:
+                self._consecutive_rate_limits = 0
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    queue_timeout_seconds=LLM_QUEUE_TIMEOUT_SECONDS,
+    user_calls_per_minute=LLM_USER_CALLS_PER_MINUTE,
+    user_burst=LLM_USER_BURST,
+    quota_max_wait_seconds=LLM_USER_QUOTA_MAX_WAIT_SECONDS,
+    backoff_base_seconds=LLM_RATE_LIMIT_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=LLM_RATE_LIMIT_BACKOFF_MAX_SECONDS,
+    max_rate_limit_retries=LLM_RATE_LIMIT_MAX_RETRIES,
+)
@@ -0,0 +1,210 @@
+"""
+Logging configuration: lazy, truncated/redacted payloads, per-logger levels, debug sampling and a non-blocking handler.
+
+create_app()에서 configure_logging()을 한 번 호출합니다.
+- 레벨: 루트는 LOG_LEVEL, 로거별 레벨은 LOG_LEVELS ("backend.story_routes=DEBUG,httpx=WARNING").
+- 지연 포맷: logger.debug("... %s", truncated(payload))처럼 쓰면 레벨이 꺼져 있을 때 문자열을 만들지 않고,
+  켜져 있어도 긴 문자열 필드(history 등)와 전체 메시지를 LOG_MAX_FIELD_CHARS / LOG_MAX_MESSAGE_CHARS로 자르며
+  토큰/비밀번호 키와 JWT 모양의 문자열은 가립니다.
+- 샘플링: DEBUG 로그는 호출 위치(파일, 줄)마다 초당 LOG_DEBUG_MAX_PER_SECOND건까지만 남기고 나머지 건수는 다음 줄에 표시합니다.
+- 비동기: 요청 스레드는 제한된 큐에 레코드를 넣기만 하고 (가득 차면 버림), 출력은 별도 스레드(QueueListener)가 합니다.
+  리스너는 프로세스(gunicorn 워커)마다 첫 로그에서 시작합니다.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from backend.config import (LOG_LEVEL, LOG_LEVELS, LOG_JSON, LOG_ASYNC, LOG_QUEUE_MAX, LOG_MAX_MESSAGE_CHARS,
+                            LOG_MAX_FIELD_CHARS, LOG_DEBUG_MAX_PER_SECOND)
+
+_REDACTED_KEYS = {"access_token", "refresh_token", "user_jwt", "jwt", "token", "password", "authorization", "apikey",
+                  "api_key", "secret"}
+_JWT_PATTERN = re.compile(r"eyJ[\w-]{8,}\.[\w-]{8,}\.[\w-]{8,}")
+_MAX_LIST_ITEMS = 10
+
+_configured = False
+_configure_lock = threading.Lock()
+_stats = {"dropped": 0, "sampled_out": 0}
+
+
+def _shorten(value, field_chars, depth=0):
+    """긴 문자열/목록을 줄이고 비밀 값을 가린 복사본을 만듭니다."""
+    if isinstance(value, str):
+        value = _JWT_PATTERN.sub("[REDACTED_JWT]", value)
+        if len(value) > field_chars:
+            return f"{value[:field_chars]}...(+{len(value) - field_chars} chars)"
+        return value
+    if depth >= 4:
+        return f"<{type(value).__name__}>"
+    if isinstance(value, dict):
+        return {key: "[REDACTED]" if str(key).lower() in _REDACTED_KEYS else _shorten(item, field_chars, depth + 1)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_shorten(item, field_chars, depth + 1) for item in value[:_MAX_LIST_ITEMS]]
+        if len(value) > _MAX_LIST_ITEMS:
+            items.append(f"...(+{len(value) - _MAX_LIST_ITEMS} items)")
+        return items
+    return value
+
+
+class truncated:
+    """로그 인자용 지연 요약. 로그가 실제로 출력될 때만 payload를 줄여서 문자열로 만듭니다."""
+    __slots__ = ("value", "field_chars")
+
+    def __init__(self, value, field_chars=None):
+        self.value = value
+        self.field_chars = field_chars or LOG_MAX_FIELD_CHARS
+
+    def __str__(self):
+        return _clip(str(_shorten(self.value, self.field_chars)), LOG_MAX_MESSAGE_CHARS)
+
+    __repr__ = __str__
+
+
+def _clip(text, limit):
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...(+{len(text) - limit} chars)"
+    return text
+
+
+class _DebugSampler(logging.Filter):
+    """DEBUG 이하 레코드를 호출 위치마다 초당 max_per_second건으로 제한합니다."""
+
+    def __init__(self, max_per_second):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self._windows = {} # (pathname, lineno) -> [window_start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.max_per_second <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} (직전 1초 동안 같은 위치의 로그 {suppressed}건 생략)"
+                return True
+            if window[1] < self.max_per_second:
+                window[1] += 1
+                return True
+            window[2] += 1
+            _stats["sampled_out"] += 1
+            return False
+
+
+class _MessageClipper(logging.Filter):
+    """% 인자를 적용한 메시지를 LOG_MAX_MESSAGE_CHARS로 자르고 JWT 모양의 문자열을 가립니다."""
+
+    def filter(self, record):
+        message = _JWT_PATTERN.sub("[REDACTED_JWT]", _clip(record.getMessage(), LOG_MAX_MESSAGE_CHARS))
+        record.msg, record.args = message, None
+        return True
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                 "thread": record.threadName, "msg": record.getMessage()}
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _AsyncQueueHandler(QueueHandler):
+    """
+    제한된 큐에 넣기만 하는 핸들러. 큐가 가득 차면 레코드를 버리고 요청 스레드를 막지 않습니다.
+    출력 핸들러의 포맷/쓰기는 리스너 스레드가 합니다.
+    """
+
+    def __init__(self, target, max_size):
+        super().__init__(queue.Queue(maxsize=max_size))
+        self.target = target
+        self._listener = None
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid != os.getpid(): # fork 이후에는 부모의 리스너 스레드가 없으므로 새로 시작
+                self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._listener_pid = os.getpid()
+
+    def prepare(self, record):
+        # _MessageClipper가 이미 메시지를 만들었고 큐는 같은 프로세스 안에 있으므로, 복사/재포맷 없이 그대로 넘김
+        # (예외 정보는 리스너 스레드의 출력 핸들러가 포맷)
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _stats["dropped"] += 1
+
+    def stop(self):
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop() # 남은 레코드를 모두 출력한 뒤 종료
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """루트 로거를 설정합니다. 여러 번 호출해도 한 번만 적용됩니다."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+
+        output = logging.StreamHandler(sys.stderr)
+        if LOG_JSON:
+            output.setFormatter(_JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+        if LOG_ASYNC:
+            handler = _AsyncQueueHandler(output, LOG_QUEUE_MAX)
+            atexit.register(handler.stop)
+        else:
+            handler = output
+        handler.addFilter(_DebugSampler(LOG_DEBUG_MAX_PER_SECOND))
+        handler.addFilter(_MessageClipper()) # 샘플링을 통과한 레코드만 메시지를 만듦
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL.upper())
+        for name, level in _parse_levels(LOG_LEVELS).items():
+            try:
+                logging.getLogger(name).setLevel(level)
+            except ValueError:
+                print(f"[WARN logging_setup] 알 수 없는 로그 레벨: {name}={level}")
+
+
+def logging_stats() -> dict:
+    """큐가 가득 차 버린 레코드 수와 샘플링으로 생략한 DEBUG 레코드 수."""
+    return dict(_stats)
@@ -0,0 +1,77 @@
+"""
+Per-process registry of configured Gemini model handles.
+
+gemini_utils의 각 함수가 호출마다 genai.GenerativeModel과 GenerationConfig를 새로 만들지 않도록,
+(모델 이름, 생성 설정, 시스템 지시문) 조합별로 핸들을 한 번만 만들어 재사용합니다. 생성 설정(응답 스키마 포함)의
+변환도 핸들을 만들 때 한 번만 수행됩니다. 모든 핸들은 genai가 프로세스당 하나 캐시하는 generative
+클라이언트(gRPC 채널)를 공유하며, warm_up()으로 워커 시작 시 채널 연결까지 미리 열어 둘 수 있습니다.
+핸들은 LLM_PROVIDER로 고른 provider(llm_providers)가 만듭니다 (gemini, fake, record, replay).
+"""
+import json
+import logging
+import threading
+import time
+
+from backend.config import GEMINI_MODEL_NAME
+from backend.llm_providers import llm_provider
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiModelRegistry:
+    def __init__(self, default_model_name, provider):
+        self.default_model_name = default_model_name
+        self.provider = provider
+        # (model_name, 시스템 지시문, 생성 설정 JSON) -> GenerativeModel
+        self._models = {}
+        self._lock = threading.Lock()
+        self._stats = {"builds": 0, "reuses": 0, "warmups": 0, "warmup_errors": 0, "last_warmup_ms": None}
+
+    def get(self, model_name=None, system_instruction=None, **generation_config):
+        """
+        생성 설정이 적용된 모델 핸들을 반환합니다. 예: get(max_output_tokens=800, temperature=0.7)
+        생성 설정 없이 부르면 모델 기본 설정의 핸들을 반환합니다.
+        system_instruction은 호출 종류별로 바뀌지 않는 지시문으로, 핸들에 한 번 묶어 둡니다.
+        """
+        model_name = model_name or self.default_model_name
+        key = (model_name, system_instruction, json.dumps(generation_config, sort_keys=True, ensure_ascii=False, default=str))
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._stats["reuses"] += 1
+                return model
+        model = self.provider.build_model(model_name, generation_config, system_instruction)
+        with self._lock:
+            # 동시에 같은 핸들을 만든 경우 먼저 등록된 것을 사용
+            model = self._models.setdefault(key, model)
+            self._stats["builds"] += 1
+        return model
+
+    def warm_up(self, network=False):
+        """
+        generative 클라이언트(전송 채널)를 미리 만들고, network=True이면 count_tokens 호출로 연결까지 엽니다.
+        provider를 쓸 수 없으면(API 키 없음) 아무것도 하지 않습니다.
+        """
+        if not self.provider.available:
+            return False
+        started_at = time.perf_counter()
+        try:
+            self.provider.warm_up(self.get(), network)
+        except Exception as e:
+            logger.exception("Gemini 워밍업 실패: %s", e)
+            with self._lock:
+                self._stats["warmup_errors"] += 1
+            return False
+        with self._lock:
+            self._stats["warmups"] += 1
+            self._stats["last_warmup_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["builds"] + self._stats["reuses"]
+            return {"handles": len(self._models), "default_model": self.default_model_name, "provider": self.provider.name,
+                    "reuse_rate": round(self._stats["reuses"] / lookups, 4) if lookups else 0.0, **self._stats}
+
+
+gemini_models = GeminiModelRegistry(default_model_name=GEMINI_MODEL_NAME, provider=llm_provider)
@@ -0,0 +1,142 @@
+"""
+Per-world pool of pre-generated opening scenes for start_new_adventure.
+
+시작 프롬프트(START_WITH_USER_POINT_PROMPT_TEMPLATE / START_WITH_USER_POINT_CHOICES_ONLY_PROMPT_TEMPLATE)는
+같은 세계관의 모든 플레이어에게 동일하므로, 세계관마다 N개의 첫 장면(스토리 + 선택지)을 미리 생성해 두고
+시작할 때 하나씩 꺼내 씁니다. 꺼낸 만큼은 백그라운드 워커가 다시 채웁니다.
+풀은 프롬프트 지문으로 묶여 있어서, 다른 워커에서 세계관 설정이 바뀌어도 이전 첫 장면은 제공되지 않습니다.
+같은 프로세스의 update_world는 invalidate()로 즉시 비웁니다.
+풀의 첫 장면은 그 세계관의 모든 플레이어에게 제공되므로, 실제로 파싱된 선택지가 2개 이상인 응답만 넣고
+API 키가 없을 때(예시 데이터만 나옴)는 풀을 쓰지도 채우지도 않습니다.
+"""
+import functools
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config import (OPENING_POOL_ENABLED, OPENING_POOL_SIZE, OPENING_POOL_MAX_WORKERS,
+                            OPENING_POOL_MAX_WORLDS, OPENING_POOL_PUBLIC_ONLY)
+from backend.gemini_utils import call_gemini_api
+from backend.llm_providers import llm_provider
+from backend.llm_scheduler import llm_call_context, PRIORITY_BACKGROUND
+from backend.token_accounting import usage_scope
+
+logger = logging.getLogger(__name__)
+
+
+class OpeningPool:
+    def __init__(self, generate_fn, enabled, pool_size, max_workers, max_worlds, public_only):
+        self._generate_fn = generate_fn # prompt -> (story_part, choices)
+        self.enabled = enabled
+        self.pool_size = pool_size
+        self.max_workers = max_workers
+        self.max_worlds = max_worlds
+        self.public_only = public_only
+        self._executor = None
+        # world_id -> {'fingerprint', 'prompt', 'openings': deque[(story_part, choices)], 'refilling'}
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "generated": 0, "discarded_stale": 0,
+                       "invalidations": 0, "evictions": 0, "errors": 0, "rejected": 0}
+
+    def take(self, world_id, prompt, is_public):
+        """
+        미리 생성된 첫 장면 (story_part, choices)를 하나 꺼내 반환합니다. 없으면 None (호출자가 직접 생성).
+        어느 경우든 풀이 pool_size만큼 차도록 백그라운드 보충을 예약합니다.
+        """
+        if not self.enabled or not world_id or (self.public_only and not is_public) or not llm_provider.available:
+            return None
+        world_id = str(world_id)
+        fingerprint = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            entry = self._pools.get(world_id)
+            if entry is None or entry['fingerprint'] != fingerprint:
+                if entry is not None:
+                    # 세계관 설정이 바뀜 (다른 워커에서의 수정 포함): 이전 첫 장면은 버림
+                    self._stats["discarded_stale"] += len(entry['openings'])
+                entry = {'fingerprint': fingerprint, 'prompt': prompt, 'openings': deque(), 'refilling': False}
+                self._pools[world_id] = entry
+            self._pools.move_to_end(world_id)
+            while len(self._pools) > self.max_worlds:
+                self._pools.popitem(last=False)
+                self._stats["evictions"] += 1
+
+            opening = entry['openings'].popleft() if entry['openings'] else None
+            self._stats["hits" if opening else "misses"] += 1
+            self._schedule_refill_locked(world_id, entry)
+        return opening
+
+    def invalidate(self, world_id):
+        with self._lock:
+            entry = self._pools.pop(str(world_id), None)
+            if entry is not None:
+                self._stats["invalidations"] += 1
+                self._stats["discarded_stale"] += len(entry['openings'])
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {"enabled": self.enabled, "worlds": len(self._pools),
+                    "pooled": sum(len(entry['openings']) for entry in self._pools.values()),
+                    "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0, **self._stats}
+
+    def _schedule_refill_locked(self, world_id, entry):
+        if entry['refilling'] or len(entry['openings']) >= self.pool_size:
+            return
+        if self._executor is None:
+            # gunicorn fork 이후 워커 프로세스 안에서 스레드 풀을 만들도록 첫 사용 시점에 생성
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="opening-pool")
+        entry['refilling'] = True
+        self._executor.submit(self._refill_one, world_id, entry)
+
+    def _refill_one(self, world_id, entry):
+        """첫 장면을 하나 생성해 넣고, 아직 모자라면 다음 생성을 다시 예약합니다 (여러 세계관이 워커를 나눠 쓰도록)."""
+        try:
+            # 여러 사용자가 공유하는 풀이므로 특정 사용자의 호출 한도로 계산하지 않고, 가장 낮은 우선순위로 생성
+            # 토큰 사용량은 세션 없이 세계관으로만 집계
+            with llm_call_context(priority_floor=PRIORITY_BACKGROUND), usage_scope(world_id=world_id):
+                opening = self._generate_fn(entry['prompt'])
+        except Exception as e:
+            logger.exception("첫 장면 생성 실패 (world_id=%s): %s", world_id, e)
+            with self._lock:
+                self._stats["errors"] += 1
+                entry['refilling'] = False # 다음 take()에서 다시 시도
+            return
+        if not is_servable_opening(opening):
+            logger.warning("선택지가 부족하거나 대체 응답인 첫 장면을 버립니다 (world_id=%s).", world_id)
+            with self._lock:
+                self._stats["rejected"] += 1
+                entry['refilling'] = False # 다음 take()에서 다시 시도
+            return
+        with self._lock:
+            entry['refilling'] = False
+            if self._pools.get(world_id) is not entry:
+                # 생성하는 동안 무효화되었거나 설정이 바뀜
+                self._stats["discarded_stale"] += 1
+                return
+            entry['openings'].append(opening)
+            self._stats["generated"] += 1
+            self._schedule_refill_locked(world_id, entry)
+
+
+def is_servable_opening(opening) -> bool:
+    """
+    다른 플레이어에게 제공해도 되는 첫 장면인지: 본문이 있고, 모델 응답에서 파싱한 선택지(choice_N)가 2개 이상.
+    대체/오류/예시 선택지(fallback_*, error_api_*, example_choice_*)가 섞인 응답은 제외합니다.
+    """
+    story_part, choices = opening
+    return (bool(story_part and story_part.strip()) and len(choices) >= 2
+            and all(str(choice.get('id', '')).startswith("choice_") for choice in choices))
+
+
+opening_pool = OpeningPool(
+    # strict: 예외/API 키 없음/선택지 부족을 대체 응답 대신 예외로 받아 첫 장면으로 저장하지 않음 (is_servable_opening으로 한 번 더 확인)
+    generate_fn=functools.partial(call_gemini_api, strict=True),
+    enabled=OPENING_POOL_ENABLED,
+    pool_size=OPENING_POOL_SIZE,
+    max_workers=OPENING_POOL_MAX_WORKERS,
+    max_worlds=OPENING_POOL_MAX_WORLDS,
+    public_only=OPENING_POOL_PUBLIC_ONLY,
+)
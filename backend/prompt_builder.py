@@ -0,0 +1,192 @@
+"""
+Token-budgeted prompt assembly for story turns.
+
+이어가기 프롬프트(DEFAULT_PROMPT_TEMPLATE)를 글자 수 한도 대신 토큰 예산(PROMPT_TOKEN_BUDGET)으로 조립합니다.
+예산은 모델 입력 전체 기준이므로 함께 보내는 STORYTELLER_SYSTEM_INSTRUCTION도 고정 비용으로 셉니다.
+- 토큰 수는 token_accounting.token_estimator의 로컬 추정치입니다 (실제 입력 토큰 수로 계속 보정됨).
+- 지시문(시스템 지시문 + 템플릿), 플레이어 행동, 시스템 목록은 항상 그대로 넣고, 남은 예산을 세계관 설정과 이야기 기억에 나눕니다.
+- 세계관 설정은 PROMPT_SETTING_MAX_TOKENS까지만 넣습니다 (fit_setting, 첫 장면 프롬프트와 요약에도 같은 값 사용).
+- 그래도 예산을 넘으면 우선순위가 낮은 것부터 줄입니다:
+  지난 이야기 개요 → 오래된 챕터 요약 → PROMPT_MIN_RECENT_TURNS개를 넘는 오래된 원문 턴
+  → 세계관 설정 (PROMPT_SETTING_MIN_TOKENS까지) → 남은 가장 오래된 턴의 앞부분.
+  줄이는 것은 이번 프롬프트뿐이며 세션의 이야기 기억은 바뀌지 않습니다.
+- history_budget()은 요청 경로의 하드 한도 압축(story_summarizer.compact_blocking)이 맞춰야 할 히스토리 토큰 수입니다.
+  보통은 압축으로 예산 안에 들어오므로 위의 잘라내기는 요약이 실패했거나 설정/행동이 매우 긴 경우에만 일어납니다.
+"""
+import threading
+
+from backend import story_memory
+from backend.config import PROMPT_TOKEN_BUDGET, PROMPT_SETTING_MAX_TOKENS, PROMPT_SETTING_MIN_TOKENS, PROMPT_MIN_RECENT_TURNS
+from backend.gemini_utils import DEFAULT_PROMPT_TEMPLATE, STORYTELLER_SYSTEM_INSTRUCTION
+from backend.token_accounting import token_estimator
+
+TRIM_MARKER = "...(이하 생략)"
+CLIP_MARKER = "(앞부분 생략)..."
+NO_SYSTEMS_TEXT = "없음. 시스템 변경 지시를 내리지 마세요."
+_MIN_CLIPPED_TURN_TOKENS = 50 # 이보다 적게 남길 바에는 턴을 통째로 뺌
+
+
+def systems_list_text(active_systems) -> str:
+    if not active_systems:
+        return NO_SYSTEMS_TEXT
+    return ", ".join(f"{name} (현재값: {value})" for name, value in active_systems.items())
+
+
+class PromptBuilder:
+    def __init__(self, estimator, token_budget, setting_max_tokens, setting_min_tokens, min_recent_turns):
+        self.estimator = estimator
+        self.token_budget = token_budget
+        self.setting_max_tokens = setting_max_tokens
+        self.setting_min_tokens = min(setting_min_tokens, setting_max_tokens)
+        self.min_recent_turns = max(1, min_recent_turns)
+        # 시스템 지시문과 자리표시자를 비운 템플릿 (지시문) 의 보정 전 추정치는 한 번만 계산
+        self._system_instruction_raw = estimator.raw_estimate(STORYTELLER_SYSTEM_INSTRUCTION)
+        self._instructions_raw = self._system_instruction_raw + estimator.raw_estimate(
+            DEFAULT_PROMPT_TEMPLATE.format(world_setting_summary="", story_summary="", user_action="",
+                                           current_systems_list_for_prompt=""))
+        self._stats = {"built": 0, "over_budget": 0, "still_over_budget": 0, "setting_trimmed": 0,
+                       "summaries_dropped": 0, "turns_dropped": 0, "turns_clipped": 0,
+                       "prompt_tokens_sum": 0, "prompt_tokens_max": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def fit_text(self, text, max_tokens, marker=TRIM_MARKER) -> str:
+        """text를 max_tokens 이하로 줄입니다 (뒷부분 생략, 가능하면 줄/문장 경계에서)."""
+        if not text:
+            return text
+        tokens = self.estimator.estimate(text)
+        if tokens <= max_tokens:
+            return text
+        cut = int(len(text) * max_tokens / tokens)
+        while cut > 0:
+            boundary = max(text.rfind("\n", 0, cut), text.rfind(". ", 0, cut))
+            if boundary > cut * 0.8:
+                cut = boundary + 1
+            trimmed = text[:cut].rstrip() + "\n" + marker
+            if self.estimator.estimate(trimmed) <= max_tokens:
+                return trimmed
+            cut = int(cut * 0.9)
+        return marker
+
+    def _clip_front(self, text, max_tokens) -> str:
+        """text의 뒷부분을 max_tokens 이하로 남깁니다 (오래된 턴의 앞부분 생략)."""
+        tokens = self.estimator.estimate(text)
+        if tokens <= max_tokens:
+            return text
+        keep = int(len(text) * max_tokens / tokens)
+        while keep > 0:
+            clipped = CLIP_MARKER + text[len(text) - keep:]
+            if self.estimator.estimate(clipped) <= max_tokens:
+                return clipped
+            keep = int(keep * 0.9)
+        return CLIP_MARKER
+
+    def fit_setting(self, world_setting) -> str:
+        """세계관 설정을 PROMPT_SETTING_MAX_TOKENS 이하로 줄입니다."""
+        fitted = self.fit_text(world_setting, self.setting_max_tokens)
+        if fitted is not world_setting:
+            self._count("setting_trimmed")
+        return fitted
+
+    def _fixed_tokens(self, player_action_block, user_action, systems_text) -> int:
+        estimate = self.estimator.estimate
+        return (int(self._instructions_raw * self.estimator.calibration + 0.5) + estimate(player_action_block)
+                + estimate(user_action) + estimate(systems_text))
+
+    def history_budget(self, world_setting, player_action_block, player_action_text, active_systems) -> int:
+        """이번 턴 프롬프트에서 이야기 기억(렌더링된 히스토리)에 쓸 수 있는 토큰 수."""
+        fixed = self._fixed_tokens(player_action_block, player_action_text or "(선택지를 선택함)",
+                                   systems_list_text(active_systems))
+        return self.token_budget - fixed - self.estimator.estimate(self.fit_text(world_setting, self.setting_max_tokens))
+
+    def history_fits(self, memory, budget) -> bool:
+        return self.estimator.estimate(story_memory.render_history(memory)) <= budget
+
+    def build_continue_prompt(self, world_setting, memory, player_action_block, player_action_text, active_systems):
+        """
+        이어가기 프롬프트를 예산 안에서 조립합니다. memory는 바꾸지 않습니다.
+        (prompt, report)를 반환합니다. report: 구성 요소별 추정 토큰과 이번에 줄인 항목.
+        prompt_tokens는 턴마다 보내는 프롬프트, input_tokens는 시스템 지시문을 더한 모델 입력 전체입니다.
+        """
+        estimate = self.estimator.estimate
+        user_action = player_action_text if player_action_text else "(선택지를 선택함)"
+        systems_text = systems_list_text(active_systems)
+        setting = self.fit_text(world_setting, self.setting_max_tokens)
+        trimmed = story_memory.copy_memory(memory)
+        available = self.token_budget - self._fixed_tokens(player_action_block, user_action, systems_text)
+        report = {"trimmed": []}
+
+        def history_tokens():
+            return estimate(story_memory.render_history(trimmed))
+
+        def over():
+            return estimate(setting) + history_tokens() > available
+
+        if over():
+            self._count("over_budget")
+            if trimmed["arc"]:
+                trimmed["arc"] = ""
+                report["trimmed"].append("arc")
+                self._count("summaries_dropped")
+            while trimmed["chapters"] and over():
+                trimmed["chapters"].pop(0)
+                report["trimmed"].append("chapter")
+                self._count("summaries_dropped")
+            while len(trimmed["turns"]) > self.min_recent_turns and over():
+                trimmed["turns"].pop(0)
+                report["trimmed"].append("turn")
+                self._count("turns_dropped")
+            if over():
+                setting = self.fit_text(setting, max(self.setting_min_tokens, available - history_tokens()))
+                report["trimmed"].append("setting")
+            while trimmed["turns"] and over():
+                rest = history_tokens() - estimate(trimmed["turns"][0])
+                allowed = available - estimate(setting) - rest
+                if allowed >= _MIN_CLIPPED_TURN_TOKENS or len(trimmed["turns"]) == 1:
+                    trimmed["turns"][0] = self._clip_front(trimmed["turns"][0], max(allowed, 0))
+                    report["trimmed"].append("turn_clipped")
+                    self._count("turns_clipped")
+                    break
+                trimmed["turns"].pop(0)
+                report["trimmed"].append("turn")
+                self._count("turns_dropped")
+            if over():
+                self._count("still_over_budget") # 지시문/행동/시스템 목록만으로 예산을 넘음
+
+        prompt = DEFAULT_PROMPT_TEMPLATE.format(
+            world_setting_summary=setting,
+            story_summary=story_memory.render_history(trimmed) + player_action_block,
+            user_action=user_action,
+            current_systems_list_for_prompt=systems_text
+        )
+        prompt_tokens = estimate(prompt)
+        report.update(prompt_tokens=prompt_tokens, input_tokens=prompt_tokens + self._system_instruction_tokens(),
+                      setting_tokens=estimate(setting), history_tokens=history_tokens(), budget=self.token_budget)
+        with self._lock:
+            self._stats["built"] += 1
+            self._stats["prompt_tokens_sum"] += prompt_tokens
+            self._stats["prompt_tokens_max"] = max(self._stats["prompt_tokens_max"], prompt_tokens)
+        return prompt, report
+
+    def _system_instruction_tokens(self) -> int:
+        return int(self._system_instruction_raw * self.estimator.calibration + 0.5)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["prompt_tokens_avg"] = round(stats["prompt_tokens_sum"] / stats["built"]) if stats["built"] else 0
+        stats["system_instruction_tokens"] = self._system_instruction_tokens()
+        stats["estimator"] = self.estimator.stats()
+        return stats
+
+
+prompt_builder = PromptBuilder(
+    estimator=token_estimator,
+    token_budget=PROMPT_TOKEN_BUDGET,
+    setting_max_tokens=PROMPT_SETTING_MAX_TOKENS,
+    setting_min_tokens=PROMPT_SETTING_MIN_TOKENS,
+    min_recent_turns=PROMPT_MIN_RECENT_TURNS,
+)
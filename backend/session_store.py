@@ -0,0 +1,250 @@
+"""
+Bounded, thread-safe in-memory store for story session state.
+
+story_routes의 story_sessions_data를 대체합니다. LRU + 유휴 TTL로 세션을 퇴출하고,
+세션 상태의 대략적인 바이트 크기를 합산해 메모리 예산을 넘지 않도록 합니다.
+세션별 락(lock striping)으로 같은 세션의 동시 턴을 직렬화합니다.
+SESSION_SHARED_SQLITE_PATH가 설정되면 같은 호스트의 모든 워커가 공유하는 SQLite 파일을 2차 저장소로 사용합니다.
+"""
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from backend.config import SESSION_STORE_MAX_SESSIONS, SESSION_STORE_IDLE_TTL_SECONDS, SESSION_STORE_MAX_BYTES, SESSION_LOCK_STRIPES, SESSION_SHARED_SQLITE_PATH
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(obj) -> int:
+    """세션 상태의 대략적인 메모리 사용량(바이트)을 계산합니다. 문자열은 sys.getsizeof로 O(1) 측정합니다."""
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_size(item) for item in obj)
+    return sys.getsizeof(obj)
+
+
+class SQLiteSessionTier:
+    """
+    워커 프로세스 간에 세션 상태를 공유하는 SQLite 파일 저장소.
+    각 행은 쓰기 시각(time_ns) 기반 version을 가지며, 메모리 사본보다 새 버전이 있으면 다시 읽어옵니다.
+    프로세스 간 동시 쓰기는 마지막 쓰기가 우선합니다.
+    """
+    _CLEANUP_EVERY_WRITES = 200
+
+    def __init__(self, path, idle_ttl_seconds):
+        self.path = path
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS story_sessions ("
+                     "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL, state TEXT NOT NULL)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 연결은 스레드 간 공유하지 않고 스레드마다 하나씩 사용
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def version(self, session_id):
+        row = self._conn().execute("SELECT version FROM story_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, session_id):
+        """(state, version) 또는 None을 반환합니다."""
+        row = self._conn().execute("SELECT state, version, updated_at FROM story_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if not row:
+            return None
+        if self.idle_ttl_seconds > 0 and time.time() - row[2] > self.idle_ttl_seconds:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def save(self, session_id, state) -> int:
+        version = time.time_ns()
+        conn = self._conn()
+        conn.execute("INSERT INTO story_sessions (session_id, version, updated_at, state) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT(session_id) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at, state = excluded.state",
+                     (session_id, version, time.time(), json.dumps(state, ensure_ascii=False, default=str)))
+        self._writes += 1
+        if self.idle_ttl_seconds > 0 and self._writes % self._CLEANUP_EVERY_WRITES == 0:
+            conn.execute("DELETE FROM story_sessions WHERE updated_at < ?", (time.time() - self.idle_ttl_seconds,))
+        conn.commit()
+        return version
+
+    def delete(self, session_id):
+        conn = self._conn()
+        conn.execute("DELETE FROM story_sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+
+
+class SessionStore:
+    """
+    dict와 비슷하게 사용할 수 있는 세션 저장소 (in, [], get, pop).
+    get/[]으로 얻은 상태 dict를 수정한 뒤에는 store[session_id] = state로 다시 넣어야 크기가 재계산됩니다.
+    """
+    def __init__(self, max_sessions, idle_ttl_seconds, max_bytes, lock_stripes, shared_tier=None):
+        self.max_sessions = max_sessions
+        self.shared_tier = shared_tier
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_bytes = max_bytes
+        # session_id -> (state, size_bytes, last_access, version); 앞쪽일수록 오래 사용되지 않은 세션
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._session_locks = [threading.RLock() for _ in range(max(1, lock_stripes))]
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions_lru": 0, "evictions_idle": 0, "evictions_memory": 0,
+                       "shared_hits": 0, "shared_refreshes": 0, "shared_errors": 0}
+
+    def lock(self, session_id):
+        """같은 세션의 턴 처리를 직렬화하는 락을 반환합니다 (with store.lock(session_id): ...)."""
+        return self._session_locks[zlib.crc32(str(session_id).encode("utf-8")) % len(self._session_locks)]
+
+    def get(self, session_id, default=None):
+        return self._lookup(session_id, default, count=True)
+
+    def _lookup(self, session_id, default, count):
+        """count가 거짓이면 hits/misses에 집계하지 않습니다 (in 확인 뒤 get/[]으로 다시 읽어도 한 번만 집계)."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            now = time.monotonic()
+            if entry is not None and self._is_idle(entry, now):
+                self._remove(session_id)
+                self._stats["evictions_idle"] += 1
+                entry = None
+            if entry is not None:
+                state, size, _, version = entry
+                self._entries[session_id] = (state, size, now, version)
+                self._entries.move_to_end(session_id)
+        if self.shared_tier is not None:
+            state = self._read_shared_tier(session_id, entry)
+            if state is not None:
+                return state
+        with self._lock:
+            if entry is None:
+                if count:
+                    self._stats["misses"] += 1
+                return default
+            if count:
+                self._stats["hits"] += 1
+            return entry[0]
+
+    def _read_shared_tier(self, session_id, entry):
+        """공유 저장소에 메모리 사본보다 새 버전이 있으면 읽어 와서 메모리에 넣고 반환합니다."""
+        try:
+            if entry is not None:
+                shared_version = self.shared_tier.version(session_id)
+                if shared_version is None or shared_version <= entry[3]:
+                    return None
+            loaded = self.shared_tier.load(session_id)
+        except sqlite3.Error as e:
+            logger.exception("공유 세션 저장소 읽기 실패 (session_id=%s): %s", session_id, e)
+            with self._lock:
+                self._stats["shared_errors"] += 1
+            return None
+        if loaded is None:
+            return None
+        state, version = loaded
+        with self._lock:
+            self._stats["shared_refreshes" if entry is not None else "shared_hits"] += 1
+            self._put(session_id, state, version)
+        return state
+
+    def __getitem__(self, session_id):
+        state = self.get(session_id)
+        if state is None:
+            raise KeyError(session_id)
+        return state
+
+    def __contains__(self, session_id):
+        return self._lookup(session_id, None, count=False) is not None
+
+    def __setitem__(self, session_id, state):
+        version = 0
+        if self.shared_tier is not None:
+            try:
+                version = self.shared_tier.save(session_id, state)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.exception("공유 세션 저장소 쓰기 실패 (session_id=%s): %s", session_id, e)
+                with self._lock:
+                    self._stats["shared_errors"] += 1
+        with self._lock:
+            self._stats["sets"] += 1
+            self._put(session_id, state, version)
+
+    def _put(self, session_id, state, version):
+        size = estimate_size(state)
+        if session_id in self._entries:
+            self._remove(session_id)
+        self._entries[session_id] = (state, size, time.monotonic(), version)
+        self._total_bytes += size
+        self._evict()
+
+    def pop(self, session_id, default=None):
+        if self.shared_tier is not None:
+            try:
+                self.shared_tier.delete(session_id)
+            except sqlite3.Error as e:
+                logger.exception("공유 세션 저장소 삭제 실패 (session_id=%s): %s", session_id, e)
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return default
+            self._remove(session_id)
+            return entry[0]
+
+    def __delitem__(self, session_id):
+        if self.pop(session_id) is None:
+            raise KeyError(session_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._entries), "bytes": self._total_bytes,
+                    "max_sessions": self.max_sessions, "max_bytes": self.max_bytes,
+                    "shared_tier": self.shared_tier is not None, **self._stats}
+
+    def _is_idle(self, entry, now) -> bool:
+        return self.idle_ttl_seconds > 0 and now - entry[2] > self.idle_ttl_seconds
+
+    def _remove(self, session_id):
+        size = self._entries.pop(session_id)[1]
+        self._total_bytes -= size
+
+    def _evict(self):
+        now = time.monotonic()
+        # 가장 오래 사용되지 않은 쪽부터 유휴 세션 제거
+        while self._entries:
+            oldest_id, oldest_entry = next(iter(self._entries.items()))
+            if not self._is_idle(oldest_entry, now):
+                break
+            self._remove(oldest_id)
+            self._stats["evictions_idle"] += 1
+        while len(self._entries) > self.max_sessions:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions_lru"] += 1
+        # 메모리 예산 초과 시 LRU 순으로 제거 (방금 넣은 세션 하나는 남김)
+        while self.max_bytes > 0 and self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions_memory"] += 1
+
+
+story_session_store = SessionStore(
+    max_sessions=SESSION_STORE_MAX_SESSIONS,
+    idle_ttl_seconds=SESSION_STORE_IDLE_TTL_SECONDS,
+    max_bytes=SESSION_STORE_MAX_BYTES,
+    lock_stripes=SESSION_LOCK_STRIPES,
+    shared_tier=SQLiteSessionTier(SESSION_SHARED_SQLITE_PATH, SESSION_STORE_IDLE_TTL_SECONDS) if SESSION_SHARED_SQLITE_PATH else None,
+)
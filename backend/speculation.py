@@ -0,0 +1,209 @@
+"""
+Speculative pre-generation of the next story segment for offered choices (opt-in).
+
+턴 응답을 보낸 뒤 플레이어가 글을 읽는 동안, 제시한 선택지(상위 k개)마다 다음 이야기를 미리 생성해
+(session_id, turn, choice_id) 키로 보관합니다. 플레이어가 그 선택지를 고르면 바로 사용하고,
+같은 턴의 나머지 결과는 취소/폐기합니다. 직접 입력한 행동은 일반 생성으로 처리됩니다.
+사용자별/전체 동시 생성 수와 사용자별 시간당 호출 수로 API 비용을 제한합니다.
+"""
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from backend.config import (SPECULATION_ENABLED, SPECULATION_WORLD_IDS, SPECULATION_TOP_K, SPECULATION_MAX_WORKERS,
+                            SPECULATION_MAX_PER_USER, SPECULATION_MAX_GLOBAL, SPECULATION_USER_CALLS_PER_HOUR,
+                            SPECULATION_TTL_SECONDS, SPECULATION_MAX_WAIT_SECONDS)
+from backend.gemini_utils import call_gemini_api, STORYTELLER_SYSTEM_INSTRUCTION
+from backend.llm_resilience import detached_context, remaining_budget
+from backend.llm_scheduler import llm_call_context, PRIORITY_BACKGROUND
+
+
+class SpeculativeGenerator:
+    def __init__(self, generate_fn, enabled, world_ids, top_k, max_workers, max_per_user, max_global,
+                 user_calls_per_hour, ttl_seconds, max_wait_seconds):
+        self._generate_fn = generate_fn # prompt -> (story_part, choices)
+        self.enabled = enabled
+        self.world_ids = world_ids # 비어 있으면 모든 세계관
+        self.top_k = top_k
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self.max_global = max_global
+        self.user_calls_per_hour = user_calls_per_hour
+        self.ttl_seconds = ttl_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._executor = None
+        # (session_id, turn, choice_id) -> {'future', 'user_id', 'choice_text', 'created_at'}
+        self._entries = {}
+        self._user_calls = {} # user_id -> deque[monotonic]
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "hits": 0, "waited_hits": 0, "misses": 0, "free_text": 0,
+                       "cancelled": 0, "wait_timeouts": 0, "discarded": 0, "budget_rejected": 0, "errors": 0}
+
+    def is_enabled_for(self, world_id) -> bool:
+        return self.enabled and (not self.world_ids or str(world_id) in self.world_ids)
+
+    def submit_for_choices(self, session_id, turn, user_id, world_id, choices, build_prompt_fn):
+        """제시한 선택지 중 상위 k개의 다음 이야기를 백그라운드에서 생성합니다. build_prompt_fn(choice_text) -> prompt"""
+        if not self.is_enabled_for(world_id) or not choices:
+            return 0
+        submitted = 0
+        for choice in choices[:self.top_k]:
+            key = (str(session_id), int(turn), str(choice['id']))
+            with self._lock:
+                self._expire_locked()
+                if key in self._entries:
+                    continue
+                if not self._reserve_budget_locked(str(user_id)):
+                    self._stats["budget_rejected"] += 1
+                    break
+                if self._executor is None:
+                    # gunicorn fork 이후 워커 프로세스 안에서 스레드 풀을 만들도록 첫 사용 시점에 생성
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="speculation")
+                future = self._executor.submit(detached_context().run, self._generate, build_prompt_fn(choice['text']))
+                self._entries[key] = {'future': future, 'user_id': str(user_id), 'choice_text': choice['text'],
+                                      'created_at': time.monotonic()}
+                self._stats["submitted"] += 1
+                submitted += 1
+        return submitted
+
+    def take(self, session_id, turn, user_id, choice_id, action_text):
+        """
+        플레이어가 고른 선택지의 미리 생성된 결과 (story_part, choices)를 반환합니다. 없으면 None.
+        같은 세션의 다른 예측 결과는 모두 취소/폐기합니다.
+        생성 중인 결과는 max_wait_seconds와 요청 데드라인의 남은 시간 중 짧은 쪽까지만 기다리고, 넘으면 None (일반 생성).
+        """
+        if not self.enabled:
+            return None
+        entry = None
+        with self._lock:
+            if choice_id is None:
+                self._stats["free_text"] += 1
+            else:
+                candidate = self._entries.pop((str(session_id), int(turn), str(choice_id)), None)
+                # 선택지 텍스트까지 같아야 같은 행동으로 봄 (클라이언트가 보낸 action_text와 비교)
+                if candidate and candidate['user_id'] == str(user_id) and candidate['choice_text'] == action_text:
+                    entry = candidate
+            self._discard_session_locked(str(session_id))
+
+        if entry is None:
+            if choice_id is not None:
+                with self._lock:
+                    self._stats["misses"] += 1
+            return None
+
+        future = entry['future']
+        if not future.done() and not future.running():
+            # 아직 대기열에 있으면 기다리기보다 일반 생성이 빠름
+            future.cancel()
+            with self._lock:
+                self._stats["cancelled"] += 1
+                self._stats["misses"] += 1
+            return None
+        waited = not future.done()
+        # 예측 생성은 요청 데드라인 없이 백그라운드 우선순위로 돌기 때문에, 세션 락을 잡은 요청이 오래 기다리지 않도록 제한
+        wait_seconds = self.max_wait_seconds
+        budget = remaining_budget()
+        if budget is not None:
+            wait_seconds = max(0.0, min(wait_seconds, budget))
+        try:
+            result = future.result(timeout=wait_seconds)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats["wait_timeouts"] += 1
+                self._stats["misses"] += 1
+            return None
+        except Exception:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+            if waited:
+                self._stats["waited_hits"] += 1
+        return result
+
+    def discard_session(self, session_id):
+        with self._lock:
+            self._discard_session_locked(str(session_id))
+
+    def stats(self) -> dict:
+        with self._lock:
+            decided = self._stats["hits"] + self._stats["misses"]
+            return {"enabled": self.enabled, "entries": len(self._entries),
+                    "hit_rate": round(self._stats["hits"] / decided, 4) if decided else 0.0, **self._stats}
+
+    def render_prometheus(self) -> str:
+        """예측 생성 제출/적중/실패 횟수, 적중률, 보관 중인 결과 수 (Prometheus 텍스트 형식)."""
+        with self._lock:
+            lines = ["# HELP storydive_speculation_events_total Speculative pre-generation events by outcome.",
+                     "# TYPE storydive_speculation_events_total counter"]
+            for event in ("submitted", "hits", "waited_hits", "misses", "free_text", "cancelled", "wait_timeouts", "discarded",
+                          "budget_rejected", "errors"):
+                lines.append(f'storydive_speculation_events_total{{event="{event}"}} {self._stats[event]}')
+            decided = self._stats["hits"] + self._stats["misses"]
+            lines += ["# HELP storydive_speculation_hit_ratio Share of chosen offered choices served from a pre-generated result.",
+                      "# TYPE storydive_speculation_hit_ratio gauge",
+                      f"storydive_speculation_hit_ratio {self._stats['hits'] / decided if decided else 0.0:.4f}",
+                      "# HELP storydive_speculation_entries Pre-generated results currently held in this process.",
+                      "# TYPE storydive_speculation_entries gauge",
+                      f"storydive_speculation_entries {len(self._entries)}"]
+        return "\n".join(lines) + "\n"
+
+    def _generate(self, prompt):
+        try:
+            # 플레이어가 기다리는 호출보다 항상 뒤에 처리 (사용자 호출 한도에서도 차감하지 않음)
+            with llm_call_context(priority_floor=PRIORITY_BACKGROUND):
+                return self._generate_fn(prompt)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+
+    def _reserve_budget_locked(self, user_id) -> bool:
+        outstanding = [entry for entry in self._entries.values() if not entry['future'].done()]
+        if len(outstanding) >= self.max_global:
+            return False
+        if sum(1 for entry in outstanding if entry['user_id'] == user_id) >= self.max_per_user:
+            return False
+        calls = self._user_calls.setdefault(user_id, deque())
+        now = time.monotonic()
+        while calls and now - calls[0] > 3600:
+            calls.popleft()
+        if len(calls) >= self.user_calls_per_hour:
+            return False
+        calls.append(now)
+        return True
+
+    def _discard_session_locked(self, session_id):
+        for key in [key for key in self._entries if key[0] == session_id]:
+            entry = self._entries.pop(key)
+            if entry['future'].cancel():
+                self._stats["cancelled"] += 1
+            else:
+                self._stats["discarded"] += 1
+
+    def _expire_locked(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        for key in [key for key, entry in self._entries.items() if entry['created_at'] < deadline]:
+            entry = self._entries.pop(key)
+            entry['future'].cancel()
+            self._stats["discarded"] += 1
+        for user_id in [uid for uid, calls in self._user_calls.items() if not calls or time.monotonic() - calls[-1] > 3600]:
+            del self._user_calls[user_id]
+
+
+speculative_generator = SpeculativeGenerator(
+    # 오류/대체 응답을 결과로 저장하지 않도록 strict, 이어가기 턴과 같은 스토리텔러 시스템 지시문 사용
+    generate_fn=functools.partial(call_gemini_api, strict=True, system_instruction=STORYTELLER_SYSTEM_INSTRUCTION),
+    enabled=SPECULATION_ENABLED,
+    world_ids=SPECULATION_WORLD_IDS,
+    top_k=SPECULATION_TOP_K,
+    max_workers=SPECULATION_MAX_WORKERS,
+    max_per_user=SPECULATION_MAX_PER_USER,
+    max_global=SPECULATION_MAX_GLOBAL,
+    user_calls_per_hour=SPECULATION_USER_CALLS_PER_HOUR,
+    ttl_seconds=SPECULATION_TTL_SECONDS,
+    max_wait_seconds=SPECULATION_MAX_WAIT_SECONDS,
+)
@@ -0,0 +1,118 @@
+"""
+Hierarchical per-session story memory.
+
+세션의 이야기 기억을 세 단계로 나눠 보관합니다.
+- turns: 최근 턴 원문 (그대로 보존)
+- chapters: 오래된 턴 묶음을 한 번만 요약한 챕터 요약 (이후 다시 요약하지 않음)
+- arc: 챕터가 너무 많아지면 가장 오래된 챕터들을 합쳐 만든 전체 개요
+요약 대상은 항상 가장 오래된 원문 턴 묶음 또는 (개요 + 가장 오래된 챕터)뿐이므로,
+모험이 길어져도 한 번의 압축에 들어가는 입력 크기가 일정하게 유지됩니다.
+
+history 문자열(클라이언트/ongoing_adventures에 저장되는 값)은 render_history()로 만든 값이며,
+memory_from_history()로 다시 구조를 복원할 수 있습니다 (이전 형식의 "(이전 내용 요약됨)" 히스토리 포함).
+"""
+import re
+
+TURN_PREFIX = "플레이어의 행동:"
+SUMMARY_MARKER = "(이전 내용 요약됨)"
+ARC_HEADER = "[지난 이야기 개요]"
+_CHAPTER_HEADER_PATTERN = re.compile(r"^\[챕터 (\d+) 요약\]$", re.M)
+_TURN_SPLIT_PATTERN = re.compile(r"(?=^" + re.escape(TURN_PREFIX) + ")", re.M)
+
+
+def new_memory() -> dict:
+    return {"arc": "", "chapters": [], "turns": []}
+
+def copy_memory(memory: dict) -> dict:
+    return {"arc": memory.get("arc", ""), "chapters": list(memory.get("chapters", [])), "turns": list(memory.get("turns", []))}
+
+def get_memory(session_state: dict) -> dict:
+    """세션 상태의 기억 구조를 복사해 반환합니다. 아직 없으면 history 문자열에서 만듭니다."""
+    memory = session_state.get("memory")
+    if memory is None:
+        return memory_from_history(session_state.get("history", ""))
+    return copy_memory(memory)
+
+def split_turns(raw_history: str) -> list:
+    """원문 히스토리를 '플레이어의 행동:'으로 시작하는 턴 단위로 나눕니다. 첫 턴 앞부분(도입부)도 하나의 턴입니다."""
+    return [turn for turn in _TURN_SPLIT_PATTERN.split(raw_history) if turn.strip()]
+
+def memory_from_history(history: str) -> dict:
+    memory = new_memory()
+    if not history:
+        return memory
+    raw = history
+    if SUMMARY_MARKER in history:
+        summary_part, raw = history.rsplit(SUMMARY_MARKER, 1)
+        headers = list(_CHAPTER_HEADER_PATTERN.finditer(summary_part))
+        arc_text = summary_part[:headers[0].start()] if headers else summary_part
+        for i, header in enumerate(headers):
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(summary_part)
+            chapter_text = summary_part[header.end():end].strip()
+            if chapter_text:
+                memory["chapters"].append(chapter_text)
+        arc_text = arc_text.strip()
+        if arc_text.startswith(ARC_HEADER):
+            arc_text = arc_text[len(ARC_HEADER):].strip()
+        memory["arc"] = arc_text
+        raw = raw.lstrip("\n")
+    memory["turns"] = split_turns(raw)
+    return memory
+
+def render_history(memory: dict) -> str:
+    """기억 구조를 프롬프트/저장용 히스토리 문자열로 만듭니다."""
+    parts = []
+    if memory["arc"]:
+        parts.append(f"{ARC_HEADER}\n{memory['arc']}")
+    for i, chapter in enumerate(memory["chapters"], 1):
+        parts.append(f"[챕터 {i} 요약]\n{chapter}")
+    raw = "".join(memory["turns"])
+    if not parts:
+        return raw
+    return "\n\n".join(parts) + f"\n\n{SUMMARY_MARKER}\n\n" + raw
+
+def append_turn(memory: dict, turn_text: str):
+    memory["turns"].append(turn_text)
+
+def next_compaction(memory: dict, turns_per_chapter: int, keep_recent_turns: int, max_chapters: int, force: bool = False):
+    """
+    다음에 수행할 압축 작업을 반환합니다. 없으면 None.
+    ("arc", 현재 개요, 개요에 합칠 오래된 챕터들) 또는 ("chapter", 챕터로 요약할 가장 오래된 턴들)
+    force=True(하드 한도)이면 턴이 turns_per_chapter보다 적어도 최근 턴 하나만 남기고 요약합니다.
+    """
+    if len(memory["chapters"]) > max_chapters:
+        rolled = tuple(memory["chapters"][:len(memory["chapters"]) - max_chapters])
+        return ("arc", memory["arc"], rolled)
+    compactable = len(memory["turns"]) - (1 if force else keep_recent_turns)
+    if compactable >= turns_per_chapter:
+        return ("chapter", tuple(memory["turns"][:turns_per_chapter]))
+    if force and compactable > 0:
+        return ("chapter", tuple(memory["turns"][:compactable]))
+    if force and memory["chapters"]:
+        return ("arc", memory["arc"], tuple(memory["chapters"]))
+    return None
+
+def compaction_input(job) -> str:
+    """압축 작업의 요약 입력 텍스트를 만듭니다."""
+    if job[0] == "chapter":
+        return "".join(job[1])
+    arc, rolled = job[1], job[2]
+    return "\n\n".join(([f"{ARC_HEADER}\n{arc}"] if arc else []) + list(rolled))
+
+def apply_compaction(memory: dict, job, summary: str) -> bool:
+    """요약 결과를 적용합니다. 작업을 만든 이후 기억이 바뀌어 대상이 더 이상 맨 앞에 없으면 False."""
+    if not summary or not summary.strip():
+        return False
+    if job[0] == "chapter":
+        chunk = job[1]
+        if tuple(memory["turns"][:len(chunk)]) != chunk:
+            return False
+        memory["turns"] = memory["turns"][len(chunk):]
+        memory["chapters"].append(summary.strip())
+        return True
+    arc, rolled = job[1], job[2]
+    if memory["arc"] != arc or tuple(memory["chapters"][:len(rolled)]) != rolled:
+        return False
+    memory["arc"] = summary.strip()
+    memory["chapters"] = memory["chapters"][len(rolled):]
+    return True
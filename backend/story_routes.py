@@ -1,8 +1,10 @@
 """
 Routes for story progression (handling actions, loading stories).
 """
-from flask import Blueprint, request, jsonify, session, render_template
+from flask import Blueprint, request, jsonify, session, render_template, Response, stream_with_context, make_response
+import json
 import uuid
+import time
 import traceback
 import re # 정규식 사용을 위해 추가
 import logging # 로깅 모듈 추가
@@ -10,24 +12,38 @@ import logging # 로깅 모듈 추가
 # Absolute imports from the 'backend' package perspective
 from backend.auth_utils import get_user_and_token_from_request, get_current_user_id_from_request
 from backend.database import get_db_client, save_story_to_db, load_story_from_db, get_ongoing_adventure
-from backend.gemini_utils import call_gemini_api, DEFAULT_PROMPT_TEMPLATE, summarize_story_with_gemini, START_WITH_USER_POINT_PROMPT_TEMPLATE, START_WITH_USER_POINT_CHOICES_ONLY_PROMPT_TEMPLATE, generate_enhanced_ending_story, check_ending_conditions_with_llm
-from backend.config import GEMINI_API_KEY
-
-# 로거 설정
-logging.basicConfig(level=logging.DEBUG) # 로그 레벨 설정
+from backend.gemini_utils import call_gemini_api, stream_gemini_api, STORYTELLER_SYSTEM_INSTRUCTION, START_WITH_USER_POINT_PROMPT_TEMPLATE, START_WITH_USER_POINT_CHOICES_ONLY_PROMPT_TEMPLATE, generate_enhanced_ending_story, check_ending_conditions_with_llm, needs_llm_ending_check
+from backend.config import GEMINI_API_KEY, AUTOSAVE_WRITE_BEHIND_ENABLED, ENDING_CHECK_MAX_WAIT_SECONDS, LLM_REQUEST_DEADLINE_SECONDS
+from backend.autosave_queue import autosave_queue
+from backend.session_store import story_session_store
+from backend.world_cache import world_cache
+from backend.ending_checks import ending_checks
+from backend.story_summarizer import story_summarizer
+from backend.speculation import speculative_generator
+from backend.opening_pool import opening_pool
+from backend.llm_scheduler import llm_call_context, LLMAdmissionError
+from backend.llm_resilience import request_deadline
+from backend import story_memory
+from backend import tracing
+from backend.logging_setup import truncated
+from backend.token_accounting import usage_scope, bind_usage
+from backend.prompt_builder import prompt_builder
+
+# 로거 설정 (핸들러/레벨은 create_app의 configure_logging에서 한 번 설정)
 logger = logging.getLogger(__name__) # 로거 객체 생성
 
 story_bp = Blueprint('story_bp', __name__, url_prefix='/api')
 
-MAX_HISTORY_CHAR_LENGTH = 2800 # Gemini API 호출 전 히스토리 요약 트리거 길이
+_TRACED_ACTION_TYPES = {"start_new_adventure", "continue_adventure", "load_story", "generate_ending_story"}
+
 
-# 인메모리 스토리 세션 데이터 (프로덕션에서는 Redis 등으로 대체 고려)
+# 인메모리 스토리 세션 데이터 (LRU + 유휴 TTL + 메모리 예산으로 제한되는 세션 저장소)
 # 각 세션 ID를 키로, 값으로 {'history': "...", 'world_id': "...", 'world_title': "...", 'active_systems': {...}, 'system_configs': {...}} 등을 저장
-story_sessions_data = {}
+story_sessions_data = story_session_store
 
 # 시스템 업데이트 파싱 및 적용 함수
 def parse_and_apply_system_updates(text_with_updates, current_systems):
-    logger.debug(f"Parsing system updates from text: '{text_with_updates[:200]}...', current_systems: {current_systems}")
+    logger.debug("Parsing system updates from text: %s, current_systems: %s", truncated(text_with_updates), current_systems)
     
     # 수정된 정규식 패턴 (유연성 증가) - 백슬래시 없는 형태로 수정
     system_update_pattern_str = r'\[SYSTEM_UPDATE:\s*(?P<name>.+?)\s*(?P<operator>[+=-])\s*(?P<value>-?\d+(?:\.\d+)?)\s*\]'
@@ -47,7 +63,7 @@ def parse_and_apply_system_updates(text_with_updates, current_systems):
             logger.warning(f"Could not parse components from tag: '{full_tag_text}'. Regex group missing. Skipping.")
             return "" # 오류 발생 시 태그만 제거하고 원본 텍스트 유지 또는 빈 문자열 반환
         
-        logger.debug(f"Parsed tag: Name='{system_name_raw}', Op='{operator}', ValStr='{value_str}' from '{full_tag_text}'")
+        logger.debug("Parsed tag: Name='%s', Op='%s', ValStr='%s' from '%s'", system_name_raw, operator, value_str, full_tag_text)
         raw_updates_parsed.append({
             "name": system_name_raw,
             "operator": operator,
@@ -67,7 +83,7 @@ def parse_and_apply_system_updates(text_with_updates, current_systems):
                 # 시스템 변화량 일관성 검증 및 조정
                 normalized_value = normalize_system_change(system_name_raw, value_to_change, operator, original_value)
                 if normalized_value != value_to_change:
-                    logger.info(f"Normalized system change for '{system_name_raw}': {value_to_change} -> {normalized_value}")
+                    logger.info("Normalized system change for '%s': %s -> %s", system_name_raw, value_to_change, normalized_value)
                     value_to_change = normalized_value
                 
                 new_value = original_value
@@ -83,7 +99,7 @@ def parse_and_apply_system_updates(text_with_updates, current_systems):
                 
                 systems_to_update[system_name_raw] = new_value
                 updates_applied_summary[system_name_raw] = new_value
-                logger.info(f"System '{system_name_raw}' updated from {original_value} to {new_value} based on tag: {full_tag_text}")
+                logger.info("System '%s' updated from %s to %s based on tag: %s", system_name_raw, original_value, new_value, full_tag_text)
             except ValueError:
                 logger.warning(f"Invalid numeric value '{value_str}' in tag '{full_tag_text}'. Update skipped.")
             except Exception as e:
@@ -98,7 +114,7 @@ def parse_and_apply_system_updates(text_with_updates, current_systems):
         # compiled_pattern = re.compile(system_update_pattern_str, re.DEBUG)
         # cleaned_story = compiled_pattern.sub(apply_change_and_remove_tag, text_with_updates)
         cleaned_story = re.sub(system_update_pattern_str, apply_change_and_remove_tag, text_with_updates)
-        logger.debug(f"Regex substitution completed. Cleaned story (first 100 chars): '{cleaned_story[:100]}...'")
+        logger.debug("Regex substitution completed. Cleaned story: %s", truncated(cleaned_story, 100))
     except re.error as e:
         logger.error(f"Regex pattern error: {e} for pattern: {system_update_pattern_str}")
         # 패턴 오류 시, 원본 텍스트를 반환하고 시스템 업데이트는 없도록 처리
@@ -110,7 +126,7 @@ def parse_and_apply_system_updates(text_with_updates, current_systems):
         cleaned_story = text_with_updates
         systems_to_update = current_systems.copy() if current_systems is not None else {}
 
-    logger.debug(f"Final active_systems after updates: {systems_to_update}")
+    logger.debug("Final active_systems after updates: %s", systems_to_update)
     return systems_to_update, {
         "cleaned_story": cleaned_story.strip(),
         "updates_applied": updates_applied_summary,
@@ -149,29 +165,451 @@ def normalize_system_change(system_name, change_value, operator, current_value):
     # 변화량이 너무 작으면 조정
     if abs_change < min_change and abs_change > 0:
         normalized_change = min_change
-        logger.info(f"Increased change for '{system_name}' from {abs_change} to {normalized_change} (minimum threshold)")
+        logger.info("Increased change for '%s' from %s to %s (minimum threshold)", system_name, abs_change, normalized_change)
     # 변화량이 너무 크면 제한 (선택적)
     elif abs_change > min_change * 10:
         normalized_change = min_change * 8  # 최대 8배까지
-        logger.info(f"Reduced change for '{system_name}' from {abs_change} to {normalized_change} (maximum threshold)")
+        logger.info("Reduced change for '%s' from %s to %s (maximum threshold)", system_name, abs_change, normalized_change)
     else:
         normalized_change = abs_change
     
     # 원래 부호 유지
     return normalized_change if change_value >= 0 else -normalized_change
 
+def _rehydrate_session_from_db(session_id, user_id, user_jwt, db_client):
+    """
+    ongoing_adventures에 저장된 모험으로 세션 상태를 복원해 story_sessions_data에 넣습니다.
+    다른 워커가 처리했거나 콜드 스타트/퇴출로 메모리에 세션이 없을 때 사용합니다.
+    (session_state, loaded_adventure)를 반환하며, 찾지 못하면 (None, None)입니다.
+    """
+    if not session_id:
+        return None, None
+    with tracing.span("db_load"):
+        if AUTOSAVE_WRITE_BEHIND_ENABLED:
+            autosave_queue.flush_session(session_id, user_id, user_jwt)
+        loaded_adventure = get_ongoing_adventure(session_id=session_id, user_id=user_id, user_jwt=user_jwt)
+    if not loaded_adventure:
+        return None, None
+
+    # 세계관 ID로부터 엔딩 정보를 조회 (캐시)
+    world_id = loaded_adventure.get("world_id")
+    with tracing.span("world_fetch"):
+        world_row = world_cache.get_world(world_id, user_id, db_client)
+    world_endings = (world_row.get('endings') or []) if world_row else []
+
+    session_state = {
+        "history": loaded_adventure.get("history", ""),
+        "last_ai_response": loaded_adventure.get("last_ai_response", ""),
+        "last_choices": loaded_adventure.get("last_choices", []),
+        "world_id": str(world_id) if world_id else None,
+        "world_title": loaded_adventure.get("world_title", "불러온 모험"),
+        "active_systems": loaded_adventure.get("active_systems", {}),
+        "system_configs": loaded_adventure.get("system_configs", {}),
+        "world_endings": world_endings,
+        "user_id": user_id,
+        "token_usage": loaded_adventure.get("token_usage") or {}, # 이 모험의 누적 Gemini 토큰 사용량
+        "turn": int(loaded_adventure.get("turn") or 0) # 턴 번호를 이어서 매김 (엔딩 판정 키가 이전 턴과 겹치지 않도록)
+    }
+    story_sessions_data[session_id] = session_state
+    return session_state, loaded_adventure
+
+def _player_action_block(player_action_text):
+    if player_action_text:
+        return f"{story_memory.TURN_PREFIX} {player_action_text}\n\n"
+    return f"{story_memory.TURN_PREFIX} (선택지를 선택함 - 텍스트 없음)\n\n"
+
+def _build_continue_prompt(world_setting, memory, player_action_text, active_systems):
+    # Gemini API 호출 시에는 현재 시스템 상태를 전달 (아직 AI 응답 전이므로 이전 턴의 시스템 상태)
+    # 세계관 설정/요약/최근 턴을 토큰 예산(PROMPT_TOKEN_BUDGET) 안에서 배분
+    prompt, report = prompt_builder.build_continue_prompt(world_setting, memory, _player_action_block(player_action_text),
+                                                          player_action_text, active_systems)
+    if report["trimmed"]:
+        logger.debug("Prompt trimmed to budget: %s", report)
+    return prompt
+
+def _prepare_continue_turn(data, session_id, user_id, user_jwt, db_client):
+    """
+    continue_adventure 턴의 세션 상태를 확인하고 Gemini 프롬프트를 만듭니다.
+    (turn, None) 또는 (None, (error_response, status_code))를 반환합니다.
+    """
+    session_state = story_sessions_data.get(session_id)
+    if session_state and session_state.get('user_id') and session_state.get('user_id') != user_id:
+        return None, ({"error": "이 모험에 접근할 권한이 없습니다."}, 403)
+    if not session_state:
+        # 메모리에 없으면 (다른 워커, 재시작, 퇴출) DB에 저장된 모험에서 복원
+        logger.debug("session %s not in memory, rehydrating from ongoing_adventures", session_id)
+        session_state, _ = _rehydrate_session_from_db(session_id, user_id, user_jwt, db_client)
+    if not session_state or not session_state.get('world_id'):
+        return None, ({"error": "잘못된 세션이거나, 아직 시작되지 않은 모험입니다. 먼저 모험을 시작해주세요."}, 400)
+    # 이 턴과 이 턴이 시작한 백그라운드 호출(요약, 엔딩 판정, 예측 생성)의 토큰을 이 세션/세계관으로 집계
+    bind_usage(world_id=session_state.get('world_id'), session_usage=session_state.setdefault('token_usage', {}))
+
+    player_action_text = data.get('action_text') # 사용자가 선택한 선택지의 텍스트 (시스템 태그 없음)
+    current_active_systems = session_state.get('active_systems', {})
+    world_id_for_setting_cont = session_state.get('world_id')
+    world_title_for_response = session_state.get('world_title', '알 수 없는 세계관')
+    world_system_configs = session_state.get('system_configs', {})
+    world_endings = session_state.get('world_endings', [])
+
+    # 계층형 이야기 기억 (최근 턴 원문 / 챕터 요약 / 전체 개요). 턴이 끝날 때 세션 상태에 반영합니다.
+    story_memory_state = story_memory.get_memory(session_state)
+    # 지난 턴 이후 백그라운드 압축이 끝났다면 기억에 적용
+    if story_summarizer.take_ready(session_id, story_memory_state):
+        logger.debug(f"Applied background memory compaction for session {session_id}")
+
+    # AI에게 다음 스토리 생성을 요청하기 위한 세계관 설정 (retrieved_world_setting_cont)
+    retrieved_world_setting_cont = "이 세계관의 설정" # 기본값
+    with tracing.span("world_fetch"):
+        world_row_cont = world_cache.get_world(world_id_for_setting_cont, user_id, db_client)
+    if world_row_cont and world_row_cont.get('setting'):
+        # 설정 길이와 무관하게 프롬프트 크기가 일정하도록 배정된 토큰까지만 사용 (요약/예측 생성에도 같은 값)
+        retrieved_world_setting_cont = prompt_builder.fit_setting(world_row_cont.get('setting'))
+    else:
+        logger.warning(f"World setting not found for world_id {world_id_for_setting_cont}")
+
+    player_action_block = _player_action_block(player_action_text)
+
+    history_budget = prompt_builder.history_budget(retrieved_world_setting_cont, player_action_block, player_action_text,
+                                                   current_active_systems)
+    if not prompt_builder.history_fits(story_memory_state, history_budget):
+        # 하드 한도: 백그라운드 압축을 기다리거나 (없으면) 가장 오래된 턴 묶음만 여기서 요약
+        logger.debug(f"Compacting story memory at hard ceiling for session {session_id}")
+        with tracing.span("summarize"):
+            story_summarizer.compact_blocking(session_id, story_memory_state, retrieved_world_setting_cont,
+                                              fits=lambda memory: prompt_builder.history_fits(memory, history_budget))
+    current_story_history = story_memory.render_history(story_memory_state) + player_action_block
+    logger.debug("Story memory for session %s: %d chapters, %d raw turns, %d chars", session_id,
+                 len(story_memory_state['chapters']), len(story_memory_state['turns']), len(current_story_history))
+
+    with tracing.span("prompt_build"):
+        prompt_to_gemini = _build_continue_prompt(retrieved_world_setting_cont, story_memory_state, player_action_text, current_active_systems)
+    logger.debug("Prompt for continue_adventure for session %s: %s", session_id, truncated(prompt_to_gemini, 300))
+
+    turn = {
+        'session_state': session_state,
+        'history': current_story_history,
+        'active_systems': current_active_systems,
+        'system_configs': world_system_configs,
+        'world_endings': world_endings,
+        'user_id': user_id,
+        'world_setting': retrieved_world_setting_cont,
+        'memory': story_memory_state,
+        'player_action_block': player_action_block,
+        'prompt': prompt_to_gemini,
+        # 이 행동이 고른 선택지가 제시된 턴 번호와 선택지 ID (예측 생성 결과 조회용, 직접 입력이면 None)
+        'offered_turn': session_state.get('turn', 0),
+        'choice_id': data.get('choice_id'),
+        'action_text': player_action_text
+    }
+    return turn, None
+
+def _continue_turn_error(session_id, turn, e):
+    if isinstance(e, LLMAdmissionError):
+        # 대기열/사용자 호출 한도 초과: 서버 오류가 아니므로 잠시 후 다시 시도하도록 429로 응답
+        logger.warning(f"Gemini call not admitted for session {session_id}: {e}")
+        return {
+            "error": "요청이 많아 AI 응답을 바로 생성할 수 없습니다. 잠시 후 다시 시도해주세요.",
+            "choices": [],
+            "context": {'history': turn['history']},
+            'active_systems': turn['session_state'].get('active_systems', turn['active_systems']),
+            'system_configs': turn['system_configs'],
+            'world_endings': turn['world_endings']
+        }, 429
+    logger.error(f"Error during Gemini call or system update parsing for session {session_id}: {str(e)}")
+    logger.error(traceback.format_exc())
+    response_data = {
+        "error": f"AI 응답 처리 중 오류 발생: {str(e)}",
+        "new_story_segment": "AI 응답을 처리하는 중 문제가 발생했습니다. 잠시 후 다시 시도해주세요.",
+        "choices": [], 
+        "context": {'history': turn['history']},
+        'active_systems': turn['session_state'].get('active_systems', turn['active_systems']), # 오류 발생 시점의 (업데이트 시도 전 또는 후의) 시스템 상태
+        'system_configs': turn['system_configs'],
+        'world_endings': turn['world_endings']
+    }
+    return response_data, 500
+
+def _finish_continue_turn(session_id, turn, generated_story_part, choices_from_ai):
+    """
+    Gemini 응답에서 시스템 변경을 반영하고 세션 상태를 갱신한 뒤 (response_data, status_code)를 반환합니다.
+    호출자는 story_sessions_data.lock(session_id)를 잡은 상태여야 합니다.
+    """
+    session_state = turn['session_state']
+    current_story_history = turn['history']
+    current_active_systems = turn['active_systems']
+    world_system_configs = turn['system_configs']
+    world_endings = turn['world_endings']
+    updates_applied_from_story = {}
+
+    try:
+        logger.debug("Gemini response for session %s:\nStory part: %s\nChoices: %s", session_id, truncated(generated_story_part), truncated(choices_from_ai))
+
+        # AI가 생성한 스토리 본문(generated_story_part)에서 시스템 업데이트 태그를 파싱하고 시스템 값을 업데이트합니다.
+        # current_active_systems는 이 함수 호출 전에 이미 플레이어의 이전 행동에 의해 업데이트되었을 수 있으므로,
+        # AI 응답에 의한 추가적인 변경을 여기에 반영합니다.
+        if generated_story_part:
+            logger.debug("Applying system updates FROM AI STORY TEXT for session %s. Systems BEFORE this AI response: %s", session_id, current_active_systems)
+            
+            # parse_and_apply_system_updates는 (업데이트된 시스템 dict, 파싱 정보 dict)를 반환합니다.
+            # 여기서 current_active_systems.copy()를 전달하여 원본 불변성을 유지합니다.
+            with tracing.span("parse"):
+                processed_systems_after_ai_story, story_parse_info = parse_and_apply_system_updates(generated_story_part, current_active_systems.copy())
+            
+            cleaned_generated_story_part = story_parse_info.get("cleaned_story", generated_story_part) # 태그 제거된 스토리 본문
+            updates_applied_from_story = story_parse_info.get("updates_applied", {})
+            
+            if updates_applied_from_story: # AI 스토리 본문에 의해 실제로 시스템 변경이 있었다면
+                current_active_systems = processed_systems_after_ai_story # 현재 active_systems를 AI 본문에 의한 변경으로 업데이트
+                session_state['active_systems'] = current_active_systems
+                logger.info("Systems updated based on AI story text for session %s. Applied: %s", session_id, updates_applied_from_story)
+            else:
+                logger.debug("No system updates found or applied from AI story text for session %s.", session_id)
+            logger.debug("Cleaned story part after AI response processing: %s", truncated(cleaned_generated_story_part))
+        else:
+            cleaned_generated_story_part = "" # AI 응답이 비었을 경우
+        
+        # 선택지 처리: AI가 프롬프트 지시를 따라 선택지에는 태그를 포함하지 않을 것으로 예상합니다.
+        # 만약 포함 가능성을 대비하려면, 여기서 각 choice['text']에 대해서도 태그 제거 로직을 추가할 수 있습니다.
+        # (단, 이때는 시스템 값을 변경하지 않고 텍스트만 정제해야 함)
+        processed_choices_for_client = []
+        if choices_from_ai:
+            for choice_item in choices_from_ai:
+                # 간단히 태그 제거 (시스템 값 변경 X)
+                _, choice_parse_info = parse_and_apply_system_updates(choice_item['text'], {})
+                cleaned_choice_text = choice_parse_info.get("cleaned_story", choice_item['text'])
+                processed_choices_for_client.append({
+                    "id": choice_item['id'],
+                    "text": cleaned_choice_text 
+                    # "original_text_with_tags": choice_item['text'] # 이전 로직, 이제 불필요
+                })
+        else:
+             processed_choices_for_client = []
+
+    except Exception as e:
+        return _continue_turn_error(session_id, turn, e)
+
+    story_memory_state = turn['memory']
+    story_memory.append_turn(story_memory_state, turn['player_action_block'] + f"AI 응답: {cleaned_generated_story_part}\n\n")
+    current_story_history = story_memory.render_history(story_memory_state)
+    session_state['memory'] = story_memory_state
+    session_state['history'] = current_story_history
+    session_state['last_choices'] = processed_choices_for_client # AI가 생성한 (태그 없는) 선택지 그대로 저장
+    session_state['last_ai_response'] = cleaned_generated_story_part
+    turn_number = session_state.get('turn', 0) + 1
+    session_state['turn'] = turn_number
+    story_sessions_data[session_id] = session_state # 변경된 상태를 다시 넣어 저장소의 크기 계산을 갱신
+    # 소프트 워터마크를 넘었으면 다음 턴 전에 요약이 준비되도록 백그라운드에서 시작
+    story_summarizer.maybe_start(session_id, story_memory.copy_memory(story_memory_state), turn['world_setting'])
+    
+    # 엔딩 조건 체크 (LLM 사용): 응답을 지연시키지 않도록 백그라운드에서 실행하고,
+    # 결과는 턴 번호로 조회합니다 (/action/ending 폴링 또는 스트리밍의 ending 이벤트).
+    ending_check = None
+    if world_endings and cleaned_generated_story_part and needs_llm_ending_check(world_endings):
+        logger.debug(f"Submitting background ending check for session {session_id}, turn {turn_number}")
+        with tracing.span("ending_check_submit"): # 판정 자체는 백그라운드에서 "ending_check" 단계로 기록
+            ending_checks.submit(
+                session_id, turn_number, turn['user_id'], check_ending_conditions_with_llm,
+                story_content=cleaned_generated_story_part,
+                story_history=current_story_history,
+                world_endings=world_endings,
+                active_systems=current_active_systems
+            )
+        ending_check = {"status": "pending", "turn": turn_number}
+
+    # 예측 생성(옵트인): 플레이어가 읽는 동안 제시한 선택지의 다음 이야기를 미리 만들어 둠
+    world_id = session_state.get('world_id')
+    if processed_choices_for_client and speculative_generator.is_enabled_for(world_id):
+        speculation_memory = story_memory.copy_memory(story_memory_state)
+        speculation_systems = dict(current_active_systems)
+        speculation_setting = turn['world_setting']
+
+        def build_speculative_prompt(choice_text):
+            return _build_continue_prompt(speculation_setting, speculation_memory, choice_text, speculation_systems)
+
+        speculative_generator.submit_for_choices(session_id, turn_number, turn['user_id'], world_id,
+                                                 processed_choices_for_client, build_speculative_prompt)
+    
+    response_data = {
+        'new_story_segment': cleaned_generated_story_part,
+        'choices': processed_choices_for_client, 
+        'context': {'history': current_story_history},
+        'active_systems': current_active_systems, # 최종적으로 업데이트된 (또는 변경 없는) 시스템 상태
+        'system_configs': world_system_configs,
+        'world_endings': world_endings,
+        'system_updates_applied': updates_applied_from_story, # 이번 AI 응답으로 적용된 시스템 변경
+        'turn': turn_number,
+        'triggered_ending': None, # LLM 엔딩 판정은 ending_check의 턴 번호로 따로 조회
+        'ending_check': ending_check
+    }
+    logger.debug("Data being sent to client for session %s: %s", session_id, truncated(response_data)) # 최종 응답 데이터 로깅 (history 등은 잘라서)
+    return response_data, 200
+
+def _take_speculative_result(session_id, turn):
+    """고른 선택지에 대해 미리 생성된 (story_part, choices)가 있으면 반환하고, 같은 턴의 나머지 예측은 폐기합니다."""
+    speculative_result = speculative_generator.take(session_id, turn['offered_turn'], turn['user_id'],
+                                                    turn['choice_id'], turn['action_text'])
+    if speculative_result:
+        logger.debug(f"Serving speculative continuation for session {session_id}, choice {turn['choice_id']}")
+    return speculative_result
+
+def _continue_adventure_turn(data, session_id, user_id, user_jwt, db_client):
+    """
+    continue_adventure 한 턴을 처리하고 (response_data, status_code)를 반환합니다.
+    호출자는 story_sessions_data.lock(session_id)를 잡은 상태여야 합니다.
+    """
+    turn, error = _prepare_continue_turn(data, session_id, user_id, user_jwt, db_client)
+    if error:
+        return error
+    try:
+        speculative_result = _take_speculative_result(session_id, turn)
+        if speculative_result:
+            generated_story_part, choices_from_ai = speculative_result
+        else:
+            generated_story_part, choices_from_ai = call_gemini_api(turn['prompt'], system_instruction=STORYTELLER_SYSTEM_INSTRUCTION)
+    except Exception as e:
+        return _continue_turn_error(session_id, turn, e)
+    return _finish_continue_turn(session_id, turn, generated_story_part, choices_from_ai)
+
+def _sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+@story_bp.route('/action/stream', methods=['POST'])
+def handle_action_stream():
+    """
+    continue_adventure의 스트리밍 버전 (Server-Sent Events).
+    Gemini가 토큰을 생성하는 동안 delta 이벤트로 태그를 제거한 스토리 본문 조각을 보내고,
+    끝나면 choices / systems 이벤트와 /action과 같은 형태의 전체 응답(final)을 보내고,
+    LLM 엔딩 판정이 있으면 판정이 끝난 뒤 같은 연결로 ending 이벤트를 보냅니다.
+    스트림의 단계별 시간은 final 이벤트까지 재서 /metrics에만 반영합니다 (헤더는 이미 보낸 뒤이므로).
+    """
+    trace = tracing.new_trace("continue_adventure_stream")
+    with tracing.activate(trace):
+        response = make_response(_handle_action_stream(trace))
+    if not response.is_streamed: # 스트림을 시작하기 전의 오류 응답
+        tracing.finish_response(trace, response)
+    return response
+
+def _handle_action_stream(trace):
+    with tracing.span("auth"):
+        current_user, user_jwt = get_user_and_token_from_request(request)
+    if not current_user or not user_jwt:
+        return jsonify({"error": "인증되지 않은 사용자이거나 토큰이 없습니다."}), 401
+    user_id_from_token = str(current_user.id)
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "요청 본문이 비어있거나 JSON 형식이 아닙니다."}), 400
+    if data.get('action_type', 'continue_adventure') != 'continue_adventure':
+        return jsonify({"error": "스트리밍은 continue_adventure만 지원합니다. 다른 액션은 /api/action을 사용하세요."}), 400
+
+    session_id = data.get('session_id')
+    if not session_id:
+        return jsonify({"error": "세션 ID가 제공되지 않았습니다."}), 400
+    if not data.get('world_key'):
+        return jsonify({"error": "continue_adventure 시 세계관 ID(world_key)가 제공되지 않았습니다."}), 400
+
+    db_client_instance = get_db_client(user_jwt=user_jwt)
+    if not db_client_instance:
+        return jsonify({"error": "데이터베이스 사용자 세션 연결에 실패했습니다."}), 500
+
+    def generate():
+        # 턴이 끝날 때까지 세션 락을 유지합니다. 클라이언트가 연결을 끊으면 세션 상태는 갱신되지 않습니다.
+        # 데드라인은 스트림이 실제로 시작될 때부터 계산합니다.
+        with tracing.activate(trace), llm_call_context(user_id=user_id_from_token), usage_scope(session_id=session_id), \
+                request_deadline(LLM_REQUEST_DEADLINE_SECONDS), story_sessions_data.lock(session_id):
+            turn, error = _prepare_continue_turn(data, session_id, user_id_from_token, user_jwt, db_client_instance)
+            if error:
+                error_response, status_code = error
+                if trace:
+                    trace.finish(status_code)
+                yield _sse_event("error", {**error_response, "status": status_code})
+                return
+
+            final_event = None
+            try:
+                speculative_result = _take_speculative_result(session_id, turn)
+                if speculative_result:
+                    # 미리 생성된 결과는 태그를 제거한 본문을 한 번에 보냄
+                    _, speculative_parse_info = parse_and_apply_system_updates(speculative_result[0] or "", {})
+                    events = [("delta", speculative_parse_info.get("cleaned_story", "")), ("final", *speculative_result)]
+                else:
+                    events = stream_gemini_api(turn['prompt'], system_instruction=STORYTELLER_SYSTEM_INSTRUCTION)
+                stream_started = time.perf_counter()
+                first_delta_recorded = False
+                for event in events:
+                    if event[0] == "delta":
+                        if not first_delta_recorded:
+                            tracing.record("llm_first_delta", time.perf_counter() - stream_started)
+                            first_delta_recorded = True
+                        yield _sse_event("delta", {"text": event[1]})
+                    else:
+                        final_event = event
+                tracing.record("llm_stream", time.perf_counter() - stream_started)
+                response_data, status_code = _finish_continue_turn(session_id, turn, final_event[1], final_event[2])
+            except Exception as e:
+                response_data, status_code = _continue_turn_error(session_id, turn, e)
+            if trace:
+                trace.finish(status_code)
+
+        if status_code != 200:
+            yield _sse_event("error", {**response_data, "status": status_code})
+            return
+        yield _sse_event("choices", {"choices": response_data['choices']})
+        yield _sse_event("systems", {"active_systems": response_data['active_systems'],
+                                     "updates_applied": response_data['system_updates_applied']})
+        yield _sse_event("final", response_data)
+
+        # 엔딩 판정은 세션 락을 놓은 뒤 기다려서, 다음 턴을 막지 않습니다.
+        ending_check = response_data.get('ending_check')
+        if ending_check:
+            verdict = ending_checks.result(session_id, ending_check['turn'], user_id_from_token, wait_seconds=ENDING_CHECK_MAX_WAIT_SECONDS)
+            yield _sse_event("ending", verdict)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # 프록시 버퍼링 방지
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+@story_bp.route('/action/ending', methods=['GET'])
+def get_ending_check():
+    """
+    continue_adventure 응답의 ending_check에 대한 LLM 엔딩 판정 결과를 조회합니다.
+    쿼리: session_id, turn, wait(선택, 초 단위 롱 폴링; ENDING_CHECK_MAX_WAIT_SECONDS로 제한)
+    """
+    current_user, user_jwt = get_user_and_token_from_request(request)
+    if not current_user or not user_jwt:
+        return jsonify({"error": "인증되지 않은 사용자이거나 토큰이 없습니다."}), 401
+
+    session_id = request.args.get('session_id')
+    turn = request.args.get('turn', type=int)
+    if not session_id or turn is None:
+        return jsonify({"error": "session_id와 turn이 필요합니다."}), 400
+    wait_seconds = min(max(request.args.get('wait', default=0.0, type=float), 0.0), ENDING_CHECK_MAX_WAIT_SECONDS)
+
+    return jsonify(ending_checks.result(session_id, turn, str(current_user.id), wait_seconds=wait_seconds)), 200
+
 @story_bp.route('/action', methods=['POST'])
 def handle_action():
-    current_user, user_jwt = get_user_and_token_from_request(request)
+    # 단계별 시간(인증, 세계관 조회, 요약, Gemini 시도, 파싱, 엔딩 판정, 직렬화)을 재서 Server-Timing 헤더와 /metrics에 반영
+    with tracing.start_trace() as trace:
+        response = make_response(_authenticated_handle_action())
+    return tracing.finish_response(trace, response)
+
+def _authenticated_handle_action():
+    with tracing.span("auth"):
+        current_user, user_jwt = get_user_and_token_from_request(request)
     if not current_user or not user_jwt:
         return jsonify({"error": "인증되지 않은 사용자이거나 토큰이 없습니다."}), 401
-    user_id_from_token = str(current_user.id)
+    # 이 요청이 시작한 Gemini 호출(백그라운드 작업 포함)을 이 사용자의 호출 한도로 계산하고,
+    # 요청 안에서 기다리는 호출 전체를 LLM_REQUEST_DEADLINE_SECONDS 안에 끝냄. 토큰 사용량은 세션/세계관이 정해지면 bind_usage로 연결
+    with llm_call_context(user_id=str(current_user.id)), request_deadline(LLM_REQUEST_DEADLINE_SECONDS), usage_scope():
+        return _handle_action(str(current_user.id), user_jwt)
 
+def _handle_action(user_id_from_token, user_jwt):
     data = request.get_json()
     if not data:
         return jsonify({"error": "요청 본문이 비어있거나 JSON 형식이 아닙니다."}), 400
 
     action_type = data.get('action_type')
+    # 히스토그램 라벨 수가 늘어나지 않도록 알려진 액션 종류만 그대로 씀
+    tracing.set_action(action_type if action_type in _TRACED_ACTION_TYPES else "unknown")
     player_action = data.get('action_text')
     current_story_history = data.get('current_story_history', '')
     session_id = data.get('session_id')
@@ -181,13 +619,14 @@ def handle_action():
 
     if not session_id:
         return jsonify({"error": "세션 ID가 제공되지 않았습니다."}), 400
+    bind_usage(session_id=session_id)
     
     if action_type in ["start_new_adventure", "continue_adventure"] and not world_key:
         return jsonify({"error": f"{action_type} 시 세계관 ID(world_key)가 제공되지 않았습니다."}), 400
 
     db_client_instance = get_db_client(user_jwt=user_jwt)
     if not db_client_instance:
-        print("Failed to get DB client for user for story action.")
+        logger.error("Failed to get DB client for user for story action.")
         return jsonify({"error": "데이터베이스 사용자 세션 연결에 실패했습니다."}), 500
         
     newly_generated_story_segment = ""
@@ -198,19 +637,20 @@ def handle_action():
     response_data = {} # 함수 시작 시 response_data 초기화
 
     if action_type == "start_new_adventure":
-        print(f"[DEBUG starting_point] 'start_new_adventure' action initiated for world_id: {world_key}")
+        logger.debug("[starting_point] 'start_new_adventure' action initiated for world_id: %s", world_key)
         world_setting_text = ""
         user_defined_starting_point = None
         world_title_for_response = "알 수 없는 세계관"
         current_active_systems = {} # Initialize here
         world_system_configs = {} # Initialize here
+        token_usage = {} # 새 모험의 누적 Gemini 토큰 사용량 (첫 장면 생성부터)
         
         try:
-            # DB에서 사용자 세계관 조회 시 starting_point 포함
-            world_response = db_client_instance.table("worlds").select("title, setting, starting_point, id, systems, system_configs, endings").eq("id", world_key).maybe_single().execute()
+            # 세계관 캐시에서 조회 (starting_point, systems, system_configs, endings 포함)
+            with tracing.span("world_fetch"):
+                world_data_from_db = world_cache.get_world(world_key, user_id_from_token, db_client_instance)
             
-            if world_response and hasattr(world_response, 'data') and world_response.data:
-                world_data_from_db = world_response.data
+            if world_data_from_db:
                 world_setting_text = world_data_from_db.get('setting', '')
                 user_defined_starting_point = world_data_from_db.get('starting_point')
                 world_title_for_response = world_data_from_db.get('title', "타이틀 없음")
@@ -218,6 +658,7 @@ def handle_action():
                 world_systems = world_data_from_db.get('systems', [])
                 world_system_configs = world_data_from_db.get('system_configs', {})
                 world_endings = world_data_from_db.get('endings', [])
+                bind_usage(world_id=actual_world_id_to_save, session_usage=token_usage)
 
                 if world_systems and isinstance(world_systems, list): # world_systems가 리스트인지 확인
                     logger.debug(f"[DEBUG Systems] Processing world_systems: {world_systems}")
@@ -268,24 +709,38 @@ def handle_action():
                 prompt_for_ai = START_WITH_USER_POINT_CHOICES_ONLY_PROMPT_TEMPLATE.format(
                     user_starting_point=newly_generated_story_segment
                 )
-                logger.debug(f"[DEBUG Gemini Call] Attempting to call Gemini for CHOICES ONLY. Session: {session_id}, Prompt: {prompt_for_ai[:200]}...")
-                _, choices_for_client = call_gemini_api(prompt_for_ai) 
+                # 같은 세계관의 시작 프롬프트는 모든 플레이어에게 같으므로 미리 생성된 선택지를 먼저 사용
+                with tracing.span("opening_pool"):
+                    pooled_opening = opening_pool.take(actual_world_id_to_save, prompt_for_ai, world_data_from_db.get('is_public'))
+                if pooled_opening:
+                    _, choices_for_client = pooled_opening
+                else:
+                    logger.debug(f"[DEBUG Gemini Call] Attempting to call Gemini for CHOICES ONLY. Session: {session_id}, Prompt: {prompt_for_ai[:200]}...")
+                    _, choices_for_client = call_gemini_api(prompt_for_ai) 
                 complete_initial_history = (world_setting_text + "\n\n" + newly_generated_story_segment if world_setting_text else newly_generated_story_segment)
             else: # not using_starting_point
                 systems_status_for_prompt = "현재 활성화된 시스템: " + (", ".join([f"{name}({value})" for name, value in current_active_systems.items()]) if current_active_systems else "없음")
         
                 initial_prompt_for_gemini = START_WITH_USER_POINT_PROMPT_TEMPLATE.format(
-                    world_setting=world_setting_text if world_setting_text else "특별한 설정 없음.",
+                    world_setting=prompt_builder.fit_setting(world_setting_text) if world_setting_text else "특별한 설정 없음.",
                     user_starting_point="모험이 지금 막 시작됩니다. 이 세계관에 어울리는 흥미로운 첫 장면을 묘사해주세요.",
                     systems_status=systems_status_for_prompt
                 )
 
-                logger.debug(f"[DEBUG Gemini Call] Attempting to call Gemini for initial story and choices. Session: {session_id}, Prompt: {initial_prompt_for_gemini[:200]}...")
-                newly_generated_story_segment, choices_for_client = call_gemini_api(initial_prompt_for_gemini)
+                with tracing.span("opening_pool"):
+                    pooled_opening = opening_pool.take(actual_world_id_to_save, initial_prompt_for_gemini, world_data_from_db.get('is_public'))
+                if pooled_opening:
+                    newly_generated_story_segment, choices_for_client = pooled_opening
+                else:
+                    logger.debug(f"[DEBUG Gemini Call] Attempting to call Gemini for initial story and choices. Session: {session_id}, Prompt: {initial_prompt_for_gemini[:200]}...")
+                    newly_generated_story_segment, choices_for_client = call_gemini_api(initial_prompt_for_gemini)
                 complete_initial_history = (world_setting_text + "\n\n" + newly_generated_story_segment if world_setting_text else newly_generated_story_segment)
             
             logger.debug(f"[DEBUG Gemini Call Success] Gemini call successful. Session: {session_id}, Story segment (start): {newly_generated_story_segment[:50] if newly_generated_story_segment else 'N/A'}")
         
+        except LLMAdmissionError as e:
+            logger.warning(f"Gemini call not admitted for session {session_id} (start_new_adventure): {e}")
+            return jsonify({"error": "요청이 많아 모험을 바로 시작할 수 없습니다. 잠시 후 다시 시도해주세요."}), 429
         except Exception as e:
             logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
             logger.critical(f"[CRITICAL ERROR] Exception during Gemini API call or processing its response for session {session_id} (start_new_adventure): {str(e)}")
@@ -299,9 +754,11 @@ def handle_action():
             'world_title': world_title_for_response,
             'active_systems': current_active_systems,
             'system_configs': world_system_configs,
-            'world_endings': world_endings
+            'world_endings': world_endings,
+            'user_id': user_id_from_token,
+            'token_usage': token_usage
         }
-        print(f"[DEBUG Systems] current_active_systems for session {session_id}: {current_active_systems}")
+        logger.debug("[Systems] current_active_systems for session %s: %s", session_id, current_active_systems)
 
         response_data = {
             'new_story_segment': newly_generated_story_segment,
@@ -316,194 +773,21 @@ def handle_action():
         }
 
     elif action_type == "continue_adventure":
-        if session_id not in story_sessions_data or not story_sessions_data[session_id].get('world_id'):
-            return jsonify({"error": "잘못된 세션이거나, 아직 시작되지 않은 모험입니다. 먼저 모험을 시작해주세요."}), 400
-
-        player_action_text = data.get('action_text') # 사용자가 선택한 선택지의 텍스트 (시스템 태그 없음)
-        current_story_history = story_sessions_data[session_id].get('history', "")
-        current_active_systems = story_sessions_data[session_id].get('active_systems', {})
-        world_id_for_setting_cont = story_sessions_data[session_id].get('world_id')
-        world_title_for_response = story_sessions_data[session_id].get('world_title', '알 수 없는 세계관')
-        world_system_configs = story_sessions_data[session_id].get('system_configs', {})
-        world_endings = story_sessions_data[session_id].get('world_endings', [])
-
-        if player_action_text:
-            current_story_history += f"플레이어의 행동: {player_action_text}\n\n"
-        else:
-            current_story_history += f"플레이어의 행동: (선택지를 선택함 - 텍스트 없음)\n\n"
-
-        if len(current_story_history) > MAX_HISTORY_CHAR_LENGTH:
-            world_id_for_setting = story_sessions_data[session_id].get('world_id')
-            retrieved_world_setting = "이 세계관의 기본 설정" # 기본값
-            if world_id_for_setting:
-                client = get_db_client() # 현재 요청의 user_jwt를 사용하는 클라이언트가 필요할 수 있음
-                if client:
-                    try:
-                        w_res = client.table("worlds").select("setting").eq("id", world_id_for_setting).maybe_single().execute()
-                        if hasattr(w_res, 'data') and w_res.data and w_res.data.get('setting'):
-                            retrieved_world_setting = w_res.data.get('setting')
-                        else:
-                            logger.warning(f"summarize: World setting not found for world_id {world_id_for_setting}")
-                    except Exception as e:
-                        logger.error(f"summarize: Error fetching world setting for {world_id_for_setting}: {e}")
-            
-            logger.debug(f"Summarizing history. Original length: {len(current_story_history)}. World setting snippet: {retrieved_world_setting[:100]}...")
-            # 수정된 함수 호출 방식: world_setting_for_summary 인자 명시적 전달
-            summarized_history = summarize_story_with_gemini(story_text_to_summarize=current_story_history, world_setting_for_summary=retrieved_world_setting)
-            if summarized_history:
-                logger.debug(f"History summarized. New length: {len(summarized_history)}")
-                current_story_history = summarized_history + "\n\n(이전 내용 요약됨)\n\n"
-            else:
-                logger.warning("History summarization failed or returned empty.")
-        
-        # AI에게 다음 스토리 생성을 요청하기 위한 세계관 설정 (retrieved_world_setting_cont)
-        retrieved_world_setting_cont = "이 세계관의 설정" # 기본값
-        if world_id_for_setting_cont:
-            client_cont = get_db_client()
-            if client_cont:
-                w_res_cont = client_cont.table("worlds").select("setting").eq("id", world_id_for_setting_cont).maybe_single().execute()
-                if hasattr(w_res_cont, 'data') and w_res_cont.data and w_res_cont.data.get('setting'):
-                    retrieved_world_setting_cont = w_res_cont.data.get('setting')
-        
-        # Gemini API 호출 시에는 현재 시스템 상태를 전달 (아직 AI 응답 전이므로 이전 턴의 시스템 상태)
-        current_systems_list_for_prompt = ", ".join([f"{name} (현재값: {value})" for name, value in current_active_systems.items()]) if current_active_systems else "없음. 시스템 변경 지시를 내리지 마세요."
-
-        prompt_to_gemini = DEFAULT_PROMPT_TEMPLATE.format(
-            world_setting_summary=retrieved_world_setting_cont, 
-            story_summary=current_story_history, 
-            last_story_segment="", 
-            user_action=player_action_text if player_action_text else "(선택지를 선택함)", 
-            current_systems_list_for_prompt=current_systems_list_for_prompt
-        )
-        logger.debug(f"Prompt for continue_adventure for session {session_id}: {prompt_to_gemini[:300]}...")
-
-        try:
-            generated_story_part, choices_from_ai = call_gemini_api(prompt_to_gemini)
-            logger.debug(f"Gemini response for session {session_id}:\nStory part: '{generated_story_part}'\nChoices: {choices_from_ai}")
-
-            # AI가 생성한 스토리 본문(generated_story_part)에서 시스템 업데이트 태그를 파싱하고 시스템 값을 업데이트합니다.
-            # current_active_systems는 이 함수 호출 전에 이미 플레이어의 이전 행동에 의해 업데이트되었을 수 있으므로,
-            # AI 응답에 의한 추가적인 변경을 여기에 반영합니다.
-            if generated_story_part:
-                logger.debug(f"Applying system updates FROM AI STORY TEXT for session {session_id}. Systems BEFORE this AI response: {current_active_systems}")
-                
-                # parse_and_apply_system_updates는 (업데이트된 시스템 dict, 파싱 정보 dict)를 반환합니다.
-                # 여기서 current_active_systems.copy()를 전달하여 원본 불변성을 유지합니다.
-                processed_systems_after_ai_story, story_parse_info = parse_and_apply_system_updates(generated_story_part, current_active_systems.copy())
-                
-                cleaned_generated_story_part = story_parse_info.get("cleaned_story", generated_story_part) # 태그 제거된 스토리 본문
-                updates_applied_from_story = story_parse_info.get("updates_applied", {})
-                
-                if updates_applied_from_story: # AI 스토리 본문에 의해 실제로 시스템 변경이 있었다면
-                    current_active_systems = processed_systems_after_ai_story # 현재 active_systems를 AI 본문에 의한 변경으로 업데이트
-                    story_sessions_data[session_id]['active_systems'] = current_active_systems
-                    logger.info(f"Systems updated based on AI story text for session {session_id}. Applied: {updates_applied_from_story}")
-                else:
-                    logger.info(f"No system updates found or applied from AI story text for session {session_id}.")
-                logger.debug(f"Cleaned story part after AI response processing: '{cleaned_generated_story_part}'")
-            else:
-                cleaned_generated_story_part = "" # AI 응답이 비었을 경우
-            
-            # 선택지 처리: AI가 프롬프트 지시를 따라 선택지에는 태그를 포함하지 않을 것으로 예상합니다.
-            # 만약 포함 가능성을 대비하려면, 여기서 각 choice['text']에 대해서도 태그 제거 로직을 추가할 수 있습니다.
-            # (단, 이때는 시스템 값을 변경하지 않고 텍스트만 정제해야 함)
-            processed_choices_for_client = []
-            if choices_from_ai:
-                for choice_item in choices_from_ai:
-                    # 간단히 태그 제거 (시스템 값 변경 X)
-                    _, choice_parse_info = parse_and_apply_system_updates(choice_item['text'], {})
-                    cleaned_choice_text = choice_parse_info.get("cleaned_story", choice_item['text'])
-                    processed_choices_for_client.append({
-                        "id": choice_item['id'],
-                        "text": cleaned_choice_text 
-                        # "original_text_with_tags": choice_item['text'] # 이전 로직, 이제 불필요
-                    })
-            else:
-                 processed_choices_for_client = []
-
-        except Exception as e:
-            logger.error(f"Error during Gemini call or system update parsing for session {session_id}: {str(e)}")
-            logger.error(traceback.format_exc())
-            response_data = {
-                "error": f"AI 응답 처리 중 오류 발생: {str(e)}",
-                "new_story_segment": "AI 응답을 처리하는 중 문제가 발생했습니다. 잠시 후 다시 시도해주세요.",
-                "choices": [], 
-                "context": {'history': current_story_history},
-                'active_systems': current_active_systems, # 오류 발생 시점의 (업데이트 시도 전 또는 후의) 시스템 상태
-                'system_configs': world_system_configs,
-                'world_endings': world_endings
-            }
-            return jsonify(response_data), 500
-
-        current_story_history += f"AI 응답: {cleaned_generated_story_part}\n\n"
-        story_sessions_data[session_id]['history'] = current_story_history
-        story_sessions_data[session_id]['last_choices'] = processed_choices_for_client # AI가 생성한 (태그 없는) 선택지 그대로 저장
-        story_sessions_data[session_id]['last_ai_response'] = cleaned_generated_story_part
-        
-        # 엔딩 조건 체크 (LLM 사용)
-        triggered_ending = None
-        if world_endings and cleaned_generated_story_part:
-            logger.debug(f"Checking ending conditions for session {session_id}")
-            try:
-                triggered_ending = check_ending_conditions_with_llm(
-                    story_content=cleaned_generated_story_part,
-                    story_history=current_story_history,
-                    world_endings=world_endings,
-                    active_systems=current_active_systems
-                )
-                if triggered_ending:
-                    logger.info(f"Ending triggered for session {session_id}: {triggered_ending.get('name')}")
-                else:
-                    logger.debug(f"No ending triggered for session {session_id}")
-            except Exception as e:
-                logger.error(f"Error checking ending conditions for session {session_id}: {e}")
-        
-        response_data = {
-            'new_story_segment': cleaned_generated_story_part,
-            'choices': processed_choices_for_client, 
-            'context': {'history': current_story_history},
-            'active_systems': current_active_systems, # 최종적으로 업데이트된 (또는 변경 없는) 시스템 상태
-            'system_configs': world_system_configs,
-            'world_endings': world_endings,
-            'triggered_ending': triggered_ending  # 엔딩 트리거 결과 추가
-        }
-        logger.debug(f"Data being sent to client for session {session_id}: {response_data}") # 최종 응답 데이터 로깅
+        # 같은 세션의 동시 턴은 세션 락으로 직렬화합니다.
+        with story_sessions_data.lock(session_id):
+            response_data, status_code = _continue_adventure_turn(data, session_id, user_id_from_token, user_jwt, db_client_instance)
+        if status_code != 200:
+            return jsonify(response_data), status_code
 
     elif action_type == "load_story":
         session_id = data.get("session_id")
-        print(f"Attempting to load story for session_id: {session_id}, user_id: {user_id_from_token}")
+        logger.debug("Attempting to load story for session_id: %s, user_id: %s", session_id, user_id_from_token)
         
-        auth_header = request.headers.get("Authorization")
-        user_jwt_token = None
-        if auth_header and auth_header.startswith("Bearer "):
-            user_jwt_token = auth_header.replace("Bearer ", "")
-
-        loaded_adventure = get_ongoing_adventure(session_id=session_id, user_id=user_id_from_token, user_jwt=user_jwt_token)
+        session_state, loaded_adventure = _rehydrate_session_from_db(session_id, user_id_from_token, user_jwt, db_client_instance)
 
         if loaded_adventure:
-            print(f"Loaded adventure from DB: {loaded_adventure.get('session_id')}")
-            
-            # 세계관 ID로부터 엔딩 정보를 조회
-            world_endings = []
-            world_id = loaded_adventure.get("world_id")
-            if world_id and db_client_instance:
-                try:
-                    endings_response = db_client_instance.table("worlds").select("endings").eq("id", str(world_id)).maybe_single().execute()
-                    if endings_response and hasattr(endings_response, 'data') and endings_response.data:
-                        world_endings = endings_response.data.get('endings', [])
-                except Exception as e:
-                    logger.error(f"Error loading world endings for world_id {world_id}: {e}")
-            
-            story_sessions_data[session_id] = {
-                "history": loaded_adventure.get("history", ""),
-                "last_ai_response": loaded_adventure.get("last_ai_response", ""),
-                "last_choices": loaded_adventure.get("last_choices", []),
-                "world_id": str(loaded_adventure.get("world_id")) if loaded_adventure.get("world_id") else None,
-                "active_systems": loaded_adventure.get("active_systems", {}),
-                "system_configs": loaded_adventure.get("system_configs", {}),
-                "world_endings": world_endings,
-                "user_id": user_id_from_token
-            }
+            logger.debug("Loaded adventure from DB: %s", loaded_adventure.get('session_id'))
+            world_endings = session_state.get("world_endings", [])
             response_data = {
                 "status": "success", 
                 "message": "Story loaded from database.",
@@ -518,7 +802,7 @@ def handle_action():
                 "world_endings": world_endings
             }
         else:
-            print(f"No adventure found in DB for session_id: {session_id}, user_id: {user_id_from_token}. Or session_id was null.")
+            logger.info("No adventure found in DB for session_id: %s, user_id: %s. Or session_id was null.", session_id, user_id_from_token)
             response_data = {
                 "status": "error", 
                 "message": "Failed to load story. Adventure not found or session ID missing.", 
@@ -540,15 +824,20 @@ def handle_action():
         if not ending_name or not basic_ending_content:
             response_data = {"error": "엔딩 이름과 기본 내용이 필요합니다."}, 400
         else:
+            ending_session_state = story_sessions_data.get(session_id)
+            if ending_session_state and ending_session_state.get('user_id') == user_id_from_token:
+                bind_usage(world_id=ending_session_state.get('world_id'),
+                           session_usage=ending_session_state.setdefault('token_usage', {}))
             try:
-                enhanced_ending = generate_enhanced_ending_story(
-                    ending_name=ending_name,
-                    ending_condition=ending_condition,
-                    basic_ending_content=basic_ending_content,
-                    story_history=story_history,
-                    world_title=world_title,
-                    game_stats=game_stats
-                )
+                with tracing.span("llm_ending_enhancement"):
+                    enhanced_ending = generate_enhanced_ending_story(
+                        ending_name=ending_name,
+                        ending_condition=ending_condition,
+                        basic_ending_content=basic_ending_content,
+                        story_history=story_history,
+                        world_title=world_title,
+                        game_stats=game_stats
+                    )
                 
                 response_data = {
                     "enhanced_ending": enhanced_ending,
@@ -564,5 +853,6 @@ def handle_action():
     else: # 알 수 없는 action_type 또는 기타 경우
         response_data = {"error": f"알 수 없는 요청입니다: {action_type}"}, 400
 
-    return jsonify(response_data)
+    with tracing.span("serialize"):
+        return jsonify(response_data)
  
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""
+Rolling background compaction of hierarchical story memory (story_memory.py).
+
+렌더링된 히스토리가 소프트 워터마크(SUMMARY_SOFT_WATERMARK_CHARS)를 넘으면 다음 압축 작업
+(가장 오래된 원문 턴 묶음 → 챕터 요약, 또는 오래된 챕터 → 개요)을 백그라운드에서 요약해 두고,
+다음 턴 시작 시 세션 락 안에서 결과를 적용합니다. 작업 대상이 그 사이 바뀌었다면 결과를 버립니다.
+히스토리가 프롬프트 토큰 예산(prompt_builder.history_budget)을 넘었을 때만 요청 경로에서 요약을 기다립니다.
+"""
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from backend import story_memory
+from backend.config import (SUMMARY_SOFT_WATERMARK_CHARS, SUMMARY_MAX_WORKERS, SUMMARY_HARD_WAIT_SECONDS,
+                            SUMMARY_TURNS_PER_CHAPTER, SUMMARY_KEEP_RECENT_TURNS, SUMMARY_MAX_CHAPTERS,
+                            SUMMARY_CHAPTER_TARGET_CHARS, SUMMARY_ARC_TARGET_CHARS)
+from backend.gemini_utils import summarize_story_with_gemini
+from backend.llm_resilience import detached_context, remaining_budget
+
+logger = logging.getLogger(__name__)
+
+_JOB_RETENTION_SECONDS = 3600 # 찾아가지 않은 요약 결과를 보관하는 시간
+_MAX_BLOCKING_ROUNDS = 3 # 하드 한도에서 한 턴에 수행하는 최대 압축 횟수
+
+
+class RollingSummarizer:
+    def __init__(self, summarize_fn, soft_watermark_chars, max_workers, hard_wait_seconds,
+                 turns_per_chapter, keep_recent_turns, max_chapters, chapter_target_chars, arc_target_chars):
+        self._summarize_fn = summarize_fn # (story_text_to_summarize, world_setting_for_summary, target_char_length) -> str, 실패 시 예외
+        self.soft_watermark_chars = soft_watermark_chars
+        self.max_workers = max_workers
+        self.hard_wait_seconds = hard_wait_seconds
+        self.turns_per_chapter = turns_per_chapter
+        self.keep_recent_turns = keep_recent_turns
+        self.max_chapters = max_chapters
+        self.chapter_target_chars = chapter_target_chars
+        self.arc_target_chars = arc_target_chars
+        self._executor = None
+        # session_id -> {'job', 'future', 'started_at'}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "swapped": 0, "discarded_stale": 0, "errors": 0,
+                       "chapter_compactions": 0, "arc_compactions": 0, "summarized_input_chars": 0,
+                       "hard_ceiling_hits": 0, "hard_ceiling_waited": 0, "hard_ceiling_cancelled": 0,
+                       "hard_ceiling_deferred": 0, "inline_summaries": 0}
+
+    def maybe_start(self, session_id, memory, world_setting):
+        """히스토리가 소프트 워터마크를 넘었고 진행 중인 압축이 없으면 다음 압축 작업을 백그라운드에서 시작합니다."""
+        if len(story_memory.render_history(memory)) <= self.soft_watermark_chars:
+            return False
+        job = self._next_job(memory, force=False)
+        if job is None:
+            return False
+        with self._lock:
+            self._expire_locked()
+            if str(session_id) in self._jobs:
+                return False
+            if self._executor is None:
+                # gunicorn fork 이후 워커 프로세스 안에서 스레드 풀을 만들도록 첫 사용 시점에 생성
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="story-summary")
+            # 요청 문맥(llm_call_context의 사용자 등)을 백그라운드 요약에도 넘김
+            future = self._executor.submit(detached_context().run, self._summarize_job, job, world_setting)
+            self._jobs[str(session_id)] = {'job': job, 'future': future, 'started_at': time.monotonic()}
+            self._stats["started"] += 1
+        return True
+
+    def take_ready(self, session_id, memory) -> bool:
+        """
+        완료된 백그라운드 압축이 있으면 memory에 적용하고 True를 반환합니다.
+        호출자는 세션 락을 잡은 상태여야 합니다.
+        """
+        with self._lock:
+            entry = self._jobs.get(str(session_id))
+            if entry is None or not entry['future'].done():
+                return False
+            del self._jobs[str(session_id)]
+        return self._apply(entry, memory)
+
+    def compact_blocking(self, session_id, memory, world_setting, fits):
+        """
+        fits(memory)가 참이 될 때까지 (하드 한도 이하가 될 때까지) memory를 압축합니다.
+        진행 중인 백그라운드 작업은 SUMMARY_HARD_WAIT_SECONDS까지 기다려 쓰고, 없으면 요청 경로에서 요약합니다.
+        같은 요약을 두 번 호출하지 않도록, 그때까지 시작하지 않은 백그라운드 작업은 취소하고 요청 경로에서 요약하며,
+        이미 요약 중인 작업은 요청 데드라인까지 결과를 기다립니다. 그래도 끝나지 않으면 다음 턴의 take_ready()에 넘깁니다.
+        """
+        with self._lock:
+            self._stats["hard_ceiling_hits"] += 1
+            entry = self._jobs.pop(str(session_id), None)
+        if entry is not None:
+            future = entry['future']
+            self._wait(future, self.hard_wait_seconds)
+            if not future.done() and future.cancel():
+                with self._lock:
+                    self._stats["hard_ceiling_cancelled"] += 1
+            else:
+                if not future.done():
+                    budget = remaining_budget()
+                    self._wait(future, max(budget, 0.0) if budget is not None else None)
+                if not future.done():
+                    with self._lock:
+                        self._stats["hard_ceiling_deferred"] += 1
+                        self._jobs.setdefault(str(session_id), entry)
+                    return
+                with self._lock:
+                    self._stats["hard_ceiling_waited"] += 1
+                self._apply(entry, memory)
+
+        for _ in range(_MAX_BLOCKING_ROUNDS):
+            if fits(memory):
+                return
+            job = self._next_job(memory, force=True)
+            if job is None:
+                return
+            with self._lock:
+                self._stats["inline_summaries"] += 1
+            try:
+                summary = self._summarize_job(job, world_setting)
+            except Exception as e:
+                logger.exception("하드 한도 요약 실패: %s", e)
+                with self._lock:
+                    self._stats["errors"] += 1
+                return
+            if not story_memory.apply_compaction(memory, job, summary):
+                return
+
+    @staticmethod
+    def _wait(future, timeout):
+        try:
+            future.result(timeout=timeout)
+        except FutureTimeoutError:
+            pass
+        except Exception:
+            pass # 오류는 _apply에서 집계
+
+    def discard(self, session_id):
+        with self._lock:
+            self._jobs.pop(str(session_id), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(1 for entry in self._jobs.values() if not entry['future'].done())
+            return {"jobs": len(self._jobs), "pending": pending, "soft_watermark_chars": self.soft_watermark_chars, **self._stats}
+
+    def render_prometheus(self) -> str:
+        """요약 시작/적용/폐기/오류와 하드 한도 도달 횟수, 진행 중인 요약 작업 수 (Prometheus 텍스트 형식)."""
+        with self._lock:
+            lines = ["# HELP storydive_summary_events_total Rolling story summarization events by outcome.",
+                     "# TYPE storydive_summary_events_total counter"]
+            for event in ("started", "swapped", "discarded_stale", "errors", "chapter_compactions", "arc_compactions",
+                          "hard_ceiling_hits", "hard_ceiling_waited", "hard_ceiling_cancelled", "hard_ceiling_deferred",
+                          "inline_summaries"):
+                lines.append(f'storydive_summary_events_total{{event="{event}"}} {self._stats[event]}')
+            pending = sum(1 for entry in self._jobs.values() if not entry['future'].done())
+            lines += ["# HELP storydive_summary_input_chars_total History characters sent to the summarizer.",
+                      "# TYPE storydive_summary_input_chars_total counter",
+                      f"storydive_summary_input_chars_total {self._stats['summarized_input_chars']}",
+                      "# HELP storydive_summary_pending_jobs Background summarization jobs still running in this process.",
+                      "# TYPE storydive_summary_pending_jobs gauge",
+                      f"storydive_summary_pending_jobs {pending}"]
+        return "\n".join(lines) + "\n"
+
+    def _next_job(self, memory, force):
+        return story_memory.next_compaction(memory, self.turns_per_chapter, self.keep_recent_turns, self.max_chapters, force=force)
+
+    def _summarize_job(self, job, world_setting):
+        text = story_memory.compaction_input(job)
+        target = self.chapter_target_chars if job[0] == "chapter" else self.arc_target_chars
+        with self._lock:
+            self._stats["chapter_compactions" if job[0] == "chapter" else "arc_compactions"] += 1
+            self._stats["summarized_input_chars"] += len(text)
+        return self._summarize_fn(story_text_to_summarize=text, world_setting_for_summary=world_setting, target_char_length=target)
+
+    def _apply(self, entry, memory) -> bool:
+        try:
+            summary = entry['future'].result()
+        except Exception as e:
+            logger.exception("백그라운드 요약 실패: %s", e)
+            with self._lock:
+                self._stats["errors"] += 1
+            return False
+        if not story_memory.apply_compaction(memory, entry['job'], summary):
+            # 그 사이 기억이 다른 방식으로 바뀌었다면(다른 압축, 불러오기 등) 결과를 버림
+            with self._lock:
+                self._stats["discarded_stale"] += 1
+            return False
+        with self._lock:
+            self._stats["swapped"] += 1
+        return True
+
+    def _expire_locked(self):
+        deadline = time.monotonic() - _JOB_RETENTION_SECONDS
+        for session_id in [sid for sid, entry in self._jobs.items() if entry['started_at'] < deadline and entry['future'].done()]:
+            del self._jobs[session_id]
+
+
+story_summarizer = RollingSummarizer(
+    # 실패 시 안내/오류 문구가 요약으로 저장되고 원문 턴이 버려지지 않도록 strict (실패하면 턴을 원문으로 두고 다음 턴에 재시도)
+    summarize_fn=functools.partial(summarize_story_with_gemini, strict=True),
+    soft_watermark_chars=SUMMARY_SOFT_WATERMARK_CHARS,
+    max_workers=SUMMARY_MAX_WORKERS,
+    hard_wait_seconds=SUMMARY_HARD_WAIT_SECONDS,
+    turns_per_chapter=SUMMARY_TURNS_PER_CHAPTER,
+    keep_recent_turns=SUMMARY_KEEP_RECENT_TURNS,
+    max_chapters=SUMMARY_MAX_CHAPTERS,
+    chapter_target_chars=SUMMARY_CHAPTER_TARGET_CHARS,
+    arc_target_chars=SUMMARY_ARC_TARGET_CHARS,
+)
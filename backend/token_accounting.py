@@ -0,0 +1,223 @@
+"""
+Token accounting and cost metering for Gemini calls.
+
+gemini_utils의 모든 호출(생성, 재시도, 요약, 엔딩 판정, 엔딩 확장, 스트리밍)은 응답을 받은 뒤 token_ledger.record()를 부릅니다.
+- 토큰 수는 응답의 usage_metadata(prompt_token_count, candidates_token_count)를 쓰고, 없으면 글자 수로 추정합니다
+  (estimated_calls로 따로 셉니다). 입력 토큰에는 모델 핸들에 묶인 시스템 지시문이 포함되며,
+  그중 Gemini 캐시에서 처리된 부분(cached_content_token_count)은 cached_tokens로 따로 셉니다.
+- 호출 종류별, 세션별, 세계관별, 사용자별로 누적합니다. 세션/세계관/사용자 맵은 최근에 쓴 순서로 TOKEN_ACCOUNTING_MAX_KEYS개까지만 유지합니다.
+- 요청 처리 중에는 usage_scope()가 연 범위에 bind_usage()로 세션 ID, 세계관 ID, 세션 상태의 token_usage dict를 붙입니다.
+  범위 객체는 문맥 복사(detached_context)로 백그라운드 작업(엔딩 판정, 요약, 예측 생성)에도 그대로 넘어가므로
+  그 호출들도 같은 세션으로 집계됩니다. 사용자는 llm_call_context()의 사용자를 씁니다.
+- 세션 상태의 token_usage는 저장 시 ongoing_adventures.token_usage로 함께 저장되고, 복원 시 다시 읽습니다.
+- token_estimator는 프롬프트 조립(prompt_builder)용 로컬 토큰 추정기입니다. 실제 입력 토큰 수가 오면
+  record()가 그 값으로 보정 계수를 갱신하므로, 별도의 count_tokens 호출 없이 모델의 토큰 수에 맞춰집니다.
+"""
+import contextvars
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from backend.config import (TOKEN_ACCOUNTING_MAX_KEYS, LLM_PRICE_INPUT_PER_MTOK, LLM_PRICE_OUTPUT_PER_MTOK,
+                            PROMPT_TOKEN_CALIBRATION)
+from backend.llm_scheduler import current_llm_user_id
+
+USAGE_GENERATION_RETRY = "generation_retry" # 선택지가 모자라 다시 생성한 호출 (llm_resilience의 호출 종류 외 집계용 라벨)
+
+_scope = contextvars.ContextVar("llm_usage_scope", default=None)
+
+_ASCII_CHARS_PER_TOKEN = 4.0 # 영문/숫자/기호
+_WIDE_CHARS_PER_TOKEN = 1.5 # 한글 음절 등 UTF-8에서 여러 바이트인 문자
+_CALIBRATION_ALPHA = 0.1 # 보정 계수의 지수 이동 평균 가중치
+_CALIBRATION_BOUNDS = (0.5, 3.0)
+_CALIBRATION_MIN_CHARS = 200 # 이보다 짧은 프롬프트는 고정 오버헤드 비중이 커서 보정에 쓰지 않음
+
+
+class TokenEstimator:
+    """글자 종류별 비율로 토큰 수를 빠르게 추정하고, 실제 입력 토큰 수와의 비율로 보정합니다."""
+
+    def __init__(self, calibration):
+        self.calibration = calibration
+        self._observations = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def raw_estimate(text) -> float:
+        if not text:
+            return 0.0
+        chars = len(text)
+        wide = (len(text.encode("utf-8")) - chars) / 2 # 한글 음절은 3바이트이므로 (바이트 - 글자) / 2개
+        return (chars - wide) / _ASCII_CHARS_PER_TOKEN + wide / _WIDE_CHARS_PER_TOKEN
+
+    def estimate(self, text) -> int:
+        return int(self.raw_estimate(text) * self.calibration + 0.5)
+
+    def observe(self, text, actual_tokens):
+        """모델이 보고한 실제 입력 토큰 수로 보정 계수를 갱신합니다."""
+        if not isinstance(text, str) or len(text) < _CALIBRATION_MIN_CHARS or not actual_tokens:
+            return
+        ratio = actual_tokens / self.raw_estimate(text)
+        ratio = min(max(ratio, _CALIBRATION_BOUNDS[0]), _CALIBRATION_BOUNDS[1])
+        with self._lock:
+            self.calibration += _CALIBRATION_ALPHA * (ratio - self.calibration)
+            self._observations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calibration": round(self.calibration, 4), "observations": self._observations}
+
+
+class UsageScope:
+    __slots__ = ("session_id", "world_id", "session_usage")
+
+    def __init__(self, session_id=None, world_id=None, session_usage=None):
+        self.session_id = session_id
+        self.world_id = world_id
+        self.session_usage = session_usage # 세션 상태의 token_usage dict (누적 대상)
+
+
+@contextmanager
+def usage_scope(session_id=None, world_id=None, session_usage=None):
+    """이 블록 안의 Gemini 호출 토큰을 집계할 범위를 엽니다. 값은 나중에 bind_usage()로 채울 수 있습니다."""
+    token = _scope.set(UsageScope(session_id, world_id, session_usage))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def bind_usage(**fields):
+    """현재 범위에 session_id / world_id / session_usage를 붙입니다 (범위가 없으면 무시)."""
+    scope = _scope.get()
+    if scope is not None:
+        for name, value in fields.items():
+            setattr(scope, name, value)
+
+
+def usage_from_response(response, prompt, text=None):
+    """(입력 토큰, 출력 토큰, 캐시된 입력 토큰, 추정 여부). usage_metadata가 없거나 비어 있으면 글자 수로 추정합니다."""
+    metadata = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(metadata, "prompt_token_count", 0) or 0
+    output_tokens = getattr(metadata, "candidates_token_count", 0) or 0
+    if prompt_tokens:
+        return prompt_tokens, output_tokens, getattr(metadata, "cached_content_token_count", 0) or 0, False
+    if text is None:
+        try:
+            text = response.text
+        except Exception: # 차단된 응답 등은 .text가 예외를 냄
+            text = ""
+    return token_estimator.estimate(prompt), token_estimator.estimate(text) if text else 0, 0, True
+
+
+def _empty_totals():
+    return {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "estimated_calls": 0, "cost_usd": 0.0}
+
+
+def _add(totals, prompt_tokens, output_tokens, cached_tokens, estimated, cost):
+    totals["calls"] = totals.get("calls", 0) + 1
+    totals["prompt_tokens"] = totals.get("prompt_tokens", 0) + prompt_tokens
+    totals["output_tokens"] = totals.get("output_tokens", 0) + output_tokens
+    totals["cached_tokens"] = totals.get("cached_tokens", 0) + cached_tokens
+    totals["estimated_calls"] = totals.get("estimated_calls", 0) + (1 if estimated else 0)
+    totals["cost_usd"] = round(totals.get("cost_usd", 0.0) + cost, 6)
+
+
+class TokenLedger:
+    def __init__(self, max_keys, input_price_per_mtok, output_price_per_mtok):
+        self.max_keys = max_keys
+        self.input_price_per_mtok = input_price_per_mtok
+        self.output_price_per_mtok = output_price_per_mtok
+        self._totals = _empty_totals()
+        self._by_call_type = {}
+        self._by_dimension = {"session": OrderedDict(), "world": OrderedDict(), "user": OrderedDict()}
+        self._lock = threading.Lock()
+
+    def cost(self, prompt_tokens, output_tokens) -> float:
+        return (prompt_tokens * self.input_price_per_mtok + output_tokens * self.output_price_per_mtok) / 1_000_000
+
+    def _add_keyed(self, dimension, key, *values):
+        entries = self._by_dimension[dimension]
+        totals = entries.get(key)
+        if totals is None:
+            totals = entries[key] = _empty_totals()
+            if len(entries) > self.max_keys:
+                entries.popitem(last=False)
+        else:
+            entries.move_to_end(key)
+        _add(totals, *values)
+
+    def record(self, call_type, prompt, response, text=None, system_instruction=None):
+        """
+        Gemini 응답 하나의 토큰을 현재 범위(세션/세계관)와 사용자, 호출 종류로 누적합니다.
+        system_instruction은 모델 핸들에 묶인 지시문으로, 추정/보정할 때 입력에 함께 셉니다.
+        """
+        input_text = f"{system_instruction}\n\n{prompt}" if system_instruction else prompt
+        prompt_tokens, output_tokens, cached_tokens, estimated = usage_from_response(response, input_text, text)
+        if not estimated:
+            token_estimator.observe(input_text, prompt_tokens)
+        values = (prompt_tokens, output_tokens, cached_tokens, estimated, self.cost(prompt_tokens, output_tokens))
+        scope = _scope.get()
+        user_id = current_llm_user_id()
+        with self._lock:
+            _add(self._totals, *values)
+            _add(self._by_call_type.setdefault(call_type, _empty_totals()), *values)
+            if scope is not None and scope.session_id:
+                self._add_keyed("session", scope.session_id, *values)
+            if scope is not None and scope.world_id:
+                self._add_keyed("world", str(scope.world_id), *values)
+            if user_id:
+                self._add_keyed("user", user_id, *values)
+            if scope is not None and scope.session_usage is not None:
+                # 세션 상태에 저장되는 누적값 (ongoing_adventures.token_usage)
+                _add(scope.session_usage, *values)
+                _add(scope.session_usage.setdefault("by_call_type", {}).setdefault(call_type, {}), *values)
+
+    def snapshot(self, session_usage) -> dict:
+        """저장용으로 세션 누적값을 복사합니다 (백그라운드 작업이 동시에 더할 수 있으므로 잠금 안에서)."""
+        with self._lock:
+            usage = dict(session_usage or {})
+            if "by_call_type" in usage:
+                usage["by_call_type"] = {name: dict(totals) for name, totals in usage["by_call_type"].items()}
+            return usage
+
+    def stats(self, top=20) -> dict:
+        """전체/호출 종류별 누적과, 세션/세계관/사용자별 토큰 사용량 상위 top개."""
+        with self._lock:
+            def top_entries(entries):
+                ranked = sorted(entries.items(), key=lambda item: item[1]["prompt_tokens"] + item[1]["output_tokens"], reverse=True)
+                return [{"id": key, **totals} for key, totals in ranked[:top]]
+            return {"totals": dict(self._totals),
+                    "by_call_type": {name: dict(totals) for name, totals in self._by_call_type.items()},
+                    "top_sessions": top_entries(self._by_dimension["session"]),
+                    "top_worlds": top_entries(self._by_dimension["world"]),
+                    "top_users": top_entries(self._by_dimension["user"]),
+                    "tracked": {dimension: len(entries) for dimension, entries in self._by_dimension.items()},
+                    "price_per_mtok": {"input": self.input_price_per_mtok, "output": self.output_price_per_mtok}}
+
+    def session_totals(self, session_id):
+        with self._lock:
+            totals = self._by_dimension["session"].get(session_id)
+            return dict(totals) if totals else None
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            lines = ["# HELP storydive_llm_tokens_total Gemini tokens by call type and direction.",
+                     "# TYPE storydive_llm_tokens_total counter"]
+            for call_type, totals in sorted(self._by_call_type.items()):
+                lines.append(f'storydive_llm_tokens_total{{call_type="{call_type}",direction="input"}} {totals["prompt_tokens"]}')
+                lines.append(f'storydive_llm_tokens_total{{call_type="{call_type}",direction="output"}} {totals["output_tokens"]}')
+                lines.append(f'storydive_llm_tokens_total{{call_type="{call_type}",direction="cached_input"}} {totals["cached_tokens"]}')
+            lines += ["# HELP storydive_llm_calls_total Gemini calls with recorded usage by call type.",
+                      "# TYPE storydive_llm_calls_total counter"]
+            for call_type, totals in sorted(self._by_call_type.items()):
+                lines.append(f'storydive_llm_calls_total{{call_type="{call_type}"}} {totals["calls"]}')
+        return "\n".join(lines) + "\n"
+
+
+token_estimator = TokenEstimator(calibration=PROMPT_TOKEN_CALIBRATION)
+
+token_ledger = TokenLedger(
+    max_keys=TOKEN_ACCOUNTING_MAX_KEYS,
+    input_price_per_mtok=LLM_PRICE_INPUT_PER_MTOK,
+    output_price_per_mtok=LLM_PRICE_OUTPUT_PER_MTOK,
+)
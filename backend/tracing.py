@@ -0,0 +1,215 @@
+"""
+Per-stage timing for story requests: spans, per-action histograms, Server-Timing and Prometheus metrics.
+
+- 요청마다 start_trace()/activate()로 트레이스를 열고(contextvars), 단계마다 span("world_fetch") 등으로 시간을 잽니다.
+  같은 이름의 단계가 여러 번 실행되면 (예: 선택지 파싱) 시간을 합칩니다.
+- 트레이스가 끝나면(finish) 단계별 시간과 전체 시간을 액션 종류별 히스토그램(stage_metrics)에 누적하고,
+  finish_response()는 응답에 Server-Timing 헤더를 붙입니다 (브라우저 개발자 도구의 Timing 탭에서 확인).
+- stage_metrics.render_prometheus()는 /metrics 엔드포인트용 Prometheus 텍스트 형식입니다.
+
+트레이스가 없는 곳(스크립트, detached_context()로 넘긴 백그라운드 작업)에서 span()은 아무것도 기록하지 않습니다.
+응답 이후에도 이어지는 백그라운드 작업은 background_span()으로 요청의 액션 종류 아래 단계 히스토그램에 직접 기록합니다.
+"""
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from backend.config import TRACING_ENABLED, SERVER_TIMING_ENABLED, TRACING_HISTOGRAM_BUCKETS
+
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+_SERVER_TIMING_NAME = re.compile(r"[^A-Za-z0-9_\-]")
+
+
+class Trace:
+    def __init__(self, action):
+        self.action = action
+        self.started = time.perf_counter()
+        self._stages = {} # 단계 이름 -> 누적 초 (처음 기록된 순서 유지)
+        self._lock = threading.Lock() # 헤지 요청 스레드도 같은 트레이스에 기록할 수 있음
+        self._finished = False
+
+    def record(self, name, seconds):
+        with self._lock:
+            if not self._finished:
+                self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    def stages(self) -> dict:
+        with self._lock:
+            return dict(self._stages)
+
+    def finish(self, status_code):
+        """트레이스를 닫고 히스토그램에 누적합니다. Server-Timing 헤더 값을 반환합니다 (이미 닫혔으면 None)."""
+        total_seconds = time.perf_counter() - self.started
+        with self._lock:
+            if self._finished:
+                return None
+            self._finished = True
+            stages = dict(self._stages)
+        stage_metrics.observe(self.action, status_code, total_seconds, stages)
+        entries = [f"{_SERVER_TIMING_NAME.sub('_', name)};dur={seconds * 1000:.1f}" for name, seconds in stages.items()]
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def new_trace(action="unknown"):
+    """트레이스를 만듭니다 (TRACING_ENABLED가 꺼져 있으면 None). 활성화는 activate()로 합니다."""
+    return Trace(action) if TRACING_ENABLED else None
+
+
+@contextmanager
+def activate(trace):
+    """이 문맥에서 span()이 trace에 기록되도록 합니다 (스트리밍 응답처럼 뷰 밖에서 이어지는 작업용)."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def start_trace(action="unknown"):
+    with activate(new_trace(action)) as trace:
+        yield trace
+
+
+def set_action(action):
+    """요청 본문을 읽은 뒤 현재 트레이스의 액션 종류를 정합니다."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.action = action
+
+
+def detach():
+    """현재 문맥에서 트레이스를 뺍니다. detached_context()가 백그라운드 작업 문맥에 적용합니다."""
+    _current_trace.set(None)
+
+
+@contextmanager
+def span(name):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(name, time.perf_counter() - started)
+
+
+def current_action():
+    """현재 트레이스의 액션 종류 (트레이스가 없으면 None). 백그라운드 작업에 넘겨 background_span()에 씁니다."""
+    trace = _current_trace.get()
+    return trace.action if trace is not None else None
+
+
+@contextmanager
+def background_span(action, name):
+    """
+    요청 트레이스와 별개로 action의 단계 히스토그램에 시간을 기록합니다 (Server-Timing에는 나오지 않음).
+    요청이 끝난 뒤 완료되는 백그라운드 작업(예: 엔딩 판정)용이며, action이 None이면 기록하지 않습니다.
+    """
+    if action is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_metrics.observe_stage(action, name, time.perf_counter() - started)
+
+
+def record(name, seconds):
+    """이미 잰 시간을 현재 트레이스에 기록합니다 (예: 스트리밍의 첫 조각까지 걸린 시간)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(name, seconds)
+
+
+def finish_response(trace, response):
+    """trace를 닫고 Flask 응답에 Server-Timing 헤더를 붙입니다. 응답을 그대로 반환합니다."""
+    if trace is None:
+        return response
+    server_timing = trace.finish(response.status_code)
+    if server_timing and SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = server_timing
+    return response
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, bucket_count):
+        self.counts = [0] * bucket_count # 버킷별 (누적 아님) 개수, 마지막 이후는 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class StageMetrics:
+    """액션 종류/단계별, 액션 종류/상태 코드별 지연 시간 히스토그램."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._stage_histograms = {} # (action, stage) -> _Histogram
+        self._request_histograms = {} # (action, status) -> _Histogram
+        self._lock = threading.Lock()
+
+    def _observe(self, histograms, key, seconds):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = _Histogram(len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram.counts[i] += 1
+                break
+        histogram.sum += seconds
+        histogram.count += 1
+
+    def observe(self, action, status_code, total_seconds, stages):
+        with self._lock:
+            self._observe(self._request_histograms, (action, str(status_code)), total_seconds)
+            for stage, seconds in stages.items():
+                self._observe(self._stage_histograms, (action, stage), seconds)
+
+    def observe_stage(self, action, stage, seconds):
+        with self._lock:
+            self._observe(self._stage_histograms, (action, stage), seconds)
+
+    def stats(self) -> dict:
+        """액션 종류별 단계의 호출 수와 평균(ms)."""
+        with self._lock:
+            result = {}
+            for (action, stage), histogram in sorted(self._stage_histograms.items()):
+                result.setdefault(action, {})[stage] = {
+                    "count": histogram.count, "avg_ms": round(histogram.sum / histogram.count * 1000, 1)}
+            return result
+
+    def _render_histogram(self, lines, metric, label_names, histograms):
+        for key, histogram in sorted(histograms.items()):
+            labels = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            lines = ["# HELP storydive_request_duration_seconds Story request duration by action type and status code.",
+                     "# TYPE storydive_request_duration_seconds histogram"]
+            self._render_histogram(lines, "storydive_request_duration_seconds", ("action", "status"), self._request_histograms)
+            lines += ["# HELP storydive_stage_duration_seconds Time spent in each request stage by action type.",
+                      "# TYPE storydive_stage_duration_seconds histogram"]
+            self._render_histogram(lines, "storydive_stage_duration_seconds", ("action", "stage"), self._stage_histograms)
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+stage_metrics = StageMetrics(TRACING_HISTOGRAM_BUCKETS)
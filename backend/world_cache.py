@@ -0,0 +1,126 @@
+"""
+Per-process cache of world metadata used on the story hot path.
+
+continue_adventure / start_new_adventure / load_story가 매 턴 worlds 테이블을 조회하지 않도록
+setting, systems, system_configs, endings, starting_point 등을 world_id별로 캐시합니다.
+TTL이 지나면 updated_at만 조회해 변경 여부를 확인(재검증)하고, 바뀐 경우에만 전체 행을 다시 읽습니다.
+같은 프로세스의 update_world / delete_world는 invalidate()로 즉시 캐시를 비웁니다.
+다른 워커 프로세스에서의 수정은 TTL 만료 후 updated_at 재검증으로 반영됩니다.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from backend.config import WORLD_CACHE_TTL_SECONDS, WORLD_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+WORLD_CACHE_COLUMNS = "id, title, setting, starting_point, systems, system_configs, endings, is_public, user_id, updated_at"
+
+
+class WorldCache:
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # world_id -> (row, fetched_at); 앞쪽일수록 오래 사용되지 않은 세계관
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "revalidated": 0, "refetched": 0,
+                       "invalidations": 0, "evictions": 0, "denied": 0, "errors": 0}
+
+    def get_world(self, world_id, user_id, db_client):
+        """
+        세계관 행(dict)을 반환합니다. 없거나 접근 권한이 없으면 None.
+        캐시는 사용자 간에 공유되므로, RLS와 같은 기준(공개 세계관 또는 본인 소유)으로 접근을 확인합니다.
+        """
+        if not world_id:
+            return None
+        world_id = str(world_id)
+        row = self._lookup(world_id, db_client)
+        if row is None:
+            return None
+        if not row.get('is_public') and str(row.get('user_id')) != str(user_id):
+            with self._lock:
+                self._stats["denied"] += 1
+            return None
+        return dict(row)
+
+    def invalidate(self, world_id):
+        with self._lock:
+            if self._entries.pop(str(world_id), None) is not None:
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            hit_rate = self._stats["hits"] / lookups if lookups else 0.0
+            return {"entries": len(self._entries), "hit_rate": round(hit_rate, 4), **self._stats}
+
+    def render_prometheus(self) -> str:
+        """세계관 캐시 조회/적중/재검증 횟수와 항목 수 (Prometheus 텍스트 형식)."""
+        with self._lock:
+            lines = ["# HELP storydive_world_cache_lookups_total World metadata cache lookups by result.",
+                     "# TYPE storydive_world_cache_lookups_total counter",
+                     f'storydive_world_cache_lookups_total{{result="hit"}} {self._stats["hits"]}',
+                     f'storydive_world_cache_lookups_total{{result="miss"}} {self._stats["misses"]}',
+                     "# HELP storydive_world_cache_events_total World metadata cache revalidations, refetches, invalidations and evictions.",
+                     "# TYPE storydive_world_cache_events_total counter"]
+            for event in ("revalidated", "refetched", "invalidations", "evictions", "denied", "errors"):
+                lines.append(f'storydive_world_cache_events_total{{event="{event}"}} {self._stats[event]}')
+            lookups = self._stats["hits"] + self._stats["misses"]
+            lines += ["# HELP storydive_world_cache_hit_ratio World metadata cache hit ratio since process start.",
+                      "# TYPE storydive_world_cache_hit_ratio gauge",
+                      f"storydive_world_cache_hit_ratio {self._stats['hits'] / lookups if lookups else 0.0:.4f}",
+                      "# HELP storydive_world_cache_entries Worlds currently cached in this process.",
+                      "# TYPE storydive_world_cache_entries gauge",
+                      f"storydive_world_cache_entries {len(self._entries)}"]
+        return "\n".join(lines) + "\n"
+
+    def _lookup(self, world_id, db_client):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(world_id)
+            if entry is not None:
+                self._entries.move_to_end(world_id)
+                if now - entry[1] < self.ttl_seconds:
+                    self._stats["hits"] += 1
+                    return entry[0]
+            self._stats["misses"] += 1
+
+        if not db_client:
+            return entry[0] if entry is not None else None
+
+        try:
+            if entry is not None:
+                # TTL 만료: updated_at만 확인하고 그대로면 기존 행을 계속 사용
+                check = db_client.table("worlds").select("updated_at").eq("id", world_id).maybe_single().execute()
+                if check and check.data and check.data.get('updated_at') == entry[0].get('updated_at'):
+                    self._store(world_id, entry[0], revalidated=True)
+                    return entry[0]
+                if not (check and check.data):
+                    self.invalidate(world_id)
+                    return None
+            response = db_client.table("worlds").select(WORLD_CACHE_COLUMNS).eq("id", world_id).maybe_single().execute()
+        except Exception as e:
+            logger.exception("worlds 조회 실패 (world_id=%s): %s", world_id, e)
+            with self._lock:
+                self._stats["errors"] += 1
+            return entry[0] if entry is not None else None
+
+        if not (response and response.data):
+            return None
+        self._store(world_id, response.data, revalidated=False)
+        return response.data
+
+    def _store(self, world_id, row, revalidated):
+        with self._lock:
+            self._stats["revalidated" if revalidated else "refetched"] += 1
+            self._entries[world_id] = (row, time.monotonic())
+            self._entries.move_to_end(world_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+
+world_cache = WorldCache(ttl_seconds=WORLD_CACHE_TTL_SECONDS, max_entries=WORLD_CACHE_MAX_ENTRIES)
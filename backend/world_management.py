@@ -16,6 +16,8 @@ from backend.config import SUPABASE_URL, SUPABASE_SERVICE_KEY # SUPABASE_SERVICE
 # Absolute imports from the 'backend' package perspective
 from backend.auth_utils import get_user_and_token_from_request
 from backend.database import get_db_client
+from backend.world_cache import world_cache
+from backend.opening_pool import opening_pool
 
 worlds_bp = Blueprint('worlds_bp', __name__, url_prefix='/api/worlds')
 
@@ -504,6 +506,11 @@ def update_world(world_id):
 
     try:
         response = client.table("worlds").update(update_data).eq("id", str(world_id)).eq("user_id", str(current_user.id)).execute()
+        world_cache.invalidate(world_id) # 스토리 진행 중인 세션도 수정된 설정을 바로 사용하도록
+        # 시작 프롬프트에 들어가는 값이 바뀌었으면 미리 생성된 첫 장면을 버림
+        if any(key in update_data and update_data[key] != existing_world_data.get(key)
+               for key in ('setting', 'systems', 'system_configs', 'starting_point')):
+            opening_pool.invalidate(world_id)
 
         if hasattr(response, 'data') and response.data:
             return jsonify(response.data[0]), 200
@@ -542,6 +549,8 @@ def delete_world(world_id):
             return jsonify({"error": "해당 세계관을 찾을 수 없거나 삭제 권한이 없습니다."}), 404
 
         response = client.table("worlds").delete().eq("id", str(world_id)).eq("user_id", str(current_user.id)).execute()
+        world_cache.invalidate(world_id)
+        opening_pool.invalidate(world_id)
 
         if hasattr(response, 'error' ) and response.error:
             error_message = f"세계관 삭제 중 오류 발생: {response.error.message if hasattr(response.error, 'message') else str(response.error)}"
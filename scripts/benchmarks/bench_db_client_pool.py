@@ -0,0 +1,122 @@
+"""
+get_db_client 커넥션 풀 벤치마크.
+
+로컬 HTTP 서버(PostgREST 흉내)를 띄운 뒤, 요청마다 create_client를 새로 만드는 이전 방식과
+공유 커넥션 풀을 쓰는 get_db_client(user_jwt=...)를 비교합니다.
+측정 항목: 요청당 시간, tracemalloc 기준 할당량, 서버가 받은 TCP 연결 수.
+
+실행: python scripts/benchmarks/bench_db_client_pool.py [--requests 200] [--threads 8]
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """모든 요청에 빈 JSON 배열로 응답하는 PostgREST 대역. keep-alive를 위해 HTTP/1.1을 사용합니다."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.stats_lock:
+            self.server.requests += 1
+
+    do_GET = _reply
+    do_POST = _reply
+    do_PATCH = _reply
+    do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_stand_in():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    server.daemon_threads = True
+    server.stats_lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _reset(server):
+    with server.stats_lock:
+        server.connections = 0
+        server.requests = 0
+
+
+def _run(label, server, make_client, total_requests, threads, tokens):
+    _reset(server)
+
+    def one_request(i):
+        client = make_client(tokens[i % len(tokens)])
+        client.table("stories").select("id").eq("session_id", f"s{i}").execute()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one_request, range(total_requests)))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot_total = sum(stat.size for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+
+    print(f"{label:<28} {elapsed * 1000 / total_requests:>8.2f} ms/req  "
+          f"peak {peak / 1024:>9.1f} KiB  retained {snapshot_total / 1024:>9.1f} KiB  "
+          f"connections {server.connections:>5}  requests {server.requests:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20, help="서로 다른 JWT 개수")
+    args = parser.parse_args()
+
+    server = _start_stand_in()
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.setdefault("SUPABASE_KEY", "bench-anon-key")
+
+    from supabase import create_client, ClientOptions
+    from backend import database
+    logging.getLogger().setLevel(logging.WARNING) # 요청마다 찍히는 httpx/httpcore 로그가 측정을 방해하지 않도록
+
+    tokens = [f"bench-user-token-{i}" for i in range(args.users)]
+
+    def legacy_client(user_jwt):
+        # 이전 get_db_client와 동일: 요청마다 새 클라이언트(새 커넥션 풀)를 생성
+        options = ClientOptions()
+        options.headers["Authorization"] = f"Bearer {user_jwt}"
+        return create_client(database.SUPABASE_URL, database.SUPABASE_KEY, options=options)
+
+    print(f"requests={args.requests} threads={args.threads} users={args.users}")
+    _run("create_client per request", server, legacy_client, args.requests, args.threads, tokens)
+    _run("pooled get_db_client", server, lambda t: database.get_db_client(user_jwt=t), args.requests, args.threads, tokens)
+    print(f"pool stats: {database.get_db_pool_stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
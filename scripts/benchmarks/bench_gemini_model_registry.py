@@ -0,0 +1,77 @@
+"""
+Gemini 모델 핸들 레지스트리 벤치마크 (네트워크 호출 없음).
+
+호출마다 genai.GenerativeModel과 GenerationConfig를 새로 만드는 이전 방식과, model_registry의
+gemini_models.get()으로 (모델, 생성 설정)별 핸들을 재사용하는 방식을 비교합니다.
+generate_content가 서버에 요청을 보내기 직전까지의 준비 비용(핸들 생성 + 생성 설정/응답 스키마 변환 +
+요청 객체 생성)과, 전송 클라이언트(gRPC 채널) 인스턴스 수를 측정합니다.
+
+실행: python scripts/benchmarks/bench_gemini_model_registry.py [--calls 2000] [--structured]
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+PROMPT = "당신은 판타지 세계관의 AI 스토리텔러입니다. " * 40
+
+
+def _run(label, prepare_request, calls):
+    prepare_request() # 첫 호출(클라이언트 생성 등)은 측정에서 제외
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(calls):
+        prepare_request()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<32} {elapsed * 1_000_000 / calls:>9.1f} us/call  peak {peak / 1024:>8.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--structured", action="store_true", help="JSON 응답 스키마가 있는 구조화 출력 설정으로 측정")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "bench-api-key") # 전송 클라이언트 생성용 (요청은 보내지 않음)
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+    from backend import gemini_utils
+    from backend.model_registry import gemini_models
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.structured:
+        config = {"max_output_tokens": 1024, "temperature": 0.7,
+                  "response_mime_type": "application/json", "response_schema": gemini_utils.STORY_RESPONSE_SCHEMA}
+    else:
+        config = {"max_output_tokens": 800, "temperature": 0.7}
+
+    def legacy_prepare():
+        # 이전 gemini_utils와 동일: 호출마다 모델과 GenerationConfig를 새로 만들고 generate_content에 전달
+        model = genai.GenerativeModel(gemini_models.default_model_name)
+        generation_config = genai.types.GenerationConfig(**config)
+        model._prepare_request(contents=PROMPT, generation_config=generation_config, tools=None, tool_config=None)
+        if model._client is None:
+            model._client = genai_client.get_default_generative_client()
+
+    def registry_prepare():
+        model = gemini_models.get(**config)
+        model._prepare_request(contents=PROMPT, tools=None, tool_config=None)
+        if model._client is None:
+            model._client = genai_client.get_default_generative_client()
+
+    print(f"calls={args.calls} structured={args.structured}")
+    _run("GenerativeModel per call", legacy_prepare, args.calls)
+    _run("gemini_models.get (registry)", registry_prepare, args.calls)
+    clients = {id(genai_client.get_default_generative_client()) for _ in range(3)}
+    print(f"generative transport clients in process: {len(clients)}")
+    print(f"registry stats: {gemini_models.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Gemini 호출 데드라인/헤지/서킷 브레이커 벤치마크 (네트워크 호출 없음).
+
+지연 시간 분포와 오류율을 지정할 수 있는 가짜 LLM 호출로 llm_resilience.LLMResilience를 실행합니다.
+- tail: 대부분 빠르고 일부(--slow-rate)만 매우 느린 분포에서, 헤지 없음/헤지 있음의 p50/p95/p99와 추가 호출 비율
+- deadline: 요청 데드라인보다 느린 호출이 남은 예산만큼만 기다리고, 다음 호출은 LLMDeadlineExceeded로 바로 끝나는지
+- breaker: 장애 구간 동안 브레이커가 열려 가짜 LLM까지 가는 호출 수가 줄어드는지
+
+실행: python scripts/benchmarks/bench_llm_resilience.py [--calls 200] [--slow-rate 0.05] [--slow-seconds 1.5]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend.llm_resilience import (LLMResilience, CircuitBreaker, LLMUnavailableError, LLMDeadlineExceeded,  # noqa: E402
+                                    CALL_GENERATION, request_deadline)
+
+
+class FakeLLM:
+    """fast_seconds 근처의 지연으로 응답하고, slow_rate 확률로 slow_seconds, error_rate 확률로 예외를 냅니다."""
+
+    def __init__(self, fast_seconds, slow_seconds, slow_rate, error_rate=0.0):
+        self.fast_seconds = fast_seconds
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout_seconds):
+        with self._lock:
+            self.requests += 1
+        delay = self.slow_seconds if random.random() < self.slow_rate else self.fast_seconds * random.uniform(0.7, 1.3)
+        time.sleep(min(delay, timeout_seconds))
+        if delay > timeout_seconds:
+            raise TimeoutError("fake LLM timeout")
+        if random.random() < self.error_rate:
+            raise RuntimeError("fake LLM 500")
+        return "ok"
+
+
+def _make_resilience(hedge_enabled, timeout_seconds=5.0, breaker=None):
+    return LLMResilience(
+        call_timeouts={CALL_GENERATION: timeout_seconds}, hedge_enabled=hedge_enabled, hedge_percentile=0.95,
+        hedge_min_delay_seconds=0.01, hedge_initial_delay_seconds=0.2, hedge_max_workers=32,
+        breaker=breaker or CircuitBreaker(window_seconds=60, min_calls=10**9, error_rate=1.0, open_seconds=1))
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000  # noqa: E731
+    return f"p50 {pick(0.5):>7.1f} ms  p95 {pick(0.95):>7.1f} ms  p99 {pick(0.99):>7.1f} ms"
+
+
+def bench_tail(args):
+    print(f"[tail] calls={args.calls} concurrency={args.concurrency} slow_rate={args.slow_rate} slow={args.slow_seconds}s")
+    for hedge_enabled in (False, True):
+        random.seed(7)
+        llm = FakeLLM(fast_seconds=args.fast_seconds, slow_seconds=args.slow_seconds, slow_rate=args.slow_rate)
+        resilience = _make_resilience(hedge_enabled)
+        for _ in range(30):  # 헤지 지연(p95) 계산용 표본
+            resilience.call(CALL_GENERATION, llm)
+        llm.requests = 0
+        stats_before = resilience.stats()
+
+        def one_call(_):
+            started = time.perf_counter()
+            resilience.call(CALL_GENERATION, llm)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = list(pool.map(one_call, range(args.calls)))
+        stats = resilience.stats()
+        label = "hedged" if hedge_enabled else "no hedge"
+        print(f"  {label:<9} {_percentiles(latencies)}  requests/call {llm.requests / args.calls:.3f}  "
+              f"hedges fired {stats['hedges_fired'] - stats_before['hedges_fired']} "
+              f"won {stats['hedges_won'] - stats_before['hedges_won']}")
+
+
+def bench_deadline(args):
+    budget = 0.8
+    llm = FakeLLM(fast_seconds=args.slow_seconds, slow_seconds=args.slow_seconds, slow_rate=1.0)
+    resilience = _make_resilience(hedge_enabled=False)
+    started = time.perf_counter()
+    outcome = "ok"
+    with request_deadline(budget):
+        try:
+            resilience.call(CALL_GENERATION, llm)
+        except TimeoutError:
+            outcome = "timeout (request timeout = remaining budget)"
+        try:
+            resilience.call(CALL_GENERATION, llm)
+        except LLMDeadlineExceeded:
+            outcome += ", next call short-circuited by deadline"
+    print(f"[deadline] budget {budget * 1000:.0f} ms, fake LLM {args.slow_seconds * 1000:.0f} ms -> "
+          f"{outcome} after {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+def bench_breaker(args):
+    breaker = CircuitBreaker(window_seconds=60, min_calls=10, error_rate=0.5, open_seconds=0.5)
+    resilience = _make_resilience(hedge_enabled=False, breaker=breaker)
+    llm = FakeLLM(fast_seconds=0.005, slow_seconds=0.005, slow_rate=0.0, error_rate=1.0)
+    short_circuited = 0
+    started = time.perf_counter()
+    for _ in range(args.calls):
+        try:
+            resilience.call(CALL_GENERATION, llm)
+        except LLMUnavailableError:
+            short_circuited += 1
+        except RuntimeError:
+            pass
+    outage_elapsed = time.perf_counter() - started
+    llm.error_rate = 0.0  # 장애 복구
+    time.sleep(0.6)
+    recovered = resilience.call(CALL_GENERATION, llm) == "ok"
+    print(f"[breaker] {args.calls} calls during outage: {llm.requests} reached fake LLM, {short_circuited} short-circuited "
+          f"in {outage_elapsed * 1000:.1f} ms; recovered after open window: {recovered}; state {breaker.stats()['state']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--fast-seconds", type=float, default=0.05)
+    parser.add_argument("--slow-seconds", type=float, default=1.5)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    args = parser.parse_args()
+    bench_tail(args)
+    bench_deadline(args)
+    bench_breaker(args)
+
+
+if __name__ == "__main__":
+    main()
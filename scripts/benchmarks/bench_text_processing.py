@@ -0,0 +1,215 @@
+"""
+스토리 텍스트 처리 핫패스 마이크로벤치마크 (네트워크 호출 없음).
+
+실제 모델 출력과 비슷한 한국어 코퍼스(선택지 표시/목록 기호 변형, 본문 속 [SYSTEM_UPDATE] 태그, 중복 선택지,
+구조화 출력 JSON), 이야기 기록, 엔딩 정의를 시드로 결정적으로 만들고 다음 함수를 측정합니다.
+- gemini_utils.parse_story_and_choices (call_gemini_api/stream_gemini_api의 텍스트 파서)
+- gemini_utils.validate_structured_story
+- gemini_utils.StoryStreamFilter (조각 단위 스트리밍 필터)
+- story_routes.parse_and_apply_system_updates / normalize_system_change
+- gemini_utils.determine_ending_condition_type / get_story_condition_endings
+
+커밋 간 회귀 추적:
+  --save results.jsonl    측정 결과를 현재 git 커밋과 함께 한 줄로 덧붙임
+  --compare results.jsonl 기록의 마지막 결과(또는 --baseline 커밋)와 비교해 변화율 출력
+  --fail-above 10         비교 대상보다 10% 넘게 느려진 항목이 있으면 종료 코드 1
+
+실행: python scripts/benchmarks/bench_text_processing.py [--rounds 7] [--corpus 200] [--save f] [--compare f]
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+_STORY_SENTENCES = [
+    "안개가 부두를 삼키자 등불 하나가 힘없이 깜빡였다.",
+    "기사단의 종소리가 세 번 울렸고, 골목의 상인들은 서둘러 덧문을 내렸다.",
+    "당신은 젖은 밧줄을 움켜쥔 채 낯선 이름을 속으로 되뇌었다.",
+    "\"여기서 오래 머무르면 곤란해질 거요.\" 늙은 뱃사공이 낮게 속삭였다.",
+    "손바닥에 남은 문양이 희미하게 빛나며 따끔거렸다.",
+    "밀수꾼들의 창고에서 누군가 급히 상자를 옮기는 소리가 들려왔다.",
+    "성당의 첨탑 위로 검은 새 떼가 원을 그리며 날아올랐다.",
+    "주머니 속 편지에는 당신의 필체로 '돌아오지 마라'라고 적혀 있었다.",
+    "발밑의 돌바닥은 오래된 피 얼룩처럼 붉게 물들어 있었다.",
+    "몰락한 귀족 가문의 문장이 새겨진 반지가 진흙 속에서 반짝였다.",
+]
+_CHOICES = [
+    "뱃사공에게 편지에 대해 묻는다.", "창고 쪽으로 몸을 숨긴 채 다가간다.", "성당으로 가서 기사단을 찾는다.",
+    "반지를 주워 문장을 자세히 살펴본다.", "안개 속으로 조용히 사라진다.", "손바닥의 문양을 등불에 비춰본다.",
+    "상인들에게 오늘 밤 무슨 일이 있는지 묻는다.", "밧줄을 타고 배 위로 올라간다.",
+]
+_SYSTEMS = {"체력": 100, "명성": 10, "의심": 0, "골드": 50, "정신력": 30}
+_MARKERS = ["\n선택지:", "\n**선택지:**", "\nChoices:", "\n다음 행동을 선택하세요:", "\n선택지 목록:"]
+_BULLETS = ["- ", "* ", "1. ", "가. ", "• "]
+_ENDING_CONDITIONS = [
+    "체력 <= 0", "명성 >= 80", "골드가 0이 되면", "주인공이 자신의 진짜 이름을 되찾는다",
+    "기사단을 배신하고 밀수꾼의 편에 선다", "사랑하는 사람을 구하기 위해 희생한다", "모든 의뢰를 완료",
+    "정신력이 최소치에 도달하고 절망에 빠진다", "성당의 비밀을 밝혀내는 데 성공", "항구를 떠나 새로운 삶을 시작한다",
+]
+
+
+def _tag(rng):
+    name = rng.choice(list(_SYSTEMS))
+    operator = rng.choice("+-=")
+    value = rng.choice([1, 2, 5, 10, 15, 40, 120]) if operator != "=" else rng.randint(0, 100)
+    spacing = rng.choice(["", " "])
+    return f"[SYSTEM_UPDATE:{spacing}{name}{spacing}{operator}{spacing}{value}]"
+
+
+def build_corpus(size, seed):
+    """(텍스트 출력, 구조화 JSON 출력, 스트리밍 조각 목록) 코퍼스와 이야기 기록, 엔딩 정의를 만듭니다."""
+    rng = random.Random(seed)
+    text_outputs, structured_outputs, stream_chunks = [], [], []
+    for _ in range(size):
+        sentences = [rng.choice(_STORY_SENTENCES) for _ in range(rng.randint(4, 12))]
+        for _ in range(rng.randint(0, 3)):
+            sentences.insert(rng.randrange(len(sentences) + 1), _tag(rng))
+        story = " ".join(sentences)
+        if rng.random() < 0.3:
+            story = "이야기: " + story
+        choices = rng.sample(_CHOICES, rng.randint(2, 4))
+        if rng.random() < 0.2:
+            choices.append(choices[0]) # 모델이 같은 선택지를 반복하는 경우
+        bullet = rng.choice(_BULLETS)
+        lines = [(f"{i + 1}. " if bullet == "1. " else bullet) + choice for i, choice in enumerate(choices)]
+        text = story + "\n" + rng.choice(_MARKERS) + "\n" + "\n".join(lines)
+        if rng.random() < 0.1:
+            text = story # 선택지 표시 없이 끝난 응답
+        text_outputs.append(text)
+
+        updates = [{"system": rng.choice(list(_SYSTEMS)), "operator": rng.choice("+-="), "value": rng.randint(1, 30)}
+                   for _ in range(rng.randint(0, 3))]
+        structured_outputs.append(json.dumps({"story": " ".join(s for s in sentences if not s.startswith("[")),
+                                              "choices": choices, "system_updates": updates}, ensure_ascii=False))
+
+        chunks, pos = [], 0
+        while pos < len(text):
+            step = rng.randint(8, 40)
+            chunks.append(text[pos:pos + step])
+            pos += step
+        stream_chunks.append(chunks)
+
+    history = "\n\n".join(f"사용자 선택: {rng.choice(_CHOICES)}\nAI 응답: {' '.join(rng.sample(_STORY_SENTENCES, 6))}"
+                          for _ in range(40))
+    endings = [{"name": f"엔딩 {i + 1}", "condition": condition, "content": "..."}
+               for i, condition in enumerate(_ENDING_CONDITIONS)]
+    return text_outputs, structured_outputs, stream_chunks, history, endings
+
+
+def _time_case(fn, items, rounds):
+    """항목 전체를 한 번 처리하는 시간을 rounds번 재서, 항목당 중앙값/최솟값(us)을 반환합니다."""
+    fn(items[0]) # 지연 초기화(정규식 컴파일 등) 제외
+    per_item = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        per_item.append((time.perf_counter() - started) * 1_000_000 / len(items))
+    return {"median_us": round(statistics.median(per_item), 2), "min_us": round(min(per_item), 2)}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def _load_baseline(path, commit=None):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if commit:
+        entries = [entry for entry in entries if entry["commit"].startswith(commit)]
+    return entries[-1] if entries else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=int, default=200, help="모델 출력 샘플 수")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=20261018)
+    parser.add_argument("--save", metavar="JSONL", help="결과를 커밋과 함께 덧붙일 기록 파일")
+    parser.add_argument("--compare", metavar="JSONL", help="비교할 기록 파일")
+    parser.add_argument("--baseline", metavar="COMMIT", help="--compare에서 비교할 커밋 (기본: 마지막 기록)")
+    parser.add_argument("--fail-above", type=float, metavar="PERCENT", help="이 비율보다 느려진 항목이 있으면 실패")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()): # 모듈 import 시의 설정 경고 출력 숨김
+        from backend import gemini_utils
+        from backend import story_routes
+    logging.getLogger().setLevel(logging.WARNING) # 운영과 같이 debug/info 로그는 내보내지 않음
+    story_routes.logger.setLevel(logging.WARNING)
+
+    text_outputs, structured_outputs, stream_chunks, history, endings = build_corpus(args.corpus, args.seed)
+    tagged_texts = [text for text in text_outputs if "[SYSTEM_UPDATE" in text] or text_outputs
+    rng = random.Random(args.seed)
+    normalize_args = [(rng.choice(list(_SYSTEMS) + ["행운", "HP"]), float(rng.choice([0.5, 1, 3, 12, 90])),
+                       rng.choice("+-="), float(rng.randint(0, 100))) for _ in range(args.corpus)]
+
+    def run_stream_filter(chunks):
+        stream_filter = gemini_utils.StoryStreamFilter()
+        for chunk in chunks:
+            stream_filter.feed(chunk)
+        stream_filter.finish()
+
+    cases = {
+        "parse_story_and_choices": (gemini_utils.parse_story_and_choices, text_outputs),
+        "validate_structured_story": (gemini_utils.validate_structured_story, structured_outputs),
+        "stream_filter": (run_stream_filter, stream_chunks),
+        "parse_and_apply_system_updates": (lambda text: story_routes.parse_and_apply_system_updates(text, _SYSTEMS),
+                                           tagged_texts),
+        "normalize_system_change": (lambda a: story_routes.normalize_system_change(*a), normalize_args),
+        "determine_ending_condition_type": (gemini_utils.determine_ending_condition_type,
+                                            [ending["condition"] for ending in endings]),
+        "get_story_condition_endings": (gemini_utils.get_story_condition_endings, [endings] * 20),
+        "parse_history_sized_text": (gemini_utils.parse_story_and_choices, [history] * 20),
+    }
+
+    results = {name: _time_case(fn, items, args.rounds) for name, (fn, items) in cases.items()}
+    commit = _git_commit()
+    baseline = _load_baseline(args.compare, args.baseline) if args.compare else None
+
+    print(f"commit={commit} corpus={args.corpus} rounds={args.rounds} python={platform.python_version()}")
+    header = f"{'case':<34}{'median us':>12}{'min us':>10}"
+    if baseline:
+        header += f"{'base min':>12}{'change':>9}"
+    print(header)
+    regressions = []
+    for name, result in results.items():
+        line = f"{name:<34}{result['median_us']:>12.2f}{result['min_us']:>10.2f}"
+        base = (baseline or {}).get("results", {}).get(name)
+        if base:
+            # 최솟값이 실행 간 잡음이 가장 적으므로 최솟값끼리 비교
+            change = (result["min_us"] - base["min_us"]) / base["min_us"] * 100
+            line += f"{base['min_us']:>12.2f}{change:>+8.1f}%"
+            if args.fail_above is not None and change > args.fail_above:
+                regressions.append(name)
+        print(line)
+    if args.compare and not baseline:
+        print(f"(비교할 기록이 없습니다: {args.compare})")
+
+    if args.save:
+        entry = {"commit": commit, "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "corpus": args.corpus, "seed": args.seed, "results": results}
+        with open(args.save, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    if regressions:
+        print(f"회귀: {', '.join(regressions)} (> {args.fail_above}%)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+고정 규칙을 system_instruction으로 분리하기 전(inline)/후(system_instruction)의 턴당 입력 토큰과 지연 비교.
+
+같은 합성 세션(세계관 설정, 이야기 기억, 플레이어 행동)으로 두 방식 각각 이어가기 생성(call_gemini_api)과
+엔딩 조건 판정(check_ending_conditions_with_llm)을 턴마다 호출하고 다음을 출력합니다.
+- content chars: 호출마다 사용자 내용으로 보내는 글자 수 (inline은 규칙 포함, system_instruction은 턴별 내용만)
+- input tok: 모델이 보고한 입력 토큰 (usage_metadata.prompt_token_count, 시스템 지시문 포함)
+- cached tok: 그중 Gemini 캐시에서 처리된 토큰 (cached_content_token_count, 실제 Gemini에서만 0이 아님)
+- p50/mean ms: 호출 지연
+
+시스템 지시문도 입력 토큰으로 과금되므로 input tok는 두 방식이 비슷하고, 차이는 턴마다 만드는 내용의 크기와
+(실제 Gemini에서) 모든 요청이 같은 지시문으로 시작해 생기는 캐시 적중(cached tok, 지연)에서 나옵니다.
+기본값은 LLM_PROVIDER=fake이며 가짜 provider의 지연은 입력 크기와 무관하므로, 실제 수치는
+LLM_PROVIDER=gemini(GEMINI_API_KEY 필요, 과금됨) 또는 기록을 재생하는 LLM_PROVIDER=replay로 측정하세요.
+
+실행: python scripts/benchmarks/compare_system_instructions.py [--sessions 3] [--turns 5] [--json out.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+_SETTING_SENTENCES = [
+    "안개가 걷히지 않는 항구 도시 벨모어는 기사단과 밀수꾼 조합이 밤낮으로 세력을 다투는 곳이다.",
+    "도시의 성당 지하에는 오래전 봉인된 유물이 잠들어 있다는 소문이 돈다.",
+    "주인공은 기억을 잃은 채 부두에서 깨어났고, 손바닥에는 알 수 없는 문양이 새겨져 있다.",
+    "기사단은 문양을 가진 자를 이단으로 몰아 추적하고, 밀수꾼들은 그 힘을 이용하려 한다.",
+    "도시의 모든 세력은 곧 다가올 '검은 조수'의 밤을 두려워한다.",
+]
+_TURN_SENTENCES = [
+    "낡은 등불이 흔들리며 벽에 긴 그림자를 드리웠다.", "멀리서 종소리가 세 번 울렸다.",
+    "당신은 손끝에 닿는 차가운 금속의 감촉에 숨을 죽였다.", "문틈 사이로 누군가의 낮은 목소리가 새어 나왔다.",
+    "동행은 말없이 고개를 끄덕이고는 앞장서 걸음을 옮겼다.", "지도에 표시되지 않은 갈림길이 눈앞에 나타났다.",
+]
+_ACTIONS = ["조심스럽게 문을 열고 안으로 들어간다.", "동행에게 지금까지 알게 된 것을 털어놓는다.",
+            "소리가 난 쪽으로 몸을 숨긴 채 다가간다.", "지도를 펼쳐 갈림길의 위치를 확인한다."]
+_ENDINGS = [{"name": "고백", "condition": "주인공이 동행에게 진심으로 사랑을 고백한다", "content": "..."},
+            {"name": "배신", "condition": "기사단을 배신하고 밀수꾼의 편에 선다", "content": "..."}]
+
+
+def build_sessions(count, turns, seed):
+    """세션마다 (세계관 설정, 턴별 (행동, 이번 턴까지의 기억)) 목록을 만듭니다. 두 방식이 같은 입력을 쓰도록 응답은 합성합니다."""
+    from backend import story_memory
+    rng = random.Random(seed)
+    sessions = []
+    for _ in range(count):
+        setting = " ".join(rng.choice(_SETTING_SENTENCES) for _ in range(rng.randint(3, 12)))
+        memory = story_memory.new_memory()
+        story_memory.append_turn(memory, setting + "\n\n" + " ".join(rng.sample(_TURN_SENTENCES, 4)) + "\n\n")
+        steps = []
+        for _ in range(turns):
+            action = rng.choice(_ACTIONS)
+            steps.append((action, story_memory.copy_memory(memory)))
+            story_memory.append_turn(memory, f"{story_memory.TURN_PREFIX} {action}\n\nAI 응답: "
+                                     + " ".join(rng.sample(_TURN_SENTENCES, 4)) + "\n\n")
+        sessions.append((setting, steps))
+    return sessions
+
+
+def run_mode(enabled, sessions, systems):
+    from backend import gemini_utils, story_memory
+    from backend.prompt_builder import prompt_builder
+    from backend.token_accounting import token_ledger
+    gemini_utils.GEMINI_SYSTEM_INSTRUCTIONS_ENABLED = enabled
+
+    samples = {"generation": [], "ending_check": []}
+
+    def measure(call_type, content_chars, fn):
+        before = token_ledger.stats(top=0)["by_call_type"].get(call_type, {})
+        started = time.perf_counter()
+        fn()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        after = token_ledger.stats(top=0)["by_call_type"].get(call_type, {})
+        samples[call_type].append({
+            "content_chars": content_chars, "ms": elapsed_ms,
+            "input_tokens": after.get("prompt_tokens", 0) - before.get("prompt_tokens", 0),
+            "cached_tokens": after.get("cached_tokens", 0) - before.get("cached_tokens", 0)})
+
+    for setting, steps in sessions:
+        setting = prompt_builder.fit_setting(setting)
+        for action, memory in steps:
+            block = f"{story_memory.TURN_PREFIX} {action}\n\n"
+            prompt, _ = prompt_builder.build_continue_prompt(setting, memory, block, action, systems)
+            instruction = gemini_utils.STORYTELLER_SYSTEM_INSTRUCTION
+            measure("generation", len(prompt) + (0 if enabled else len(instruction) + 2),
+                    lambda: gemini_utils.call_gemini_api(prompt, system_instruction=instruction))
+            history = story_memory.render_history(memory) + block
+            story_content = " ".join(_TURN_SENTENCES[:3])
+            ending_prompt = gemini_utils.build_ending_check_prompt(story_content, history, _ENDINGS, systems)
+            ending_instruction = gemini_utils.ENDING_CHECK_SYSTEM_INSTRUCTION
+            measure("ending_check", len(ending_prompt) + (0 if enabled else len(ending_instruction) + 2),
+                    lambda: gemini_utils.check_ending_conditions_with_llm(story_content, history, _ENDINGS, systems))
+
+    summary = {}
+    for call_type, items in samples.items():
+        if not items:
+            continue
+        summary[call_type] = {
+            "calls": len(items),
+            "content_chars": round(statistics.mean(item["content_chars"] for item in items)),
+            "input_tokens": round(statistics.mean(item["input_tokens"] for item in items)),
+            "cached_tokens": round(statistics.mean(item["cached_tokens"] for item in items)),
+            "p50_ms": round(statistics.median(item["ms"] for item in items), 1),
+            "mean_ms": round(statistics.mean(item["ms"] for item in items), 1)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=20261018)
+    parser.add_argument("--json", metavar="PATH", help="결과를 JSON으로 저장")
+    args = parser.parse_args()
+
+    # backend import 전에 provider를 정함 (지정하지 않았으면 네트워크 없는 가짜 provider)
+    os.environ.setdefault("LLM_PROVIDER", "fake")
+    if os.environ["LLM_PROVIDER"] == "fake":
+        os.environ.setdefault("LLM_FAKE_FIRST_TOKEN_SECONDS", "0.05")
+        os.environ.setdefault("LLM_FAKE_TOKENS_PER_SECOND", "2000")
+    with contextlib.redirect_stdout(io.StringIO()): # 모듈 import 시의 설정 경고 출력 숨김
+        from backend import gemini_utils # provider/모델 레지스트리 초기화
+        from backend.llm_providers import llm_provider
+
+    sessions = build_sessions(args.sessions, args.turns, args.seed)
+    systems = {"체력": 80, "명성": 15, "의심": 5}
+    results = {}
+    for mode, enabled in (("inline", False), ("system_instruction", True)):
+        with contextlib.redirect_stdout(io.StringIO()): # gemini_utils의 호출별 print 숨김
+            results[mode] = run_mode(enabled, sessions, systems)
+
+    print(f"provider={llm_provider.name} sessions={args.sessions} turns={args.turns}")
+    print(f"{'call':<14}{'mode':<20}{'calls':>6}{'content chars':>15}{'input tok':>11}{'cached tok':>12}{'p50 ms':>9}{'mean ms':>9}")
+    for call_type in ("generation", "ending_check"):
+        for mode in results:
+            row = results[mode].get(call_type)
+            if row:
+                print(f"{call_type:<14}{mode:<20}{row['calls']:>6}{row['content_chars']:>15}{row['input_tokens']:>11}"
+                      f"{row['cached_tokens']:>12}{row['p50_ms']:>9}{row['mean_ms']:>9}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"provider": llm_provider.name, "sessions": args.sessions, "turns": args.turns, "results": results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
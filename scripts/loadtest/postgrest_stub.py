@@ -0,0 +1,288 @@
+"""
+부하 테스트용 로컬 PostgREST 대역 (메모리 저장, 네트워크 지연 옵션).
+
+backend/database.py, world_cache.py, world_management.py가 supabase-py(postgrest-py)로 보내는 요청 중
+worlds / stories / ongoing_adventures 테이블과 upsert_story_snapshots RPC에 필요한 부분만 구현합니다.
+- GET    /rest/v1/<table>?select=...&col=eq.값&order=col.desc&limit=n   (Accept: vnd.pgrst.object+json이면 단일 행)
+- POST   /rest/v1/<table>[?on_conflict=a,b]   (Prefer: resolution=merge-duplicates이면 upsert)
+- PATCH  /rest/v1/<table>?col=eq.값
+- DELETE /rest/v1/<table>?col=eq.값          (Prefer: count=exact이면 Content-Range로 개수 반환)
+- POST   /rest/v1/rpc/upsert_story_snapshots
+RLS는 흉내 내지 않습니다 (백엔드 쿼리가 항상 user_id로 거르므로 부하 특성에는 영향이 적음).
+
+단독 실행 (외부에서 띄운 gunicorn의 SUPABASE_URL로 사용):
+    python scripts/loadtest/postgrest_stub.py --port 54321 --worlds 5 --latency-ms 5
+"""
+import argparse
+import datetime
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+LOADTEST_WORLD_OWNER_ID = "00000000-0000-4000-8000-000000000001"
+
+# 요청 예시에 맞춘 세계관 시드 (시스템, 엔딩 포함)
+_SEED_WORLD_SETTING = ("안개가 걷히지 않는 항구 도시 벨로나. 밀수꾼과 성당 기사단, 몰락한 귀족 가문이 "
+                       "도시의 밤을 나누어 다스린다. 플레이어는 기억을 잃은 채 부두에서 깨어난 떠돌이다. ") * 3
+_SEED_WORLD_SYSTEMS = ["체력", "명성", "의심"]
+_SEED_WORLD_SYSTEM_CONFIGS = {"체력": {"initial_value": 100}, "명성": {"initial_value": 10}, "의심": {"initial_value": 0}}
+_SEED_WORLD_ENDINGS = [
+    {"name": "항구의 그림자", "condition": "체력 <= 0", "content": "안개 속에서 당신의 여정은 끝을 맞았다."},
+    {"name": "새벽의 기사", "condition": "명성 >= 80", "content": "기사단은 당신을 새벽의 기사로 맞아들였다."},
+    {"name": "잃어버린 이름", "condition": "주인공이 자신의 진짜 이름을 되찾는다", "content": "당신은 마침내 자신의 이름을 기억해냈다."},
+]
+
+
+def _now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _as_filter_text(value):
+    """행의 값을 PostgREST 필터 문자열(eq.true, eq.null 등)과 비교할 수 있는 형태로 바꿉니다."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    return str(value)
+
+
+class StubDatabase:
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.tables = {"worlds": [], "stories": [], "ongoing_adventures": []}
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def seed_worlds(self, count, owner_id=LOADTEST_WORLD_OWNER_ID, starting_point_every=2):
+        """공개 세계관 count개를 넣고 id 목록을 반환합니다. starting_point_every번째마다 사용자 시작점을 둡니다."""
+        world_ids = []
+        for i in range(count):
+            world_id = str(uuid.uuid4())
+            starting_point = ("당신은 젖은 밧줄 더미 위에서 눈을 떴다. 멀리서 기사단의 종이 울리고 있다."
+                              if starting_point_every and i % starting_point_every == 1 else None)
+            self.tables["worlds"].append({
+                "id": world_id, "user_id": owner_id, "title": f"부하 테스트 세계관 {i + 1}",
+                "setting": _SEED_WORLD_SETTING, "starting_point": starting_point, "is_public": True,
+                "is_system_world": False, "genre": "판타지", "tags": ["loadtest"], "cover_image_url": None,
+                "systems": list(_SEED_WORLD_SYSTEMS), "system_configs": dict(_SEED_WORLD_SYSTEM_CONFIGS),
+                "endings": list(_SEED_WORLD_ENDINGS), "created_at": _now_iso(), "updated_at": _now_iso(),
+            })
+            world_ids.append(world_id)
+        return world_ids
+
+    def select(self, table, filters, order=None, limit=None, columns="*"):
+        with self.lock:
+            rows = [row for row in self.tables.setdefault(table, []) if self._matches(row, filters)]
+            if order:
+                column, _, direction = order.partition(".")
+                rows.sort(key=lambda row: (row.get(column) is None, str(row.get(column))), reverse=direction.startswith("desc"))
+            if limit is not None:
+                rows = rows[:limit]
+            return [self._project(row, columns) for row in rows]
+
+    def upsert(self, table, rows, conflict_columns, merge):
+        written = []
+        with self.lock:
+            table_rows = self.tables.setdefault(table, [])
+            for incoming in rows:
+                incoming = {k: (_now_iso() if v == "now()" else v) for k, v in incoming.items()}
+                existing = None
+                if merge and conflict_columns:
+                    existing = next((row for row in table_rows
+                                     if all(str(row.get(c)) == str(incoming.get(c)) for c in conflict_columns)), None)
+                if existing is not None:
+                    existing.update(incoming)
+                    existing["updated_at"] = incoming.get("updated_at", _now_iso())
+                    written.append(dict(existing))
+                else:
+                    row = {"id": str(uuid.uuid4()), "created_at": _now_iso(), "updated_at": _now_iso(), **incoming}
+                    table_rows.append(row)
+                    written.append(dict(row))
+        return written
+
+    def update(self, table, filters, values):
+        with self.lock:
+            updated = []
+            for row in self.tables.setdefault(table, []):
+                if self._matches(row, filters):
+                    row.update(values)
+                    row["updated_at"] = _now_iso()
+                    updated.append(dict(row))
+            return updated
+
+    def delete(self, table, filters):
+        with self.lock:
+            table_rows = self.tables.setdefault(table, [])
+            deleted = [row for row in table_rows if self._matches(row, filters)]
+            self.tables[table] = [row for row in table_rows if not self._matches(row, filters)]
+            return deleted
+
+    def upsert_story_snapshots(self, snapshots):
+        rows = []
+        for snapshot in snapshots:
+            row = {key: snapshot.get(key) for key in ("user_id", "session_id", "world_id", "story_history",
+                                                      "last_ai_response", "last_choices")}
+            row["status"] = snapshot.get("status") or "ongoing"
+            row["last_updated_at"] = row["last_played_at"] = _now_iso()
+            rows.append(row)
+        return len(self.upsert("stories", rows, ("user_id", "session_id"), merge=True))
+
+    def sizes(self) -> dict:
+        with self.lock:
+            return {table: len(rows) for table, rows in self.tables.items()}
+
+    @staticmethod
+    def _matches(row, filters):
+        for column, op, value in filters:
+            matched = _as_filter_text(row.get(column)) == value
+            if (op in ("eq", "is") and not matched) or (op == "neq" and matched):
+                return False
+        return True
+
+    @staticmethod
+    def _project(row, columns):
+        names = [name.strip() for name in (columns or "*").split(",") if name.strip()]
+        if not names or "*" in names:
+            return dict(row)
+        return {name: row.get(name) for name in names}
+
+
+def _make_handler(db):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive (백엔드의 공유 httpx 풀과 같은 조건)
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PATCH(self):
+            self._handle("PATCH")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+        def do_HEAD(self):
+            self._handle("HEAD")
+
+        def _handle(self, method):
+            if db.latency_seconds:
+                time.sleep(db.latency_seconds)
+            with db.lock:
+                db.request_count += 1
+            parts = urlsplit(self.path)
+            path = parts.path
+            if not path.startswith("/rest/v1/"):
+                return self._send(404, {"message": f"not found: {path}"})
+            resource = path[len("/rest/v1/"):]
+            params = parse_qsl(parts.query, keep_blank_values=True)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            prefer = self.headers.get("Prefer", "")
+            try:
+                if resource.startswith("rpc/"):
+                    return self._rpc(resource[len("rpc/"):], body or {})
+                self._table(method, resource, params, body, prefer)
+            except Exception as e:
+                self._send(400, {"message": str(e), "code": "PGRST000", "details": None, "hint": None})
+
+        def _rpc(self, fn, body):
+            if fn != "upsert_story_snapshots":
+                return self._send(404, {"message": f"function {fn} not found", "code": "PGRST202"})
+            self._send(200, db.upsert_story_snapshots(body.get("snapshots") or []))
+
+        def _table(self, method, table, params, body, prefer):
+            filters, order, limit, columns, on_conflict = [], None, None, "*", ""
+            for key, value in params:
+                if key == "select":
+                    columns = value
+                elif key == "order":
+                    order = value
+                elif key == "limit":
+                    limit = int(value)
+                elif key == "on_conflict":
+                    on_conflict = value
+                elif key == "columns":
+                    continue
+                else:
+                    op, _, raw = value.partition(".")
+                    filters.append((key, op, raw))
+
+            if method in ("GET", "HEAD"):
+                rows = db.select(table, filters, order, limit, columns)
+                if "vnd.pgrst.object+json" in (self.headers.get("Accept") or ""):
+                    if len(rows) != 1:
+                        return self._send(406, {"message": "JSON object requested, multiple (or no) rows returned",
+                                                "code": "PGRST116", "details": f"The result contains {len(rows)} rows"})
+                    return self._send(200, rows[0])
+                return self._send(200, rows, count=len(rows) if "count=" in prefer else None)
+
+            if method == "POST":
+                rows = body if isinstance(body, list) else [body]
+                merge = "resolution=merge-duplicates" in prefer
+                conflict_columns = [c.strip() for c in on_conflict.split(",") if c.strip()] or ["id"]
+                written = db.upsert(table, rows, conflict_columns, merge)
+                return self._send(201, written, minimal="return=minimal" in prefer,
+                                  count=len(written) if "count=" in prefer else None)
+            if method == "PATCH":
+                updated = db.update(table, filters, body or {})
+                return self._send(200, updated, minimal="return=minimal" in prefer,
+                                  count=len(updated) if "count=" in prefer else None)
+            if method == "DELETE":
+                deleted = db.delete(table, filters)
+                return self._send(200, deleted, minimal="return=minimal" in prefer,
+                                  count=len(deleted) if "count=" in prefer else None)
+            self._send(405, {"message": f"method {method} not allowed"})
+
+        def _send(self, status, payload, minimal=False, count=None):
+            data = b"" if minimal else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(204 if minimal and status < 300 else status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            if count is not None:
+                self.send_header("Content-Range", f"0-{max(count - 1, 0)}/{count}" if count else "*/0")
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(data)
+
+    return Handler
+
+
+def start_stub_server(db, host="127.0.0.1", port=0):
+    """백그라운드 스레드에서 서버를 시작하고 (server, base_url)을 반환합니다. port=0이면 빈 포트를 사용합니다."""
+    server = ThreadingHTTPServer((host, port), _make_handler(db))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="postgrest-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--worlds", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="요청마다 더할 지연 (DB 왕복 시간 흉내)")
+    args = parser.parse_args()
+
+    db = StubDatabase(latency_seconds=args.latency_ms / 1000)
+    world_ids = db.seed_worlds(args.worlds)
+    server, base_url = start_stub_server(db, args.host, args.port)
+    print(f"PostgREST stub: SUPABASE_URL={base_url}")
+    print("world ids: " + ",".join(world_ids))
+    try:
+        while True:
+            time.sleep(60)
+            print(f"requests={db.request_count} rows={db.sizes()}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
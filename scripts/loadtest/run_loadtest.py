@@ -0,0 +1,311 @@
+"""
+/api/action 전체 흐름 부하 테스트 (로컬 PostgREST 대역 + 가짜 LLM, 외부 네트워크 없음).
+
+가상 플레이어마다 start_new_adventure → continue_adventure N턴 → 저장(POST /api/adventures) →
+load_story → generate_ending_story 순서로 요청을 보내고 다음을 보고합니다.
+- 행동 종류별 요청 수, 오류 수(2xx 이외), p50/p95/p99 지연
+- 초당 요청 수(전체, 워커당)
+- story_sessions_data의 세션 수/추정 바이트 증가량과 프로세스 최대 RSS (앱을 이 프로세스에서 띄운 경우)
+- 행동 종류별 단계(세계관 조회, Gemini 시도, 파싱 등) 평균 시간 (tracing.stage_metrics, 앱을 이 프로세스에서 띄운 경우)
+- 호출 종류별 Gemini 토큰 수와 턴당 평균 토큰 (token_accounting.token_ledger, 앱을 이 프로세스에서 띄운 경우)
+- 이어가기 프롬프트의 추정 토큰 수(평균/최대)와 예산 때문에 줄인 횟수 (prompt_builder.stats())
+
+기본 모드에서는 이 프로세스 안에서 postgrest_stub과 backend/main.py의 Flask 앱(werkzeug 멀티스레드 서버)을
+띄웁니다. 환경 변수(LLM_PROVIDER=fake, SUPABASE_URL 등)는 backend를 import하기 전에 여기서 설정하며,
+--env KEY=VALUE로 다른 설정(LLM_MAX_CONCURRENCY, SESSION_STORE_MAX_BYTES 등)을 덮어쓸 수 있습니다.
+
+gunicorn 워커/스레드 수를 조정할 때는 postgrest_stub.py를 단독으로 띄우고, 같은 SUPABASE_JWT_SECRET과
+LLM_PROVIDER=fake로 gunicorn을 실행한 뒤 --base-url, --world-ids, --workers를 지정합니다.
+
+실행: python scripts/loadtest/run_loadtest.py [--players 20] [--concurrency 8] [--turns 5] [--stream]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+LOADTEST_JWT_SECRET = "loadtest-jwt-secret-not-for-production"
+
+
+def _mint_token(secret, user_id, role="authenticated"):
+    from jose import jwt
+    now = int(time.time())
+    return jwt.encode({"sub": user_id, "aud": "authenticated", "role": role, "iat": now, "exp": now + 6 * 3600},
+                      secret, algorithm="HS256")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list) # action -> [초]
+        self.errors = defaultdict(lambda: defaultdict(int)) # action -> status -> 횟수
+        self.lock = threading.Lock()
+
+    def record(self, action, seconds, status):
+        with self.lock:
+            self.latencies[action].append(seconds)
+            if not 200 <= status < 300:
+                self.errors[action][status] += 1
+
+    def summary(self):
+        with self.lock:
+            result = {}
+            for action, samples in self.latencies.items():
+                ordered = sorted(samples)
+                pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 1)  # noqa: E731
+                result[action] = {"count": len(ordered), "errors": dict(self.errors.get(action, {})),
+                                  "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+                                  "max_ms": round(ordered[-1] * 1000, 1)}
+            return result
+
+
+class Player:
+    def __init__(self, client, recorder, token, world_id, turns, stream, rng):
+        self.client = client
+        self.recorder = recorder
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.world_id = world_id
+        self.turns = turns
+        self.stream = stream
+        self.rng = rng
+        self.session_id = str(uuid.uuid4())
+
+    def run(self):
+        data = self._action("start_new_adventure", {"world_key": self.world_id})
+        if data is None:
+            return
+        choices, last_response, history = data.get("choices") or [], data.get("new_story_segment", ""), ""
+        active_systems, system_configs = data.get("active_systems") or {}, data.get("system_configs") or {}
+        for _ in range(self.turns):
+            choice = self.rng.choice(choices) if choices else {"id": None, "text": "주변을 살펴본다."}
+            payload = {"world_key": self.world_id, "action_text": choice["text"], "choice_id": choice.get("id")}
+            data = self._stream_turn(payload) if self.stream else self._action("continue_adventure", payload)
+            if data is None:
+                return
+            choices = data.get("choices") or []
+            last_response = data.get("new_story_segment", last_response)
+            history = (data.get("context") or {}).get("history", history)
+            active_systems = data.get("active_systems") or active_systems
+
+        self._request("save", "POST", "/api/adventures", {
+            "session_id": self.session_id, "world_id": self.world_id, "world_title": "부하 테스트",
+            "history": history, "last_ai_response": last_response, "last_choices": choices,
+            "active_systems": active_systems, "system_configs": system_configs})
+        self._action("load_story", {})
+        self._action("generate_ending_story", {
+            "ending_name": "잃어버린 이름", "ending_condition": "주인공이 자신의 진짜 이름을 되찾는다",
+            "basic_ending_content": "당신은 마침내 자신의 이름을 기억해냈다.", "story_history": history[-3000:],
+            "world_title": "부하 테스트", "game_stats": {"total_turns": self.turns, "play_time_minutes": 5,
+                                                      "choices_made": self.turns}})
+
+    def _action(self, action_type, payload):
+        return self._request(action_type, "POST", "/api/action",
+                             {"action_type": action_type, "session_id": self.session_id, **payload})
+
+    def _request(self, label, method, path, payload):
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, path, json=payload, headers=self.headers)
+            status = response.status_code
+        except Exception as e:
+            self.recorder.record(label, time.perf_counter() - started, 599)
+            print(f"[loadtest] {label} 요청 실패: {e}", file=sys.__stderr__)
+            return None
+        self.recorder.record(label, time.perf_counter() - started, status)
+        if not 200 <= status < 300:
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+    def _stream_turn(self, payload):
+        """/api/action/stream으로 한 턴을 진행하고, 첫 delta까지의 시간도 따로 기록합니다."""
+        body = {"action_type": "continue_adventure", "session_id": self.session_id, **payload}
+        started = time.perf_counter()
+        first_delta_at, final, event = None, None, None
+        try:
+            with self.client.stream("POST", "/api/action/stream", json=body, headers=self.headers) as response:
+                status = response.status_code
+                for line in response.iter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        if event == "delta" and first_delta_at is None:
+                            first_delta_at = time.perf_counter()
+                        elif event == "final":
+                            final = json.loads(line[len("data:"):])
+                        elif event == "error":
+                            status = json.loads(line[len("data:"):]).get("status", 500)
+        except Exception as e:
+            self.recorder.record("continue_adventure_stream", time.perf_counter() - started, 599)
+            print(f"[loadtest] stream 요청 실패: {e}", file=sys.__stderr__)
+            return None
+        self.recorder.record("continue_adventure_stream", time.perf_counter() - started, status if final else 500)
+        if first_delta_at is not None:
+            self.recorder.record("continue_adventure_stream_ttfd", first_delta_at - started, 200)
+        return final
+
+
+def _start_local_app(args):
+    """postgrest_stub과 Flask 앱을 이 프로세스에서 띄우고 (base_url, world_ids, story_sessions_data, 대역 DB)를 반환합니다."""
+    from postgrest_stub import StubDatabase, start_stub_server, LOADTEST_WORLD_OWNER_ID
+
+    db = StubDatabase(latency_seconds=args.db_latency_ms / 1000)
+    world_ids = db.seed_worlds(args.worlds)
+    _, supabase_url = start_stub_server(db)
+
+    os.environ.update({
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_KEY": _mint_token(LOADTEST_JWT_SECRET, LOADTEST_WORLD_OWNER_ID, role="anon"),
+        "SUPABASE_JWT_SECRET": LOADTEST_JWT_SECRET,
+        "FLASK_SECRET_KEY": "loadtest",
+        "LLM_PROVIDER": "fake",
+        "LLM_FAKE_FIRST_TOKEN_SECONDS": str(args.llm_first_token),
+        "LLM_FAKE_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "LLM_FAKE_FAILURE_RATE": str(args.llm_failure_rate),
+        "GEMINI_WARMUP_ON_START": "false",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+
+    import logging
+    from werkzeug.serving import make_server
+    from backend.main import app
+    from backend.story_routes import story_sessions_data
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadtest-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", world_ids, story_sessions_data, db
+
+
+def _max_rss_mib():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) # Linux: KiB
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=20, help="가상 플레이어 수 (플레이어마다 모험 1개)")
+    parser.add_argument("--concurrency", type=int, default=8, help="동시에 진행하는 플레이어 수")
+    parser.add_argument("--turns", type=int, default=5, help="플레이어당 continue_adventure 턴 수")
+    parser.add_argument("--stream", action="store_true", help="continue_adventure를 /api/action/stream(SSE)으로 보냄")
+    parser.add_argument("--worlds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-first-token", type=float, default=0.8, help="가짜 LLM 첫 토큰 지연 중앙값(초)")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="PostgREST 대역의 요청당 지연")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="앱 설정 덮어쓰기 (반복 가능)")
+    parser.add_argument("--base-url", help="이미 떠 있는 앱을 대상으로 실행 (예: gunicorn)")
+    parser.add_argument("--world-ids", help="--base-url과 함께: postgrest_stub이 출력한 세계관 id 목록 (쉼표 구분)")
+    parser.add_argument("--jwt-secret", default=LOADTEST_JWT_SECRET, help="--base-url 앱의 SUPABASE_JWT_SECRET")
+    parser.add_argument("--workers", type=int, default=1, help="워커당 초당 요청 수 계산용 (--base-url 앱의 워커 수)")
+    parser.add_argument("--app-log", default=os.devnull, help="앱의 print 출력을 보낼 파일 (기본: 버림)")
+    parser.add_argument("--json", help="결과를 JSON으로 저장할 경로 (커밋 간 비교용)")
+    args = parser.parse_args()
+
+    import httpx
+
+    story_sessions_data, db = None, None
+    app_log = open(args.app_log, "w", encoding="utf-8")
+    if args.base_url:
+        base_url, world_ids = args.base_url.rstrip("/"), [w for w in (args.world_ids or "").split(",") if w]
+        if not world_ids:
+            parser.error("--base-url에는 --world-ids가 필요합니다.")
+    else:
+        sys.stdout = app_log # 앱의 디버그 print가 결과 출력을 덮지 않도록
+        base_url, world_ids, story_sessions_data, db = _start_local_app(args)
+
+    sessions_before = story_sessions_data.stats() if story_sessions_data is not None else None
+    rss_before = _max_rss_mib()
+    samples = []
+    stop_sampling = threading.Event()
+
+    def sample_memory():
+        while not stop_sampling.wait(0.5):
+            stats = story_sessions_data.stats()
+            samples.append((stats["sessions"], stats["bytes"]))
+
+    if story_sessions_data is not None:
+        threading.Thread(target=sample_memory, name="loadtest-sampler", daemon=True).start()
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    with httpx.Client(base_url=base_url, timeout=120, limits=limits) as client:
+        players = [Player(client, recorder, _mint_token(args.jwt_secret, str(uuid.uuid4())), rng.choice(world_ids),
+                          args.turns, args.stream, random.Random(rng.random())) for _ in range(args.players)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda player: player.run(), players))
+        elapsed = time.perf_counter() - started
+    stop_sampling.set()
+    sys.stdout = sys.__stdout__
+
+    summary = recorder.summary()
+    total_requests = sum(action["count"] for name, action in summary.items() if not name.endswith("_ttfd"))
+    result = {"players": args.players, "concurrency": args.concurrency, "turns": args.turns, "stream": args.stream,
+              "elapsed_seconds": round(elapsed, 2), "requests": total_requests,
+              "requests_per_second": round(total_requests / elapsed, 2),
+              "requests_per_second_per_worker": round(total_requests / elapsed / max(1, args.workers), 2),
+              "actions": summary}
+    if story_sessions_data is not None:
+        after = story_sessions_data.stats()
+        result["story_sessions_data"] = {
+            "sessions_before": sessions_before["sessions"], "sessions_after": after["sessions"],
+            "bytes_before": sessions_before["bytes"], "bytes_after": after["bytes"],
+            "peak_bytes": max([b for _, b in samples] + [after["bytes"]]),
+            "bytes_per_session": round(after["bytes"] / after["sessions"]) if after["sessions"] else 0,
+            "evictions": {k: v for k, v in after.items() if "evict" in k}}
+        result["max_rss_mib"] = {"before": rss_before, "after": _max_rss_mib()}
+        result["db_requests"] = db.request_count
+        from backend.tracing import stage_metrics
+        result["stages"] = stage_metrics.stats()
+        from backend.token_accounting import token_ledger
+        result["tokens"] = token_ledger.stats(top=0)
+        from backend.prompt_builder import prompt_builder
+        result["prompts"] = prompt_builder.stats()
+
+    print(f"players={args.players} concurrency={args.concurrency} turns={args.turns} stream={args.stream} "
+          f"elapsed={result['elapsed_seconds']}s")
+    print(f"{'action':<32}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for action, stats in sorted(summary.items()):
+        errors = sum(stats["errors"].values())
+        print(f"{action:<32}{stats['count']:>7}{errors:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+              f"{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    print(f"requests/sec: {result['requests_per_second']} (per worker: {result['requests_per_second_per_worker']})")
+    if "story_sessions_data" in result:
+        print(f"story_sessions_data: {result['story_sessions_data']}")
+        print(f"max RSS MiB: {result['max_rss_mib']}  db requests: {result['db_requests']}")
+        print("stage avg ms (tracing):")
+        for action, stages in result["stages"].items():
+            print(f"  {action:<30}" + "  ".join(f"{stage} {s['avg_ms']}" for stage, s in stages.items()))
+        turns = sum(summary.get(action, {}).get("count", 0) for action in ("start_new_adventure", "continue_adventure"))
+        totals = result["tokens"]["totals"]
+        print(f"gemini tokens: input {totals['prompt_tokens']} output {totals['output_tokens']} "
+              f"(per turn: {round((totals['prompt_tokens'] + totals['output_tokens']) / turns) if turns else 0})")
+        for call_type, usage in result["tokens"]["by_call_type"].items():
+            print(f"  {call_type:<30}calls {usage['calls']}  input {usage['prompt_tokens']}  output {usage['output_tokens']}")
+        prompts = result["prompts"]
+        print(f"continue prompts (estimated tokens): built {prompts['built']} avg {prompts['prompt_tokens_avg']} "
+              f"max {prompts['prompt_tokens_max']} over_budget {prompts['over_budget']} "
+              f"calibration {prompts['estimator']['calibration']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -129,6 +129,83 @@ export async function postStoryAction(actionData) {
     });
 }
 
+// continue_adventure 스트리밍 (Server-Sent Events).
+// onDelta(text)는 스토리 본문 조각이 도착할 때마다 호출됩니다. final 이벤트가 오면 최종 응답으로 resolve되고,
+// 이후 같은 연결로 오는 LLM 엔딩 판정(ending 이벤트)은 onEnding(verdict)으로 전달됩니다.
+export async function streamStoryAction(actionData, { onDelta, onEnding } = {}) {
+    const headers = { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' };
+    if (window.supabaseClient && window.currentSession && window.currentSession.access_token) {
+        headers['Authorization'] = `Bearer ${window.currentSession.access_token}`;
+    }
+
+    const response = await fetch(`${API_BASE_URL}/action/stream`, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify(actionData),
+    });
+    if (!response.ok || !response.body) {
+        let errorData = {};
+        try { errorData = await response.json(); } catch (e) { /* 본문 없음 */ }
+        throw new Error(errorData.error || `HTTP error ${response.status}`);
+    }
+
+    return new Promise((resolve, reject) => {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let finalReceived = false;
+
+        const handleEvent = (rawEvent) => {
+            let eventName = 'message';
+            let dataText = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+            });
+            const payload = dataText ? JSON.parse(dataText) : {};
+
+            if (eventName === 'delta' && onDelta) {
+                onDelta(payload.text || '');
+            } else if (eventName === 'final') {
+                finalReceived = true;
+                resolve(payload);
+            } else if (eventName === 'ending' && onEnding) {
+                onEnding(payload);
+            } else if (eventName === 'error' && !finalReceived) {
+                reject(new Error(payload.error || 'Streaming error'));
+            }
+        };
+
+        (async () => {
+            try {
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                        const rawEvent = buffer.slice(0, boundary);
+                        buffer = buffer.slice(boundary + 2);
+                        handleEvent(rawEvent);
+                    }
+                }
+                if (!finalReceived) {
+                    reject(new Error('스트리밍 응답이 완료되기 전에 연결이 끊어졌습니다.'));
+                }
+            } catch (error) {
+                if (!finalReceived) reject(error);
+                else console.warn('[DEBUG streamStoryAction] Stream closed after final event:', error);
+            }
+        })();
+    });
+}
+
+// LLM 엔딩 판정 결과 조회 (waitSeconds 동안 서버에서 롱 폴링)
+export async function getEndingCheck(sessionId, turn, waitSeconds = 10) {
+    const params = new URLSearchParams({ session_id: sessionId, turn: String(turn), wait: String(waitSeconds) });
+    return fetchAPI(`/action/ending?${params.toString()}`);
+}
+
 // --- Ongoing Adventures APIs ---
 export async function getOngoingAdventuresAPI() {
     return fetchAPI('/adventures');
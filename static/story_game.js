@@ -708,6 +708,50 @@ export class StoryGameManager {
         return false;
     }
 
+    /**
+     * 현재 선택지를 숨기고 잠시 뒤 엔딩을 표시합니다 (같은 턴에 한 번만)
+     */
+    scheduleEnding(ending, turn) {
+        if (this.endingScheduledTurn !== undefined && this.endingScheduledTurn === turn) return;
+        this.endingScheduledTurn = turn;
+        
+        // 엔딩이 트리거된 경우, 현재 선택지를 저장하고 숨기기
+        this.lastChoices = this.currentTurnChoices || [];
+        this.updateChoices([]);
+        setTimeout(() => {
+            this.triggerEnding(ending);
+        }, 2000); // 2초 후 엔딩 표시 (스토리를 읽을 시간)
+    }
+
+    /**
+     * 백엔드 LLM 엔딩 판정을 적용합니다. 판정이 계산된 턴이 현재 턴일 때만 반영합니다.
+     */
+    applyBackendEndingVerdict(verdict) {
+        if (!verdict || verdict.status !== 'done' || !verdict.triggered_ending) return;
+        if (verdict.turn !== this.currentTurn) {
+            console.log(`[DEBUG applyBackendEndingVerdict] Ignoring verdict for turn ${verdict.turn} (current turn ${this.currentTurn})`);
+            return;
+        }
+        console.log("[DEBUG applyBackendEndingVerdict] Ending triggered by backend:", verdict.triggered_ending);
+        this.scheduleEnding(verdict.triggered_ending, verdict.turn);
+    }
+
+    async pollEndingVerdict(sessionId, turn) {
+        // 판정이 끝나거나 플레이어가 다음 턴으로 넘어갈 때까지 롱 폴링
+        for (let attempt = 0; attempt < 3 && turn === this.currentTurn; attempt++) {
+            try {
+                const verdict = await api.getEndingCheck(sessionId, turn);
+                if (verdict.status !== 'pending') {
+                    this.applyBackendEndingVerdict(verdict);
+                    return;
+                }
+            } catch (error) {
+                console.warn('[DEBUG pollEndingVerdict] Ending check poll failed:', error);
+                return;
+            }
+        }
+    }
+
     /**
      * 엔딩을 트리거하고 UI를 표시합니다
      */
@@ -866,7 +910,29 @@ export class StoryGameManager {
         console.log(`[DEBUG] API Call (${actionType}) payload:`, apiPayload);
 
         try {
-            const response = await api.postStoryAction(apiPayload);
+            let response;
+            if (actionType === 'continue_adventure') {
+                // 스토리 본문을 생성되는 대로 표시하고, 스트리밍을 쓸 수 없으면 일반 요청으로 대체
+                let streamedText = '';
+                try {
+                    response = await api.streamStoryAction(apiPayload, {
+                        onDelta: (text) => {
+                            streamedText += text;
+                            this.displayStory(streamedText);
+                        },
+                        // processStoryResponse가 현재 턴을 기록한 뒤에 판정을 적용하도록 다음 태스크로 미룸
+                        onEnding: (verdict) => setTimeout(() => this.applyBackendEndingVerdict(verdict), 0)
+                    });
+                    this.endingVerdictViaStream = true;
+                } catch (streamError) {
+                    if (streamedText) throw streamError;
+                    console.warn('[DEBUG handleStoryApiCall] Streaming failed, falling back to /action:', streamError);
+                    response = await api.postStoryAction(apiPayload);
+                    this.endingVerdictViaStream = false;
+                }
+            } else {
+                response = await api.postStoryAction(apiPayload);
+            }
             console.log('[DEBUG handleStoryApiCall] API Response received:', response);
 
             if (response.error) {
@@ -936,19 +1002,17 @@ export class StoryGameManager {
                 response.active_systems
             );
             
-            // 백엔드에서 스토리 조건 체크 결과 확인
+            // 백엔드의 스토리 조건(LLM) 판정은 응답 이후에 턴 번호로 따로 도착합니다
+            this.currentTurn = response.turn;
+            this.currentTurnChoices = response.choices || [];
             let finalTriggeredEnding = frontendTriggeredEnding || response.triggered_ending;
             
             if (finalTriggeredEnding) {
                 const triggerSource = frontendTriggeredEnding ? "frontend" : "backend";
                 console.log(`[DEBUG processStoryResponse] Ending triggered by ${triggerSource}:`, finalTriggeredEnding);
-                
-                // 엔딩이 트리거된 경우, 현재 선택지를 저장하고 숨기기
-                this.lastChoices = response.choices || [];
-                this.updateChoices([]);
-                setTimeout(() => {
-                    this.triggerEnding(finalTriggeredEnding);
-                }, 2000); // 2초 후 엔딩 표시 (스토리를 읽을 시간)
+                this.scheduleEnding(finalTriggeredEnding, response.turn);
+            } else if (response.ending_check && response.ending_check.status === 'pending' && !this.endingVerdictViaStream) {
+                this.pollEndingVerdict(sessionIdToUse, response.ending_check.turn);
             } else {
                 console.log("[DEBUG processStoryResponse] No ending triggered");
             }
@@ -0,0 +1,41 @@
+-- stories 저장을 한 번의 왕복으로 처리하기 위한 유니크 인덱스와 배치 upsert 함수.
+-- backend/database.py 의 save_story_to_db / save_story_snapshots_to_db 가 사용합니다.
+
+-- 유니크 인덱스를 만들기 전에 같은 (user_id, session_id) 의 중복 행을 정리합니다.
+-- 이전의 확인 후 쓰기 방식은 동시 저장에서 중복 행을 만들 수 있었으므로, 가장 최근에 갱신된 행만 남깁니다
+-- (갱신 시각이 같으면 id 가 큰 행).
+delete from public.stories as s
+using public.stories as newer
+where s.user_id = newer.user_id
+  and s.session_id = newer.session_id
+  and (coalesce(newer.last_updated_at, '-infinity'::timestamptz), newer.id)
+      > (coalesce(s.last_updated_at, '-infinity'::timestamptz), s.id);
+
+create unique index if not exists stories_user_id_session_id_key
+    on public.stories (user_id, session_id);
+
+-- snapshots: [{user_id, session_id, world_id, story_history, last_ai_response, last_choices, status}, ...]
+-- 충돌 시 world_id 와 created_at 은 덮어쓰지 않습니다 (기존 update 경로와 동일한 의미).
+-- security invoker 이므로 호출한 사용자의 JWT 기준으로 RLS 가 그대로 적용됩니다.
+create or replace function public.upsert_story_snapshots(snapshots jsonb)
+returns integer
+language sql
+security invoker
+as $$
+    with upserted as (
+        insert into public.stories as s
+            (user_id, session_id, world_id, story_history, last_ai_response, last_choices, status, last_updated_at, last_played_at)
+        select r.user_id, r.session_id, r.world_id, r.story_history, r.last_ai_response, r.last_choices,
+               coalesce(r.status, 'ongoing'), now(), now()
+        from jsonb_populate_recordset(null::public.stories, snapshots) as r
+        on conflict (user_id, session_id) do update set
+            story_history    = excluded.story_history,
+            last_ai_response = excluded.last_ai_response,
+            last_choices     = excluded.last_choices,
+            status           = excluded.status,
+            last_updated_at  = excluded.last_updated_at,
+            last_played_at   = excluded.last_played_at
+        returning 1
+    )
+    select count(*)::integer from upserted;
+$$;
@@ -0,0 +1,5 @@
+-- 진행 중인 모험의 누적 Gemini 토큰 사용량 (backend/token_accounting.py).
+-- {calls, prompt_tokens, output_tokens, estimated_calls, cost_usd, by_call_type: {호출 종류: {...}}}
+-- backend/database.py 의 _build_ongoing_adventure_row 가 서버 세션 값을 알 때만 채우고, 복원 시 세션 상태로 다시 읽습니다.
+alter table public.ongoing_adventures
+    add column if not exists token_usage jsonb not null default '{}'::jsonb;
@@ -0,0 +1,23 @@
+-- 진행 중인 모험 저장의 순서 보장 (backend/autosave_queue.py).
+-- saved_at 은 서버가 저장 요청을 받은 시각입니다. write-behind 큐는 워커마다 따로 플러시하므로
+-- 늦게 플러시된 이전 저장이 더 새 저장을 덮어쓸 수 있습니다. 이미 기록된 saved_at 보다 오래된 upsert 는
+-- 아래 트리거가 건너뜁니다 (같은 저장을 여러 번 기록하는 것은 허용).
+alter table public.ongoing_adventures
+    add column if not exists saved_at timestamptz;
+
+create or replace function public.ongoing_adventures_keep_newer()
+returns trigger
+language plpgsql
+as $$
+begin
+    if new.saved_at is not null and old.saved_at is not null and new.saved_at < old.saved_at then
+        return null; -- 더 새 저장이 이미 기록됨: 이 행의 갱신만 건너뜀
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists ongoing_adventures_keep_newer on public.ongoing_adventures;
+create trigger ongoing_adventures_keep_newer
+    before update on public.ongoing_adventures
+    for each row execute function public.ongoing_adventures_keep_newer();
@@ -0,0 +1,5 @@
+-- 진행 중인 모험의 턴 번호 (backend/story_routes.py 의 session_state['turn']).
+-- 엔딩 판정 결과를 (session_id, turn) 으로 조회하므로, 복원한 세션이 턴 번호를 0 부터 다시 매기지 않도록 저장합니다.
+-- backend/database.py 의 _build_ongoing_adventure_row 가 서버 세션 값을 알 때만 채우고, 복원 시 세션 상태로 다시 읽습니다.
+alter table public.ongoing_adventures
+    add column if not exists turn integer not null default 0;